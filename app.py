@@ -14,6 +14,28 @@ from controllers.promotion_controller import promotions
 from controllers.admin_promotion_controller import admin_promotions
 from config.app_config import get_config, INITIAL_ADMIN, generate_secure_password
 from config.security import SecurityConfig
+from database import get_db, init_app as init_database
+from services.scheduler import start_scheduler
+from services.email_outbox import EmailOutbox
+from migrations import run_migrations
+from services.export_service import ExportService, EXPORT_FORMATS
+from services.user_stats_service import UserStatsService
+from services.conversion_rollup_service import ConversionRollupService, DEFAULT_CONVERSION_WINDOW
+from services.referring_doctor_service import ReferringDoctorService
+from services.team_metrics_service import TeamMetricsService
+from services.leaderboard_service import LeaderboardService, LEADERBOARD_PERIODS, period_key
+from services.reward_rules_service import RewardRuleCache
+from queries import (
+    DASHBOARD_DOCUMENTS_SQL, DASHBOARD_REFERRALS_SQL, MESSAGES_ALL_SQL, MESSAGES_RECEIVED_SQL,
+    MESSAGES_SENT_SQL, PROVIDER_CODE_SQL, REFERRAL_COLUMNS, REFERRAL_JOINED_FIELDS,
+    REFERRAL_LIST_PATIENT_FILTER, REFERRAL_LIST_PROVIDER_FILTER, REFERRAL_SORT_COLUMNS,
+    REFERRALS_PAGE_DENTIST_SQL, REFERRALS_PAGE_PATIENT_SQL, REFERRALS_PAGE_SPECIALIST_SQL,
+    referral_list_query, referrals_page_query
+)
+from utils.pagination import (
+    DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor, keyset_condition,
+    parse_fields, parse_limit, parse_order
+)
 import os
 import sqlite3
 import uuid
@@ -50,6 +72,12 @@ app.config['MAX_CONTENT_LENGTH'] = config_class.MAX_CONTENT_LENGTH
 # Initialize security configuration
 SecurityConfig.init_app(app)
 
+# Share one pooled SQLite connection per request
+init_database(app)
+
+# Run scheduled maintenance jobs on a background thread (SCHEDULER_ENABLED)
+start_scheduler()
+
 # Stripe configuration
 stripe.api_key = config_class.STRIPE_SECRET_KEY
 STRIPE_PUBLISHABLE_KEY = config_class.STRIPE_PUBLISHABLE_KEY
@@ -131,7 +159,7 @@ def validate_password_complexity(password):
 
 def get_user_by_username_or_email(username):
     """Get user by username or email"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Try to find by username first, then by email
@@ -143,490 +171,31 @@ def get_user_by_username_or_email(username):
         cursor.execute('SELECT id, username, password_hash, full_name, role, email FROM users WHERE email = ?', (username,))
         user = cursor.fetchone()
     
-    conn.close()
     return user
 
 # Database initialization
 def init_db():
-    """Initialize the SQLite database"""
-    config_class = get_config()
-    conn = sqlite3.connect(config_class.DATABASE_NAME)
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            full_name TEXT NOT NULL,
-            role TEXT DEFAULT 'patient',
-            is_verified BOOLEAN DEFAULT FALSE,
-            fraud_score DECIMAL(5,2) DEFAULT 0.0,
-            is_paused BOOLEAN DEFAULT FALSE,
-            device_fingerprint TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Referrals table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS referrals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            referral_id TEXT UNIQUE NOT NULL,
-            patient_name TEXT NOT NULL,
-            referring_doctor TEXT,
-            target_doctor TEXT,
-            medical_condition TEXT,
-            urgency_level TEXT DEFAULT 'normal',
-            status TEXT DEFAULT 'pending',
-
-            case_status TEXT DEFAULT 'pending',
-            consultation_date TIMESTAMP,
-            case_accepted_date TIMESTAMP,
-            treatment_start_date TIMESTAMP,
-            treatment_complete_date TIMESTAMP,
-            rejection_reason TEXT,
-            estimated_value DECIMAL(10,2),
-            actual_value DECIMAL(10,2),
-            notes TEXT,
-            qr_code TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Add case acceptance tracking columns to referrals if they don't exist
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN case_status TEXT DEFAULT "pending"')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN consultation_date TIMESTAMP')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN case_accepted_date TIMESTAMP')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN treatment_start_date TIMESTAMP')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN treatment_complete_date TIMESTAMP')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN rejection_reason TEXT')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN estimated_value DECIMAL(10,2)')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN actual_value DECIMAL(10,2)')
-    except sqlite3.OperationalError:
-        pass
-    
-    # Add patient_id and dentist_id columns for new referrals module
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN patient_id INTEGER')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('ALTER TABLE referrals ADD COLUMN dentist_id INTEGER')
-    except sqlite3.OperationalError:
-        pass
-    
-    # Documents table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            referral_id INTEGER,
-            user_id INTEGER,
-            file_type TEXT NOT NULL,
-            file_name TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            file_size INTEGER,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (referral_id) REFERENCES referrals (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Reward Programs table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reward_programs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            program_type TEXT DEFAULT 'referral',
-            status TEXT DEFAULT 'active',
-            start_date TIMESTAMP,
-            end_date TIMESTAMP,
-            created_by INTEGER,
-            compliance_notes TEXT,
-            legal_language TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (created_by) REFERENCES users (id)
-        )
-    ''')
-    
-    # Reward Tiers table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reward_tiers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            program_id INTEGER,
-            tier_name TEXT NOT NULL,
-            tier_level INTEGER DEFAULT 1,
-            referrals_required INTEGER DEFAULT 1,
-            reward_type TEXT DEFAULT 'points',
-            reward_value DECIMAL(10,2),
-            reward_description TEXT,
-            fulfillment_type TEXT DEFAULT 'manual',
-            fulfillment_config TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (program_id) REFERENCES reward_programs (id)
-        )
-    ''')
-    
-    # User Rewards table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_rewards (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            program_id INTEGER,
-            tier_id INTEGER,
-            referral_id INTEGER,
-            points_earned DECIMAL(10,2) DEFAULT 0,
-            reward_status TEXT DEFAULT 'pending',
-            earned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            redeemed_date TIMESTAMP,
-            fulfillment_status TEXT DEFAULT 'pending',
-            fulfillment_notes TEXT,
-            compliance_verified BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (program_id) REFERENCES reward_programs (id),
-            FOREIGN KEY (tier_id) REFERENCES reward_tiers (id),
-            FOREIGN KEY (referral_id) REFERENCES referrals (id)
-        )
-    ''')
-    
-    # Reward Triggers table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reward_triggers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            program_id INTEGER,
-            trigger_type TEXT NOT NULL,
-            trigger_condition TEXT,
-            trigger_value TEXT,
-            points_awarded DECIMAL(10,2),
-            tier_advancement BOOLEAN DEFAULT FALSE,
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (program_id) REFERENCES reward_programs (id)
-        )
-    ''')
-    
-    # Reward Notifications table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reward_notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            notification_type TEXT,
-            title TEXT,
-            message TEXT,
-            is_read BOOLEAN DEFAULT FALSE,
-            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Compliance Audit Trail table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS compliance_audit_trail (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            action_type TEXT,
-            entity_type TEXT,
-            entity_id INTEGER,
-            action_details TEXT,
-            ip_address TEXT,
-            user_agent TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Gamification Achievements table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS achievements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            icon TEXT,
-            achievement_type TEXT,
-            requirement_value INTEGER,
-            points_value DECIMAL(10,2),
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    """Initialize the SQLite database by applying any pending schema migrations"""
+    conn = get_db()
+    run_migrations(conn)
     
-    # User Achievements table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_achievements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            achievement_id INTEGER,
-            earned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            progress INTEGER DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (achievement_id) REFERENCES achievements (id)
-        )
-    ''')
-    
-    # Provider Codes table for 4-digit system
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS provider_codes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            provider_code TEXT UNIQUE NOT NULL,
-            provider_type TEXT NOT NULL,
-            practice_name TEXT,
-            specialization TEXT,
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Messages table for portal messaging
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_id INTEGER NOT NULL,
-            recipient_id INTEGER NOT NULL,
-            subject TEXT NOT NULL,
-            content TEXT NOT NULL,
-            message_type TEXT DEFAULT 'general',
-            referral_id INTEGER,
-            is_read BOOLEAN DEFAULT FALSE,
-            is_deleted_by_sender BOOLEAN DEFAULT FALSE,
-            is_deleted_by_recipient BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            read_at TIMESTAMP,
-            FOREIGN KEY (sender_id) REFERENCES users (id),
-            FOREIGN KEY (recipient_id) REFERENCES users (id),
-            FOREIGN KEY (referral_id) REFERENCES referrals (id)
-        )
-    ''')
-    
-    # Subscription Plans table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subscription_plans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            plan_name TEXT NOT NULL,
-            plan_type TEXT NOT NULL,
-            price_monthly DECIMAL(10,2),
-            price_annual DECIMAL(10,2),
-            features TEXT,
-            max_referrals INTEGER,
-            max_users INTEGER,
-            storage_gb INTEGER,
-            support_level TEXT,
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # User Subscriptions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_subscriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            plan_id INTEGER,
-            subscription_status TEXT DEFAULT 'active',
-            billing_cycle TEXT DEFAULT 'monthly',
-            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            end_date TIMESTAMP,
-            auto_renew BOOLEAN DEFAULT TRUE,
-            payment_method TEXT,
-            stripe_customer_id TEXT,
-            stripe_subscription_id TEXT,
-            stripe_payment_method_id TEXT,
-            trial_end_date TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (plan_id) REFERENCES subscription_plans (id)
-        )
-    ''')
-    
-    # Practice Management table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS practices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            practice_name TEXT NOT NULL,
-            practice_type TEXT,
-            address TEXT,
-            phone TEXT,
-            email TEXT,
-            website TEXT,
-            admin_user_id INTEGER,
-            subscription_id INTEGER,
-            is_verified BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (admin_user_id) REFERENCES users (id),
-            FOREIGN KEY (subscription_id) REFERENCES user_subscriptions (id)
-        )
-    ''')
-    
-    # Practice Members table (for multi-user practices)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS practice_members (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            practice_id INTEGER,
-            user_id INTEGER,
-            role TEXT,
-            permissions TEXT,
-            status TEXT DEFAULT 'active',
-            invited_by INTEGER,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (practice_id) REFERENCES practices (id),
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (invited_by) REFERENCES users (id)
-        )
-    ''')
-    
-    # Insert default subscription plans
-    cursor.execute('''
-        INSERT OR IGNORE INTO subscription_plans 
-        (plan_name, plan_type, price_monthly, price_annual, features, max_referrals, max_users, storage_gb, support_level)
-        VALUES 
-        ('Basic', 'free', 0.00, 0.00, 'Up to 5 referrals/month, Basic messaging, Limited network access', 5, 1, 1, 'email'),
-        ('Professional', 'practice', 49.99, 499.99, 'Unlimited referrals, Priority support, Full network access, QR codes, CE credits', -1, 3, 10, 'priority'),
-        ('Enterprise', 'enterprise', 149.99, 1499.99, 'Everything in Professional, Multi-practice management, Advanced analytics, API access', -1, -1, 50, 'phone')
-    ''')
-    
-    # User Profiles table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL,
-            phone TEXT,
-            license_number TEXT,
-            specialization TEXT,
-            practice_name TEXT,
-            practice_address TEXT,
-            years_experience TEXT,
-            website TEXT,
-            bio TEXT,
-            account_type TEXT,
-            avatar_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # User Preferences table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_preferences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            preference_key TEXT NOT NULL,
-            preference_value TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            UNIQUE(user_id, preference_key)
-        )
-    ''')
-    
-    # Add is_verified column to users table if it doesn't exist
-    try:
+    # Seed initial admin user
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM users WHERE email = ?", (INITIAL_ADMIN['email'],))
+    if cursor.fetchone() is None:
+        password_hash = generate_password_hash(generate_secure_password())
         cursor.execute('''
-            ALTER TABLE users ADD COLUMN is_verified BOOLEAN DEFAULT FALSE
-        ''')
-    except sqlite3.OperationalError:
-        # Column already exists, skip
-        pass
-
-    # Referring Doctor Profiles table for relationship management
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS referring_doctors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT,
-            phone TEXT,
-            practice_name TEXT,
-            specialty TEXT,
-            address TEXT,
-            city TEXT,
-            state TEXT,
-            zip_code TEXT,
-            referral_count INTEGER DEFAULT 0,
-            conversion_rate DECIMAL(5,2) DEFAULT 0.0,
-            avg_case_value DECIMAL(10,2) DEFAULT 0.0,
-            relationship_score INTEGER DEFAULT 0,
-            last_referral_date TIMESTAMP,
-            communication_preference TEXT DEFAULT 'email',
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Case Conversion Tracking table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS case_conversions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            referral_id TEXT NOT NULL,
-            stage TEXT NOT NULL,
-            stage_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            notes TEXT,
-            assigned_to TEXT,
-            response_time_hours INTEGER,
-            created_by INTEGER,
-            FOREIGN KEY (created_by) REFERENCES users (id)
-        )
-    ''')
+            INSERT INTO users (username, email, password_hash, full_name, role, is_verified)
+            VALUES (?, ?, ?, ?, ?, TRUE)
+        ''', (
+            INITIAL_ADMIN['username'],
+            INITIAL_ADMIN['email'],
+            password_hash,
+            INITIAL_ADMIN['full_name'],
+            INITIAL_ADMIN['role']
+        ))
     
-    # Team Productivity Metrics table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS team_metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            date DATE DEFAULT CURRENT_DATE,
-            referrals_processed INTEGER DEFAULT 0,
-            consultations_completed INTEGER DEFAULT 0,
-            cases_accepted INTEGER DEFAULT 0,
-            avg_response_time_hours DECIMAL(10,2) DEFAULT 0.0,
-            revenue_generated DECIMAL(10,2) DEFAULT 0.0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-
     conn.commit()
-    conn.close()
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -747,12 +316,11 @@ def complete_onboarding():
                 return jsonify({'success': False, 'message': f'Missing required field: {field}'}), 400
         
         # Check if email already exists
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('SELECT id FROM users WHERE email = ?', (data['email'],))
         if cursor.fetchone():
-            conn.close()
             return jsonify({'success': False, 'message': 'Email already registered'}), 400
         
         # Create user account
@@ -854,7 +422,6 @@ def complete_onboarding():
             ''', (user_id, pref_key, str(pref_value)))
         
         conn.commit()
-        conn.close()
         
         # Set session for auto-login
         session['user_id'] = user_id
@@ -901,18 +468,13 @@ def login():
             session['role'] = user[4]
             session['email'] = user_email
             
-            conn = sqlite3.connect('sapyyn.db')
+            conn = get_db()
             cursor = conn.cursor()
             
             # Handle provider code after login
             if provider_code:
                 # Get provider information
-                cursor.execute('''
-                    SELECT pc.user_id, pc.practice_name, pc.provider_type, pc.specialization, u.full_name
-                    FROM provider_codes pc
-                    JOIN users u ON pc.user_id = u.id
-                    WHERE pc.provider_code = ? AND pc.is_active = TRUE
-                ''', (provider_code,))
+                cursor.execute(PROVIDER_CODE_SQL, (provider_code,))
                 provider_info = cursor.fetchone()
                 
                 if provider_info:
@@ -928,14 +490,12 @@ def login():
                     conn.commit()
                     
                     flash(f'Login successful! You have been connected to {provider_info[2]} {provider_info[4]} at {provider_info[1]}.', 'success')
-                    conn.close()
                     return redirect(url_for('patient_portal'))
                 else:
                     flash('Login successful, but the provider code was invalid.', 'warning')
             else:
                 flash('Login successful!', 'success')
             
-            conn.close()
             return redirect(url_for('dashboard'))
         else:
             flash('Invalid username or password', 'error')
@@ -951,16 +511,10 @@ def register():
     
     # If provider code is provided, validate it and get provider information
     if provider_code:
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT pc.user_id, pc.practice_name, pc.provider_type, pc.specialization, u.full_name
-            FROM provider_codes pc
-            JOIN users u ON pc.user_id = u.id
-            WHERE pc.provider_code = ? AND pc.is_active = TRUE
-        ''', (provider_code,))
+        cursor.execute(PROVIDER_CODE_SQL, (provider_code,))
         provider_info = cursor.fetchone()
-        conn.close()
         
         if not provider_info:
             flash('Invalid provider code. Please check the code and try again.', 'error')
@@ -1011,7 +565,7 @@ def register():
         password_hash = generate_password_hash(password)
         
         try:
-            conn = sqlite3.connect('sapyyn.db')
+            conn = get_db()
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO users (username, email, password_hash, full_name, role)
@@ -1054,7 +608,6 @@ def register():
                 )
             
             conn.commit()
-            conn.close()
             
             if signup_type in ['inline', 'cta']:
                 # For inline signups, automatically log them in and redirect to onboarding
@@ -1098,33 +651,23 @@ def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get user's referrals
-    cursor.execute('''
-        SELECT r.*, COUNT(d.id) as document_count
-        FROM referrals r
-        LEFT JOIN documents d ON r.id = d.referral_id
-        WHERE r.user_id = ?
-        GROUP BY r.id
-        ORDER BY r.created_at DESC
-    ''', (session['user_id'],))
+    # Totals come from the materialized counters rather than the full history
+    stats = UserStatsService.get_stats(conn, session['user_id'])
+    
+    # Get user's most recent referrals
+    cursor.execute(DASHBOARD_REFERRALS_SQL, (session['user_id'],))
     referrals = cursor.fetchall()
     
     # Get recent documents
-    cursor.execute('''
-        SELECT file_type, file_name, upload_date
-        FROM documents
-        WHERE user_id = ?
-        ORDER BY upload_date DESC
-        LIMIT 5
-    ''', (session['user_id'],))
+    cursor.execute(DASHBOARD_DOCUMENTS_SQL, (session['user_id'],))
     recent_documents = cursor.fetchall()
     
-    conn.close()
-    
-    return render_template('dashboard.html', referrals=referrals, recent_documents=recent_documents)
+    return render_template('dashboard.html', referrals=referrals, recent_documents=recent_documents,
+                         total_referrals=stats['referral_total'],
+                         total_documents=stats['document_total'])
 
 @app.route('/referral/new', methods=['GET', 'POST'])
 def new_referral():
@@ -1146,7 +689,7 @@ def new_referral():
         qr_code = generate_qr_code(qr_data)
         
         try:
-            conn = sqlite3.connect('sapyyn.db')
+            conn = get_db()
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO referrals (user_id, referral_id, patient_name, referring_doctor, 
@@ -1155,7 +698,6 @@ def new_referral():
             ''', (session['user_id'], referral_id, patient_name, referring_doctor, 
                   target_doctor, medical_condition, urgency_level, notes, qr_code))
             conn.commit()
-            conn.close()
             
             flash('Referral created successfully!', 'success')
             return redirect(url_for('dashboard'))
@@ -1191,14 +733,13 @@ def upload_file():
             file.save(file_path)
             
             # Save to database
-            conn = sqlite3.connect('sapyyn.db')
+            conn = get_db()
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO documents (user_id, file_type, file_name, file_path, file_size)
                 VALUES (?, ?, ?, ?, ?)
             ''', (session['user_id'], file_type, filename, file_path, os.path.getsize(file_path)))
             conn.commit()
-            conn.close()
             
             flash('File uploaded successfully!', 'success')
             return redirect(url_for('dashboard'))
@@ -1213,7 +754,7 @@ def view_documents():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT id, file_type, file_name, file_size, upload_date
@@ -1222,7 +763,6 @@ def view_documents():
         ORDER BY upload_date DESC
     ''', (session['user_id'],))
     documents = cursor.fetchall()
-    conn.close()
     
     return render_template('documents.html', documents=documents)
 
@@ -1232,32 +772,16 @@ def api_stats():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    conn = sqlite3.connect('sapyyn.db')
-    cursor = conn.cursor()
+    conn = get_db()
     
-    # Count referrals by status
-    cursor.execute('''
-        SELECT status, COUNT(*) 
-        FROM referrals 
-        WHERE user_id = ? 
-        GROUP BY status
-    ''', (session['user_id'],))
-    status_counts = dict(cursor.fetchall())
-    
-    # Count documents by type
-    cursor.execute('''
-        SELECT file_type, COUNT(*) 
-        FROM documents 
-        WHERE user_id = ? 
-        GROUP BY file_type
-    ''', (session['user_id'],))
-    document_counts = dict(cursor.fetchall())
-    
-    conn.close()
+    stats = UserStatsService.get_stats(conn, session['user_id'])
     
     return jsonify({
-        'status_counts': status_counts,
-        'document_counts': document_counts
+        'status_counts': stats['status_counts'],
+        'document_counts': stats['document_counts'],
+        'total_referrals': stats['referral_total'],
+        'total_documents': stats['document_total'],
+        'last_activity_at': stats['last_activity_at']
     })
 
 # ============================================================================
@@ -1270,7 +794,7 @@ def check_subscription():
     if 'user_id' not in session:
         return jsonify({'has_subscription': False, 'message': 'Not authenticated'})
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check for active subscription or trial
@@ -1283,7 +807,6 @@ def check_subscription():
     ''', (session['user_id'],))
     
     subscription = cursor.fetchone()
-    conn.close()
     
     if subscription:
         status, trial_end, plan_name = subscription
@@ -1313,18 +836,12 @@ def validate_provider_code():
     if not provider_code or len(provider_code) != 6 or not provider_code.isalnum():
         return jsonify({'valid': False, 'message': 'Provider code must be exactly 6 alphanumeric characters'})
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT pc.user_id, pc.practice_name, pc.provider_type, pc.specialization, u.full_name
-        FROM provider_codes pc
-        JOIN users u ON pc.user_id = u.id
-        WHERE pc.provider_code = ? AND pc.is_active = TRUE
-    ''', (provider_code,))
+    cursor.execute(PROVIDER_CODE_SQL, (provider_code,))
     
     provider = cursor.fetchone()
-    conn.close()
     
     if provider:
         return jsonify({
@@ -1391,7 +908,7 @@ def create_emergency_referral():
         qr_code = generate_qr_code(qr_data)
         
         # Save to database
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -1407,7 +924,6 @@ def create_emergency_referral():
         ))
         
         conn.commit()
-        conn.close()
         
         # Log the emergency referral creation for audit
         log_compliance_action(
@@ -1469,7 +985,7 @@ def create_routine_referral():
         qr_code = generate_qr_code(qr_data)
         
         # Save to database
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -1483,7 +999,6 @@ def create_routine_referral():
         ))
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True,
@@ -1528,7 +1043,7 @@ def request_consultation():
         qr_code = generate_qr_code(qr_data)
         
         # Save as special referral type
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -1543,7 +1058,6 @@ def request_consultation():
         ))
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True,
@@ -1563,7 +1077,7 @@ def track_referral(referral_id):
         flash('Please log in to track your referral.', 'error')
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get referral details
@@ -1573,7 +1087,6 @@ def track_referral(referral_id):
     ''', (referral_id, session['user_id']))
     
     referral = cursor.fetchone()
-    conn.close()
     
     if not referral:
         flash('Referral not found.', 'error')
@@ -1602,7 +1115,7 @@ def update_case_status():
         if not referral_id or not new_status:
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Update referral with new case status
@@ -1651,14 +1164,13 @@ def update_case_status():
         
         # Update referring doctor stats if case is accepted or rejected
         if new_status in ['case_accepted', 'case_rejected']:
-            update_referring_doctor_stats(cursor, referral_id, new_status == 'case_accepted', actual_value or estimated_value)
+            update_referring_doctor_stats(cursor, referral_id, new_status == 'case_accepted')
         
         # Update team metrics
         if session.get('user_id'):
             update_team_metrics(cursor, session['user_id'], new_status)
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True,
@@ -1670,55 +1182,54 @@ def update_case_status():
         app.logger.error(f'Error updating case status: {str(e)}')
         return jsonify({'success': False, 'message': 'Internal server error'}), 500
 
+@app.route('/api/team-metrics/bulk', methods=['POST'])
+def bulk_update_team_metrics():
+    """Apply a batch of case status events to team metrics in one transaction"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        # Batch imports may attribute events to other team members
+        cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
+        user = cursor.fetchone()
+        if not user or user[0] not in ['admin']:
+            return jsonify({'success': False, 'error': 'Admin privileges required'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        events = data.get('events')
+        if not isinstance(events, list) or not events:
+            return jsonify({'success': False, 'error': 'events must be a non-empty list'}), 400
+        
+        rows = TeamMetricsService.record_events(conn, [
+            (event.get('user_id'), event.get('status'), event.get('date'))
+            for event in events
+        ])
+        
+        return jsonify({'success': True, 'events': len(events), 'rows_updated': rows})
+        
+    except (ValueError, AttributeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f'Error applying team metrics batch: {str(e)}')
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
+
 @app.route('/api/conversion-analytics')
 def get_conversion_analytics():
     """Get conversion pipeline analytics for dashboard"""
     try:
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        # Get conversion funnel data
-        cursor.execute('''
-            SELECT 
-                case_status,
-                COUNT(*) as count,
-                AVG(CASE WHEN estimated_value IS NOT NULL THEN estimated_value ELSE 0 END) as avg_estimated_value,
-                AVG(CASE WHEN actual_value IS NOT NULL THEN actual_value ELSE 0 END) as avg_actual_value
-            FROM referrals 
-            WHERE created_at >= date('now', '-30 days')
-            GROUP BY case_status
-        ''')
+        days = int(request.args.get('days', DEFAULT_CONVERSION_WINDOW))
         
-        conversion_data = {}
-        for row in cursor.fetchall():
-            conversion_data[row[0] or 'pending'] = {
-                'count': row[1],
-                'avg_estimated_value': round(row[2] or 0, 2),
-                'avg_actual_value': round(row[3] or 0, 2)
-            }
-        
-        # Get referring doctor performance
-        cursor.execute('''
-            SELECT 
-                rd.name,
-                rd.referral_count,
-                rd.conversion_rate,
-                rd.avg_case_value,
-                rd.last_referral_date
-            FROM referring_doctors rd
-            ORDER BY rd.conversion_rate DESC
-            LIMIT 10
-        ''')
+        # Get conversion funnel data from the daily rollups
+        conversion_data = ConversionRollupService.get_funnel(conn, days)
         
-        top_referring_doctors = []
-        for row in cursor.fetchall():
-            top_referring_doctors.append({
-                'name': row[0],
-                'referral_count': row[1],
-                'conversion_rate': row[2],
-                'avg_case_value': row[3],
-                'last_referral_date': row[4]
-            })
+        # Get referring doctor performance, ranked straight off the index
+        top_referring_doctors = ReferringDoctorService.top_doctors(conn, limit=10)
         
         # Get team productivity
         cursor.execute('''
@@ -1744,114 +1255,38 @@ def get_conversion_analytics():
                 'revenue_generated': row[4]
             })
         
-        conn.close()
-        
-        return jsonify({
+        response = jsonify({
             'success': True,
+            'days': days,
             'conversion_funnel': conversion_data,
             'top_referring_doctors': top_referring_doctors,
             'team_performance': team_performance
         })
         
+        # Dashboards poll this endpoint; let the browser reuse a recent answer
+        # and revalidate cheaply with the ETag once it goes stale
+        response.headers['Cache-Control'] = f"private, max-age={app.config['CONVERSION_ANALYTICS_MAX_AGE']}"
+        response.vary.add('Cookie')
+        response.add_etag()
+        return response.make_conditional(request)
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         app.logger.error(f'Error getting conversion analytics: {str(e)}')
         return jsonify({'success': False, 'message': 'Internal server error'}), 500
 
-def update_referring_doctor_stats(cursor, referral_id, case_accepted, case_value=None):
+def update_referring_doctor_stats(cursor, referral_id, case_accepted):
     """Update referring doctor statistics based on case outcome"""
     try:
-        # Get referring doctor name from referral
-        cursor.execute('SELECT referring_doctor FROM referrals WHERE referral_id = ?', (referral_id,))
-        result = cursor.fetchone()
-        if not result or not result[0]:
-            return
-        
-        referring_doctor_name = result[0]
-        
-        # Check if referring doctor exists in our system
-        cursor.execute('SELECT id, referral_count, conversion_rate, avg_case_value FROM referring_doctors WHERE name = ?', 
-                      (referring_doctor_name,))
-        doctor_record = cursor.fetchone()
-        
-        if doctor_record:
-            # Update existing doctor record
-            doctor_id, current_count, current_rate, current_avg = doctor_record
-            new_count = current_count + 1
-            
-            if case_accepted:
-                new_conversion_rate = ((current_rate * current_count) + 100) / new_count
-                if case_value:
-                    new_avg_value = ((current_avg * current_count) + case_value) / new_count
-                else:
-                    new_avg_value = current_avg
-            else:
-                new_conversion_rate = (current_rate * current_count) / new_count
-                new_avg_value = current_avg
-            
-            cursor.execute('''
-                UPDATE referring_doctors 
-                SET referral_count = ?, conversion_rate = ?, avg_case_value = ?, 
-                    last_referral_date = ?, updated_at = ?
-                WHERE id = ?
-            ''', (new_count, round(new_conversion_rate, 2), round(new_avg_value, 2), 
-                  datetime.now(), datetime.now(), doctor_id))
-        else:
-            # Create new doctor record
-            initial_rate = 100 if case_accepted else 0
-            initial_value = case_value if case_accepted and case_value else 0
-            
-            cursor.execute('''
-                INSERT INTO referring_doctors 
-                (name, referral_count, conversion_rate, avg_case_value, last_referral_date)
-                VALUES (?, 1, ?, ?, ?)
-            ''', (referring_doctor_name, initial_rate, initial_value, datetime.now()))
-    
+        ReferringDoctorService.record_outcome(cursor, referral_id, case_accepted)
     except Exception as e:
         app.logger.error(f'Error updating referring doctor stats: {str(e)}')
 
 def update_team_metrics(cursor, user_id, status):
     """Update team productivity metrics"""
     try:
-        today = datetime.now().date()
-        
-        # Check if record exists for today
-        cursor.execute('SELECT id FROM team_metrics WHERE user_id = ? AND date = ?', (user_id, today))
-        existing_record = cursor.fetchone()
-        
-        if existing_record:
-            # Update existing record
-            if status in ['consultation_scheduled', 'case_accepted', 'case_rejected']:
-                cursor.execute('''
-                    UPDATE team_metrics 
-                    SET referrals_processed = referrals_processed + 1
-                    WHERE user_id = ? AND date = ?
-                ''', (user_id, today))
-            
-            if status == 'consultation_scheduled':
-                cursor.execute('''
-                    UPDATE team_metrics 
-                    SET consultations_completed = consultations_completed + 1
-                    WHERE user_id = ? AND date = ?
-                ''', (user_id, today))
-            
-            if status == 'case_accepted':
-                cursor.execute('''
-                    UPDATE team_metrics 
-                    SET cases_accepted = cases_accepted + 1
-                    WHERE user_id = ? AND date = ?
-                ''', (user_id, today))
-        else:
-            # Create new record
-            referrals_processed = 1 if status in ['consultation_scheduled', 'case_accepted', 'case_rejected'] else 0
-            consultations_completed = 1 if status == 'consultation_scheduled' else 0
-            cases_accepted = 1 if status == 'case_accepted' else 0
-            
-            cursor.execute('''
-                INSERT INTO team_metrics 
-                (user_id, date, referrals_processed, consultations_completed, cases_accepted)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, today, referrals_processed, consultations_completed, cases_accepted))
-    
+        TeamMetricsService.record_status(cursor, user_id, status)
     except Exception as e:
         app.logger.error(f'Error updating team metrics: {str(e)}')
 
@@ -1866,7 +1301,7 @@ def conversion_dashboard():
 
 def log_compliance_action(user_id, action_type, entity_type, entity_id, action_details, request):
     """Log compliance actions for audit trail"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -1877,41 +1312,32 @@ def log_compliance_action(user_id, action_type, entity_type, entity_id, action_d
           request.remote_addr, request.headers.get('User-Agent', '')))
     
     conn.commit()
-    conn.close()
 
 def check_reward_triggers(user_id, referral_id):
     """Check and process reward triggers for a user action"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get active reward programs
-    cursor.execute('''
-        SELECT rp.*, rt.* FROM reward_programs rp
-        JOIN reward_triggers rt ON rp.id = rt.program_id
-        WHERE rp.status = 'active' AND rt.is_active = TRUE
-    ''')
-    active_triggers = cursor.fetchall()
-    
-    for trigger in active_triggers:
-        program_id, trigger_type = trigger[0], trigger[13]
-        
-        if trigger_type == 'referral_completed':
-            # Award points for completed referral
-            cursor.execute('''
-                INSERT INTO user_rewards 
-                (user_id, program_id, referral_id, points_earned, reward_status)
-                VALUES (?, ?, ?, ?, 'earned')
-            ''', (user_id, program_id, referral_id, trigger[16]))
-            
-            # Send notification
-            cursor.execute('''
-                INSERT INTO reward_notifications 
-                (user_id, notification_type, title, message)
-                VALUES (?, 'reward_earned', 'Reward Earned!', 'You earned points for your referral!')
-            ''', (user_id,))
+    # Active referral_completed triggers, cached until a program, trigger or tier changes
+    rules = RewardRuleCache.rules_for(conn, 'referral_completed')
+    if not rules:
+        return
+    
+    # Award points for completed referral
+    cursor.executemany('''
+        INSERT INTO user_rewards 
+        (user_id, program_id, referral_id, points_earned, reward_status)
+        VALUES (?, ?, ?, ?, 'earned')
+    ''', [(user_id, rule['program_id'], referral_id, rule['points_awarded']) for rule in rules])
+    
+    # Send notification
+    cursor.executemany('''
+        INSERT INTO reward_notifications 
+        (user_id, notification_type, title, message)
+        VALUES (?, 'reward_earned', 'Reward Earned!', 'You earned points for your referral!')
+    ''', [(user_id,)] * len(rules))
     
     conn.commit()
-    conn.close()
 
 @app.route('/rewards')
 def rewards_dashboard():
@@ -1919,7 +1345,7 @@ def rewards_dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get user's total points
@@ -1969,8 +1395,6 @@ def rewards_dashboard():
     ''', (session['user_id'],))
     notifications = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('rewards/dashboard.html', 
                          total_points=total_points,
                          recent_rewards=recent_rewards,
@@ -1985,7 +1409,7 @@ def rewards_admin():
         return redirect(url_for('login'))
     
     # Check admin privileges
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
     user_role = cursor.fetchone()[0]
@@ -2017,8 +1441,6 @@ def rewards_admin():
     ''')
     program_stats = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('rewards/admin.html', 
                          programs=programs, 
                          program_stats=program_stats)
@@ -2030,7 +1452,7 @@ def new_reward_program():
         return redirect(url_for('login'))
     
     # Check admin privileges
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
     user_role = cursor.fetchone()[0]
@@ -2063,12 +1485,11 @@ def new_reward_program():
                             program_id, f'Created reward program: {name}', request)
         
         conn.commit()
-        conn.close()
+        RewardRuleCache.invalidate()
         
         flash('Reward program created successfully!', 'success')
         return redirect(url_for('edit_reward_program', program_id=program_id))
     
-    conn.close()
     return render_template('rewards/new_program.html')
 
 @app.route('/rewards/admin/program/<int:program_id>/edit', methods=['GET', 'POST'])
@@ -2077,7 +1498,7 @@ def edit_reward_program(program_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check admin privileges
@@ -2107,6 +1528,7 @@ def edit_reward_program(program_id):
                             program_id, f'Updated reward program: {name}', request)
         
         conn.commit()
+        RewardRuleCache.invalidate()
         flash('Reward program updated successfully!', 'success')
     
     # Get program details
@@ -2121,8 +1543,6 @@ def edit_reward_program(program_id):
     cursor.execute('SELECT * FROM reward_triggers WHERE program_id = ?', (program_id,))
     triggers = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('rewards/edit_program.html', 
                          program=program, tiers=tiers, triggers=triggers)
 
@@ -2132,7 +1552,7 @@ def add_reward_tier(program_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check admin privileges
@@ -2164,7 +1584,7 @@ def add_reward_tier(program_id):
                         cursor.lastrowid, f'Created tier: {tier_name}', request)
     
     conn.commit()
-    conn.close()
+    RewardRuleCache.invalidate()
     
     return jsonify({'success': True, 'message': 'Tier added successfully'})
 
@@ -2174,49 +1594,35 @@ def rewards_leaderboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get top users by points (anonymized for HIPAA compliance)
-    cursor.execute('''
-        SELECT 
-            CASE 
-                WHEN u.id = ? THEN u.full_name 
-                ELSE 'User ' || SUBSTR(u.full_name, 1, 1) || '***'
-            END as display_name,
-            SUM(ur.points_earned) as total_points,
-            COUNT(ur.id) as total_rewards,
-            CASE WHEN u.id = ? THEN 1 ELSE 0 END as is_current_user
-        FROM users u
-        JOIN user_rewards ur ON u.id = ur.user_id
-        WHERE ur.reward_status = 'earned'
-        GROUP BY u.id, u.full_name
-        ORDER BY total_points DESC
-        LIMIT 20
-    ''', (session['user_id'], session['user_id']))
-    leaderboard = cursor.fetchall()
-    
-    # Get user's rank
-    cursor.execute('''
-        SELECT COUNT(*) + 1 as user_rank
-        FROM (
-            SELECT SUM(ur.points_earned) as total_points
-            FROM user_rewards ur
-            WHERE ur.reward_status = 'earned'
-            GROUP BY ur.user_id
-            HAVING total_points > (
-                SELECT SUM(ur2.points_earned)
-                FROM user_rewards ur2
-                WHERE ur2.user_id = ? AND ur2.reward_status = 'earned'
-            )
-        )
-    ''', (session['user_id'],))
-    user_rank = cursor.fetchone()[0]
+    period = request.args.get('period', 'all')
+    if period not in LEADERBOARD_PERIODS:
+        period = 'all'
+    
+    def leaderboard_row(entry):
+        # Other users are anonymized for HIPAA compliance
+        is_current_user = entry['user_id'] == session['user_id']
+        display_name = entry['full_name'] if is_current_user else f"User {(entry['full_name'] or '?')[:1]}***"
+        return (display_name, entry['points'], entry['reward_count'], 1 if is_current_user else 0, entry['rank'])
     
-    conn.close()
+    # Get top users and the caller's position from the precomputed totals
+    leaderboard = [leaderboard_row(entry) for entry in LeaderboardService.top(conn, period, limit=20)]
+    user_entry = LeaderboardService.get_entry(conn, session['user_id'], period)
+    neighbors = [leaderboard_row(entry) for entry in LeaderboardService.neighbors(conn, session['user_id'], period)]
+    
+    # Users without points rank after everyone who has some
+    if user_entry:
+        user_rank = user_entry['rank']
+    else:
+        cursor.execute('SELECT COUNT(*) FROM user_points WHERE period = ?', (period_key(period),))
+        user_rank = cursor.fetchone()[0] + 1
     
     return render_template('rewards/leaderboard.html', 
-                         leaderboard=leaderboard, user_rank=user_rank)
+                         leaderboard=leaderboard, user_rank=user_rank,
+                         user_entry=user_entry, neighbors=neighbors,
+                         period=period, periods=LEADERBOARD_PERIODS)
 
 @app.route('/rewards/compliance/audit')
 def compliance_audit():
@@ -2224,7 +1630,7 @@ def compliance_audit():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check admin privileges
@@ -2245,17 +1651,63 @@ def compliance_audit():
     ''')
     audit_entries = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('rewards/compliance_audit.html', audit_entries=audit_entries)
 
+@app.route('/rewards/compliance/audit/export')
+def export_compliance_audit():
+    """Stream the compliance audit trail as CSV or NDJSON"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Check admin privileges
+    cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
+    user = cursor.fetchone()
+    if not user or user[0] not in ['admin']:
+        return jsonify({'error': 'Access denied. Admin privileges required.'}), 403
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+    
+    query = '''
+        SELECT cat.id, cat.user_id, u.full_name as user_name, cat.action_type, cat.entity_type,
+               cat.entity_id, cat.action_details, cat.ip_address, cat.user_agent, cat.timestamp
+        FROM compliance_audit_trail cat
+        LEFT JOIN users u ON cat.user_id = u.id
+    '''
+    conditions = []
+    params = []
+    if request.args.get('since'):
+        conditions.append('cat.timestamp >= ?')
+        params.append(request.args['since'])
+    if request.args.get('until'):
+        conditions.append('cat.timestamp < ?')
+        params.append(request.args['until'])
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY cat.id'
+    
+    log_compliance_action(session['user_id'], 'EXPORT', 'compliance_audit_trail', None,
+                          f'Audit trail exported as {export_format}', request)
+    
+    return ExportService.stream(
+        query, params,
+        export_format=export_format,
+        filename=f"compliance_audit_{datetime.now().strftime('%Y%m%d')}",
+        compress=ExportService.wants_gzip(request),
+        database=app.config.get('DATABASE_NAME')
+    )
+
 @app.route('/api/rewards/notifications/mark-read', methods=['POST'])
 def mark_notifications_read():
     """Mark reward notifications as read"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -2265,7 +1717,6 @@ def mark_notifications_read():
     ''', (session['user_id'],))
     
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
@@ -2294,7 +1745,7 @@ def profile():
         flash('Please log in to access your profile.', 'error')
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get user information
@@ -2330,8 +1781,6 @@ def profile():
     doc_stats = cursor.fetchone()
     total_documents = doc_stats[0] if doc_stats else 0
     
-    conn.close()
-    
     user_data = {
         'username': user[0],
         'email': user[1],
@@ -2359,7 +1808,7 @@ def edit_profile():
             flash('Please fill in all required fields.', 'error')
             return redirect(url_for('edit_profile'))
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
@@ -2377,13 +1826,11 @@ def edit_profile():
             
         except sqlite3.IntegrityError:
             flash('Email address is already in use.', 'error')
-        finally:
-            conn.close()
         
         return redirect(url_for('profile'))
     
     # GET request - show edit form
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -2393,7 +1840,6 @@ def edit_profile():
     ''', (session['user_id'],))
     
     user = cursor.fetchone()
-    conn.close()
     
     if not user:
         flash('User not found.', 'error')
@@ -2439,7 +1885,7 @@ def change_password():
         flash('Password must be at least 6 characters long.', 'error')
         return redirect(url_for('settings'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Verify current password
@@ -2451,7 +1897,6 @@ def change_password():
     
     if not user or not check_password_hash(user[0], current_password):
         flash('Current password is incorrect.', 'error')
-        conn.close()
         return redirect(url_for('settings'))
     
     # Update password
@@ -2461,7 +1906,6 @@ def change_password():
     ''', (new_password_hash, session['user_id']))
     
     conn.commit()
-    conn.close()
     
     flash('Password changed successfully!', 'success')
     return redirect(url_for('settings'))
@@ -2481,13 +1925,11 @@ def generate_provider_code():
         # Generate 6-character alphanumeric code
         code = ''.join(random.choice(chars) for _ in range(6))
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM provider_codes WHERE provider_code = ?', (code,))
         if not cursor.fetchone():
-            conn.close()
             return code
-        conn.close()
         attempt += 1
     
     # Fallback if we can't find a unique code (very unlikely with 30^6 combinations)
@@ -2526,7 +1968,7 @@ def require_roles(required_roles):
 
 def get_user_subscription(user_id):
     """Get user's current subscription details"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT us.*, sp.plan_name, sp.plan_type, sp.features, sp.max_referrals, sp.support_level
@@ -2536,7 +1978,6 @@ def get_user_subscription(user_id):
         ORDER BY us.created_at DESC LIMIT 1
     ''', (user_id,))
     result = cursor.fetchone()
-    conn.close()
     return result
 
 def create_provider_code(user_id, provider_type, practice_name=None, specialization=None):
@@ -2548,7 +1989,7 @@ def create_provider_code(user_id, provider_type, practice_name=None, specializat
         raise ValueError(f"Provider codes can only be created for dentists and specialists, not {provider_type}")
     
     # Check if user already has an active provider code
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT provider_code FROM provider_codes 
@@ -2557,7 +1998,6 @@ def create_provider_code(user_id, provider_type, practice_name=None, specializat
     existing_code = cursor.fetchone()
     
     if existing_code:
-        conn.close()
         return existing_code[0]  # Return existing code
     
     # Generate new code
@@ -2568,7 +2008,6 @@ def create_provider_code(user_id, provider_type, practice_name=None, specializat
         VALUES (?, ?, ?, ?, ?)
     ''', (user_id, code, provider_type, practice_name, specialization))
     conn.commit()
-    conn.close()
     return code
 
 @app.route('/pricing')
@@ -2582,7 +2021,7 @@ def pricing():
 @require_roles(['dentist', 'dentist_admin'])
 def dentist_portal():
     """Dentist portal dashboard"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get dentist's provider code
@@ -2634,8 +2073,6 @@ def dentist_portal():
     ''', (f"%{session['full_name']}%", session['full_name']))
     incoming_stats = cursor.fetchone()
     
-    conn.close()
-    
     return render_template('portal/dentist.html', 
                          provider_info=provider_info,
                          stats=stats,
@@ -2647,7 +2084,7 @@ def dentist_portal():
 @require_roles(['specialist', 'specialist_admin'])
 def specialist_portal():
     """Specialist portal dashboard"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get specialist's provider code
@@ -2700,8 +2137,6 @@ def specialist_portal():
     ''', (session['full_name'], f"%{session['full_name']}%"))
     incoming_referrals = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('portal/specialist.html',
                          provider_info=provider_info,
                          incoming_stats=incoming_stats,
@@ -2713,7 +2148,7 @@ def specialist_portal():
 @require_roles(['patient'])
 def patient_portal():
     """Patient portal dashboard"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get patient's referrals (referrals where they are the subject)
@@ -2745,8 +2180,6 @@ def patient_portal():
     ''', (f"%{session['full_name']}%", f"%{session['full_name']}%"))
     referral_stats = cursor.fetchone()
     
-    conn.close()
-    
     return render_template('portal/patient.html',
                          referrals=referrals,
                          documents=documents,
@@ -2757,7 +2190,7 @@ def patient_portal():
 @require_roles(['dentist_admin', 'specialist_admin', 'admin'])
 def admin_portal():
     """Admin portal for practice management"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     user_role = session.get('role')
@@ -2858,8 +2291,6 @@ def admin_portal():
     ), (session['user_id'],) if user_role != 'admin' else ())
     recent_activity = cursor.fetchall()
     
-    conn.close()
-    
     return render_template('portal/admin.html',
                          practice_info=practice_info,
                          practices_info=practices_info,
@@ -2930,7 +2361,7 @@ def create_quick_referral():
         if len(provider_code) != 6 or not provider_code.isalnum():
             return jsonify({'success': False, 'message': 'Provider code must be exactly 6 alphanumeric characters'}), 400
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Find provider by code
@@ -2944,12 +2375,10 @@ def create_quick_referral():
         provider = cursor.fetchone()
         
         if not provider:
-            conn.close()
             return jsonify({'success': False, 'message': 'Provider code not found or inactive'}), 404
         
         # Verify provider is a dentist or specialist
         if provider[3] not in ['dentist', 'dentist_admin', 'specialist', 'specialist_admin']:
-            conn.close()
             return jsonify({'success': False, 'message': 'Provider code is not valid for referrals'}), 400
         
         # Generate referral ID and QR code
@@ -2977,7 +2406,6 @@ def create_quick_referral():
         ))
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True,
@@ -3003,49 +2431,20 @@ def get_messages():
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         user_id = session['user_id']
         message_type = request.args.get('type', 'all')  # 'sent', 'received', 'all'
         
         if message_type == 'sent':
-            cursor.execute('''
-                SELECT m.id, m.subject, m.content, m.message_type, m.referral_id, 
-                       m.is_read, m.created_at, u.full_name as recipient_name,
-                       u.role as recipient_role
-                FROM messages m
-                JOIN users u ON m.recipient_id = u.id
-                WHERE m.sender_id = ? AND m.is_deleted_by_sender = FALSE
-                ORDER BY m.created_at DESC
-            ''', (user_id,))
+            cursor.execute(MESSAGES_SENT_SQL, (user_id,))
         elif message_type == 'received':
-            cursor.execute('''
-                SELECT m.id, m.subject, m.content, m.message_type, m.referral_id,
-                       m.is_read, m.created_at, u.full_name as sender_name,
-                       u.role as sender_role
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.recipient_id = ? AND m.is_deleted_by_recipient = FALSE
-                ORDER BY m.created_at DESC
-            ''', (user_id,))
+            cursor.execute(MESSAGES_RECEIVED_SQL, (user_id,))
         else:  # all messages
-            cursor.execute('''
-                SELECT m.id, m.subject, m.content, m.message_type, m.referral_id,
-                       m.is_read, m.created_at, 
-                       CASE WHEN m.sender_id = ? THEN u2.full_name ELSE u1.full_name END as contact_name,
-                       CASE WHEN m.sender_id = ? THEN u2.role ELSE u1.role END as contact_role,
-                       CASE WHEN m.sender_id = ? THEN 'sent' ELSE 'received' END as direction
-                FROM messages m
-                JOIN users u1 ON m.sender_id = u1.id
-                JOIN users u2 ON m.recipient_id = u2.id
-                WHERE (m.sender_id = ? AND m.is_deleted_by_sender = FALSE) 
-                   OR (m.recipient_id = ? AND m.is_deleted_by_recipient = FALSE)
-                ORDER BY m.created_at DESC
-            ''', (user_id, user_id, user_id, user_id, user_id))
+            cursor.execute(MESSAGES_ALL_SQL, (user_id, user_id, user_id, user_id, user_id))
         
         messages = cursor.fetchall()
-        conn.close()
         
         # Convert to list of dictionaries
         message_list = []
@@ -3091,12 +2490,11 @@ def send_message():
         referral_id = data.get('referral_id')
         
         # Verify recipient exists
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('SELECT id FROM users WHERE id = ?', (recipient_id,))
         if not cursor.fetchone():
-            conn.close()
             return jsonify({'success': False, 'error': 'Recipient not found'}), 404
         
         # Insert message
@@ -3107,7 +2505,6 @@ def send_message():
         
         message_id = cursor.lastrowid
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True, 'message_id': message_id})
         
@@ -3123,7 +2520,7 @@ def mark_message_read(message_id):
     try:
         user_id = session['user_id']
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verify user is the recipient of this message
@@ -3133,7 +2530,6 @@ def mark_message_read(message_id):
         ''', (message_id, user_id))
         
         if not cursor.fetchone():
-            conn.close()
             return jsonify({'success': False, 'error': 'Message not found or access denied'}), 404
         
         # Mark as read
@@ -3144,7 +2540,6 @@ def mark_message_read(message_id):
         ''', (message_id, user_id))
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
         
@@ -3160,7 +2555,7 @@ def delete_message(message_id):
     try:
         user_id = session['user_id']
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Check if user is sender or recipient
@@ -3170,7 +2565,6 @@ def delete_message(message_id):
         
         result = cursor.fetchone()
         if not result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Message not found'}), 404
         
         sender_id, recipient_id = result
@@ -3185,11 +2579,9 @@ def delete_message(message_id):
                 UPDATE messages SET is_deleted_by_recipient = TRUE WHERE id = ?
             ''', (message_id,))
         else:
-            conn.close()
             return jsonify({'success': False, 'error': 'Access denied'}), 403
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
         
@@ -3206,7 +2598,7 @@ def get_user_contacts():
         user_id = session['user_id']
         user_role = session.get('role', 'patient')
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Different contact lists based on user role
@@ -3247,7 +2639,6 @@ def get_user_contacts():
             ''', (user_id,))
         
         contacts = cursor.fetchall()
-        conn.close()
         
         # Convert to list of dictionaries
         contact_list = []
@@ -3271,7 +2662,7 @@ def get_referral_detail(referral_id):
         return jsonify({'success': False, 'error': 'Authentication required'}), 401
     
     try:
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Get referral details with access control
@@ -3296,7 +2687,6 @@ def get_referral_detail(referral_id):
                          (referral_id, f'%{patient_name}%', user_id))
         
         referral = cursor.fetchone()
-        conn.close()
         
         if not referral:
             return jsonify({'success': False, 'error': 'Referral not found or access denied'}), 404
@@ -3347,152 +2737,46 @@ def create_referral_by_code():
     if len(provider_code) != 6 or not provider_code.isalnum():
         return jsonify({'error': 'Provider code must be exactly 6 alphanumeric characters'}), 400
     
-    conn = sqlite3.connect('sapyyn.db')
-    cursor = conn.cursor()
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    # Documents table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            referral_id INTEGER,
-            user_id INTEGER,
-            file_type TEXT NOT NULL,
-            file_name TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            file_size INTEGER,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (referral_id) REFERENCES referrals (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
+    conn = get_db()
+    cursor = conn.cursor()
     
-    # Provider Codes table
+    # Look up the active provider behind the code
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS provider_codes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            provider_code TEXT UNIQUE NOT NULL,
-            provider_type TEXT NOT NULL,
-            practice_name TEXT,
-            specialization TEXT,
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
+        SELECT pc.user_id, pc.practice_name, u.full_name
+        FROM provider_codes pc
+        JOIN users u ON pc.user_id = u.id
+        WHERE pc.provider_code = ? AND pc.is_active = TRUE
+        AND (pc.expires_at IS NULL OR pc.expires_at > CURRENT_TIMESTAMP)
+    ''', (provider_code,))
     
-    # Appointments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS appointments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            appointment_id TEXT UNIQUE NOT NULL,
-            patient_id INTEGER,
-            provider_id INTEGER NOT NULL,
-            referral_id TEXT,
-            appointment_type TEXT DEFAULT 'consultation',
-            appointment_date TIMESTAMP NOT NULL,
-            duration_minutes INTEGER DEFAULT 60,
-            status TEXT DEFAULT 'scheduled',
-            notes TEXT,
-            patient_name TEXT,
-            patient_email TEXT,
-            patient_phone TEXT,
-            reason TEXT,
-            location TEXT,
-            virtual_meeting_link TEXT,
-            created_by INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (patient_id) REFERENCES users (id),
-            FOREIGN KEY (provider_id) REFERENCES users (id),
-            FOREIGN KEY (created_by) REFERENCES users (id)
-        )
-    ''')
+    provider = cursor.fetchone()
+    if not provider:
+        return jsonify({'error': 'Invalid or inactive provider code'}), 404
     
-    # Promotions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS promotions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            description TEXT,
-            image_path TEXT,
-            image_filename TEXT,
-            start_date DATE NOT NULL,
-            end_date DATE NOT NULL,
-            is_active BOOLEAN DEFAULT TRUE,
-            status TEXT DEFAULT 'draft',
-            target_audience TEXT,
-            budget DECIMAL(10,2),
-            impressions INTEGER DEFAULT 0,
-            clicks INTEGER DEFAULT 0,
-            click_through_rate DECIMAL(5,4) DEFAULT 0.0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
+    provider_id, practice_name, target_doctor = provider
+    referral_id = str(uuid.uuid4())[:8].upper()
     
-    # User Feedback table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_feedback (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            visit_purpose TEXT,
-            ease_of_use TEXT,
-            confusion_feedback TEXT,
-            nps_score INTEGER,
-            additional_comments TEXT,
-            contact_email TEXT,
-            page_url TEXT,
-            page_title TEXT,
-            timestamp TEXT,
-            server_timestamp TEXT,
-            ip_address TEXT,
-            user_agent TEXT,
-            screen_resolution TEXT,
-            session_duration INTEGER,
-            user_role TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    qr_data = f"Referral ID: {referral_id}\nPatient: {patient_name}\nCondition: {medical_condition}"
+    qr_code = generate_qr_code(qr_data)
     
-    # Fraud Detection tables
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fraud_scores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            ip_address TEXT,
-            email TEXT,
-            device_fingerprint TEXT,
-            fraud_score DECIMAL(5,2) DEFAULT 0.0,
-            risk_level TEXT DEFAULT 'low',
-            is_paused BOOLEAN DEFAULT FALSE,
-            reasons TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Seed initial admin user
-    cursor.execute("SELECT id FROM users WHERE email = ?", (INITIAL_ADMIN['email'],))
-    if cursor.fetchone() is None:
-        password_hash = generate_password_hash(generate_secure_password())
-        cursor.execute('''
-            INSERT INTO users (username, email, password_hash, full_name, role, is_verified)
-            VALUES (?, ?, ?, ?, ?, TRUE)
-        ''', (
-            INITIAL_ADMIN['username'],
-            INITIAL_ADMIN['email'],
-            password_hash,
-            INITIAL_ADMIN['full_name'],
-            INITIAL_ADMIN['role']
-        ))
+        INSERT INTO referrals (user_id, referral_id, patient_name, referring_doctor,
+                             target_doctor, medical_condition, dentist_id, qr_code)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (session['user_id'], referral_id, patient_name, referring_doctor,
+          target_doctor, medical_condition, provider_id, qr_code))
     
     conn.commit()
-    conn.close()
+    
+    return jsonify({
+        'success': True,
+        'referral_id': referral_id,
+        'target_doctor': target_doctor,
+        'practice_name': practice_name
+    })
 
 # Helper functions
 def create_provider_code(user_id, provider_type, practice_name, specialization):
@@ -3505,7 +2789,7 @@ def create_provider_code(user_id, provider_type, practice_name, specialization):
     
     while True:
         code = ''.join(random.choices(chars, k=length))
-        conn = sqlite3.connect(config_class.DATABASE_NAME)
+        conn = get_db()
         cursor = conn.cursor()
         
         try:
@@ -3514,10 +2798,8 @@ def create_provider_code(user_id, provider_type, practice_name, specialization):
                 VALUES (?, ?, ?, ?, ?)
             ''', (user_id, code, provider_type, practice_name, specialization))
             conn.commit()
-            conn.close()
             return code
         except sqlite3.IntegrityError:
-            conn.close()
             continue
 
 # Routes
@@ -3533,11 +2815,10 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = sqlite3.connect(config_class.DATABASE_NAME)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
         user = cursor.fetchone()
-        conn.close()
         
         if user and check_password_hash(user[3], password):
             if user[6]:  # is_paused
@@ -3565,14 +2846,13 @@ def register():
         full_name = request.form['full_name']
         role = request.form.get('role', 'patient')
         
-        conn = sqlite3.connect(config_class.DATABASE_NAME)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Check if user exists
         cursor.execute('SELECT id FROM users WHERE username = ? OR email = ?', (username, email))
         if cursor.fetchone():
             flash('Username or email already exists', 'error')
-            conn.close()
             return redirect(url_for('register'))
         
         # Create user
@@ -3588,8 +2868,13 @@ def register():
         if role in ['dentist', 'specialist', 'dentist_admin', 'specialist_admin']:
             create_provider_code(user_id, role, f"{full_name} Practice", 'General')
         
+        # Queued with the account so the request never waits on SMTP
+        EmailOutbox.enqueue(
+            cursor, email, 'Welcome to Sapyyn',
+            f"Hi {full_name}, your Sapyyn account has been created. You can now log in as {username}."
+        )
+        
         conn.commit()
-        conn.close()
         
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('login'))
@@ -3602,21 +2887,15 @@ def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect(config_class.DATABASE_NAME)
-    cursor = conn.cursor()
+    conn = get_db()
     
     # Get user stats
-    cursor.execute('SELECT COUNT(*) FROM referrals WHERE user_id = ?', (session['user_id'],))
-    total_referrals = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM referrals WHERE user_id = ? AND status = "pending"', (session['user_id'],))
-    pending_referrals = cursor.fetchone()[0]
-    
-    conn.close()
+    stats = UserStatsService.get_stats(conn, session['user_id'])
     
     return render_template('dashboard.html', 
-                         total_referrals=total_referrals,
-                         pending_referrals=pending_referrals,
+                         total_referrals=stats['referral_total'],
+                         pending_referrals=stats['status_counts'].get('pending', 0),
+                         total_documents=stats['document_total'],
                          analytics_config=ANALYTICS_CONFIG)
 
 @app.route('/logout')
@@ -3626,21 +2905,6 @@ def logout():
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
-# API Routes
-@app.route('/api/referrals', methods=['GET'])
-def get_referrals():
-    """Get user referrals"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
-    conn = sqlite3.connect(config_class.DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM referrals WHERE user_id = ? ORDER BY created_at DESC', (session['user_id'],))
-    referrals = cursor.fetchall()
-    conn.close()
-
-
-
 
 # ============================================================================
 # STATIC PAGE ROUTES & NAVIGATION LINKS
@@ -3887,71 +3151,61 @@ def referrals():
         flash('Please log in to view your referrals.', 'error')
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get filter parameters
     status_filter = request.args.get('status', 'all')
     search_query = request.args.get('search', '')
     sort_by = request.args.get('sort', 'created_at')
-    sort_order = request.args.get('order', 'desc')
+    sort_order = request.args.get('order', 'desc').lower()
+    
+    # Only whitelisted sort keys and directions ever reach the SQL
+    if sort_by not in REFERRAL_SORT_COLUMNS:
+        sort_by = 'created_at'
+    if sort_order not in ('asc', 'desc'):
+        sort_order = 'desc'
+    sort_expr = REFERRAL_SORT_COLUMNS[sort_by]
+    
+    try:
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
     
     # Build base query - get referrals based on user role
     user_role = session.get('role', 'patient')
     
     if user_role in ['dentist', 'dentist_admin']:
         # Dentists see referrals they created
-        base_query = '''
-            SELECT r.*, COUNT(d.id) as document_count,
-                   u.full_name as target_provider_name
-            FROM referrals r
-            LEFT JOIN documents d ON r.id = d.referral_id
-            LEFT JOIN users u ON u.full_name = r.target_doctor
-            WHERE r.user_id = ?
-        '''
+        base_query = REFERRALS_PAGE_DENTIST_SQL
         query_params = [session['user_id']]
     elif user_role in ['specialist', 'specialist_admin']:
         # Specialists see referrals sent to them + ones they created
-        base_query = '''
-            SELECT r.*, COUNT(d.id) as document_count,
-                   CASE WHEN r.user_id = ? THEN r.target_doctor ELSE u.full_name END as target_provider_name,
-                   CASE WHEN r.user_id = ? THEN 'sent' ELSE 'received' END as referral_direction
-            FROM referrals r
-            LEFT JOIN documents d ON r.id = d.referral_id
-            LEFT JOIN users u ON r.user_id = u.id
-            WHERE r.user_id = ? OR r.target_doctor = ?
-        '''
+        base_query = REFERRALS_PAGE_SPECIALIST_SQL
         user_full_name = session.get('full_name', '')
         query_params = [session['user_id'], session['user_id'], session['user_id'], user_full_name]
     else:
         # Patients see referrals where they are the patient
-        base_query = '''
-            SELECT r.*, COUNT(d.id) as document_count,
-                   r.target_doctor as target_provider_name,
-                   u.full_name as referring_provider_name
-            FROM referrals r
-            LEFT JOIN documents d ON r.id = d.referral_id
-            LEFT JOIN users u ON r.user_id = u.id
-            WHERE r.patient_name LIKE ? OR r.user_id = ?
-        '''
+        base_query = REFERRALS_PAGE_PATIENT_SQL
         query_params = [f'%{session.get("full_name", "")}%', session['user_id']]
+    conditions = []
     
     # Add status filter
     if status_filter != 'all':
-        base_query += ' AND r.status = ?'
+        conditions.append('r.status = ?')
         query_params.append(status_filter)
     
     # Add search filter
     if search_query:
-        base_query += ''' AND (r.patient_name LIKE ? OR r.referring_doctor LIKE ? 
-                             OR r.target_doctor LIKE ? OR r.medical_condition LIKE ?)'''
+        conditions.append('''(r.patient_name LIKE ? OR r.referring_doctor LIKE ? 
+                             OR r.target_doctor LIKE ? OR r.medical_condition LIKE ?)''')
         search_pattern = f'%{search_query}%'
         query_params.extend([search_pattern, search_pattern, search_pattern, search_pattern])
     
-    # Add GROUP BY and ORDER BY
-    base_query += f''' GROUP BY r.id ORDER BY r.{sort_by} {sort_order.upper()}'''
-    
-    cursor.execute(base_query, query_params)
+    # Add GROUP BY, ORDER BY and page size; further pages are loaded by
+    # the page's script through /api/referrals
+    query_params.append(limit)
+    cursor.execute(referrals_page_query(base_query, sort_expr, sort_order, conditions), query_params)
     referrals = cursor.fetchall()
     
     # Get summary statistics
@@ -3973,8 +3227,6 @@ def referrals():
     cursor.execute('SELECT DISTINCT status FROM referrals WHERE user_id = ? ORDER BY status', (session['user_id'],))
     available_statuses = [row[0] for row in cursor.fetchall()]
     
-    conn.close()
-    
     return render_template('referrals.html', 
                          referrals=referrals,
                          stats=stats,
@@ -4070,33 +3322,9 @@ def submit_feedback():
         feedback_data['user_role'] = session.get('role')
         
         # Save to database
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        # Create feedback table if it doesn't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_feedback (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                visit_purpose TEXT,
-                ease_of_use TEXT,
-                confusion_feedback TEXT,
-                nps_score INTEGER,
-                additional_comments TEXT,
-                contact_email TEXT,
-                page_url TEXT,
-                page_title TEXT,
-                timestamp TEXT,
-                server_timestamp TEXT,
-                ip_address TEXT,
-                user_agent TEXT,
-                screen_resolution TEXT,
-                session_duration INTEGER,
-                user_role TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
         # Insert feedback
         cursor.execute('''
             INSERT INTO user_feedback (
@@ -4125,7 +3353,6 @@ def submit_feedback():
         ))
         
         conn.commit()
-        conn.close()
         
         # Track feedback submission in analytics
         if ANALYTICS_CONFIG['ENABLE_ANALYTICS']:
@@ -4165,7 +3392,7 @@ def analytics_stats():
     try:
         days = request.args.get('days', 30, type=int)
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Get feedback stats by purpose
@@ -4225,8 +3452,6 @@ def analytics_stats():
         '''.format(days))
         ease_distribution = cursor.fetchall()
         
-        conn.close()
-        
         return jsonify({
             'feedback_stats': feedback_stats,
             'user_stats': user_stats,
@@ -4255,7 +3480,7 @@ def get_feedback_detail(feedback_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     try:
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -4263,7 +3488,6 @@ def get_feedback_detail(feedback_id):
         ''', (feedback_id,))
         
         feedback = cursor.fetchone()
-        conn.close()
         
         if not feedback:
             return jsonify({'error': 'Feedback not found'}), 404
@@ -4280,18 +3504,29 @@ def get_feedback_detail(feedback_id):
 
 @app.route('/api/feedback/export')
 def export_feedback():
-    """Export feedback data as CSV"""
+    """Stream feedback data as CSV or NDJSON"""
     if 'user_id' not in session or session.get('role') not in ['admin', 'dentist_admin', 'specialist_admin']:
         return jsonify({'error': 'Unauthorized'}), 403
-
     
-    return jsonify([{
-        'id': r[0],
-        'referral_id': r[2],
-        'patient_name': r[3],
-        'status': r[9],
-        'created_at': r[15]
-    } for r in referrals])
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+    
+    query = 'SELECT * FROM user_feedback'
+    params = []
+    days = request.args.get('days', type=int)
+    if days:
+        query += " WHERE created_at >= date('now', ?)"
+        params.append(f'-{days} days')
+    query += ' ORDER BY id'
+    
+    return ExportService.stream(
+        query, params,
+        export_format=export_format,
+        filename=f"feedback_{datetime.now().strftime('%Y%m%d')}",
+        compress=ExportService.wants_gzip(request),
+        database=app.config.get('DATABASE_NAME')
+    )
 
 # Error handlers
 @app.errorhandler(404)
@@ -4316,7 +3551,7 @@ app.register_blueprint(admin_promotions, url_prefix='/admin/promotions')
 
 @app.route('/api/referrals', methods=['GET'])
 def get_referrals_list():
-    """Get list of referrals with filtering and permissions"""
+    """Get a page of referrals with filtering, permissions and keyset pagination"""
     if 'user_id' not in session:
         return jsonify({'error': 'Authentication required'}), 401
     
@@ -4324,82 +3559,149 @@ def get_referrals_list():
         user_id = session['user_id']
         user_role = session.get('role', 'patient')
         status_filter = request.args.get('status', 'all')  # all, pending, completed
+        sort_by = request.args.get('sort', 'created_at')
+        
+        if sort_by not in REFERRAL_SORT_COLUMNS:
+            return jsonify({'success': False, 'error': f'Unsupported sort: {sort_by}'}), 400
         
-        conn = sqlite3.connect('sapyyn.db')
+        try:
+            sort_order = parse_order(request.args.get('order'))
+            limit = parse_limit(request.args.get('limit'))
+            fields = parse_fields(request.args.get('fields'),
+                                  set(REFERRAL_COLUMNS) | set(REFERRAL_JOINED_FIELDS))
+            after = None
+            if request.args.get('cursor'):
+                after = decode_cursor(request.args['cursor'], sort_by, sort_order)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        # Column projection; id and the sort key are always returned so the
+        # client can build the next cursor
+        fields = fields or list(REFERRAL_COLUMNS) + list(REFERRAL_JOINED_FIELDS)
+        for required in (sort_by, 'id'):
+            if required not in fields:
+                fields.insert(0, required)
+        select_list = ', '.join(
+            f'{REFERRAL_JOINED_FIELDS[name]} as {name}' if name in REFERRAL_JOINED_FIELDS else f'r.{name}'
+            for name in fields
+        )
+        sort_expr = REFERRAL_SORT_COLUMNS[sort_by]
+        
+        conn = get_db()
         cursor = conn.cursor()
         
         # Build query based on user role and permissions
+        conditions = []
+        query_params = []
         if user_role == 'admin':
             # Admin sees all referrals
-            base_query = '''
-                SELECT r.*, 
-                       p.full_name as patient_name_user,
-                       d.full_name as dentist_name_user
-                FROM referrals r
-                LEFT JOIN users p ON r.patient_id = p.id
-                LEFT JOIN users d ON r.dentist_id = d.id
-            '''
-            query_params = []
+            pass
         elif user_role in ['dentist', 'dentist_admin', 'specialist', 'specialist_admin']:
             # Dentists see referrals they initiated
-            base_query = '''
-                SELECT r.*,
-                       p.full_name as patient_name_user,
-                       d.full_name as dentist_name_user
-                FROM referrals r
-                LEFT JOIN users p ON r.patient_id = p.id
-                LEFT JOIN users d ON r.dentist_id = d.id
-                WHERE r.dentist_id = ? OR r.user_id = ?
-            '''
-            query_params = [user_id, user_id]
+            conditions.append(REFERRAL_LIST_PROVIDER_FILTER)
+            query_params.extend([user_id, user_id])
         else:
             # Patients see their own referrals
-            base_query = '''
-                SELECT r.*,
-                       p.full_name as patient_name_user,
-                       d.full_name as dentist_name_user
-                FROM referrals r
-                LEFT JOIN users p ON r.patient_id = p.id
-                LEFT JOIN users d ON r.dentist_id = d.id
-                WHERE r.patient_id = ? OR r.user_id = ?
-            '''
-            query_params = [user_id, user_id]
+            conditions.append(REFERRAL_LIST_PATIENT_FILTER)
+            query_params.extend([user_id, user_id])
         
         # Add status filter
         if status_filter != 'all':
             if status_filter == 'pending':
-                base_query += ' AND (r.status = "pending" OR r.status = "emergency_pending" OR r.status = "consultation_pending")'
+                conditions.append("r.status IN ('pending', 'emergency_pending', 'consultation_pending')")
             elif status_filter == 'completed':
-                base_query += ' AND (r.status = "completed" OR r.status = "treatment_completed")'
+                conditions.append("r.status IN ('completed', 'treatment_completed')")
             else:
-                base_query += ' AND r.status = ?'
+                conditions.append('r.status = ?')
                 query_params.append(status_filter)
         
-        base_query += ' ORDER BY r.created_at DESC'
+        # Continue after the last row of the previous page
+        if after is not None:
+            conditions.append(keyset_condition(sort_expr, 'r.id', sort_order))
+            query_params.extend(after)
+        
+        query = referral_list_query(select_list, sort_expr, sort_order, conditions)
         
-        cursor.execute(base_query, query_params)
-        referrals = cursor.fetchall()
+        # Fetch one extra row to learn whether another page exists
+        cursor.execute(query, query_params + [limit + 1])
+        rows = cursor.fetchmany(limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
         # Convert to list of dictionaries
         columns = [description[0] for description in cursor.description]
         referrals_list = []
-        for referral in referrals:
-            referral_dict = dict(zip(columns, referral))
+        for row in rows:
+            referral_dict = dict(zip(columns, row))
+            referral_dict.pop('_sort_key')
             referrals_list.append(referral_dict)
         
-        conn.close()
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            next_cursor = encode_cursor(sort_by, sort_order, last[-1], last[columns.index('id')])
         
         return jsonify({
             'success': True,
             'referrals': referrals_list,
             'count': len(referrals_list),
-            'filter': status_filter
+            'filter': status_filter,
+            'sort': sort_by,
+            'order': sort_order,
+            'limit': limit,
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
         app.logger.error(f'Error getting referrals list: {str(e)}')
         return jsonify({'success': False, 'error': 'Internal server error'}), 500
 
+@app.route('/api/referrals/export', methods=['GET'])
+def export_referrals():
+    """Stream every visible referral as CSV or NDJSON"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    user_id = session['user_id']
+    user_role = session.get('role', 'patient')
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': f'Unsupported export format: {export_format}'}), 400
+    
+    # QR code images are large and rarely wanted in a bulk export
+    default_fields = [name for name in REFERRAL_COLUMNS if name != 'qr_code']
+    try:
+        fields = parse_fields(request.args.get('fields'), set(REFERRAL_COLUMNS)) or default_fields
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    query = f"SELECT {', '.join(f'r.{name}' for name in fields)} FROM referrals r"
+    conditions = []
+    query_params = []
+    if user_role in ['dentist', 'dentist_admin', 'specialist', 'specialist_admin']:
+        conditions.append(REFERRAL_LIST_PROVIDER_FILTER)
+        query_params.extend([user_id, user_id])
+    elif user_role != 'admin':
+        conditions.append(REFERRAL_LIST_PATIENT_FILTER)
+        query_params.extend([user_id, user_id])
+    
+    status_filter = request.args.get('status', 'all')
+    if status_filter != 'all':
+        conditions.append('r.status = ?')
+        query_params.append(status_filter)
+    
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY r.id'
+    
+    return ExportService.stream(
+        query, query_params,
+        export_format=export_format,
+        filename=f"referrals_{datetime.now().strftime('%Y%m%d')}",
+        compress=ExportService.wants_gzip(request),
+        database=app.config.get('DATABASE_NAME')
+    )
+
 @app.route('/api/referrals/<int:referral_id>', methods=['GET'])
 def get_referral_detail(referral_id):
     """Get detailed information for a specific referral"""
@@ -4410,7 +3712,7 @@ def get_referral_detail(referral_id):
         user_id = session['user_id']
         user_role = session.get('role', 'patient')
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Get referral with permission check
@@ -4427,31 +3729,30 @@ def get_referral_detail(referral_id):
             ''', (referral_id,))
         elif user_role in ['dentist', 'dentist_admin', 'specialist', 'specialist_admin']:
             # Dentists can see referrals they initiated
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT r.*,
                        p.full_name as patient_name_user,
                        d.full_name as dentist_name_user
                 FROM referrals r
                 LEFT JOIN users p ON r.patient_id = p.id
                 LEFT JOIN users d ON r.dentist_id = d.id
-                WHERE r.id = ? AND (r.dentist_id = ? OR r.user_id = ?)
+                WHERE r.id = ? AND {REFERRAL_LIST_PROVIDER_FILTER}
             ''', (referral_id, user_id, user_id))
         else:
             # Patients can see their own referrals
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT r.*,
                        p.full_name as patient_name_user,
                        d.full_name as dentist_name_user
                 FROM referrals r
                 LEFT JOIN users p ON r.patient_id = p.id
                 LEFT JOIN users d ON r.dentist_id = d.id
-                WHERE r.id = ? AND (r.patient_id = ? OR r.user_id = ?)
+                WHERE r.id = ? AND {REFERRAL_LIST_PATIENT_FILTER}
             ''', (referral_id, user_id, user_id))
         
         referral = cursor.fetchone()
         
         if not referral:
-            conn.close()
             return jsonify({'success': False, 'error': 'Referral not found or access denied'}), 404
         
         # Convert to dictionary
@@ -4473,8 +3774,6 @@ def get_referral_detail(referral_id):
         
         referral_dict['documents'] = documents_list
         
-        conn.close()
-        
         return jsonify({
             'success': True,
             'referral': referral_dict
@@ -4516,20 +3815,18 @@ def create_referral():
         if user_role not in ['dentist', 'dentist_admin', 'specialist', 'specialist_admin', 'admin']:
             return jsonify({'success': False, 'error': 'Insufficient permissions to create referrals'}), 403
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verify patient and dentist exist
         cursor.execute('SELECT full_name FROM users WHERE id = ?', (patient_id,))
         patient = cursor.fetchone()
         if not patient:
-            conn.close()
             return jsonify({'success': False, 'error': 'Patient not found'}), 404
         
         cursor.execute('SELECT full_name FROM users WHERE id = ?', (dentist_id,))
         dentist = cursor.fetchone()
         if not dentist:
-            conn.close()
             return jsonify({'success': False, 'error': 'Dentist not found'}), 404
         
         # Generate referral ID and QR code
@@ -4558,7 +3855,6 @@ def create_referral():
         
         new_referral_id = cursor.lastrowid
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True,
@@ -4592,7 +3888,7 @@ def update_referral_status():
         if not new_status:
             return jsonify({'success': False, 'error': 'Status is required'}), 400
         
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Check if referral exists and user has permission to update it
@@ -4607,7 +3903,6 @@ def update_referral_status():
         referral = cursor.fetchone()
         
         if not referral:
-            conn.close()
             return jsonify({'success': False, 'error': 'Referral not found or access denied'}), 404
         
         old_status = referral[1]
@@ -4633,7 +3928,6 @@ def update_referral_status():
         ''', update_values)
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True,
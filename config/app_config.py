@@ -15,7 +15,51 @@ class Config:
     # Database Configuration
     DATABASE_NAME = os.environ.get('DATABASE_NAME', 'sapyyn.db')
     DATABASE_URL = os.environ.get('DATABASE_URL', f'sqlite:///{DATABASE_NAME}')
-    
+
+    # SQLite Connection Pool Configuration
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 10))
+    SQLITE_POOL_TIMEOUT = float(os.environ.get('SQLITE_POOL_TIMEOUT', 30))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16384))  # 16MB page cache
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024))  # 128MB
+
+    # Seconds browsers may reuse a /api/conversion-analytics response
+    CONVERSION_ANALYTICS_MAX_AGE = int(os.environ.get('CONVERSION_ANALYTICS_MAX_AGE', 60))
+
+    # Reward Job Queue Configuration
+    REWARD_QUEUE_BATCH_SIZE = int(os.environ.get('REWARD_QUEUE_BATCH_SIZE', 50))
+    REWARD_QUEUE_MAX_ATTEMPTS = int(os.environ.get('REWARD_QUEUE_MAX_ATTEMPTS', 8))
+    REWARD_QUEUE_BACKOFF_SECONDS = float(os.environ.get('REWARD_QUEUE_BACKOFF_SECONDS', 30))
+    REWARD_QUEUE_MAX_BACKOFF_SECONDS = float(os.environ.get('REWARD_QUEUE_MAX_BACKOFF_SECONDS', 3600))
+    REWARD_QUEUE_LEASE_SECONDS = float(os.environ.get('REWARD_QUEUE_LEASE_SECONDS', 300))
+    REWARD_QUEUE_POLL_SECONDS = float(os.environ.get('REWARD_QUEUE_POLL_SECONDS', 2))
+
+    # Fraud Signal Configuration
+    FRAUD_COUNTER_SYNC_SECONDS = float(os.environ.get('FRAUD_COUNTER_SYNC_SECONDS', 5))
+    FRAUD_COUNTER_MAX_KEYS = int(os.environ.get('FRAUD_COUNTER_MAX_KEYS', 50000))
+    FRAUD_UA_VELOCITY_THRESHOLD = int(os.environ.get('FRAUD_UA_VELOCITY_THRESHOLD', 10))  # per hour
+    FRAUD_SUBNET_THRESHOLD = int(os.environ.get('FRAUD_SUBNET_THRESHOLD', 10))  # per day
+    FRAUD_ADVOCATE_DAILY_THRESHOLD = int(os.environ.get('FRAUD_ADVOCATE_DAILY_THRESHOLD', 20))  # batch re-scoring
+
+    # Promotion Slot Configuration
+    PROMOTION_INDEX_REFRESH_SECONDS = float(os.environ.get('PROMOTION_INDEX_REFRESH_SECONDS', 60))
+    PROMOTION_OPT_OUT_CACHE_SIZE = int(os.environ.get('PROMOTION_OPT_OUT_CACHE_SIZE', 10000))
+    PROMOTION_OPT_OUT_TTL_SECONDS = float(os.environ.get('PROMOTION_OPT_OUT_TTL_SECONDS', 300))
+    PROMOTION_COUNTER_FLUSH_SECONDS = float(os.environ.get('PROMOTION_COUNTER_FLUSH_SECONDS', 10))
+    PROMOTION_COUNTER_FLUSH_EVENTS = int(os.environ.get('PROMOTION_COUNTER_FLUSH_EVENTS', 500))
+    PROMOTION_COUNTER_SPOOL_DIR = os.environ.get('PROMOTION_COUNTER_SPOOL_DIR', 'spool/promotion_counters')  # empty: memory only
+
+    # Background Scheduler Configuration
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'False').lower() == 'true'  # thread in each web worker
+    SCHEDULER_POLL_SECONDS = float(os.environ.get('SCHEDULER_POLL_SECONDS', 30))
+    SCHEDULER_LEASE_SECONDS = float(os.environ.get('SCHEDULER_LEASE_SECONDS', 600))
+    SCHEDULER_RETRY_SECONDS = float(os.environ.get('SCHEDULER_RETRY_SECONDS', 60))
+    SCHEDULER_HISTORY_DAYS = int(os.environ.get('SCHEDULER_HISTORY_DAYS', 30))
+
+    # Appointment Reminder Configuration
+    REMINDER_LEAD_HOURS = float(os.environ.get('REMINDER_LEAD_HOURS', 24))  # remind this long before start
+    REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', 500))
+
     # File Upload Configuration
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB default
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
@@ -60,6 +104,14 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    MAIL_TIMEOUT_SECONDS = float(os.environ.get('MAIL_TIMEOUT_SECONDS', 30))
+    MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE', 4))  # open SMTP connections per email worker
+    MAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('MAIL_OUTBOX_BATCH_SIZE', 100))
+    MAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('MAIL_OUTBOX_MAX_ATTEMPTS', 6))
+    MAIL_OUTBOX_BACKOFF_SECONDS = float(os.environ.get('MAIL_OUTBOX_BACKOFF_SECONDS', 60))
+    MAIL_OUTBOX_MAX_BACKOFF_SECONDS = float(os.environ.get('MAIL_OUTBOX_MAX_BACKOFF_SECONDS', 3600))
+    MAIL_OUTBOX_LEASE_SECONDS = float(os.environ.get('MAIL_OUTBOX_LEASE_SECONDS', 300))
+    MAIL_OUTBOX_POLL_SECONDS = float(os.environ.get('MAIL_OUTBOX_POLL_SECONDS', 2))
 
     # Analytics Configuration
     GA4_MEASUREMENT_ID = os.environ.get('GA4_MEASUREMENT_ID')
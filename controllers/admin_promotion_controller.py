@@ -5,9 +5,10 @@ Admin controller for managing promotions
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
 from models import db, Promotion, PromotionRole, PromotionLocation
 from services.promotion_service import PromotionService
+from services.promotion_analytics_service import PromotionAnalyticsService
 from services.image_service import ImageService
 from services.audit_service import AuditService
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
 # Create blueprint
@@ -284,7 +285,11 @@ def get_stats(promotion_id):
         'start_date': promotion.start_date.strftime('%Y-%m-%d'),
         'end_date': promotion.end_date.strftime('%Y-%m-%d'),
         'status': 'Active' if promotion.is_active else 'Inactive',
-        'days_remaining': (promotion.end_date - datetime.utcnow()).days
+        'days_remaining': (promotion.end_date - datetime.utcnow()).days,
+        'daily': PromotionAnalyticsService.time_series(
+            *PromotionAnalyticsService.window(datetime.utcnow() - timedelta(days=30)),
+            granularity='day', promotion_id=promotion_id
+        )
     }
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -294,4 +299,67 @@ def get_stats(promotion_id):
         'admin/promotions/stats.html',
         promotion=promotion,
         stats=stats
-    )
\ No newline at end of file
+    )
+
+@admin_promotions.route('/analytics/timeseries', methods=['GET'])
+@require_admin
+def analytics_timeseries():
+    """Handle GET request for impressions, clicks and CTR per hour or day
+    
+    Query parameters: start, end (ISO dates or times, UTC), granularity
+    ('hour' or 'day'), promotion_id, location, role
+    """
+    try:
+        start, end = PromotionAnalyticsService.window(request.args.get('start'), request.args.get('end'))
+        series = PromotionAnalyticsService.time_series(
+            start, end,
+            granularity=request.args.get('granularity', 'day'),
+            promotion_id=request.args.get('promotion_id', type=int),
+            location=request.args.get('location'),
+            role=request.args.get('role')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'series': series})
+
+@admin_promotions.route('/analytics/breakdown', methods=['GET'])
+@require_admin
+def analytics_breakdown():
+    """Handle GET request for performance per slot location or viewer role
+    
+    Query parameters: start, end, by ('location' or 'role'), promotion_id
+    """
+    try:
+        start, end = PromotionAnalyticsService.window(request.args.get('start'), request.args.get('end'))
+        rows = PromotionAnalyticsService.breakdown(
+            start, end,
+            by=request.args.get('by', 'location'),
+            promotion_id=request.args.get('promotion_id', type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'breakdown': rows})
+
+@admin_promotions.route('/analytics/top', methods=['GET'])
+@require_admin
+def analytics_top_performers():
+    """Handle GET request for the best promotions over a window
+    
+    Query parameters: start, end, metric ('ctr', 'clicks' or 'impressions'),
+    limit, min_impressions, location
+    """
+    try:
+        start, end = PromotionAnalyticsService.window(request.args.get('start'), request.args.get('end'))
+        rows = PromotionAnalyticsService.top_performers(
+            start, end,
+            metric=request.args.get('metric', 'ctr'),
+            limit=min(request.args.get('limit', 10, type=int), 100),
+            min_impressions=request.args.get('min_impressions', 100, type=int),
+            location=request.args.get('location')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'promotions': rows})
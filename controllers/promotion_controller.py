@@ -35,7 +35,7 @@ def get_promotion_slot(location):
         
         # Record impression if promotion found
         if promotion:
-            PromotionService.record_impression(promotion.id)
+            PromotionService.record_impression(promotion.id, promotion.location, user.role if user else None)
         
         # Render the promotion slot
         return render_template(
@@ -75,7 +75,7 @@ def get_promotion_api(location):
         
         # Record impression if promotion found
         if promotion:
-            PromotionService.record_impression(promotion.id)
+            PromotionService.record_impression(promotion.id, promotion.location, user.role if user else None)
             
             # Return promotion data
             return jsonify({
@@ -159,7 +159,7 @@ def record_click(promotion_id):
         abort(404)
     
     # Record the click
-    PromotionService.record_click(promotion_id)
+    PromotionService.record_click(promotion_id, promotion.location, session.get('role'))
     
     # Get current user if logged in
     user = None
@@ -204,6 +204,7 @@ def update_preferences():
         user_prefs.updated_at = datetime.utcnow()
         
         db.session.commit()
+        PromotionService.set_opt_out(user_id, opt_out)
         
         flash_message = 'You have opted out of targeted promotions.' if opt_out else 'You will now see targeted promotions.'
         flash(flash_message, 'success')
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Worker process that delivers queued email from the outbox
+
+Usage:
+    python cron_jobs/email_worker.py            # run until interrupted
+    python cron_jobs/email_worker.py --once     # drain ready messages and exit (cron)
+    python cron_jobs/email_worker.py --stats    # print outbox depth and lag
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+
+# Add parent directory to path so we can import from the main app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.app_config import get_config
+from database import connection
+from services.email_outbox import EmailOutbox, MailerPool
+from services.reward_queue import default_worker_id
+
+os.makedirs('logs', exist_ok=True)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/email_worker.log'),
+        logging.StreamHandler()
+    ]
+)
+
+logger = logging.getLogger('email_worker')
+
+_stopping = False
+
+
+def _request_stop(signum, frame):
+    """Finish the current batch, then exit"""
+    global _stopping
+    _stopping = True
+    logger.info(f"Received signal {signum}, stopping after the current batch")
+
+
+def main(argv=None):
+    """Main function to run the email worker"""
+    config = get_config()
+    parser = argparse.ArgumentParser(description='Deliver queued email')
+    parser.add_argument('--once', action='store_true', help='Drain ready messages and exit')
+    parser.add_argument('--stats', action='store_true', help='Print outbox depth and lag and exit')
+    parser.add_argument('--batch-size', type=int, default=config.MAIL_OUTBOX_BATCH_SIZE)
+    parser.add_argument('--poll-interval', type=float, default=config.MAIL_OUTBOX_POLL_SECONDS)
+    args = parser.parse_args(argv)
+
+    if args.stats:
+        with connection() as conn:
+            print(json.dumps(EmailOutbox.stats(conn), indent=2))
+        return 0
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    worker_id = default_worker_id()
+    logger.info(f"Starting email worker {worker_id}")
+
+    # Connections stay open across batches so each domain pays for its handshake once
+    pool = MailerPool()
+    try:
+        with connection() as conn:
+            while not _stopping:
+                result = EmailOutbox.run_batch(conn, pool, worker_id=worker_id, batch_size=args.batch_size)
+                if result['claimed']:
+                    logger.info(f"Delivered email batch: {result}")
+                elif args.once:
+                    break
+                else:
+                    time.sleep(args.poll_interval)
+    except Exception as e:
+        logger.error(f"Email worker failed: {str(e)}")
+        return 1
+    finally:
+        pool.close()
+
+    logger.info("Email worker stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
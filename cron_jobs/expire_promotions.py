@@ -31,8 +31,9 @@ def main():
     logger.info("Starting promotion expiration job")
     
     try:
-        # Initialize database connection
-        from app import app
+        # Initialize database connection without loading the web app
+        from services.scheduler import create_job_app
+        app = create_job_app()
         with app.app_context():
             # Expire outdated promotions
             expired_count = PromotionService.expire_outdated_promotions()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Worker process that issues queued referral rewards
+
+Usage:
+    python cron_jobs/reward_worker.py            # run until interrupted
+    python cron_jobs/reward_worker.py --once     # drain ready jobs and exit (cron)
+    python cron_jobs/reward_worker.py --stats    # print queue depth and lag
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+
+# Add parent directory to path so we can import from the main app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.app_config import get_config
+from database import connection, get_db
+from services.reward_queue import RewardQueue, default_worker_id
+
+os.makedirs('logs', exist_ok=True)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/reward_worker.log'),
+        logging.StreamHandler()
+    ]
+)
+
+logger = logging.getLogger('reward_worker')
+
+_stopping = False
+
+
+def _request_stop(signum, frame):
+    """Finish the current batch, then exit"""
+    global _stopping
+    _stopping = True
+    logger.info(f"Received signal {signum}, stopping after the current batch")
+
+
+def issue_reward(event_id):
+    """Issue the reward for one event, returning the existing reward on a retry"""
+    from referral_management import RewardEngine
+
+    try:
+        reward_id = RewardEngine().process_reward(event_id)
+    except Exception:
+        # Don't let a half-written reward ride along with the next job's commit
+        get_db().rollback()
+        raise
+    if reward_id is None:
+        # Already issued by an earlier attempt, or the event is not eligible
+        row = get_db().execute('SELECT id FROM rewards WHERE event_id = ?', (event_id,)).fetchone()
+        reward_id = row[0] if row else None
+    return reward_id
+
+
+def issue_rewards(event_ids):
+    """Issue rewards for a claimed batch, including rewards from earlier attempts"""
+    from referral_management import RewardEngine, _chunks
+
+    try:
+        reward_ids = RewardEngine().process_rewards(event_ids)
+    except Exception:
+        get_db().rollback()
+        raise
+
+    missing = [event_id for event_id in event_ids if event_id not in reward_ids]
+    for chunk in _chunks(missing):
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = get_db().execute(
+            f'SELECT event_id, MAX(id) FROM rewards WHERE event_id IN ({placeholders}) GROUP BY event_id', chunk
+        ).fetchall()
+        reward_ids.update(rows)
+    return reward_ids
+
+
+def main(argv=None):
+    """Main function to run the reward worker"""
+    config = get_config()
+    parser = argparse.ArgumentParser(description='Issue queued referral rewards')
+    parser.add_argument('--once', action='store_true', help='Drain ready jobs and exit')
+    parser.add_argument('--stats', action='store_true', help='Print queue depth and lag and exit')
+    parser.add_argument('--batch-size', type=int, default=config.REWARD_QUEUE_BATCH_SIZE)
+    parser.add_argument('--poll-interval', type=float, default=config.REWARD_QUEUE_POLL_SECONDS)
+    args = parser.parse_args(argv)
+
+    if args.stats:
+        with connection() as conn:
+            print(json.dumps(RewardQueue.stats(conn), indent=2))
+        return 0
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    worker_id = default_worker_id()
+    logger.info(f"Starting reward worker {worker_id}")
+
+    try:
+        with connection() as conn:
+            while not _stopping:
+                result = RewardQueue.run_batch(conn, issue_reward, worker_id=worker_id,
+                                               batch_size=args.batch_size, batch_handler=issue_rewards)
+                if result['claimed']:
+                    logger.info(f"Processed reward jobs: {result}")
+                elif args.once:
+                    break
+                else:
+                    time.sleep(args.poll_interval)
+    except Exception as e:
+        logger.error(f"Reward worker failed: {str(e)}")
+        return 1
+
+    logger.info("Reward worker stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
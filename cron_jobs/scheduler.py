@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Run scheduled maintenance jobs without loading the web app
+
+Usage:
+    python cron_jobs/scheduler.py                       # run due jobs until interrupted
+    python cron_jobs/scheduler.py --once                # run due jobs and exit (cron)
+    python cron_jobs/scheduler.py --run expire_promotions   # run one job now
+    python cron_jobs/scheduler.py --list                # registered jobs and their state
+    python cron_jobs/scheduler.py --history             # recent runs
+"""
+
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+
+# Add parent directory to path so we can import from the main app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import connection
+from services.scheduler import JobScheduler
+
+os.makedirs('logs', exist_ok=True)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/scheduler.log'),
+        logging.StreamHandler()
+    ]
+)
+
+logger = logging.getLogger('scheduler')
+
+
+def list_jobs(conn, scheduler):
+    """Registered jobs with their schedule and last outcome"""
+    scheduler.sync(conn)
+    rows = conn.execute('''
+        SELECT name, interval_seconds, next_run_at, locked_by, last_finished_at, last_status
+        FROM scheduler_jobs ORDER BY name
+    ''').fetchall()
+    columns = ('name', 'interval_seconds', 'next_run_at', 'locked_by', 'last_finished_at', 'last_status')
+    return [dict(zip(columns, row)) for row in rows if row[0] in scheduler.jobs]
+
+
+def main(argv=None):
+    """Main function to run the scheduler"""
+    parser = argparse.ArgumentParser(description='Run scheduled maintenance jobs')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--once', action='store_true', help='Run due jobs and exit')
+    group.add_argument('--run', metavar='JOB', help='Run one job now, even if not due')
+    group.add_argument('--list', action='store_true', help='Print registered jobs and exit')
+    group.add_argument('--history', action='store_true', help='Print recent runs and exit')
+    parser.add_argument('--database', help='SQLite database path (defaults to DATABASE_NAME)')
+    args = parser.parse_args(argv)
+
+    scheduler = JobScheduler(database=args.database)
+
+    with connection(args.database) as conn:
+        if args.list:
+            print(json.dumps(list_jobs(conn, scheduler), indent=2))
+            return 0
+        if args.history:
+            print(json.dumps(JobScheduler.history(conn), indent=2))
+            return 0
+        if args.run:
+            job = scheduler.jobs.get(args.run)
+            if job is None:
+                parser.error(f'unknown job {args.run!r}; choose from {", ".join(sorted(scheduler.jobs))}')
+            scheduler.sync(conn)
+            outcome = scheduler.run_job(conn, job, force=True)
+            if outcome is None:
+                logger.info(f"Job {args.run} is running on another worker")
+                return 1
+            logger.info(f"Job finished: {outcome}")
+            return 0 if outcome['status'] == 'succeeded' else 1
+        if args.once:
+            outcomes = scheduler.run_pending(conn)
+            for outcome in outcomes:
+                logger.info(f"Job finished: {outcome}")
+            return 0 if all(outcome['status'] == 'succeeded' for outcome in outcomes) else 1
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop())
+    logger.info(f"Starting scheduler {scheduler.worker_id} with jobs: {', '.join(sorted(scheduler.jobs))}")
+    scheduler.run_forever()
+    logger.info("Scheduler stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+SQLite Connection Management
+Pooled, thread-safe connections shared across the application
+
+Every request reuses a single connection (stored on flask.g) that is
+returned to the pool on app-context teardown. Code running outside an
+app context (scripts, cron jobs, workers) gets one connection per thread
+until close_db() is called, or can use the connection() context manager.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_app_context, current_app
+
+from config.app_config import get_config
+
+# In-memory databases are private to a connection, so the pool shares one
+# named in-memory database between its connections instead.
+SHARED_MEMORY_URI = 'file:sapyyn_memdb?mode=memory&cache=shared'
+
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+def default_pragmas(config=None):
+    """Build the per-connection PRAGMA settings from configuration"""
+    config = config or get_config()
+    return [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', config.SQLITE_BUSY_TIMEOUT_MS),
+        # Negative cache_size is expressed in KiB rather than pages
+        ('cache_size', -config.SQLITE_CACHE_SIZE_KB),
+        ('mmap_size', config.SQLITE_MMAP_SIZE),
+    ]
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections for a single database file"""
+
+    def __init__(self, database, max_size=10, timeout=30.0, pragmas=None):
+        self.database = database
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.pragmas = list(pragmas) if pragmas is not None else default_pragmas()
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    @property
+    def size(self):
+        """Number of connections currently opened by the pool"""
+        return self._created
+
+    @property
+    def idle(self):
+        """Number of connections waiting in the pool"""
+        return self._idle.qsize()
+
+    def _connect(self):
+        busy_timeout = dict(self.pragmas).get('busy_timeout', 5000)
+        conn = sqlite3.connect(
+            self.database,
+            timeout=busy_timeout / 1000.0,
+            check_same_thread=False,
+            uri=self.database.startswith('file:')
+        )
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        """Check a connection out of the pool, opening one if below max_size"""
+        if self._closed:
+            raise sqlite3.OperationalError('Connection pool is closed')
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f'Timed out after {self.timeout}s waiting for a database connection'
+            )
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        if self._closed:
+            self._discard(conn)
+            return
+
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def close_all(self):
+        """Close every idle connection and refuse further checkouts"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+def get_pool(database=None):
+    """Return the process-wide pool for a database, creating it on first use"""
+    config = get_config()
+    database = database or config.DATABASE_NAME
+    if database == ':memory:':
+        database = SHARED_MEMORY_URI
+
+    pid = os.getpid()
+    with _pools_lock:
+        pool = _pools.get(database)
+        # Connections must never cross a fork (gunicorn pre-fork workers)
+        if pool is None or pool.pid != pid:
+            pool = ConnectionPool(
+                database,
+                max_size=config.SQLITE_POOL_SIZE,
+                timeout=config.SQLITE_POOL_TIMEOUT,
+                pragmas=default_pragmas(config)
+            )
+            _pools[database] = pool
+    return pool
+
+
+def get_db():
+    """Get the connection bound to the current request (or thread)"""
+    if has_app_context():
+        if '_sqlite_conn' not in g:
+            pool = get_pool(current_app.config.get('DATABASE_NAME'))
+            g._sqlite_pool = pool
+            g._sqlite_conn = pool.acquire()
+        return g._sqlite_conn
+
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        pool = get_pool()
+        _local.pool = pool
+        _local.conn = conn = pool.acquire()
+    return conn
+
+
+def close_db(exception=None):
+    """Return the current request (or thread) connection to its pool"""
+    if has_app_context():
+        conn = g.pop('_sqlite_conn', None)
+        pool = g.pop('_sqlite_pool', None)
+    else:
+        conn = getattr(_local, 'conn', None)
+        pool = getattr(_local, 'pool', None)
+        _local.conn = _local.pool = None
+
+    if conn is not None and pool is not None:
+        pool.release(conn)
+
+
+@contextmanager
+def connection(database=None):
+    """Check out a dedicated pooled connection for the duration of a block"""
+    pool = get_pool(database)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def init_app(app):
+    """Register connection teardown with the Flask application"""
+    app.teardown_appcontext(close_db)
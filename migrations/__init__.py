@@ -0,0 +1,113 @@
+"""
+Versioned Schema Migrations
+Applies DDL once at deploy time and records the applied version
+
+Each migration is a module named ``vNNN_<description>.py`` in this package
+exposing ``VERSION``, ``DESCRIPTION`` and ``upgrade(cursor)``. Applied
+versions are recorded in the ``schema_migrations`` table and mirrored to
+``PRAGMA user_version`` so checking the current version is a single pragma
+read. Request handlers never run DDL; deploy with:
+
+    python -m migrations
+"""
+import importlib
+import logging
+import pkgutil
+import re
+
+logger = logging.getLogger(__name__)
+
+_MODULE_PATTERN = re.compile(r'^v\d{3}_\w+$')
+
+
+def load_migrations():
+    """Import every migration module, ordered by version"""
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        if _MODULE_PATTERN.match(module_info.name):
+            migrations.append(importlib.import_module(f'{__name__}.{module_info.name}'))
+
+    migrations.sort(key=lambda module: module.VERSION)
+    versions = [module.VERSION for module in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f'Duplicate migration versions: {versions}')
+    return migrations
+
+
+def latest_version():
+    """Return the version the schema will be at once fully migrated"""
+    migrations = load_migrations()
+    return migrations[-1].VERSION if migrations else 0
+
+
+def ensure_version_table(conn):
+    """Create the metadata table recording applied migrations"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def current_version(conn):
+    """Return the highest applied migration version (0 for a new database)"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending_migrations(conn):
+    """Return the migrations that have not been applied yet"""
+    version = current_version(conn)
+    return [module for module in load_migrations() if module.VERSION > version]
+
+
+def is_up_to_date(conn):
+    """Check whether every known migration has been applied"""
+    return current_version(conn) >= latest_version()
+
+
+def run_migrations(conn, target=None):
+    """
+    Apply pending migrations in order, each in its own transaction.
+
+    Args:
+        conn: sqlite3 connection to migrate
+        target: Optional version to stop at (defaults to the latest)
+
+    Returns:
+        list: Versions applied by this call
+    """
+    ensure_version_table(conn)
+    applied = []
+
+    for module in load_migrations():
+        if target is not None and module.VERSION > target:
+            break
+
+        # BEGIN IMMEDIATE serialises concurrent deploys; re-check the version
+        # once the write lock is held in case another process got there first.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if module.VERSION <= current_version(conn):
+                conn.rollback()
+                continue
+
+            cursor = conn.cursor()
+            module.upgrade(cursor)
+            cursor.execute(
+                'INSERT INTO schema_migrations (version, description) VALUES (?, ?)',
+                (module.VERSION, module.DESCRIPTION)
+            )
+            cursor.execute(f'PRAGMA user_version = {int(module.VERSION)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f'Migration {module.VERSION} ({module.DESCRIPTION}) failed')
+            raise
+
+        logger.info(f'Applied migration {module.VERSION}: {module.DESCRIPTION}')
+        applied.append(module.VERSION)
+
+    return applied
@@ -0,0 +1,39 @@
+"""
+Command line entry point for schema migrations
+
+Usage:
+    python -m migrations                  # apply all pending migrations
+    python -m migrations --status         # show applied and pending versions
+    python -m migrations --target 3       # migrate up to a specific version
+"""
+import argparse
+import logging
+import sys
+
+from database import connection
+from migrations import current_version, pending_migrations, run_migrations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply Sapyyn schema migrations')
+    parser.add_argument('--database', help='SQLite database path (defaults to DATABASE_NAME)')
+    parser.add_argument('--target', type=int, help='Stop at this migration version')
+    parser.add_argument('--status', action='store_true', help='Show migration status and exit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    with connection(args.database) as conn:
+        if args.status:
+            print(f'Current version: {current_version(conn)}')
+            for module in pending_migrations(conn):
+                print(f'Pending: {module.VERSION} {module.DESCRIPTION}')
+            return 0
+
+        applied = run_migrations(conn, target=args.target)
+        print(f'Applied {len(applied)} migration(s); schema is at version {current_version(conn)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
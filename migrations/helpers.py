@@ -0,0 +1,15 @@
+"""
+Helpers shared by schema migrations
+"""
+
+
+def column_exists(cursor, table, column):
+    """Check whether a column is already present on a table"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def add_column(cursor, table, column, definition):
+    """Add a column unless a previous schema already created it"""
+    if not column_exists(cursor, table, column):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
@@ -0,0 +1,535 @@
+"""
+Initial schema
+
+Tables previously created by init_db() and by the DDL block that used to
+run inside the /api/referral/by-code handler.
+"""
+from migrations.helpers import add_column
+
+VERSION = 1
+DESCRIPTION = 'Initial schema'
+
+
+def upgrade(cursor):
+    """Create the core application tables"""
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            full_name TEXT NOT NULL,
+            role TEXT DEFAULT 'patient',
+            is_verified BOOLEAN DEFAULT FALSE,
+            fraud_score DECIMAL(5,2) DEFAULT 0.0,
+            is_paused BOOLEAN DEFAULT FALSE,
+            device_fingerprint TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Referrals table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referrals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            referral_id TEXT UNIQUE NOT NULL,
+            patient_name TEXT NOT NULL,
+            referring_doctor TEXT,
+            target_doctor TEXT,
+            medical_condition TEXT,
+            urgency_level TEXT DEFAULT 'normal',
+            status TEXT DEFAULT 'pending',
+
+            case_status TEXT DEFAULT 'pending',
+            consultation_date TIMESTAMP,
+            case_accepted_date TIMESTAMP,
+            treatment_start_date TIMESTAMP,
+            treatment_complete_date TIMESTAMP,
+            rejection_reason TEXT,
+            estimated_value DECIMAL(10,2),
+            actual_value DECIMAL(10,2),
+            notes TEXT,
+            qr_code TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # Databases created before these columns existed need them added
+    add_column(cursor, 'referrals', 'case_status', "TEXT DEFAULT 'pending'")
+    add_column(cursor, 'referrals', 'consultation_date', 'TIMESTAMP')
+    add_column(cursor, 'referrals', 'case_accepted_date', 'TIMESTAMP')
+    add_column(cursor, 'referrals', 'treatment_start_date', 'TIMESTAMP')
+    add_column(cursor, 'referrals', 'treatment_complete_date', 'TIMESTAMP')
+    add_column(cursor, 'referrals', 'rejection_reason', 'TEXT')
+    add_column(cursor, 'referrals', 'estimated_value', 'DECIMAL(10,2)')
+    add_column(cursor, 'referrals', 'actual_value', 'DECIMAL(10,2)')
+    add_column(cursor, 'referrals', 'patient_id', 'INTEGER')
+    add_column(cursor, 'referrals', 'dentist_id', 'INTEGER')
+    
+    # Documents table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            referral_id INTEGER,
+            user_id INTEGER,
+            file_type TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_size INTEGER,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (referral_id) REFERENCES referrals (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # Reward Programs table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reward_programs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            program_type TEXT DEFAULT 'referral',
+            status TEXT DEFAULT 'active',
+            start_date TIMESTAMP,
+            end_date TIMESTAMP,
+            created_by INTEGER,
+            compliance_notes TEXT,
+            legal_language TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+    ''')
+    
+    # Reward Tiers table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reward_tiers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            program_id INTEGER,
+            tier_name TEXT NOT NULL,
+            tier_level INTEGER DEFAULT 1,
+            referrals_required INTEGER DEFAULT 1,
+            reward_type TEXT DEFAULT 'points',
+            reward_value DECIMAL(10,2),
+            reward_description TEXT,
+            fulfillment_type TEXT DEFAULT 'manual',
+            fulfillment_config TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (program_id) REFERENCES reward_programs (id)
+        )
+    ''')
+    
+    # User Rewards table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_rewards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            program_id INTEGER,
+            tier_id INTEGER,
+            referral_id INTEGER,
+            points_earned DECIMAL(10,2) DEFAULT 0,
+            reward_status TEXT DEFAULT 'pending',
+            earned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            redeemed_date TIMESTAMP,
+            fulfillment_status TEXT DEFAULT 'pending',
+            fulfillment_notes TEXT,
+            compliance_verified BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (program_id) REFERENCES reward_programs (id),
+            FOREIGN KEY (tier_id) REFERENCES reward_tiers (id),
+            FOREIGN KEY (referral_id) REFERENCES referrals (id)
+        )
+    ''')
+    
+    # Reward Triggers table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reward_triggers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            program_id INTEGER,
+            trigger_type TEXT NOT NULL,
+            trigger_condition TEXT,
+            trigger_value TEXT,
+            points_awarded DECIMAL(10,2),
+            tier_advancement BOOLEAN DEFAULT FALSE,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (program_id) REFERENCES reward_programs (id)
+        )
+    ''')
+    
+    # Reward Notifications table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reward_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            notification_type TEXT,
+            title TEXT,
+            message TEXT,
+            is_read BOOLEAN DEFAULT FALSE,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # Compliance Audit Trail table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS compliance_audit_trail (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            action_type TEXT,
+            entity_type TEXT,
+            entity_id INTEGER,
+            action_details TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # Gamification Achievements table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            icon TEXT,
+            achievement_type TEXT,
+            requirement_value INTEGER,
+            points_value DECIMAL(10,2),
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # User Achievements table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            achievement_id INTEGER,
+            earned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            progress INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (achievement_id) REFERENCES achievements (id)
+        )
+    ''')
+    
+    # Provider Codes table for 4-digit system
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS provider_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            provider_code TEXT UNIQUE NOT NULL,
+            provider_type TEXT NOT NULL,
+            practice_name TEXT,
+            specialization TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # Messages table for portal messaging
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            content TEXT NOT NULL,
+            message_type TEXT DEFAULT 'general',
+            referral_id INTEGER,
+            is_read BOOLEAN DEFAULT FALSE,
+            is_deleted_by_sender BOOLEAN DEFAULT FALSE,
+            is_deleted_by_recipient BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            read_at TIMESTAMP,
+            FOREIGN KEY (sender_id) REFERENCES users (id),
+            FOREIGN KEY (recipient_id) REFERENCES users (id),
+            FOREIGN KEY (referral_id) REFERENCES referrals (id)
+        )
+    ''')
+    
+    # Subscription Plans table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscription_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_name TEXT NOT NULL,
+            plan_type TEXT NOT NULL,
+            price_monthly DECIMAL(10,2),
+            price_annual DECIMAL(10,2),
+            features TEXT,
+            max_referrals INTEGER,
+            max_users INTEGER,
+            storage_gb INTEGER,
+            support_level TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # User Subscriptions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            plan_id INTEGER,
+            subscription_status TEXT DEFAULT 'active',
+            billing_cycle TEXT DEFAULT 'monthly',
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_date TIMESTAMP,
+            auto_renew BOOLEAN DEFAULT TRUE,
+            payment_method TEXT,
+            stripe_customer_id TEXT,
+            stripe_subscription_id TEXT,
+            stripe_payment_method_id TEXT,
+            trial_end_date TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (plan_id) REFERENCES subscription_plans (id)
+        )
+    ''')
+    
+    # Practice Management table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS practices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            practice_name TEXT NOT NULL,
+            practice_type TEXT,
+            address TEXT,
+            phone TEXT,
+            email TEXT,
+            website TEXT,
+            admin_user_id INTEGER,
+            subscription_id INTEGER,
+            is_verified BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (admin_user_id) REFERENCES users (id),
+            FOREIGN KEY (subscription_id) REFERENCES user_subscriptions (id)
+        )
+    ''')
+    
+    # Practice Members table (for multi-user practices)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS practice_members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            practice_id INTEGER,
+            user_id INTEGER,
+            role TEXT,
+            permissions TEXT,
+            status TEXT DEFAULT 'active',
+            invited_by INTEGER,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (practice_id) REFERENCES practices (id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (invited_by) REFERENCES users (id)
+        )
+    ''')
+    
+    # User Profiles table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            phone TEXT,
+            license_number TEXT,
+            specialization TEXT,
+            practice_name TEXT,
+            practice_address TEXT,
+            years_experience TEXT,
+            website TEXT,
+            bio TEXT,
+            account_type TEXT,
+            avatar_url TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # User Preferences table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            preference_key TEXT NOT NULL,
+            preference_value TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, preference_key)
+        )
+    ''')
+    
+    # Older databases were created before users.is_verified existed
+    add_column(cursor, 'users', 'is_verified', 'BOOLEAN DEFAULT FALSE')
+
+    # Referring Doctor Profiles table for relationship management
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referring_doctors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT,
+            phone TEXT,
+            practice_name TEXT,
+            specialty TEXT,
+            address TEXT,
+            city TEXT,
+            state TEXT,
+            zip_code TEXT,
+            referral_count INTEGER DEFAULT 0,
+            conversion_rate DECIMAL(5,2) DEFAULT 0.0,
+            avg_case_value DECIMAL(10,2) DEFAULT 0.0,
+            relationship_score INTEGER DEFAULT 0,
+            last_referral_date TIMESTAMP,
+            communication_preference TEXT DEFAULT 'email',
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Case Conversion Tracking table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS case_conversions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            referral_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            stage_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            notes TEXT,
+            assigned_to TEXT,
+            response_time_hours INTEGER,
+            created_by INTEGER,
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+    ''')
+    
+    # Team Productivity Metrics table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS team_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date DATE DEFAULT CURRENT_DATE,
+            referrals_processed INTEGER DEFAULT 0,
+            consultations_completed INTEGER DEFAULT 0,
+            cases_accepted INTEGER DEFAULT 0,
+            avg_response_time_hours DECIMAL(10,2) DEFAULT 0.0,
+            revenue_generated DECIMAL(10,2) DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Appointments table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            appointment_id TEXT UNIQUE NOT NULL,
+            patient_id INTEGER,
+            provider_id INTEGER NOT NULL,
+            referral_id TEXT,
+            appointment_type TEXT DEFAULT 'consultation',
+            appointment_date TIMESTAMP NOT NULL,
+            duration_minutes INTEGER DEFAULT 60,
+            status TEXT DEFAULT 'scheduled',
+            notes TEXT,
+            patient_name TEXT,
+            patient_email TEXT,
+            patient_phone TEXT,
+            reason TEXT,
+            location TEXT,
+            virtual_meeting_link TEXT,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES users (id),
+            FOREIGN KEY (provider_id) REFERENCES users (id),
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+    ''')
+    
+    # Promotions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS promotions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            image_path TEXT,
+            image_filename TEXT,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            status TEXT DEFAULT 'draft',
+            target_audience TEXT,
+            budget DECIMAL(10,2),
+            impressions INTEGER DEFAULT 0,
+            clicks INTEGER DEFAULT 0,
+            click_through_rate DECIMAL(5,4) DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # User Feedback table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            visit_purpose TEXT,
+            ease_of_use TEXT,
+            confusion_feedback TEXT,
+            nps_score INTEGER,
+            additional_comments TEXT,
+            contact_email TEXT,
+            page_url TEXT,
+            page_title TEXT,
+            timestamp TEXT,
+            server_timestamp TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            screen_resolution TEXT,
+            session_duration INTEGER,
+            user_role TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Fraud Detection tables
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fraud_scores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            ip_address TEXT,
+            email TEXT,
+            device_fingerprint TEXT,
+            fraud_score DECIMAL(5,2) DEFAULT 0.0,
+            risk_level TEXT DEFAULT 'low',
+            is_paused BOOLEAN DEFAULT FALSE,
+            reasons TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Insert default subscription plans
+    cursor.execute('SELECT COUNT(*) FROM subscription_plans')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute('''
+            INSERT INTO subscription_plans 
+            (plan_name, plan_type, price_monthly, price_annual, features, max_referrals, max_users, storage_gb, support_level)
+            VALUES 
+            ('Basic', 'free', 0.00, 0.00, 'Up to 5 referrals/month, Basic messaging, Limited network access', 5, 1, 1, 'email'),
+            ('Professional', 'practice', 49.99, 499.99, 'Unlimited referrals, Priority support, Full network access, QR codes, CE credits', -1, 3, 10, 'priority'),
+            ('Enterprise', 'enterprise', 149.99, 1499.99, 'Everything in Professional, Multi-practice management, Advanced analytics, API access', -1, -1, 50, 'phone')
+        ''')
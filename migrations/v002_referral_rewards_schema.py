@@ -0,0 +1,85 @@
+"""
+Referral rewards schema
+
+Tables used by referral_management.py (campaigns, advocate codes, referral
+events and issued rewards), which were previously never created.
+Column order matches the positional row access in that module.
+"""
+
+VERSION = 2
+DESCRIPTION = 'Referral rewards schema'
+
+
+def upgrade(cursor):
+    """Create the referral campaign and reward tables"""
+    # Referral Campaigns table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referral_campaigns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            start_date TIMESTAMP NOT NULL,
+            end_date TIMESTAMP NOT NULL,
+            advocate_role TEXT NOT NULL,
+            reward_type TEXT NOT NULL,
+            reward_value DECIMAL(10,2) NOT NULL,
+            reward_trigger TEXT NOT NULL,
+            max_referrals_per_advocate INTEGER,
+            fraud_threshold INTEGER DEFAULT 3,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Referral Codes table (one per advocate per campaign)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referral_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            campaign_id INTEGER NOT NULL,
+            advocate_id INTEGER NOT NULL,
+            code TEXT UNIQUE NOT NULL,
+            link_slug TEXT UNIQUE NOT NULL,
+            qr_svg TEXT,
+            usage_count INTEGER DEFAULT 0,
+            reward_status TEXT DEFAULT 'ACTIVE',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (campaign_id) REFERENCES referral_campaigns (id),
+            FOREIGN KEY (advocate_id) REFERENCES users (id),
+            UNIQUE(campaign_id, advocate_id)
+        )
+    ''')
+
+    # Referral Events table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referral_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code_id INTEGER NOT NULL,
+            referred_patient_id INTEGER,
+            status TEXT DEFAULT 'SIGNED_UP',
+            ip_addr TEXT,
+            user_agent TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (code_id) REFERENCES referral_codes (id),
+            FOREIGN KEY (referred_patient_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Issued Rewards table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rewards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            advocate_id INTEGER NOT NULL,
+            campaign_id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            reward_type TEXT NOT NULL,
+            amount DECIMAL(10,2) NOT NULL,
+            status TEXT DEFAULT 'PENDING',
+            fulfilled_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (advocate_id) REFERENCES users (id),
+            FOREIGN KEY (campaign_id) REFERENCES referral_campaigns (id),
+            FOREIGN KEY (event_id) REFERENCES referral_events (id)
+        )
+    ''')
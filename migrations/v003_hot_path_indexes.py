@@ -0,0 +1,43 @@
+"""
+Secondary indexes for the hot read paths
+
+Each index is driven by a query issued on every page load or API call:
+
+- dashboard / my referrals: referrals by user_id (or patient_id / dentist_id)
+  ordered by created_at, documents joined by referral_id
+- /referrals and the specialist portal: referrals by target_doctor
+- get_messages: messages by sender_id or recipient_id ordered by created_at
+- rewards dashboard and leaderboard: user_rewards by user_id / reward_status
+- FraudDetector.check_referral: referral_events by ip_addr and code_id within
+  a created_at window; the appointment webhook by referred_patient_id
+
+provider_codes.provider_code and referrals.referral_id are UNIQUE, so SQLite
+already maintains an index for them.
+"""
+
+VERSION = 3
+DESCRIPTION = 'Hot path indexes'
+
+INDEXES = [
+    ('idx_referrals_user_created', 'referrals', 'user_id, created_at'),
+    ('idx_referrals_patient_created', 'referrals', 'patient_id, created_at'),
+    ('idx_referrals_dentist_created', 'referrals', 'dentist_id, created_at'),
+    ('idx_referrals_target_doctor', 'referrals', 'target_doctor, created_at'),
+    ('idx_referrals_created_at', 'referrals', 'created_at'),
+    ('idx_documents_referral', 'documents', 'referral_id'),
+    ('idx_documents_user_uploaded', 'documents', 'user_id, upload_date'),
+    ('idx_messages_sender_created', 'messages', 'sender_id, created_at'),
+    ('idx_messages_recipient_created', 'messages', 'recipient_id, created_at'),
+    ('idx_user_rewards_user_status', 'user_rewards', 'user_id, reward_status, points_earned'),
+    ('idx_user_rewards_status_user', 'user_rewards', 'reward_status, user_id, points_earned'),
+    ('idx_referral_events_code_created', 'referral_events', 'code_id, created_at'),
+    ('idx_referral_events_ip_created', 'referral_events', 'ip_addr, created_at'),
+    ('idx_referral_events_patient_status', 'referral_events', 'referred_patient_id, status, created_at'),
+    ('idx_rewards_event', 'rewards', 'event_id'),
+]
+
+
+def upgrade(cursor):
+    """Create the hot path indexes"""
+    for name, table, columns in INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
@@ -0,0 +1,163 @@
+"""
+Per-user summary counters for the dashboard and /api/stats
+
+user_stats holds one row per user with running totals and the time of the
+last referral or document write; user_stat_counts breaks those totals down
+by referral status and document type. Both are maintained by triggers, so
+every INSERT, UPDATE or DELETE on referrals and documents adjusts the
+counters inside the same transaction no matter which handler issued it.
+
+Counters that drift (e.g. after a manual bulk edit with triggers dropped)
+can be recomputed with ``python -m services.user_stats_service --rebuild``.
+"""
+
+VERSION = 4
+DESCRIPTION = 'User stats summary tables'
+
+# (trigger name, SQL) pairs. Referral rows are counted under
+# kind='referral_status' and document rows under kind='document_type'.
+TRIGGERS = [
+    ('trg_user_stats_referral_insert', '''
+        AFTER INSERT ON referrals WHEN NEW.user_id IS NOT NULL
+        BEGIN
+            INSERT INTO user_stats (user_id, referral_total, last_activity_at)
+            VALUES (NEW.user_id, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                referral_total = referral_total + 1,
+                last_activity_at = CURRENT_TIMESTAMP;
+            INSERT INTO user_stat_counts (user_id, kind, key, count)
+            VALUES (NEW.user_id, 'referral_status', COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (user_id, kind, key) DO UPDATE SET count = count + 1;
+        END
+    '''),
+    ('trg_user_stats_referral_update', '''
+        AFTER UPDATE OF user_id, status ON referrals
+        WHEN OLD.user_id IS NOT NEW.user_id OR OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE user_stats SET referral_total = referral_total - 1
+            WHERE user_id = OLD.user_id AND OLD.user_id IS NOT NEW.user_id;
+            UPDATE user_stat_counts SET count = count - 1
+            WHERE user_id = OLD.user_id AND kind = 'referral_status' AND key = COALESCE(OLD.status, '');
+            INSERT INTO user_stats (user_id, referral_total, last_activity_at)
+            SELECT NEW.user_id, 1, CURRENT_TIMESTAMP
+            WHERE NEW.user_id IS NOT NULL AND OLD.user_id IS NOT NEW.user_id
+            ON CONFLICT (user_id) DO UPDATE SET
+                referral_total = referral_total + 1,
+                last_activity_at = CURRENT_TIMESTAMP;
+            UPDATE user_stats SET last_activity_at = CURRENT_TIMESTAMP
+            WHERE user_id = NEW.user_id AND OLD.user_id IS NEW.user_id;
+            INSERT INTO user_stat_counts (user_id, kind, key, count)
+            SELECT NEW.user_id, 'referral_status', COALESCE(NEW.status, ''), 1
+            WHERE NEW.user_id IS NOT NULL
+            ON CONFLICT (user_id, kind, key) DO UPDATE SET count = count + 1;
+        END
+    '''),
+    ('trg_user_stats_referral_delete', '''
+        AFTER DELETE ON referrals WHEN OLD.user_id IS NOT NULL
+        BEGIN
+            UPDATE user_stats SET referral_total = referral_total - 1
+            WHERE user_id = OLD.user_id;
+            UPDATE user_stat_counts SET count = count - 1
+            WHERE user_id = OLD.user_id AND kind = 'referral_status' AND key = COALESCE(OLD.status, '');
+        END
+    '''),
+    ('trg_user_stats_document_insert', '''
+        AFTER INSERT ON documents WHEN NEW.user_id IS NOT NULL
+        BEGIN
+            INSERT INTO user_stats (user_id, document_total, last_activity_at)
+            VALUES (NEW.user_id, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                document_total = document_total + 1,
+                last_activity_at = CURRENT_TIMESTAMP;
+            INSERT INTO user_stat_counts (user_id, kind, key, count)
+            VALUES (NEW.user_id, 'document_type', COALESCE(NEW.file_type, ''), 1)
+            ON CONFLICT (user_id, kind, key) DO UPDATE SET count = count + 1;
+        END
+    '''),
+    ('trg_user_stats_document_update', '''
+        AFTER UPDATE OF user_id, file_type ON documents
+        WHEN OLD.user_id IS NOT NEW.user_id OR OLD.file_type IS NOT NEW.file_type
+        BEGIN
+            UPDATE user_stats SET document_total = document_total - 1
+            WHERE user_id = OLD.user_id AND OLD.user_id IS NOT NEW.user_id;
+            UPDATE user_stat_counts SET count = count - 1
+            WHERE user_id = OLD.user_id AND kind = 'document_type' AND key = COALESCE(OLD.file_type, '');
+            INSERT INTO user_stats (user_id, document_total, last_activity_at)
+            SELECT NEW.user_id, 1, CURRENT_TIMESTAMP
+            WHERE NEW.user_id IS NOT NULL AND OLD.user_id IS NOT NEW.user_id
+            ON CONFLICT (user_id) DO UPDATE SET
+                document_total = document_total + 1,
+                last_activity_at = CURRENT_TIMESTAMP;
+            UPDATE user_stats SET last_activity_at = CURRENT_TIMESTAMP
+            WHERE user_id = NEW.user_id AND OLD.user_id IS NEW.user_id;
+            INSERT INTO user_stat_counts (user_id, kind, key, count)
+            SELECT NEW.user_id, 'document_type', COALESCE(NEW.file_type, ''), 1
+            WHERE NEW.user_id IS NOT NULL
+            ON CONFLICT (user_id, kind, key) DO UPDATE SET count = count + 1;
+        END
+    '''),
+    ('trg_user_stats_document_delete', '''
+        AFTER DELETE ON documents WHEN OLD.user_id IS NOT NULL
+        BEGIN
+            UPDATE user_stats SET document_total = document_total - 1
+            WHERE user_id = OLD.user_id;
+            UPDATE user_stat_counts SET count = count - 1
+            WHERE user_id = OLD.user_id AND kind = 'document_type' AND key = COALESCE(OLD.file_type, '');
+        END
+    '''),
+]
+
+
+def upgrade(cursor):
+    """Create the summary tables, backfill them and install the triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            referral_total INTEGER NOT NULL DEFAULT 0,
+            document_total INTEGER NOT NULL DEFAULT 0,
+            last_activity_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stat_counts (
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, kind, key)
+        ) WITHOUT ROWID
+    ''')
+
+    for name, body in TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'CREATE TRIGGER {name} {body}')
+
+    # Backfill from the existing rows
+    cursor.execute('''
+        INSERT INTO user_stat_counts (user_id, kind, key, count)
+        SELECT user_id, 'referral_status', COALESCE(status, ''), COUNT(*)
+        FROM referrals
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id, COALESCE(status, '')
+    ''')
+    cursor.execute('''
+        INSERT INTO user_stat_counts (user_id, kind, key, count)
+        SELECT user_id, 'document_type', COALESCE(file_type, ''), COUNT(*)
+        FROM documents
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id, COALESCE(file_type, '')
+    ''')
+    cursor.execute('''
+        INSERT INTO user_stats (user_id, referral_total, document_total, last_activity_at)
+        SELECT user_id, SUM(is_referral), SUM(1 - is_referral), MAX(activity_at)
+        FROM (
+            SELECT user_id, 1 AS is_referral, created_at AS activity_at
+            FROM referrals WHERE user_id IS NOT NULL
+            UNION ALL
+            SELECT user_id, 0, upload_date
+            FROM documents WHERE user_id IS NOT NULL
+        )
+        GROUP BY user_id
+    ''')
@@ -0,0 +1,82 @@
+"""
+Daily conversion funnel rollups for /api/conversion-analytics
+
+conversion_daily_rollups holds one row per (referral creation day,
+case_status) with the referral count and the sums of estimated and actual
+case values. Triggers on referrals move a referral between buckets when
+update_case_status changes its case_status or values, so the analytics
+endpoint sums at most a year of small buckets instead of scanning referrals.
+"""
+
+VERSION = 5
+DESCRIPTION = 'Conversion funnel daily rollups'
+
+# Adds one referral row (alias NEW) to its bucket
+_ADD_NEW = '''
+    INSERT INTO conversion_daily_rollups
+        (day, case_status, referral_count, estimated_value_sum, actual_value_sum)
+    SELECT date(NEW.created_at), COALESCE(NEW.case_status, 'pending'), 1,
+           COALESCE(NEW.estimated_value, 0), COALESCE(NEW.actual_value, 0)
+    WHERE NEW.created_at IS NOT NULL
+    ON CONFLICT (day, case_status) DO UPDATE SET
+        referral_count = referral_count + 1,
+        estimated_value_sum = estimated_value_sum + excluded.estimated_value_sum,
+        actual_value_sum = actual_value_sum + excluded.actual_value_sum;
+'''
+
+# Removes one referral row (alias OLD) from its bucket
+_REMOVE_OLD = '''
+    UPDATE conversion_daily_rollups SET
+        referral_count = referral_count - 1,
+        estimated_value_sum = estimated_value_sum - COALESCE(OLD.estimated_value, 0),
+        actual_value_sum = actual_value_sum - COALESCE(OLD.actual_value, 0)
+    WHERE day = date(OLD.created_at) AND case_status = COALESCE(OLD.case_status, 'pending');
+'''
+
+TRIGGERS = [
+    ('trg_conversion_rollup_insert', f'''
+        AFTER INSERT ON referrals
+        BEGIN {_ADD_NEW} END
+    '''),
+    ('trg_conversion_rollup_update', f'''
+        AFTER UPDATE OF case_status, estimated_value, actual_value, created_at ON referrals
+        WHEN OLD.case_status IS NOT NEW.case_status
+          OR OLD.estimated_value IS NOT NEW.estimated_value
+          OR OLD.actual_value IS NOT NEW.actual_value
+          OR OLD.created_at IS NOT NEW.created_at
+        BEGIN {_REMOVE_OLD} {_ADD_NEW} END
+    '''),
+    ('trg_conversion_rollup_delete', f'''
+        AFTER DELETE ON referrals
+        BEGIN {_REMOVE_OLD} END
+    '''),
+]
+
+
+def upgrade(cursor):
+    """Create the rollup table, backfill it and install the triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversion_daily_rollups (
+            day DATE NOT NULL,
+            case_status TEXT NOT NULL,
+            referral_count INTEGER NOT NULL DEFAULT 0,
+            estimated_value_sum REAL NOT NULL DEFAULT 0,
+            actual_value_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, case_status)
+        ) WITHOUT ROWID
+    ''')
+
+    for name, body in TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'CREATE TRIGGER {name} {body}')
+
+    # Backfill from the existing referrals
+    cursor.execute('''
+        INSERT INTO conversion_daily_rollups
+            (day, case_status, referral_count, estimated_value_sum, actual_value_sum)
+        SELECT date(created_at), COALESCE(case_status, 'pending'), COUNT(*),
+               SUM(COALESCE(estimated_value, 0)), SUM(COALESCE(actual_value, 0))
+        FROM referrals
+        WHERE created_at IS NOT NULL
+        GROUP BY date(created_at), COALESCE(case_status, 'pending')
+    ''')
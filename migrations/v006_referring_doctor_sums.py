@@ -0,0 +1,103 @@
+"""
+Exact running sums for referring doctor statistics
+
+referring_doctors previously stored conversion_rate and avg_case_value and
+re-derived them from their own rounded values on every case outcome, which
+accumulated drift. It now keeps integer counters:
+
+- referral_count: accepted plus rejected case outcomes
+- accepted_count: accepted outcomes
+- case_value_sum_cents / case_value_count: accepted case values, in cents
+
+Rates are derived on read by ReferringDoctorService. The old
+conversion_rate and avg_case_value columns are left in place but are no
+longer maintained.
+
+Doctors are keyed by name_key (the trimmed, lower-cased name) under a
+unique index. Rows that collide on that key are merged into the oldest one
+before the index is created: its blank contact fields are filled from the
+others, which are then deleted. All counters are then rebuilt from
+case_conversions.
+"""
+
+from migrations.helpers import add_column
+
+VERSION = 6
+DESCRIPTION = 'Referring doctor running sums and name key'
+
+CONTACT_COLUMNS = ('email', 'phone', 'practice_name', 'specialty', 'address', 'city', 'state', 'zip_code')
+
+
+def upgrade(cursor):
+    """Add the counter columns, key doctors by name and backfill"""
+    add_column(cursor, 'referring_doctors', 'name_key', 'TEXT')
+    add_column(cursor, 'referring_doctors', 'accepted_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(cursor, 'referring_doctors', 'case_value_sum_cents', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(cursor, 'referring_doctors', 'case_value_count', 'INTEGER NOT NULL DEFAULT 0')
+
+    cursor.execute('UPDATE referring_doctors SET name_key = lower(trim(name))')
+    # Fill the surviving row's blank contact fields from its duplicates, oldest first
+    for column in CONTACT_COLUMNS:
+        cursor.execute(f'''
+            UPDATE referring_doctors
+            SET {column} = (
+                SELECT d.{column} FROM referring_doctors d
+                WHERE d.name_key = referring_doctors.name_key AND trim(COALESCE(d.{column}, '')) != ''
+                ORDER BY d.id LIMIT 1
+            )
+            WHERE trim(COALESCE({column}, '')) = ''
+              AND id IN (SELECT MIN(id) FROM referring_doctors GROUP BY name_key HAVING COUNT(*) > 1)
+        ''')
+    cursor.execute('''
+        DELETE FROM referring_doctors
+        WHERE id NOT IN (SELECT MIN(id) FROM referring_doctors GROUP BY name_key)
+    ''')
+
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_referring_doctors_name_key
+        ON referring_doctors (name_key)
+    ''')
+    # Matches the ORDER BY in ReferringDoctorService.top_doctors so the
+    # ranking is read straight off the index
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_referring_doctors_conversion
+        ON referring_doctors (
+            (CAST(accepted_count AS REAL) / NULLIF(referral_count, 0)) DESC,
+            referral_count DESC
+        )
+    ''')
+
+    # Rebuild every counter from accepted and rejected cases
+    cursor.execute('''
+        UPDATE referring_doctors
+        SET referral_count = 0, accepted_count = 0,
+            case_value_sum_cents = 0, case_value_count = 0, last_referral_date = NULL
+    ''')
+    cursor.execute('''
+        INSERT INTO referring_doctors
+            (name, name_key, referral_count, accepted_count,
+             case_value_sum_cents, case_value_count, last_referral_date, updated_at)
+        SELECT MIN(trim(r.referring_doctor)),
+               lower(trim(r.referring_doctor)),
+               COUNT(*),
+               SUM(cc.stage = 'case_accepted'),
+               COALESCE(SUM(CASE WHEN cc.stage = 'case_accepted'
+                                 THEN CAST(round(COALESCE(r.actual_value, r.estimated_value) * 100) AS INTEGER)
+                            END), 0),
+               COUNT(CASE WHEN cc.stage = 'case_accepted'
+                          THEN COALESCE(r.actual_value, r.estimated_value) END),
+               MAX(cc.stage_date),
+               CURRENT_TIMESTAMP
+        FROM case_conversions cc
+        JOIN referrals r ON r.referral_id = cc.referral_id
+        WHERE cc.stage IN ('case_accepted', 'case_rejected')
+          AND trim(COALESCE(r.referring_doctor, '')) != ''
+        GROUP BY lower(trim(r.referring_doctor))
+        ON CONFLICT (name_key) DO UPDATE SET
+            referral_count = excluded.referral_count,
+            accepted_count = excluded.accepted_count,
+            case_value_sum_cents = excluded.case_value_sum_cents,
+            case_value_count = excluded.case_value_count,
+            last_referral_date = excluded.last_referral_date,
+            updated_at = excluded.updated_at
+    ''')
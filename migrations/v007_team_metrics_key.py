@@ -0,0 +1,40 @@
+"""
+Unique (user_id, date) key for team_metrics
+
+update_team_metrics used to look the day's row up and then issue up to
+three UPDATEs; with a unique key it is a single upsert. Duplicate rows for
+the same user and day are folded into the oldest one first.
+"""
+
+VERSION = 7
+DESCRIPTION = 'Team metrics unique user/date key'
+
+
+def upgrade(cursor):
+    """Merge duplicate day rows and add the unique key"""
+    cursor.execute('''
+        UPDATE team_metrics AS tm SET
+            referrals_processed = totals.referrals_processed,
+            consultations_completed = totals.consultations_completed,
+            cases_accepted = totals.cases_accepted,
+            revenue_generated = totals.revenue_generated
+        FROM (
+            SELECT MIN(id) AS id,
+                   SUM(referrals_processed) AS referrals_processed,
+                   SUM(consultations_completed) AS consultations_completed,
+                   SUM(cases_accepted) AS cases_accepted,
+                   SUM(revenue_generated) AS revenue_generated
+            FROM team_metrics
+            GROUP BY user_id, date
+            HAVING COUNT(*) > 1
+        ) AS totals
+        WHERE tm.id = totals.id
+    ''')
+    cursor.execute('''
+        DELETE FROM team_metrics
+        WHERE id NOT IN (SELECT MIN(id) FROM team_metrics GROUP BY user_id, date)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_team_metrics_user_date
+        ON team_metrics (user_id, date)
+    ''')
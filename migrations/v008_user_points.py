@@ -0,0 +1,108 @@
+"""
+Precomputed leaderboard totals in user_points
+
+user_points holds each user's earned points and reward count for the
+all-time board ('all') and for the calendar week ('week:YYYY-WW', Monday
+based like strftime %W) and month ('month:YYYY-MM') of each reward's
+earned_date. Triggers on user_rewards add a row's points when it is
+inserted as, or changed to, 'earned' and take them back when it is revoked,
+edited or deleted, so /rewards/leaderboard reads ranks off the
+(period, points, user_id) index instead of aggregating user_rewards.
+"""
+
+VERSION = 8
+DESCRIPTION = 'Leaderboard user points'
+
+
+def _periods(alias):
+    """Inline table of the leaderboard periods a user_rewards row counts in"""
+    earned = f"COALESCE({alias}.earned_date, CURRENT_TIMESTAMP)"
+    return f'''(
+        SELECT 'all' AS period
+        UNION ALL SELECT 'week:' || strftime('%Y-%W', {earned})
+        UNION ALL SELECT 'month:' || strftime('%Y-%m', {earned})
+    )'''
+
+
+_ADD_NEW = f'''
+    INSERT INTO user_points (period, user_id, points, reward_count)
+    SELECT period, NEW.user_id, COALESCE(NEW.points_earned, 0), 1
+    FROM {_periods('NEW')}
+    WHERE NEW.reward_status = 'earned' AND NEW.user_id IS NOT NULL
+    ON CONFLICT (period, user_id) DO UPDATE SET
+        points = points + excluded.points,
+        reward_count = reward_count + 1;
+'''
+
+_REMOVE_OLD = f'''
+    UPDATE user_points SET
+        points = points - COALESCE(OLD.points_earned, 0),
+        reward_count = reward_count - 1
+    WHERE OLD.reward_status = 'earned'
+      AND user_id = OLD.user_id
+      AND period IN {_periods('OLD')};
+    DELETE FROM user_points
+    WHERE user_id = OLD.user_id AND reward_count <= 0;
+'''
+
+TRIGGERS = [
+    ('trg_user_points_insert', f'''
+        AFTER INSERT ON user_rewards
+        WHEN NEW.reward_status = 'earned'
+        BEGIN {_ADD_NEW} END
+    '''),
+    ('trg_user_points_update', f'''
+        AFTER UPDATE OF user_id, points_earned, reward_status, earned_date ON user_rewards
+        WHEN (OLD.reward_status = 'earned' OR NEW.reward_status = 'earned')
+         AND (OLD.user_id IS NOT NEW.user_id
+              OR OLD.points_earned IS NOT NEW.points_earned
+              OR OLD.reward_status IS NOT NEW.reward_status
+              OR OLD.earned_date IS NOT NEW.earned_date)
+        BEGIN {_REMOVE_OLD} {_ADD_NEW} END
+    '''),
+    ('trg_user_points_delete', f'''
+        AFTER DELETE ON user_rewards
+        WHEN OLD.reward_status = 'earned'
+        BEGIN {_REMOVE_OLD} END
+    '''),
+]
+
+
+def upgrade(cursor):
+    """Create user_points, backfill it and install the triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_points (
+            period TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            points REAL NOT NULL DEFAULT 0,
+            reward_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, user_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_points_rank
+        ON user_points (period, points, user_id)
+    ''')
+
+    for name, body in TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'CREATE TRIGGER {name} {body}')
+
+    # Backfill from the rewards already earned
+    cursor.execute('''
+        INSERT INTO user_points (period, user_id, points, reward_count)
+        SELECT period, user_id, SUM(points), COUNT(*)
+        FROM (
+            SELECT 'all' AS period, user_id, COALESCE(points_earned, 0) AS points
+            FROM user_rewards WHERE reward_status = 'earned' AND user_id IS NOT NULL
+            UNION ALL
+            SELECT 'week:' || strftime('%Y-%W', COALESCE(earned_date, CURRENT_TIMESTAMP)),
+                   user_id, COALESCE(points_earned, 0)
+            FROM user_rewards WHERE reward_status = 'earned' AND user_id IS NOT NULL
+            UNION ALL
+            SELECT 'month:' || strftime('%Y-%m', COALESCE(earned_date, CURRENT_TIMESTAMP)),
+                   user_id, COALESCE(points_earned, 0)
+            FROM user_rewards WHERE reward_status = 'earned' AND user_id IS NOT NULL
+        )
+        GROUP BY period, user_id
+    ''')
@@ -0,0 +1,37 @@
+"""
+Durable reward issuance queue
+
+record_referral_event and the appointment webhook enqueue a reward_jobs row
+in the same transaction that marks an event CONVERTED; the reward worker
+(cron_jobs/reward_worker.py) claims jobs in batches and issues the rewards.
+event_id is unique so an event is queued at most once. Times are Unix
+epoch seconds so backoff and lag are plain arithmetic.
+"""
+
+VERSION = 9
+DESCRIPTION = 'Reward job queue'
+
+
+def upgrade(cursor):
+    """Create the reward_jobs table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reward_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            locked_by TEXT,
+            locked_until REAL,
+            reward_id INTEGER,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            completed_at REAL,
+            FOREIGN KEY (event_id) REFERENCES referral_events (id),
+            FOREIGN KEY (reward_id) REFERENCES rewards (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reward_jobs_status_run_after
+        ON reward_jobs (status, run_after)
+    ''')
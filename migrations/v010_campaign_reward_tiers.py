@@ -0,0 +1,80 @@
+"""
+Advocate conversion counters and per-campaign reward tiers
+
+referral_codes.converted_count counts the code's CONVERTED events. Triggers
+on referral_events keep it current whichever path flips an event's status
+(record_referral_event, the appointment webhook, campaign deletes), so the
+reward engine reads an advocate's tier from one row.
+
+campaign_reward_tiers replaces the hardcoded 5/10 conversion thresholds.
+Existing campaigns are seeded with those thresholds so rewards don't change.
+"""
+
+from migrations.helpers import add_column
+
+VERSION = 10
+DESCRIPTION = 'Campaign reward tiers and code conversion counters'
+
+# The thresholds the reward engine hardcoded before this migration:
+# (min_conversions, multiplier)
+SEED_TIERS = ((5, 1.2), (10, 1.5))
+
+TRIGGERS = [
+    ('trg_referral_codes_converted_insert', '''
+        AFTER INSERT ON referral_events
+        WHEN NEW.status = 'CONVERTED'
+        BEGIN
+            UPDATE referral_codes SET converted_count = converted_count + 1
+            WHERE id = NEW.code_id;
+        END
+    '''),
+    ('trg_referral_codes_converted_update', '''
+        AFTER UPDATE OF code_id, status ON referral_events
+        WHEN (OLD.status = 'CONVERTED' OR NEW.status = 'CONVERTED')
+         AND (OLD.status IS NOT NEW.status OR OLD.code_id IS NOT NEW.code_id)
+        BEGIN
+            UPDATE referral_codes SET converted_count = converted_count - 1
+            WHERE id = OLD.code_id AND OLD.status = 'CONVERTED';
+            UPDATE referral_codes SET converted_count = converted_count + 1
+            WHERE id = NEW.code_id AND NEW.status = 'CONVERTED';
+        END
+    '''),
+    ('trg_referral_codes_converted_delete', '''
+        AFTER DELETE ON referral_events
+        WHEN OLD.status = 'CONVERTED'
+        BEGIN
+            UPDATE referral_codes SET converted_count = converted_count - 1
+            WHERE id = OLD.code_id;
+        END
+    '''),
+]
+
+
+def upgrade(cursor):
+    """Add the counter and tier table, seed default tiers and backfill counts"""
+    add_column(cursor, 'referral_codes', 'converted_count', 'INTEGER NOT NULL DEFAULT 0')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaign_reward_tiers (
+            campaign_id INTEGER NOT NULL,
+            min_conversions INTEGER NOT NULL,
+            multiplier REAL NOT NULL,
+            PRIMARY KEY (campaign_id, min_conversions),
+            FOREIGN KEY (campaign_id) REFERENCES referral_campaigns (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.executemany('''
+        INSERT OR IGNORE INTO campaign_reward_tiers (campaign_id, min_conversions, multiplier)
+        SELECT id, ?, ? FROM referral_campaigns
+    ''', SEED_TIERS)
+
+    for name, body in TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'CREATE TRIGGER {name} {body}')
+
+    cursor.execute('''
+        UPDATE referral_codes SET converted_count = (
+            SELECT COUNT(*) FROM referral_events e
+            WHERE e.code_id = referral_codes.id AND e.status = 'CONVERTED'
+        )
+    ''')
@@ -0,0 +1,43 @@
+"""
+Generation counter for the reward trigger rules cache
+
+check_reward_triggers serves active program triggers from a per-process
+cache (services/reward_rules_service.py). Triggers on reward_programs,
+reward_triggers and reward_tiers bump the 'reward_rules' generation in the
+same transaction as any edit, so every worker process notices the change on
+its next lookup, whichever admin page or script made it.
+"""
+
+VERSION = 11
+DESCRIPTION = 'Reward rules cache generation'
+
+RULE_TABLES = ('reward_programs', 'reward_triggers', 'reward_tiers')
+
+_BUMP = '''
+    UPDATE cache_generations SET generation = generation + 1
+    WHERE name = 'reward_rules';
+'''
+
+
+def _triggers():
+    for table in RULE_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            yield f'trg_{table}_rules_{event.lower()}', f'AFTER {event} ON {table} BEGIN {_BUMP} END'
+
+
+TRIGGERS = list(_triggers())
+
+
+def upgrade(cursor):
+    """Create the generation table and the invalidation triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO cache_generations (name, generation) VALUES ('reward_rules', 0)")
+
+    for name, body in TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'CREATE TRIGGER {name} {body}')
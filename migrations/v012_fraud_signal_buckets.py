@@ -0,0 +1,76 @@
+"""
+Shared sliding-window counters for fraud signals
+
+fraud_signal_buckets counts referral events per signal key (IP, code,
+user-agent fingerprint, subnet) and time bucket, so FraudSignalEngine can
+score an event from a handful of primary-key reads instead of windowed
+COUNT(*) scans of referral_events. Buckets for the current windows are
+backfilled from existing events.
+"""
+
+import hashlib
+import ipaddress
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+VERSION = 12
+DESCRIPTION = 'Fraud signal buckets'
+
+# signal -> (window seconds, bucket seconds), as shipped with this migration
+SIGNAL_WINDOWS = {
+    'ip': (86400, 3600),
+    'code': (3600, 300),
+    'ua': (3600, 300),
+    'subnet': (86400, 3600),
+}
+
+
+def _signal_keys(code_id, ip_addr, user_agent):
+    """Each signal's key for an event: IP, code, folded user-agent hash and /24 or /64"""
+    keys = {'ip': ip_addr or None, 'code': str(code_id) if code_id is not None else None}
+
+    normalized = re.sub(r'\d+', '0', (user_agent or '').strip().lower())
+    keys['ua'] = hashlib.sha1(normalized.encode()).hexdigest()[:16] if normalized else None
+
+    try:
+        address = ipaddress.ip_address((ip_addr or '').strip())
+        prefix = 24 if address.version == 4 else 64
+        keys['subnet'] = str(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
+    except ValueError:
+        keys['subnet'] = None
+    return {signal: key for signal, key in keys.items() if key is not None}
+
+
+def upgrade(cursor):
+    """Create fraud_signal_buckets and backfill the current windows"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fraud_signal_buckets (
+            signal TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (signal, key, bucket)
+        ) WITHOUT ROWID
+    ''')
+
+    now = time.time()
+    longest = max(window for window, _ in SIGNAL_WINDOWS.values())
+    since = datetime.fromtimestamp(now - longest, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+    buckets = Counter()
+    rows = cursor.execute('''
+        SELECT code_id, ip_addr, user_agent, strftime('%s', created_at)
+        FROM referral_events
+        WHERE created_at >= ?
+    ''', (since,)).fetchall()
+    for code_id, ip_addr, user_agent, created_at in rows:
+        created_at = float(created_at) if created_at is not None else now
+        for signal, key in _signal_keys(code_id, ip_addr, user_agent).items():
+            buckets[(signal, key, int(created_at // SIGNAL_WINDOWS[signal][1]))] += 1
+
+    cursor.executemany('''
+        INSERT INTO fraud_signal_buckets (signal, key, bucket, count)
+        VALUES (?, ?, ?, ?)
+    ''', [(signal, key, bucket, count) for (signal, key, bucket), count in buckets.items()])
@@ -0,0 +1,23 @@
+"""
+Per-event rows in fraud_scores
+
+The batch re-scoring job (services/fraud_rescore_service.py) writes one
+fraud_scores row per referral event and upserts it on later runs, so rows
+carry the event and code they score. Rows written for users (event_id NULL)
+are unaffected by the unique key.
+"""
+
+from migrations.helpers import add_column
+
+VERSION = 13
+DESCRIPTION = 'Fraud scores per referral event'
+
+
+def upgrade(cursor):
+    """Add event and code columns and the per-event unique key"""
+    add_column(cursor, 'fraud_scores', 'event_id', 'INTEGER REFERENCES referral_events (id)')
+    add_column(cursor, 'fraud_scores', 'code_id', 'INTEGER REFERENCES referral_codes (id)')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_fraud_scores_event
+        ON fraud_scores (event_id) WHERE event_id IS NOT NULL
+    ''')
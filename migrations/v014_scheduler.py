@@ -0,0 +1,47 @@
+"""
+Background job scheduler state and run history
+
+scheduler_jobs holds one row per registered job with its next due time and
+the lease that lets a single worker (a gunicorn worker's scheduler thread
+or the cron container) run it at a time. scheduler_runs records every run
+with its outcome. Times are Unix epoch seconds, as in reward_jobs.
+"""
+
+VERSION = 14
+DESCRIPTION = 'Scheduler jobs and run history'
+
+
+def upgrade(cursor):
+    """Create scheduler_jobs and scheduler_runs"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            name TEXT PRIMARY KEY,
+            interval_seconds REAL NOT NULL,
+            next_run_at REAL NOT NULL,
+            locked_by TEXT,
+            locked_until REAL,
+            last_started_at REAL,
+            last_finished_at REAL,
+            last_status TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_name TEXT NOT NULL,
+            worker_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            result TEXT,
+            error TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduler_runs_job_started
+        ON scheduler_runs (job_name, started_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduler_runs_started
+        ON scheduler_runs (started_at)
+    ''')
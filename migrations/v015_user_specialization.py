@@ -0,0 +1,22 @@
+"""
+Specialist specialization on users
+
+AvailabilityService filters specialists by specialization ("find the next
+available endodontist"), but neither the User model nor the users table had
+the column. The index serves the candidate lookup by role and
+specialization.
+"""
+
+from migrations.helpers import add_column
+
+VERSION = 15
+DESCRIPTION = 'User specialization'
+
+
+def upgrade(cursor):
+    """Add users.specialization and index it with role"""
+    add_column(cursor, 'users', 'specialization', 'TEXT')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_role_specialization
+        ON users (role, specialization)
+    ''')
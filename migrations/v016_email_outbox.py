@@ -0,0 +1,44 @@
+"""
+Transactional email outbox
+
+Code that sends mail inserts a row into email_outbox on the same
+transaction as the change the mail is about (a registration, an issued
+reward, an appointment notification), so a message is queued exactly when
+that change commits and no request waits on SMTP. cron_jobs/email_worker.py
+leases ready rows, delivers them and retries failures with backoff, as the
+reward worker does for reward_jobs. Times are Unix epoch seconds.
+"""
+
+VERSION = 16
+DESCRIPTION = 'Email outbox'
+
+
+def upgrade(cursor):
+    """Create email_outbox and its worker indexes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            sender TEXT,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            notification_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            locked_by TEXT,
+            locked_until REAL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            last_error TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_ready
+        ON email_outbox (status, run_after)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_lease
+        ON email_outbox (status, locked_until)
+    ''')
@@ -0,0 +1,75 @@
+"""
+Conversion ordinal on referral events
+
+The reward worker used to pick an event's tier from its code's
+converted_count when the job ran, so a conversion committed before the
+worker reached an earlier one could lift that earlier one into a higher
+tier. referral_events.conversion_ordinal records, when an event becomes
+CONVERTED, which conversion of its code it was (1 for the first); the
+converted_count triggers from v010 now stamp it in the same statement that
+bumps the counter. Events leaving CONVERTED have it cleared.
+
+Existing converted events are numbered per code in the order they were
+last updated.
+"""
+
+from migrations.helpers import add_column
+
+VERSION = 17
+DESCRIPTION = 'Referral event conversion ordinal'
+
+_STAMP_NEW = '''
+    UPDATE referral_events SET conversion_ordinal = (
+        SELECT converted_count FROM referral_codes WHERE id = NEW.code_id
+    )
+    WHERE id = NEW.id;
+'''
+
+TRIGGERS = [
+    ('trg_referral_codes_converted_insert', f'''
+        AFTER INSERT ON referral_events
+        WHEN NEW.status = 'CONVERTED'
+        BEGIN
+            UPDATE referral_codes SET converted_count = converted_count + 1
+            WHERE id = NEW.code_id;
+            {_STAMP_NEW}
+        END
+    '''),
+    ('trg_referral_codes_converted_update', f'''
+        AFTER UPDATE OF code_id, status ON referral_events
+        WHEN (OLD.status = 'CONVERTED' OR NEW.status = 'CONVERTED')
+         AND (OLD.status IS NOT NEW.status OR OLD.code_id IS NOT NEW.code_id)
+        BEGIN
+            UPDATE referral_codes SET converted_count = converted_count - 1
+            WHERE id = OLD.code_id AND OLD.status = 'CONVERTED';
+            UPDATE referral_codes SET converted_count = converted_count + 1
+            WHERE id = NEW.code_id AND NEW.status = 'CONVERTED';
+            UPDATE referral_events SET conversion_ordinal = CASE
+                WHEN NEW.status = 'CONVERTED'
+                THEN (SELECT converted_count FROM referral_codes WHERE id = NEW.code_id)
+            END
+            WHERE id = NEW.id;
+        END
+    '''),
+]
+
+
+def upgrade(cursor):
+    """Add conversion_ordinal, stamp it from the conversion triggers and backfill it"""
+    add_column(cursor, 'referral_events', 'conversion_ordinal', 'INTEGER')
+
+    for name, body in TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'CREATE TRIGGER {name} {body}')
+
+    cursor.execute('''
+        UPDATE referral_events SET conversion_ordinal = (
+            SELECT ordinal FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY code_id ORDER BY updated_at, id) AS ordinal
+                FROM referral_events
+                WHERE status = 'CONVERTED'
+            ) numbered
+            WHERE numbered.id = referral_events.id
+        )
+        WHERE status = 'CONVERTED'
+    ''')
@@ -0,0 +1,24 @@
+"""
+One reward per referral event
+
+The reward worker reclaims a job whose lease has expired, so a batch that
+overran REWARD_QUEUE_LEASE_SECONDS could be issued by two workers: each
+checked for an existing reward, then inserted its own. idx_rewards_event
+becomes UNIQUE and the issuers insert with ON CONFLICT (event_id) DO
+NOTHING, so the second insert is a no-op.
+
+Existing duplicates keep their earliest reward.
+"""
+
+VERSION = 18
+DESCRIPTION = 'Unique reward per event'
+
+
+def upgrade(cursor):
+    """Drop duplicate rewards and make idx_rewards_event unique"""
+    cursor.execute('''
+        DELETE FROM rewards
+        WHERE id NOT IN (SELECT MIN(id) FROM rewards GROUP BY event_id)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_rewards_event')
+    cursor.execute('CREATE UNIQUE INDEX idx_rewards_event ON rewards (event_id)')
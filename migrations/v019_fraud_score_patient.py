@@ -0,0 +1,21 @@
+"""
+Per-event fraud scores belong to the referred patient
+
+The re-scoring job wrote the code's advocate into fraud_scores.user_id,
+next to the referred signup's IP address and device fingerprint. Rows with
+an event_id now carry the event's referred_patient_id; the advocate is
+reachable through code_id.
+"""
+
+VERSION = 19
+DESCRIPTION = 'Fraud score rows keyed by referred patient'
+
+
+def upgrade(cursor):
+    """Point per-event fraud_scores rows at the event's referred patient"""
+    cursor.execute('''
+        UPDATE fraud_scores SET user_id = (
+            SELECT referred_patient_id FROM referral_events WHERE referral_events.id = fraud_scores.event_id
+        )
+        WHERE event_id IS NOT NULL
+    ''')
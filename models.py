@@ -49,6 +49,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(128), nullable=False)
     full_name = db.Column(db.String(120), nullable=False)
     role = db.Column(db.String(20), default='patient')
+    specialization = db.Column(db.String(100))  # e.g. 'endodontics', for specialists
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -119,6 +120,36 @@ class UserPromotionPreference(db.Model):
     def __repr__(self):
         return f'<UserPromotionPreference user_id={self.user_id} opt_out={self.opt_out}>'
 
+class PromotionCounterSegment(db.Model):
+    """Spool segments of impression and click counts already applied to promotions"""
+    __tablename__ = 'promotion_counter_segments'
+    
+    # Segment names start with a zero-padded nanosecond timestamp, so the
+    # primary key orders them by creation time
+    segment = db.Column(db.String(255), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<PromotionCounterSegment {self.segment}>'
+
+class PromotionMetricsHourly(db.Model):
+    """Impressions and clicks per promotion, hour, slot location and viewer role"""
+    __tablename__ = 'promotion_metrics_hourly'
+    
+    promotion_id = db.Column(db.Integer, db.ForeignKey('promotions.id', ondelete='CASCADE'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)  # UTC, truncated to the hour
+    location = db.Column(db.String(32), primary_key=True)  # PromotionLocation value
+    role = db.Column(db.String(20), primary_key=True)  # 'anonymous' for logged-out viewers
+    impressions = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('idx_promotion_metrics_hourly_hour', 'hour'),
+    )
+    
+    def __repr__(self):
+        return f'<PromotionMetricsHourly {self.promotion_id} {self.hour} {self.location} {self.role}>'
+
 class Referral(db.Model):
     """Referral model"""
     __tablename__ = 'referrals'
@@ -187,6 +218,13 @@ class Appointment(db.Model):
     referral = db.relationship('Referral', backref='appointments')
     notifications = db.relationship('AppointmentNotification', backref='appointment', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        # Conflict checks and slot searches: a specialist's scheduled appointments by time
+        db.Index('idx_appointments_specialist_status_start', 'specialist_id', 'status', 'start_time'),
+        # Reminder dispatch: scheduled appointments starting in a window
+        db.Index('idx_appointments_status_start', 'status', 'start_time'),
+    )
+    
     def __repr__(self):
         return f'<Appointment {self.id}: {self.title}>'
     
@@ -236,9 +274,42 @@ class AppointmentNotification(db.Model):
     # Relationships
     user = db.relationship('User', backref='appointment_notifications')
     
+    __table_args__ = (
+        # Reminder dedupe: has this appointment had a notification of this type
+        db.Index('idx_appointment_notifications_appointment_type', 'appointment_id', 'notification_type'),
+    )
+    
     def __repr__(self):
         return f'<AppointmentNotification {self.notification_type.value} for appointment {self.appointment_id}>'
 
+class OutboxEmail(db.Model):
+    """Queued email in the transactional outbox (see migration v016 and services/email_outbox.py)"""
+    __tablename__ = 'email_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    domain = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255))
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    notification_id = db.Column(db.Integer)  # appointment_notifications row whose delivery_status it settles
+    status = db.Column(db.String(20), nullable=False, server_default='queued')
+    attempts = db.Column(db.Integer, nullable=False, server_default='0')
+    run_after = db.Column(db.Float, nullable=False)  # epoch seconds
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.Float)
+    created_at = db.Column(db.Float, nullable=False)
+    sent_at = db.Column(db.Float)
+    last_error = db.Column(db.Text)
+    
+    __table_args__ = (
+        db.Index('idx_email_outbox_ready', 'status', 'run_after'),
+        db.Index('idx_email_outbox_lease', 'status', 'locked_until'),
+    )
+    
+    def __repr__(self):
+        return f'<OutboxEmail {self.id} to {self.recipient}: {self.status}>'
+
 class ComplianceAuditTrail(db.Model):
     """Audit trail model for compliance tracking"""
     __tablename__ = 'compliance_audit_trail'
@@ -0,0 +1,153 @@
+"""
+SQL for the hot request handlers in app.py
+
+The dashboard, referral list, messages and provider code handlers run these
+on every request. They live outside app.py so tests/test_query_plans.py can
+check the statements the handlers actually execute against the migrated
+schema without loading the web app.
+"""
+
+from utils.pagination import keyset_order_by
+
+DASHBOARD_REFERRALS_SQL = '''
+    SELECT r.*
+    FROM referrals r
+    WHERE r.user_id = ?
+    ORDER BY r.created_at DESC
+    LIMIT 5
+'''
+DASHBOARD_DOCUMENTS_SQL = '''
+    SELECT file_type, file_name, upload_date
+    FROM documents
+    WHERE user_id = ?
+    ORDER BY upload_date DESC
+    LIMIT 5
+'''
+
+PROVIDER_CODE_SQL = '''
+    SELECT pc.user_id, pc.practice_name, pc.provider_type, pc.specialization, u.full_name
+    FROM provider_codes pc
+    JOIN users u ON pc.user_id = u.id
+    WHERE pc.provider_code = ? AND pc.is_active = TRUE
+'''
+
+MESSAGES_SENT_SQL = '''
+    SELECT m.id, m.subject, m.content, m.message_type, m.referral_id,
+           m.is_read, m.created_at, u.full_name as recipient_name,
+           u.role as recipient_role
+    FROM messages m
+    JOIN users u ON m.recipient_id = u.id
+    WHERE m.sender_id = ? AND m.is_deleted_by_sender = FALSE
+    ORDER BY m.created_at DESC
+'''
+MESSAGES_RECEIVED_SQL = '''
+    SELECT m.id, m.subject, m.content, m.message_type, m.referral_id,
+           m.is_read, m.created_at, u.full_name as sender_name,
+           u.role as sender_role
+    FROM messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE m.recipient_id = ? AND m.is_deleted_by_recipient = FALSE
+    ORDER BY m.created_at DESC
+'''
+MESSAGES_ALL_SQL = '''
+    SELECT m.id, m.subject, m.content, m.message_type, m.referral_id,
+           m.is_read, m.created_at,
+           CASE WHEN m.sender_id = ? THEN u2.full_name ELSE u1.full_name END as contact_name,
+           CASE WHEN m.sender_id = ? THEN u2.role ELSE u1.role END as contact_role,
+           CASE WHEN m.sender_id = ? THEN 'sent' ELSE 'received' END as direction
+    FROM messages m
+    JOIN users u1 ON m.sender_id = u1.id
+    JOIN users u2 ON m.recipient_id = u2.id
+    WHERE (m.sender_id = ? AND m.is_deleted_by_sender = FALSE)
+       OR (m.recipient_id = ? AND m.is_deleted_by_recipient = FALSE)
+    ORDER BY m.created_at DESC
+'''
+
+# Referral listing: columns exposed through fields= and the whitelisted sort
+# keys. Sort expressions are interpolated into SQL, so only values from this
+# mapping may ever reach the query.
+REFERRAL_COLUMNS = (
+    'id', 'user_id', 'referral_id', 'patient_name', 'referring_doctor', 'target_doctor',
+    'medical_condition', 'urgency_level', 'status', 'case_status', 'consultation_date',
+    'case_accepted_date', 'treatment_start_date', 'treatment_complete_date',
+    'rejection_reason', 'estimated_value', 'actual_value', 'notes', 'qr_code',
+    'created_at', 'updated_at', 'patient_id', 'dentist_id'
+)
+REFERRAL_JOINED_FIELDS = {
+    'patient_name_user': 'p.full_name',
+    'dentist_name_user': 'd.full_name'
+}
+REFERRAL_SORT_COLUMNS = {
+    'created_at': 'r.created_at',
+    'updated_at': "COALESCE(r.updated_at, '')",
+    'patient_name': 'r.patient_name',
+    'status': "COALESCE(r.status, '')",
+    'urgency_level': "COALESCE(r.urgency_level, '')"
+}
+
+# Referral visibility for non-admin roles, shared by the list, detail and
+# export handlers
+REFERRAL_LIST_PROVIDER_FILTER = '(r.dentist_id = ? OR r.user_id = ?)'
+REFERRAL_LIST_PATIENT_FILTER = '(r.patient_id = ? OR r.user_id = ?)'
+
+
+def referral_list_query(select_list, sort_expr, sort_order, conditions=()):
+    """Build the /api/referrals page query
+
+    Args:
+        select_list (str): Projected columns
+        sort_expr (str): Value from REFERRAL_SORT_COLUMNS
+        sort_order (str): 'asc' or 'desc'
+        conditions (list, optional): SQL predicates, ANDed together
+
+    Returns:
+        str: Query whose last parameter is the LIMIT
+    """
+    query = f'''
+        SELECT {select_list}, {sort_expr} as _sort_key
+        FROM referrals r
+        LEFT JOIN users p ON r.patient_id = p.id
+        LEFT JOIN users d ON r.dentist_id = d.id
+    '''
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return query + ' ' + keyset_order_by(sort_expr, 'r.id', sort_order) + ' LIMIT ?'
+
+
+# /referrals page: each role's referrals with their document counts
+REFERRALS_PAGE_DENTIST_SQL = '''
+    SELECT r.*, COUNT(d.id) as document_count,
+           u.full_name as target_provider_name
+    FROM referrals r
+    LEFT JOIN documents d ON r.id = d.referral_id
+    LEFT JOIN users u ON u.full_name = r.target_doctor
+    WHERE (r.user_id = ?)
+'''
+REFERRALS_PAGE_SPECIALIST_SQL = '''
+    SELECT r.*, COUNT(d.id) as document_count,
+           CASE WHEN r.user_id = ? THEN r.target_doctor ELSE u.full_name END as target_provider_name,
+           CASE WHEN r.user_id = ? THEN 'sent' ELSE 'received' END as referral_direction
+    FROM referrals r
+    LEFT JOIN documents d ON r.id = d.referral_id
+    LEFT JOIN users u ON r.user_id = u.id
+    WHERE (r.user_id = ? OR r.target_doctor = ?)
+'''
+REFERRALS_PAGE_PATIENT_SQL = '''
+    SELECT r.*, COUNT(d.id) as document_count,
+           r.target_doctor as target_provider_name,
+           u.full_name as referring_provider_name
+    FROM referrals r
+    LEFT JOIN documents d ON r.id = d.referral_id
+    LEFT JOIN users u ON r.user_id = u.id
+    WHERE (r.patient_name LIKE ? OR r.user_id = ?)
+'''
+
+
+def referrals_page_query(base_query, sort_expr, sort_order, conditions=()):
+    """Build the /referrals page query from a role's REFERRALS_PAGE_*_SQL
+
+    Returns:
+        str: Query whose last parameter is the LIMIT
+    """
+    query = base_query + ''.join(f' AND {condition}' for condition in conditions)
+    return query + f' GROUP BY r.id {keyset_order_by(sort_expr, "r.id", sort_order)} LIMIT ?'
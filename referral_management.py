@@ -2,7 +2,6 @@
 Referral and Reward Management Module
 """
 import os
-import sqlite3
 import uuid
 import hashlib
 import qrcode
@@ -11,114 +10,180 @@ from datetime import datetime
 from io import BytesIO
 import base64
 from flask import request, jsonify, session, render_template, redirect, url_for, flash
+from database import get_db
+from config.app_config import get_config
+from services.email_outbox import EmailOutbox
+from services.reward_queue import RewardQueue
+from services.fraud_signal_service import get_fraud_engine, subnet_of
+from services.campaign_tier_service import (
+    CampaignTierService, DEFAULT_REWARD_TIERS, multiplier_for, normalize_tiers
+)
+
+# Rows per IN (...) lookup, kept under SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# Converted events of a batch with the conversion ordinal they are tiered by
+REWARD_EVENTS_SQL = '''
+    SELECT e.id, c.advocate_id, c.campaign_id, camp.reward_type, camp.reward_value,
+           COALESCE(e.conversion_ordinal, c.converted_count)
+    FROM referral_events e
+    JOIN referral_codes c ON e.code_id = c.id
+    JOIN referral_campaigns camp ON c.campaign_id = camp.id
+    WHERE e.id IN ({placeholders}) AND e.status = 'CONVERTED'
+'''
+REWARDED_EVENTS_SQL = '''
+    SELECT event_id FROM rewards
+    WHERE event_id IN ({placeholders})
+'''
+CODE_FRAUD_THRESHOLD_SQL = '''
+    SELECT c.advocate_id, camp.fraud_threshold
+    FROM referral_codes c
+    LEFT JOIN referral_campaigns camp ON c.campaign_id = camp.id
+    WHERE c.id = ?
+'''
+LATEST_SIGNUP_SQL = '''
+    SELECT e.id, e.code_id
+    FROM referral_events e
+    WHERE e.referred_patient_id = ? AND e.status = 'SIGNED_UP'
+    ORDER BY e.created_at DESC
+    LIMIT 1
+'''
+
+def _chunks(items, size=LOOKUP_CHUNK_SIZE):
+    """Split a list into consecutive slices of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 # Reward issuers
 class RewardIssuer:
     """Base class for reward issuers"""
+    reward_type = None
+    # Status written on insert; fulfilled issuers also stamp fulfilled_at
+    initial_status = 'ISSUED'
+    fulfilled_on_issue = True
+    # Reward description for the advocate's email; None sends no email
+    email_label = None
+    
     def issue_reward(self, advocate_id, amount, campaign_id, event_id):
         """Issue a reward to an advocate"""
-        raise NotImplementedError("Subclasses must implement issue_reward")
+        return self.issue_rewards([(advocate_id, amount, campaign_id, event_id)]).get(event_id)
+    
+    def issue_rewards(self, batch):
+        """Issue many rewards in one transaction
+        
+        Events that already have a reward (e.g. issued by another worker
+        that reclaimed the job) are skipped: they get no reward id, email or
+        notification from this call.
+        
+        Args:
+            batch (list): (advocate_id, amount, campaign_id, event_id) tuples
+            
+        Returns:
+            dict: event_id -> reward id, for the rewards this call inserted
+        """
+        if self.reward_type is None:
+            raise NotImplementedError("Subclasses must set reward_type")
+        if not batch:
+            return {}
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        try:
+            reward_ids = {}
+            issued = []
+            for advocate_id, amount, campaign_id, event_id in batch:
+                cursor.execute('''
+                    INSERT INTO rewards (advocate_id, campaign_id, event_id, reward_type, amount, status, fulfilled_at)
+                    VALUES (?, ?, ?, ?, ?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END)
+                    ON CONFLICT (event_id) DO NOTHING
+                ''', (advocate_id, campaign_id, event_id, self.reward_type, amount,
+                      self.initial_status, self.fulfilled_on_issue))
+                if cursor.rowcount:
+                    reward_ids[event_id] = cursor.lastrowid
+                    issued.append((advocate_id, amount, campaign_id, event_id))
+
+            # Queue emails on the issuing transaction so they go out only if it commits
+            self._send_reward_emails(cursor, issued)
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        # Notify only once the rewards are durable
+        for advocate_id, amount, campaign_id, event_id in issued:
+            self._after_issue(advocate_id, amount)
+        
+        return reward_ids
+    
+    def _after_issue(self, advocate_id, amount):
+        """Hook run for each reward after the batch commits"""
+
+    def _send_reward_emails(self, cursor, batch):
+        """Queue a reward email to each advocate in the batch, if this issuer sends one"""
+        if self.email_label is None:
+            return
+
+        advocates = {}
+        for advocate_ids in _chunks(sorted({item[0] for item in batch})):
+            placeholders = ', '.join('?' for _ in advocate_ids)
+            cursor.execute(f'SELECT id, email, full_name FROM users WHERE id IN ({placeholders})', advocate_ids)
+            advocates.update((row[0], row[1:]) for row in cursor.fetchall())
+
+        for advocate_id, amount, campaign_id, event_id in batch:
+            if advocate_id in advocates:
+                self._send_reward_email(cursor, advocates[advocate_id], amount, self.email_label)
+
+    def _send_reward_email(self, cursor, advocate, amount, reward_type):
+        """Queue a reward email to an advocate in the email outbox
+
+        Args:
+            cursor: sqlite3 cursor of the issuing transaction
+            advocate (tuple): (email, full_name)
+            amount: Reward amount
+            reward_type (str): Reward description, e.g. 'gift card'
+        """
+        email, full_name = advocate
+        if not email:
+            return
+        EmailOutbox.enqueue(
+            cursor, email,
+            f"You've earned a ${amount} {reward_type}",
+            f"Hi {full_name}, thank you for your referral. Your ${amount} {reward_type} has been issued."
+        )
 
 class StripeGiftCardIssuer(RewardIssuer):
     """Issue rewards as Stripe gift cards"""
-    def issue_reward(self, advocate_id, amount, campaign_id, event_id):
-        """Issue a Stripe gift card"""
+    reward_type = 'GIFT_CARD'
+    email_label = 'gift card'
+
+    def _after_issue(self, advocate_id, amount):
+        """Issue the Stripe gift card"""
         # In a real implementation, this would call the Stripe API
         # For now, just log the reward
         print(f"Issuing Stripe gift card of ${amount} to advocate {advocate_id}")
-        
-        # Create reward record
-        conn = sqlite3.connect('sapyyn.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO rewards (advocate_id, campaign_id, event_id, reward_type, amount, status)
-            VALUES (?, ?, ?, 'GIFT_CARD', ?, 'ISSUED')
-        ''', (advocate_id, campaign_id, event_id, amount))
-        
-        reward_id = cursor.lastrowid
-        
-        # Update reward status
-        cursor.execute('''
-            UPDATE rewards
-            SET fulfilled_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (reward_id,))
-        
-        conn.commit()
-        conn.close()
-        
-        # Send email notification
-        self._send_reward_email(advocate_id, amount, 'gift card')
-        
-        return reward_id
-    
-    def _send_reward_email(self, advocate_id, amount, reward_type):
-        """Send reward email to advocate"""
-        # In a real implementation, this would use the existing send_email function
-        # For now, just log the email
-        print(f"Sending reward email to advocate {advocate_id} for ${amount} {reward_type}")
 
 class AccountCreditIssuer(RewardIssuer):
     """Issue rewards as account credits"""
-    def issue_reward(self, advocate_id, amount, campaign_id, event_id):
-        """Issue an account credit"""
-        # Create reward record
-        conn = sqlite3.connect('sapyyn.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO rewards (advocate_id, campaign_id, event_id, reward_type, amount, status)
-            VALUES (?, ?, ?, 'CREDIT', ?, 'ISSUED')
-        ''', (advocate_id, campaign_id, event_id, amount))
-        
-        reward_id = cursor.lastrowid
-        
+    reward_type = 'CREDIT'
+    email_label = 'account credit'
+
+    def _after_issue(self, advocate_id, amount):
+        """Credit the advocate's account"""
         # Update user account credit (would be in a separate table in a real implementation)
         # For now, just log the credit
         print(f"Adding ${amount} credit to advocate {advocate_id}")
-        
-        # Update reward status
-        cursor.execute('''
-            UPDATE rewards
-            SET fulfilled_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (reward_id,))
-        
-        conn.commit()
-        conn.close()
-        
-        # Send email notification
-        self._send_reward_email(advocate_id, amount, 'account credit')
-        
-        return reward_id
-    
-    def _send_reward_email(self, advocate_id, amount, reward_type):
-        """Send reward email to advocate"""
-        # In a real implementation, this would use the existing send_email function
-        print(f"Sending reward email to advocate {advocate_id} for ${amount} {reward_type}")
 
 class ManualSwagIssuer(RewardIssuer):
     """Issue rewards as manual swag items"""
-    def issue_reward(self, advocate_id, amount, campaign_id, event_id):
-        """Queue a manual swag reward"""
-        # Create reward record
-        conn = sqlite3.connect('sapyyn.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO rewards (advocate_id, campaign_id, event_id, reward_type, amount, status)
-            VALUES (?, ?, ?, 'SWAG', ?, 'PENDING')
-        ''', (advocate_id, campaign_id, event_id, amount))
-        
-        reward_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        # Notify admin about pending swag reward
+    reward_type = 'SWAG'
+    initial_status = 'PENDING'
+    fulfilled_on_issue = False
+    
+    def _after_issue(self, advocate_id, amount):
+        """Notify admin about a pending swag reward"""
         print(f"Notifying admin about pending swag reward for advocate {advocate_id}")
-        
-        return reward_id
 
 # Reward engine
 class RewardEngine:
@@ -132,133 +197,119 @@ class RewardEngine:
     
     def process_reward(self, event_id):
         """Process a reward for a referral event"""
-        conn = sqlite3.connect('sapyyn.db')
+        return self.process_rewards([event_id]).get(event_id)
+    
+    def process_rewards(self, event_ids):
+        """Process rewards for many referral events
+        
+        Event details with the event's conversion ordinal, already-issued
+        rewards and campaign tiers are loaded with a handful of IN queries,
+        and each issuer writes its share of the batch in one transaction.
+        Events that are not CONVERTED, already rewarded or use an unknown
+        reward type are skipped.
+        
+        Args:
+            event_ids (list): referral_events ids
+            
+        Returns:
+            dict: event_id -> reward id for the rewards issued by this call
+        """
+        event_ids = list(dict.fromkeys(event_ids))
+        conn = get_db()
         cursor = conn.cursor()
         
-        # Get event details
-        cursor.execute('''
-            SELECT e.id, e.code_id, e.referred_patient_id, e.status,
-                   c.advocate_id, c.campaign_id,
-                   camp.reward_type, camp.reward_value
-            FROM referral_events e
-            JOIN referral_codes c ON e.code_id = c.id
-            JOIN referral_campaigns camp ON c.campaign_id = camp.id
-            WHERE e.id = ?
-        ''', (event_id,))
-        
-        event = cursor.fetchone()
-        if not event:
-            conn.close()
-            return None
-        
-        event_id, code_id, referred_patient_id, status, advocate_id, campaign_id, reward_type, reward_value = event
-        
-        # Check if event is eligible for reward
-        if status != 'CONVERTED':
-            conn.close()
-            return None
-        
-        # Check if reward already issued
-        cursor.execute('''
-            SELECT id FROM rewards
-            WHERE event_id = ?
-        ''', (event_id,))
-        
-        if cursor.fetchone():
-            conn.close()
-            return None
+        events = []
+        issued = set()
+        for chunk in _chunks(event_ids):
+            placeholders = ', '.join('?' for _ in chunk)
+            
+            # Get event details
+            cursor.execute(REWARD_EVENTS_SQL.format(placeholders=placeholders), chunk)
+            events.extend(cursor.fetchall())
+            
+            # Check if rewards already issued
+            cursor.execute(REWARDED_EVENTS_SQL.format(placeholders=placeholders), chunk)
+            issued.update(row[0] for row in cursor.fetchall())
+        
+        events = [event for event in events if event[0] not in issued]
+        if not events:
+            return {}
         
         # Check for tiered rewards
-        reward_amount = self._calculate_tiered_reward(advocate_id, campaign_id, reward_value)
-        
-        conn.close()
-        
-        # Issue reward using appropriate issuer
-        issuer = self.issuers.get(reward_type)
-        if not issuer:
-            print(f"Unknown reward type: {reward_type}")
-            return None
-        
-        return issuer.issue_reward(advocate_id, reward_amount, campaign_id, event_id)
-    
-    def _calculate_tiered_reward(self, advocate_id, campaign_id, base_reward):
-        """Calculate tiered reward based on number of successful referrals"""
-        conn = sqlite3.connect('sapyyn.db')
-        cursor = conn.cursor()
-        
-        # Count successful referrals by this advocate for this campaign
-        cursor.execute('''
-            SELECT COUNT(*) FROM referral_events e
-            JOIN referral_codes c ON e.code_id = c.id
-            WHERE c.advocate_id = ? AND c.campaign_id = ? AND e.status = 'CONVERTED'
-        ''', (advocate_id, campaign_id))
-        
-        referral_count = cursor.fetchone()[0]
-        conn.close()
-        
-        # Apply tiered rewards
-        # This is a simple example; real implementation would be more sophisticated
-        if referral_count >= 10:
-            return base_reward * 1.5  # 50% bonus for 10+ referrals
-        elif referral_count >= 5:
-            return base_reward * 1.2  # 20% bonus for 5+ referrals
-        else:
-            return base_reward
+        tiers = CampaignTierService.get_tiers(conn, {event[2] for event in events})
+        
+        batches = {}
+        for event_id, advocate_id, campaign_id, reward_type, reward_value, conversion_ordinal in events:
+            if reward_type not in self.issuers:
+                print(f"Unknown reward type: {reward_type}")
+                continue
+            # Tiered by which conversion this was, not by how many there are by now
+            reward_amount = self._apply_tier(reward_value, conversion_ordinal, tiers[campaign_id])
+            batches.setdefault(reward_type, []).append((advocate_id, reward_amount, campaign_id, event_id))
+        
+        # Issue rewards using appropriate issuer
+        reward_ids = {}
+        for reward_type, batch in batches.items():
+            reward_ids.update(self.issuers[reward_type].issue_rewards(batch))
+        return reward_ids
+    
+    def _apply_tier(self, base_reward, referral_count, tiers):
+        """Apply the campaign's tier bonus for an advocate's conversion count"""
+        return base_reward * multiplier_for(tiers, referral_count)
 
 # Fraud detection
 class FraudDetector:
     """Detect potential fraud in referral system"""
+    def __init__(self, engine=None):
+        self.engine = engine or get_fraud_engine()
+    
     def check_referral(self, code_id, referred_patient_id, ip_addr, user_agent):
         """Check if a referral might be fraudulent"""
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
+        config = get_config()
         
         fraud_score = 0
         fraud_reasons = []
         
-        # Check for multiple sign-ups from same IP
-        cursor.execute('''
-            SELECT COUNT(*) FROM referral_events
-            WHERE ip_addr = ? AND created_at > datetime('now', '-1 day')
-        ''', (ip_addr,))
+        # Windowed velocity counts from the sliding-window counters
+        counts = self.engine.counts(conn, code_id, ip_addr, user_agent)
         
-        ip_count = cursor.fetchone()[0]
+        # Check for multiple sign-ups from same IP
+        ip_count = counts.get('ip', 0)
         if ip_count > 3:
             fraud_score += 2
             fraud_reasons.append(f"Multiple sign-ups ({ip_count}) from same IP")
         
-        # Check for advocate referring themselves
-        cursor.execute('''
-            SELECT advocate_id FROM referral_codes
-            WHERE id = ?
-        ''', (code_id,))
-        
-        advocate_id = cursor.fetchone()[0]
-        if advocate_id == referred_patient_id:
-            fraud_score += 5
-            fraud_reasons.append("Advocate referring themselves")
-        
         # Check for rapid-fire referrals
-        cursor.execute('''
-            SELECT COUNT(*) FROM referral_events
-            WHERE code_id = ? AND created_at > datetime('now', '-1 hour')
-        ''', (code_id,))
-        
-        recent_count = cursor.fetchone()[0]
+        recent_count = counts.get('code', 0)
         if recent_count > 5:
             fraud_score += 3
             fraud_reasons.append(f"Rapid-fire referrals ({recent_count} in last hour)")
         
-        # Get campaign fraud threshold
-        cursor.execute('''
-            SELECT camp.fraud_threshold
-            FROM referral_codes c
-            JOIN referral_campaigns camp ON c.campaign_id = camp.id
-            WHERE c.id = ?
-        ''', (code_id,))
+        # Check for one browser build signing up over and over
+        ua_count = counts.get('ua', 0)
+        if ua_count > config.FRAUD_UA_VELOCITY_THRESHOLD:
+            fraud_score += 1
+            fraud_reasons.append(f"Repeated user agent ({ua_count} in last hour)")
+        
+        # Check for sign-ups clustered on one network
+        subnet_count = counts.get('subnet', 0)
+        if subnet_count > config.FRAUD_SUBNET_THRESHOLD:
+            fraud_score += 1
+            fraud_reasons.append(f"Clustered sign-ups ({subnet_count}) from {subnet_of(ip_addr)}")
+        
+        # Get advocate and campaign fraud threshold
+        cursor.execute(CODE_FRAUD_THRESHOLD_SQL, (code_id,))
         
         result = cursor.fetchone()
-        fraud_threshold = result[0] if result else 3
+        advocate_id = result[0] if result else None
+        fraud_threshold = result[1] if result and result[1] is not None else 3
+        
+        # Check for advocate referring themselves
+        if advocate_id == referred_patient_id:
+            fraud_score += 5
+            fraud_reasons.append("Advocate referring themselves")
         
         # Update code if fraud threshold exceeded
         if fraud_score >= fraud_threshold:
@@ -269,8 +320,6 @@ class FraudDetector:
             ''', (code_id,))
             conn.commit()
         
-        conn.close()
-        
         return {
             'score': fraud_score,
             'threshold': fraud_threshold,
@@ -302,7 +351,7 @@ def generate_qr_code(data):
 
 def create_referral_code(campaign_id, advocate_id):
     """Create a new referral code for an advocate"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check if advocate already has a code for this campaign
@@ -313,7 +362,6 @@ def create_referral_code(campaign_id, advocate_id):
     
     existing_code = cursor.fetchone()
     if existing_code:
-        conn.close()
         return {
             'id': existing_code[0],
             'code': existing_code[1],
@@ -338,7 +386,6 @@ def create_referral_code(campaign_id, advocate_id):
     
     code_id = cursor.lastrowid
     conn.commit()
-    conn.close()
     
     return {
         'id': code_id,
@@ -349,7 +396,7 @@ def create_referral_code(campaign_id, advocate_id):
 
 def record_referral_event(code_id, referred_patient_id, status):
     """Record a referral event"""
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get IP and user agent
@@ -364,6 +411,10 @@ def record_referral_event(code_id, referred_patient_id, status):
     
     event_id = cursor.lastrowid
     
+    # Count the event in the fraud velocity windows
+    fraud_engine = get_fraud_engine()
+    fraud_signals = fraud_engine.record(cursor, code_id, ip_addr, user_agent)
+    
     # Update code usage count
     cursor.execute('''
         UPDATE referral_codes
@@ -371,22 +422,23 @@ def record_referral_event(code_id, referred_patient_id, status):
         WHERE id = ?
     ''', (code_id,))
     
+    # If event is CONVERTED, queue the reward with the event so the worker
+    # issues it outside the request
+    reward_queued = False
+    if status == 'CONVERTED':
+        reward_queued = RewardQueue.enqueue(cursor, event_id)
+    
     conn.commit()
+    fraud_engine.apply(fraud_signals)
     
     # Check for fraud
     fraud_detector = FraudDetector()
     fraud_result = fraud_detector.check_referral(code_id, referred_patient_id, ip_addr, user_agent)
     
-    # If event is CONVERTED, process reward
-    if status == 'CONVERTED':
-        reward_engine = RewardEngine()
-        reward_engine.process_reward(event_id)
-    
-    conn.close()
-    
     return {
         'event_id': event_id,
-        'fraud_result': fraud_result
+        'fraud_result': fraud_result,
+        'reward_queued': reward_queued
     }
 
 # API endpoints for referral campaigns
@@ -396,13 +448,12 @@ def get_campaigns():
         return jsonify({'error': 'Not authenticated'}), 401
     
     # Check if user is admin
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
     role = cursor.fetchone()[0]
     
     if role not in ['admin', 'dentist_admin', 'specialist_admin']:
-        conn.close()
         return jsonify({'error': 'Access denied'}), 403
     
     # Get campaigns
@@ -430,8 +481,6 @@ def get_campaigns():
             'updated_at': row[13]
         })
     
-    conn.close()
-    
     return jsonify({'campaigns': campaigns})
 
 def get_campaign(campaign_id):
@@ -440,13 +489,12 @@ def get_campaign(campaign_id):
         return jsonify({'error': 'Not authenticated'}), 401
     
     # Check if user is admin
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
     role = cursor.fetchone()[0]
     
     if role not in ['admin', 'dentist_admin', 'specialist_admin']:
-        conn.close()
         return jsonify({'error': 'Access denied'}), 403
     
     # Get campaign
@@ -457,7 +505,6 @@ def get_campaign(campaign_id):
     
     row = cursor.fetchone()
     if not row:
-        conn.close()
         return jsonify({'error': 'Campaign not found'}), 404
     
     campaign = {
@@ -474,7 +521,11 @@ def get_campaign(campaign_id):
         'fraud_threshold': row[10],
         'is_active': bool(row[11]),
         'created_at': row[12],
-        'updated_at': row[13]
+        'updated_at': row[13],
+        'reward_tiers': [
+            {'min_conversions': min_conversions, 'multiplier': multiplier}
+            for min_conversions, multiplier in CampaignTierService.get_tiers(conn, [campaign_id])[campaign_id]
+        ]
     }
     
     # Get campaign stats
@@ -520,8 +571,6 @@ def get_campaign(campaign_id):
             'total_reward_value': 0.0
         }
     
-    conn.close()
-    
     return jsonify({'campaign': campaign})
 
 def create_campaign():
@@ -535,13 +584,12 @@ def create_campaign():
         return jsonify({'error': 'Invalid CSRF token'}), 403
     
     # Check if user is admin
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
     role = cursor.fetchone()[0]
     
     if role not in ['admin', 'dentist_admin', 'specialist_admin']:
-        conn.close()
         return jsonify({'error': 'Access denied'}), 403
     
     # Get request data
@@ -557,24 +605,28 @@ def create_campaign():
     max_referrals_per_advocate = data.get('max_referrals_per_advocate', -1)
     fraud_threshold = data.get('fraud_threshold', 3)
     is_active = data.get('is_active', True)
+    reward_tiers = data.get('reward_tiers', DEFAULT_REWARD_TIERS)
     
     # Validate required fields
     if not all([name, start_date, end_date, advocate_role, reward_type, reward_value, reward_trigger]):
-        conn.close()
         return jsonify({'error': 'Missing required fields'}), 400
     
     # Validate reward type
     valid_reward_types = ['GIFT_CARD', 'CREDIT', 'SWAG']
     if reward_type not in valid_reward_types:
-        conn.close()
         return jsonify({'error': f'Invalid reward type. Must be one of: {", ".join(valid_reward_types)}'}), 400
     
     # Validate reward trigger
     valid_triggers = ['SIGNED_UP', 'CONVERTED']
     if reward_trigger not in valid_triggers:
-        conn.close()
         return jsonify({'error': f'Invalid reward trigger. Must be one of: {", ".join(valid_triggers)}'}), 400
     
+    # Validate reward tiers
+    try:
+        reward_tiers = normalize_tiers(reward_tiers)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid reward tiers: {str(e)}'}), 400
+    
     # Insert campaign
     try:
         cursor.execute('''
@@ -586,8 +638,8 @@ def create_campaign():
               reward_value, reward_trigger, max_referrals_per_advocate, fraud_threshold, is_active))
         
         campaign_id = cursor.lastrowid
+        CampaignTierService.set_tiers(cursor, campaign_id, reward_tiers)
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True, 
@@ -597,7 +649,6 @@ def create_campaign():
         
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({'error': f'Failed to create campaign: {str(e)}'}), 500
 
 def update_campaign(campaign_id):
@@ -611,19 +662,17 @@ def update_campaign(campaign_id):
         return jsonify({'error': 'Invalid CSRF token'}), 403
     
     # Check if user is admin
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
     role = cursor.fetchone()[0]
     
     if role not in ['admin', 'dentist_admin', 'specialist_admin']:
-        conn.close()
         return jsonify({'error': 'Access denied'}), 403
     
     # Check if campaign exists
     cursor.execute('SELECT id FROM referral_campaigns WHERE id = ?', (campaign_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({'error': 'Campaign not found'}), 404
     
     # Get request data
@@ -657,7 +706,6 @@ def update_campaign(campaign_id):
         # Validate reward type
         valid_reward_types = ['GIFT_CARD', 'CREDIT', 'SWAG']
         if data['reward_type'] not in valid_reward_types:
-            conn.close()
             return jsonify({'error': f'Invalid reward type. Must be one of: {", ".join(valid_reward_types)}'}), 400
         
         update_fields.append('reward_type = ?')
@@ -671,7 +719,6 @@ def update_campaign(campaign_id):
         # Validate reward trigger
         valid_triggers = ['SIGNED_UP', 'CONVERTED']
         if data['reward_trigger'] not in valid_triggers:
-            conn.close()
             return jsonify({'error': f'Invalid reward trigger. Must be one of: {", ".join(valid_triggers)}'}), 400
         
         update_fields.append('reward_trigger = ?')
@@ -689,12 +736,19 @@ def update_campaign(campaign_id):
         update_fields.append('is_active = ?')
         params.append(data['is_active'])
     
+    reward_tiers = None
+    if 'reward_tiers' in data:
+        # Validate reward tiers
+        try:
+            reward_tiers = normalize_tiers(data['reward_tiers'])
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid reward tiers: {str(e)}'}), 400
+    
     # Add updated_at timestamp
     update_fields.append('updated_at = CURRENT_TIMESTAMP')
     
     # If no fields to update, return error
     if not update_fields:
-        conn.close()
         return jsonify({'error': 'No fields to update'}), 400
     
     # Update campaign
@@ -703,8 +757,10 @@ def update_campaign(campaign_id):
         params.append(campaign_id)
         cursor.execute(query, params)
         
+        if reward_tiers is not None:
+            CampaignTierService.set_tiers(cursor, campaign_id, reward_tiers)
+        
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True, 
@@ -713,7 +769,6 @@ def update_campaign(campaign_id):
         
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({'error': f'Failed to update campaign: {str(e)}'}), 500
 
 def delete_campaign(campaign_id):
@@ -727,19 +782,17 @@ def delete_campaign(campaign_id):
         return jsonify({'error': 'Invalid CSRF token'}), 403
     
     # Check if user is admin
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT role FROM users WHERE id = ?', (session['user_id'],))
     role = cursor.fetchone()[0]
     
     if role not in ['admin', 'dentist_admin', 'specialist_admin']:
-        conn.close()
         return jsonify({'error': 'Access denied'}), 403
     
     # Check if campaign exists
     cursor.execute('SELECT id FROM referral_campaigns WHERE id = ?', (campaign_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({'error': 'Campaign not found'}), 404
     
     # Delete campaign
@@ -760,6 +813,11 @@ def delete_campaign(campaign_id):
             WHERE campaign_id = ?
         ''', (campaign_id,))
         
+        cursor.execute('''
+            DELETE FROM campaign_reward_tiers
+            WHERE campaign_id = ?
+        ''', (campaign_id,))
+        
         # Finally delete campaign
         cursor.execute('''
             DELETE FROM referral_campaigns
@@ -767,7 +825,6 @@ def delete_campaign(campaign_id):
         ''', (campaign_id,))
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True, 
@@ -776,7 +833,6 @@ def delete_campaign(campaign_id):
         
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({'error': f'Failed to delete campaign: {str(e)}'}), 500
 
 # API endpoints for referral codes
@@ -785,7 +841,7 @@ def get_advocate_codes():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get user's role
@@ -845,8 +901,6 @@ def get_advocate_codes():
             }
         })
     
-    conn.close()
-    
     return jsonify({'campaigns': campaigns})
 
 # Webhook endpoint for marking conversions
@@ -861,21 +915,14 @@ def webhook_appointment_completed():
     if not patient_id:
         return jsonify({'error': 'Missing patient_id'}), 400
     
-    conn = sqlite3.connect('sapyyn.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Find the most recent SIGNED_UP event for this patient
-    cursor.execute('''
-        SELECT e.id, e.code_id
-        FROM referral_events e
-        WHERE e.referred_patient_id = ? AND e.status = 'SIGNED_UP'
-        ORDER BY e.created_at DESC
-        LIMIT 1
-    ''', (patient_id,))
+    cursor.execute(LATEST_SIGNUP_SQL, (patient_id,))
     
     event = cursor.fetchone()
     if not event:
-        conn.close()
         return jsonify({'message': 'No referral event found for this patient'}), 200
     
     event_id, code_id = event
@@ -887,20 +934,25 @@ def webhook_appointment_completed():
         WHERE id = ?
     ''', (event_id,))
     
-    conn.commit()
-    conn.close()
+    # Queue the reward in the same transaction; the reward worker issues it
+    reward_queued = RewardQueue.enqueue(cursor, event_id)
     
-    # Process reward
-    reward_engine = RewardEngine()
-    reward_id = reward_engine.process_reward(event_id)
+    conn.commit()
     
     return jsonify({
         'success': True,
         'message': 'Appointment completed and referral converted',
         'event_id': event_id,
-        'reward_processed': reward_id is not None
+        'reward_queued': reward_queued
     })
 
+def get_reward_queue_stats():
+    """Reward queue depth and lag for monitoring"""
+    if 'user_id' not in session or session.get('role') not in ['admin']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return jsonify(RewardQueue.stats(get_db()))
+
 # Register routes with Flask app
 def register_routes(app):
     """Register routes with Flask app"""
@@ -912,6 +964,7 @@ def register_routes(app):
     app.add_url_rule('/api/referral/campaigns/<int:campaign_id>', 'delete_campaign', delete_campaign, methods=['DELETE'])
     app.add_url_rule('/api/referral/codes', 'get_advocate_codes', get_advocate_codes, methods=['GET'])
     app.add_url_rule('/webhooks/appointments/completed', 'webhook_appointment_completed', webhook_appointment_completed, methods=['POST'])
+    app.add_url_rule('/api/referral/reward-queue/stats', 'get_reward_queue_stats', get_reward_queue_stats, methods=['GET'])
     
     # Page routes
     @app.route('/admin/campaigns')
@@ -933,7 +986,7 @@ def register_routes(app):
     @app.route('/r/<link_slug>')
     def referral_landing(link_slug):
         """Referral landing page"""
-        conn = sqlite3.connect('sapyyn.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Find referral code by link slug
@@ -948,7 +1001,6 @@ def register_routes(app):
         ''', (link_slug,))
         
         code = cursor.fetchone()
-        conn.close()
         
         if not code:
             flash('Invalid or expired referral link', 'error')
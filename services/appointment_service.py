@@ -4,8 +4,12 @@ Appointment service for managing appointments
 
 from datetime import datetime, timedelta
 from models import db, Appointment, AppointmentStatus, User, Referral, AppointmentNotification, NotificationType
+from services.slot_engine import find_conflicts, free_slots
 from sqlalchemy import and_, or_, func
 
+# Longest date range find_available_slots searches in one call
+MAX_SLOT_SEARCH_DAYS = 62
+
 class AppointmentService:
     """Service for managing appointments"""
     
@@ -31,23 +35,81 @@ class AppointmentService:
             raise ValueError("Appointment time conflicts with an existing appointment")
         
         # Create appointment
-        appointment = Appointment(
-            patient_id=appointment_data['patient_id'],
-            specialist_id=appointment_data['specialist_id'],
-            referral_id=appointment_data.get('referral_id'),
-            title=appointment_data['title'],
-            description=appointment_data.get('description', ''),
-            start_time=appointment_data['start_time'],
-            end_time=appointment_data['end_time'],
-            status=AppointmentStatus.SCHEDULED,
-            created_by=appointment_data['created_by']
-        )
+        appointment = AppointmentService._build_appointment(appointment_data)
         
         db.session.add(appointment)
         db.session.commit()
         
         return appointment
     
+    @staticmethod
+    def create_appointments(appointments_data):
+        """Create several appointments in one transaction
+        
+        For recurring series and schedule imports. Users and referrals are
+        validated with one query each, and conflicts are checked with one
+        query per specialist, both within the batch and against existing
+        scheduled appointments. Either every appointment is created or none.
+        
+        Args:
+            appointments_data (list): Appointment data dicts, as for create_appointment
+            
+        Returns:
+            list: The created appointments, in the order given
+            
+        Raises:
+            ValueError: If any appointment is invalid or conflicts; the
+                message names its 0-based index in appointments_data
+        """
+        if not appointments_data:
+            return []
+        
+        users, referral_ids = AppointmentService._load_references(appointments_data)
+        for index, appointment_data in enumerate(appointments_data):
+            try:
+                AppointmentService._check_appointment_data(appointment_data, users, referral_ids)
+            except ValueError as e:
+                raise ValueError(f"Appointment at index {index}: {e}")
+        
+        positions = {}
+        for index, appointment_data in enumerate(appointments_data):
+            positions.setdefault(appointment_data['specialist_id'], []).append(index)
+        
+        for specialist_id, indexes in positions.items():
+            requested = [
+                (appointments_data[i]['start_time'], appointments_data[i]['end_time'])
+                for i in indexes
+            ]
+            booked = db.session.query(Appointment.start_time, Appointment.end_time).filter(
+                Appointment.specialist_id == specialist_id,
+                Appointment.status == AppointmentStatus.SCHEDULED,
+                Appointment.start_time < max(end for _, end in requested),
+                Appointment.end_time > min(start for start, _ in requested)
+            ).all()
+            
+            conflicts = find_conflicts(requested, booked)
+            if conflicts:
+                position, other = conflicts[0]
+                if other is None:
+                    raise ValueError(
+                        f"Appointment at index {indexes[position]}: "
+                        "time conflicts with an existing appointment"
+                    )
+                raise ValueError(
+                    f"Appointment at index {indexes[position]}: "
+                    f"time conflicts with appointment at index {indexes[other]}"
+                )
+        
+        appointments = [AppointmentService._build_appointment(data) for data in appointments_data]
+        try:
+            db.session.add_all(appointments)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        return appointments
+    
     @staticmethod
     def update_appointment(appointment_id, appointment_data):
         """Update an existing appointment
@@ -229,64 +291,107 @@ class AppointmentService:
         return appointment
     
     @staticmethod
-    def get_available_slots(specialist_id, date):
+    def get_available_slots(specialist_id, date, duration_minutes=30, buffer_minutes=0):
         """Get available time slots for a specialist on a specific date
         
         Args:
             specialist_id (int): ID of the specialist
             date (date): Date to check availability for
+            duration_minutes (int): Length of each slot
+            buffer_minutes (int): Free minutes required around existing appointments
             
         Returns:
             list: List of available time slots as (start_time, end_time) tuples
         """
+        slots = AppointmentService.find_available_slots(
+            [specialist_id], date, date,
+            duration_minutes=duration_minutes,
+            buffer_minutes=buffer_minutes
+        )
+        return slots.get(specialist_id, [])
+    
+    @staticmethod
+    def find_available_slots(specialist_ids, start_date, end_date=None, duration_minutes=30,
+                             buffer_minutes=0, step_minutes=None, not_before=None):
+        """Get available time slots for several specialists over a date range
+        
+        Runs two queries whatever the number of specialists and days: one for
+        availability rules and one for the scheduled appointments that overlap
+        the range. Free time is then found per specialist by subtracting the
+        appointments from the availability windows (see services/slot_engine.py).
+        
+        Args:
+            specialist_ids (list): IDs of the specialists
+            start_date (date): First date to search
+            end_date (date): Last date to search (inclusive), defaults to start_date
+            duration_minutes (int): Length of each slot
+            buffer_minutes (int): Free minutes required around existing appointments
+            step_minutes (int): Minutes between slot starts, defaults to duration_minutes
+            not_before (datetime): Optional earliest slot start, e.g. now
+            
+        Returns:
+            dict: Specialist ID to a list of (start_time, end_time) tuples in
+                order, for every requested specialist
+            
+        Raises:
+            ValueError: If the range or slot settings are invalid
+        """
         from services.availability_service import AvailabilityService
         
-        # Get specialist's availability for the date
-        availability = AvailabilityService.get_availability(specialist_id, date)
-        if not availability:
-            return []
+        end_date = end_date or start_date
+        if start_date > end_date:
+            raise ValueError("Start date must not be after end date")
+        if (end_date - start_date).days >= MAX_SLOT_SEARCH_DAYS:
+            raise ValueError(f"Cannot search more than {MAX_SLOT_SEARCH_DAYS} days at once")
         
-        # Get all appointments for the specialist on that date
-        start_of_day = datetime.combine(date, datetime.min.time())
-        end_of_day = datetime.combine(date, datetime.max.time())
+        duration = timedelta(minutes=duration_minutes)
+        buffer = timedelta(minutes=buffer_minutes)
+        step = timedelta(minutes=step_minutes) if step_minutes else None
         
-        appointments = Appointment.query.filter(
-            Appointment.specialist_id == specialist_id,
-            Appointment.start_time >= start_of_day,
-            Appointment.start_time <= end_of_day,
-            Appointment.status == AppointmentStatus.SCHEDULED
-        ).order_by(Appointment.start_time).all()
-        
-        # Generate available slots based on availability and existing appointments
-        available_slots = []
-        for avail in availability:
-            # Convert availability times to datetime
-            avail_start = datetime.combine(date, avail.start_time)
-            avail_end = datetime.combine(date, avail.end_time)
-            
-            # Default slot duration is 30 minutes
-            slot_duration = timedelta(minutes=30)
+        specialist_ids = list(dict.fromkeys(specialist_ids))
+        windows = AvailabilityService.get_availability_windows(specialist_ids, start_date, end_date)
+        
+        booked = AppointmentService.get_booked_intervals(list(windows), start_date, end_date, buffer)
+        
+        return {
+            specialist_id: free_slots(
+                windows.get(specialist_id, []), booked.get(specialist_id, []),
+                duration, buffer=buffer, step=step, not_before=not_before
+            )
+            for specialist_id in specialist_ids
+        }
+    
+    @staticmethod
+    def get_booked_intervals(specialist_ids, start_date, end_date, buffer=timedelta(0)):
+        """Get scheduled appointment times for several specialists in one query
+        
+        Args:
+            specialist_ids (list): IDs of the specialists
+            start_date (date): First date of the range
+            end_date (date): Last date of the range (inclusive)
+            buffer (timedelta): Also include appointments this close to the range
             
-            # Generate potential slots
-            current_slot_start = avail_start
-            while current_slot_start + slot_duration <= avail_end:
-                current_slot_end = current_slot_start + slot_duration
-                
-                # Check if slot conflicts with any appointment
-                is_available = True
-                for appt in appointments:
-                    if (current_slot_start < appt.end_time and 
-                        current_slot_end > appt.start_time):
-                        is_available = False
-                        break
-                
-                if is_available:
-                    available_slots.append((current_slot_start, current_slot_end))
-                
-                # Move to next potential slot
-                current_slot_start += slot_duration
-        
-        return available_slots
+        Returns:
+            dict: Specialist ID to a list of (start_time, end_time) tuples
+        """
+        if not specialist_ids:
+            return {}
+        
+        range_start = datetime.combine(start_date, datetime.min.time()) - buffer
+        range_end = datetime.combine(end_date + timedelta(days=1), datetime.min.time()) + buffer
+        rows = db.session.query(
+            Appointment.specialist_id, Appointment.start_time, Appointment.end_time
+        ).filter(
+            Appointment.specialist_id.in_(specialist_ids),
+            Appointment.status == AppointmentStatus.SCHEDULED,
+            Appointment.start_time < range_end,
+            Appointment.end_time > range_start
+        ).all()
+        
+        booked = {}
+        for specialist_id, start_time, end_time in rows:
+            booked.setdefault(specialist_id, []).append((start_time, end_time))
+        return booked
     
     @staticmethod
     def check_appointment_conflicts(specialist_id, start_time, end_time, exclude_appointment_id=None):
@@ -311,7 +416,7 @@ class AppointmentService:
         if exclude_appointment_id:
             query = query.filter(Appointment.id != exclude_appointment_id)
         
-        return query.count() > 0
+        return db.session.query(query.exists()).scalar()
     
     @staticmethod
     def get_appointments_by_referral(referral_id):
@@ -376,6 +481,51 @@ class AppointmentService:
         Args:
             appointment_data (dict): Appointment data to validate
             
+        Raises:
+            ValueError: If validation fails
+        """
+        users, referral_ids = AppointmentService._load_references([appointment_data])
+        AppointmentService._check_appointment_data(appointment_data, users, referral_ids)
+    
+    @staticmethod
+    def _load_references(appointments_data):
+        """Load the users and referrals that appointment data refers to
+        
+        Args:
+            appointments_data (list): Appointment data dicts
+            
+        Returns:
+            tuple: (dict of user ID to role, set of existing referral IDs)
+        """
+        user_ids = {
+            appointment_data[field]
+            for appointment_data in appointments_data
+            for field in ('patient_id', 'specialist_id', 'created_by')
+            if appointment_data.get(field) is not None
+        }
+        referral_ids = {
+            appointment_data['referral_id']
+            for appointment_data in appointments_data
+            if appointment_data.get('referral_id')
+        }
+        
+        users = dict(
+            db.session.query(User.id, User.role).filter(User.id.in_(user_ids)).all()
+        ) if user_ids else {}
+        referrals = {
+            row[0] for row in db.session.query(Referral.id).filter(Referral.id.in_(referral_ids)).all()
+        } if referral_ids else set()
+        return users, referrals
+    
+    @staticmethod
+    def _check_appointment_data(appointment_data, users, referral_ids):
+        """Validate appointment data against preloaded users and referrals
+        
+        Args:
+            appointment_data (dict): Appointment data to validate
+            users (dict): User ID to role, from _load_references
+            referral_ids (set): Existing referral IDs, from _load_references
+            
         Raises:
             ValueError: If validation fails
         """
@@ -385,24 +535,20 @@ class AppointmentService:
                 raise ValueError(f"Missing required field: {field}")
         
         # Validate patient exists
-        patient = User.query.get(appointment_data['patient_id'])
-        if not patient:
+        if appointment_data['patient_id'] not in users:
             raise ValueError(f"Patient with ID {appointment_data['patient_id']} not found")
         
         # Validate specialist exists
-        specialist = User.query.get(appointment_data['specialist_id'])
-        if not specialist or specialist.role != 'specialist':
+        if users.get(appointment_data['specialist_id']) != 'specialist':
             raise ValueError(f"Specialist with ID {appointment_data['specialist_id']} not found")
         
         # Validate creator exists
-        creator = User.query.get(appointment_data['created_by'])
-        if not creator:
+        if appointment_data['created_by'] not in users:
             raise ValueError(f"Creator with ID {appointment_data['created_by']} not found")
         
         # Validate referral if provided
         if 'referral_id' in appointment_data and appointment_data['referral_id']:
-            referral = Referral.query.get(appointment_data['referral_id'])
-            if not referral:
+            if appointment_data['referral_id'] not in referral_ids:
                 raise ValueError(f"Referral with ID {appointment_data['referral_id']} not found")
         
         # Validate times
@@ -423,4 +569,19 @@ class AppointmentService:
         if duration < 15:
             raise ValueError("Appointment must be at least 15 minutes long")
         if duration > 240:
-            raise ValueError("Appointment cannot be longer than 4 hours")
\ No newline at end of file
+            raise ValueError("Appointment cannot be longer than 4 hours")
+    
+    @staticmethod
+    def _build_appointment(appointment_data):
+        """Create an unsaved scheduled Appointment from validated data"""
+        return Appointment(
+            patient_id=appointment_data['patient_id'],
+            specialist_id=appointment_data['specialist_id'],
+            referral_id=appointment_data.get('referral_id'),
+            title=appointment_data['title'],
+            description=appointment_data.get('description', ''),
+            start_time=appointment_data['start_time'],
+            end_time=appointment_data['end_time'],
+            status=AppointmentStatus.SCHEDULED,
+            created_by=appointment_data['created_by']
+        )
\ No newline at end of file
@@ -113,6 +113,10 @@ class AuditService:
             promotion_id (int): ID of the promotion
             location (str): Location where the promotion was displayed
         """
+        # Views are logged at debug level only; skip building the entry otherwise
+        if not audit_logger.isEnabledFor(logging.DEBUG):
+            return
+
         # Get user information from session
         user_id = session.get('user_id', 'anonymous')
         user_role = session.get('role', 'anonymous')
@@ -4,6 +4,7 @@ Availability service for managing specialist availability
 
 from datetime import datetime, time, timedelta
 from models import db, Availability, User
+from services.slot_engine import free_slots
 from sqlalchemy import and_, or_, func
 
 class AvailabilityService:
@@ -79,6 +80,134 @@ class AvailabilityService:
         # If no date is provided, get all availability
         return Availability.query.filter_by(specialist_id=specialist_id).all()
     
+    @staticmethod
+    def get_availability_windows(specialist_ids, start_date, end_date):
+        """Get dated availability windows for several specialists and days
+        
+        Loads every matching availability rule in one query and expands the
+        recurring ones onto each date in the range.
+        
+        Args:
+            specialist_ids (list): IDs of the specialists
+            start_date (date): First date of the range
+            end_date (date): Last date of the range (inclusive)
+            
+        Returns:
+            dict: Specialist ID to a list of (start, end) datetime tuples;
+                specialists without availability are omitted
+        """
+        if not specialist_ids or start_date > end_date:
+            return {}
+        
+        rules = AvailabilityService._rules_in_range(
+            Availability.query, start_date, end_date
+        ).filter(Availability.specialist_id.in_(specialist_ids)).all()
+        return AvailabilityService._expand_windows(rules, start_date, end_date)
+    
+    @staticmethod
+    def search_available_specialists(start_date, end_date=None, specialty=None, duration_minutes=30,
+                                     buffer_minutes=0, slots_per_specialist=3, limit=10, not_before=None):
+        """Find the specialists who can see a patient soonest
+        
+        Runs two queries however many specialists match: availability rules
+        joined to their specialists, then the scheduled appointments of every
+        specialist with a rule in the range.
+        
+        Args:
+            start_date (date): First date to search
+            end_date (date): Last date to search (inclusive), defaults to start_date
+            specialty (str): Optional specialization to filter by
+            duration_minutes (int): Length of the appointment needed
+            buffer_minutes (int): Free minutes required around existing appointments
+            slots_per_specialist (int): Number of earliest slots to return per specialist
+            limit (int): Maximum number of specialists to return
+            not_before (datetime): Earliest slot start, defaults to now
+            
+        Returns:
+            list: Dicts with specialist_id, full_name, specialization,
+                first_available and slots ((start_time, end_time) tuples),
+                earliest first available first
+            
+        Raises:
+            ValueError: If the range or slot settings are invalid
+        """
+        from services.appointment_service import AppointmentService, MAX_SLOT_SEARCH_DAYS
+        
+        end_date = end_date or start_date
+        if start_date > end_date:
+            raise ValueError("Start date must not be after end date")
+        if (end_date - start_date).days >= MAX_SLOT_SEARCH_DAYS:
+            raise ValueError(f"Cannot search more than {MAX_SLOT_SEARCH_DAYS} days at once")
+        if slots_per_specialist < 1 or limit < 1:
+            raise ValueError("slots_per_specialist and limit must be positive")
+        not_before = datetime.utcnow() if not_before is None else not_before
+        
+        query = db.session.query(Availability, User).join(
+            User, User.id == Availability.specialist_id
+        ).filter(User.role == 'specialist')
+        if specialty:
+            query = query.filter(User.specialization == specialty)
+        rows = AvailabilityService._rules_in_range(query, start_date, end_date).all()
+        
+        specialists = {user.id: user for _, user in rows}
+        windows = AvailabilityService._expand_windows([rule for rule, _ in rows], start_date, end_date)
+        buffer = timedelta(minutes=buffer_minutes)
+        booked = AppointmentService.get_booked_intervals(list(windows), start_date, end_date, buffer)
+        
+        results = []
+        for specialist_id, specialist_windows in windows.items():
+            slots = free_slots(
+                specialist_windows, booked.get(specialist_id, []),
+                timedelta(minutes=duration_minutes), buffer=buffer,
+                not_before=not_before, limit=slots_per_specialist
+            )
+            if slots:
+                specialist = specialists[specialist_id]
+                results.append({
+                    'specialist_id': specialist_id,
+                    'full_name': specialist.full_name,
+                    'specialization': specialist.specialization,
+                    'first_available': slots[0][0],
+                    'slots': slots,
+                })
+        
+        results.sort(key=lambda result: (result['first_available'], result['specialist_id']))
+        return results[:limit]
+    
+    @staticmethod
+    def _rules_in_range(query, start_date, end_date):
+        """Filter an Availability query to recurring rules and dated rules in the range"""
+        return query.filter(
+            or_(
+                Availability.is_recurring == True,
+                and_(
+                    Availability.specific_date >= start_date,
+                    Availability.specific_date <= end_date
+                )
+            )
+        )
+    
+    @staticmethod
+    def _expand_windows(rules, start_date, end_date):
+        """Turn availability rules into dated (start, end) windows per specialist"""
+        days = (end_date - start_date).days + 1
+        dates_by_weekday = {}
+        for offset in range(days):
+            day = start_date + timedelta(days=offset)
+            dates_by_weekday.setdefault(day.weekday(), []).append(day)
+        
+        windows = {}
+        for rule in rules:
+            if rule.is_recurring:
+                dates = dates_by_weekday.get(rule.day_of_week, [])
+            else:
+                dates = [rule.specific_date]
+            for day in dates:
+                windows.setdefault(rule.specialist_id, []).append(
+                    (datetime.combine(day, rule.start_time), datetime.combine(day, rule.end_time))
+                )
+        return windows
+    
     @staticmethod
     def remove_availability(availability_id):
         """Remove an availability slot
@@ -0,0 +1,161 @@
+"""
+Per-campaign reward tiers and advocate conversion counters
+
+referral_codes.converted_count is kept equal to the number of CONVERTED
+referral_events on the code by triggers (see migration v010), so an
+advocate's tier is read off their code row instead of counting their event
+history. Tier bonuses live in campaign_reward_tiers: a reward is multiplied
+by the highest tier whose min_conversions the advocate has reached.
+
+Usage:
+    python -m services.campaign_tier_service --rebuild
+"""
+
+import argparse
+import sys
+
+# Tiers given to campaigns that don't configure their own; these are the
+# thresholds the reward engine used before tiers were configurable
+DEFAULT_REWARD_TIERS = ((5, 1.2), (10, 1.5))
+
+CAMPAIGN_TIERS_SQL = '''
+    SELECT campaign_id, min_conversions, multiplier
+    FROM campaign_reward_tiers
+    WHERE campaign_id IN ({placeholders})
+    ORDER BY campaign_id, min_conversions
+'''
+
+
+def normalize_tiers(tiers):
+    """Validate tiers and return them as sorted (min_conversions, multiplier) tuples
+
+    Args:
+        tiers (list): Dicts with min_conversions and multiplier, or pairs
+
+    Raises:
+        ValueError: If a tier is malformed or a threshold is repeated
+    """
+    normalized = {}
+    for tier in tiers:
+        if isinstance(tier, dict):
+            min_conversions, multiplier = tier.get('min_conversions'), tier.get('multiplier')
+        else:
+            min_conversions, multiplier = tier
+        try:
+            min_conversions, multiplier = int(min_conversions), float(multiplier)
+        except (TypeError, ValueError):
+            raise ValueError('Each tier needs an integer min_conversions and a numeric multiplier')
+        if min_conversions < 1:
+            raise ValueError('min_conversions must be at least 1')
+        if multiplier <= 0:
+            raise ValueError('multiplier must be positive')
+        if min_conversions in normalized:
+            raise ValueError(f'Duplicate tier for {min_conversions} conversions')
+        normalized[min_conversions] = multiplier
+    return sorted(normalized.items())
+
+
+def multiplier_for(tiers, converted_count):
+    """Return the multiplier of the highest tier reached, or 1.0"""
+    multiplier = 1.0
+    for min_conversions, tier_multiplier in tiers:
+        if converted_count < min_conversions:
+            break
+        multiplier = tier_multiplier
+    return multiplier
+
+
+class CampaignTierService:
+    """Service for reading and editing campaign reward tiers"""
+
+    @staticmethod
+    def get_tiers(conn, campaign_ids):
+        """Load the tiers of several campaigns
+
+        Args:
+            conn: sqlite3 connection
+            campaign_ids (iterable): referral_campaigns ids
+
+        Returns:
+            dict: campaign_id -> sorted (min_conversions, multiplier) tuples;
+                campaigns without tiers map to an empty list
+        """
+        campaign_ids = sorted(set(campaign_ids))
+        tiers = {campaign_id: [] for campaign_id in campaign_ids}
+        if not campaign_ids:
+            return tiers
+
+        placeholders = ', '.join('?' for _ in campaign_ids)
+        cursor = conn.execute(CAMPAIGN_TIERS_SQL.format(placeholders=placeholders), campaign_ids)
+        for campaign_id, min_conversions, multiplier in cursor.fetchall():
+            tiers[campaign_id].append((min_conversions, multiplier))
+        return tiers
+
+    @staticmethod
+    def set_tiers(cursor, campaign_id, tiers):
+        """Replace a campaign's tiers
+
+        Runs on the caller's transaction.
+
+        Args:
+            cursor: sqlite3 cursor
+            campaign_id (int): referral_campaigns id
+            tiers (list): Tiers accepted by normalize_tiers; empty disables bonuses
+
+        Returns:
+            list: The stored (min_conversions, multiplier) tuples
+
+        Raises:
+            ValueError: If the tiers are invalid
+        """
+        tiers = normalize_tiers(tiers)
+        cursor.execute('DELETE FROM campaign_reward_tiers WHERE campaign_id = ?', (campaign_id,))
+        cursor.executemany('''
+            INSERT INTO campaign_reward_tiers (campaign_id, min_conversions, multiplier)
+            VALUES (?, ?, ?)
+        ''', [(campaign_id, min_conversions, multiplier) for min_conversions, multiplier in tiers])
+        return tiers
+
+    @staticmethod
+    def rebuild_counts(conn):
+        """Recompute referral_codes.converted_count from referral_events
+
+        Runs on the caller's transaction and does not commit.
+
+        Returns:
+            int: Number of referral codes updated
+        """
+        cursor = conn.execute('''
+            UPDATE referral_codes SET converted_count = (
+                SELECT COUNT(*) FROM referral_events e
+                WHERE e.code_id = referral_codes.id AND e.status = 'CONVERTED'
+            )
+        ''')
+        return cursor.rowcount
+
+
+def main(argv=None):
+    from database import connection
+
+    parser = argparse.ArgumentParser(description='Rebuild referral code conversion counters')
+    parser.add_argument('--database', help='SQLite database path (defaults to DATABASE_NAME)')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute converted_count from referral_events')
+    args = parser.parse_args(argv)
+
+    if not args.rebuild:
+        parser.error('--rebuild is required')
+
+    with connection(args.database) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            codes = CampaignTierService.rebuild_counts(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f'Rebuilt conversion counters for {codes} referral code(s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Conversion funnel analytics over pre-aggregated daily buckets
+
+conversion_daily_rollups is kept current by triggers on referrals (see
+migration v005), so a funnel for any window is a sum over at most one row
+per day and case status.
+
+Usage:
+    python -m services.conversion_rollup_service --rebuild
+"""
+
+import argparse
+import sys
+
+# Windows the conversion dashboard may request, in days
+CONVERSION_WINDOWS = (7, 30, 90, 365)
+DEFAULT_CONVERSION_WINDOW = 30
+
+FUNNEL_SQL = '''
+    SELECT case_status, SUM(referral_count), SUM(estimated_value_sum), SUM(actual_value_sum)
+    FROM conversion_daily_rollups
+    WHERE day >= date('now', ?)
+    GROUP BY case_status
+    HAVING SUM(referral_count) > 0
+'''
+
+
+class ConversionRollupService:
+    """Service for reading and rebuilding the conversion funnel rollups"""
+
+    @staticmethod
+    def get_funnel(conn, days=DEFAULT_CONVERSION_WINDOW):
+        """Summarize referrals created in the last ``days`` days by case status
+
+        Args:
+            conn: sqlite3 connection
+            days (int): Window length, one of CONVERSION_WINDOWS
+
+        Returns:
+            dict: case_status -> count, avg_estimated_value, avg_actual_value
+
+        Raises:
+            ValueError: If the window is not supported
+        """
+        if days not in CONVERSION_WINDOWS:
+            raise ValueError(f'days must be one of {", ".join(map(str, CONVERSION_WINDOWS))}')
+
+        cursor = conn.cursor()
+        cursor.execute(FUNNEL_SQL, (f'-{days} days',))
+
+        funnel = {}
+        for case_status, count, estimated_sum, actual_sum in cursor.fetchall():
+            funnel[case_status] = {
+                'count': count,
+                'avg_estimated_value': round((estimated_sum or 0) / count, 2),
+                'avg_actual_value': round((actual_sum or 0) / count, 2)
+            }
+        return funnel
+
+    @staticmethod
+    def rebuild(conn):
+        """Recompute every bucket from referrals
+
+        Runs on the caller's transaction and does not commit.
+
+        Args:
+            conn: sqlite3 connection or cursor
+
+        Returns:
+            int: Number of buckets written
+        """
+        conn.execute('DELETE FROM conversion_daily_rollups')
+        cursor = conn.execute('''
+            INSERT INTO conversion_daily_rollups
+                (day, case_status, referral_count, estimated_value_sum, actual_value_sum)
+            SELECT date(created_at), COALESCE(case_status, 'pending'), COUNT(*),
+                   SUM(COALESCE(estimated_value, 0)), SUM(COALESCE(actual_value, 0))
+            FROM referrals
+            WHERE created_at IS NOT NULL
+            GROUP BY date(created_at), COALESCE(case_status, 'pending')
+        ''')
+        return cursor.rowcount
+
+
+def main(argv=None):
+    from database import connection
+
+    parser = argparse.ArgumentParser(description='Rebuild the conversion funnel rollups')
+    parser.add_argument('--database', help='SQLite database path (defaults to DATABASE_NAME)')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute rollups from referrals')
+    args = parser.parse_args(argv)
+
+    if not args.rebuild:
+        parser.error('--rebuild is required')
+
+    with connection(args.database) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            buckets = ConversionRollupService.rebuild(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f'Rebuilt {buckets} conversion bucket(s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""
+Transactional email outbox and its delivery worker
+
+EmailOutbox.enqueue adds a message to email_outbox (migration v016) on the
+caller's transaction, through a sqlite3 cursor or the SQLAlchemy session,
+so mail goes out only if the change it announces commits and the request
+that made the change never talks to an SMTP server.
+
+cron_jobs/email_worker.py leases ready messages in batches like the reward
+worker does, groups each batch by recipient domain and sends every group
+over one persistent connection from a MailerPool (MAIL_* settings). A
+message that cannot be built (say, a newline in its subject) or that the
+server refuses permanently (5xx) is marked dead at once; other
+failures retry with exponential backoff until MAIL_OUTBOX_MAX_ATTEMPTS, and
+the rest of that domain's group is put back without spending an attempt.
+Messages tied to an appointment notification set its delivery_status to
+DELIVERED or FAILED when they settle.
+
+A message whose worker dies after the server accepted it but before the
+row was updated is sent again when its lease expires.
+"""
+
+import logging
+import smtplib
+import sqlite3
+import time
+from collections import OrderedDict
+
+from config.app_config import get_config
+from models import DeliveryStatus
+from services.mailer import SMTPMailer, build_message
+from services.reward_queue import backoff_delay, default_worker_id
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+DEAD = 'dead'
+
+_COLUMNS = ('id', 'recipient', 'domain', 'sender', 'subject', 'body', 'notification_id', 'attempts')
+
+
+def recipient_domain(address):
+    """Lower-cased domain part of an email address"""
+    return address.rsplit('@', 1)[-1].strip().lower()
+
+
+def is_permanent_failure(error):
+    """Whether retrying a message that failed with error cannot succeed"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def outbox_backoff(attempts):
+    """Seconds before retry number attempts of a message"""
+    config = get_config()
+    return backoff_delay(attempts, config.MAIL_OUTBOX_BACKOFF_SECONDS, config.MAIL_OUTBOX_MAX_BACKOFF_SECONDS)
+
+
+class MailerPool:
+    """Persistent SMTP connections keyed by recipient domain
+
+    Keeps at most size mailers open, closing the least recently used one
+    when another domain needs a connection.
+    """
+
+    def __init__(self, size=None, factory=SMTPMailer):
+        self.size = size or get_config().MAIL_POOL_SIZE
+        self.factory = factory
+        self._mailers = OrderedDict()
+
+    def get(self, domain):
+        """The mailer for a domain, opening one if needed"""
+        mailer = self._mailers.pop(domain, None)
+        if mailer is None:
+            while len(self._mailers) >= self.size:
+                _, evicted = self._mailers.popitem(last=False)
+                evicted.close()
+            mailer = self.factory()
+        self._mailers[domain] = mailer
+        return mailer
+
+    def close(self):
+        """Close every open connection"""
+        while self._mailers:
+            _, mailer = self._mailers.popitem()
+            mailer.close()
+
+
+class EmailOutbox:
+    """Service for queueing email and delivering it from the outbox"""
+
+    @staticmethod
+    def enqueue(cursor, to, subject, body, sender=None, notification_id=None, now=None):
+        """Queue an email to be sent once the caller's transaction commits
+
+        Runs on the caller's transaction and does not commit.
+
+        Args:
+            cursor: sqlite3 cursor or connection, or the SQLAlchemy session
+            to (str): Recipient address
+            subject (str): Subject line
+            body (str): Plain-text body
+            sender (str, optional): From address, defaults to MAIL_DEFAULT_SENDER
+            notification_id (int, optional): appointment_notifications row to
+                mark DELIVERED or FAILED when the message settles
+            now (float, optional): Current epoch time
+        """
+        EmailOutbox.enqueue_many(cursor, [{
+            'to': to, 'subject': subject, 'body': body, 'sender': sender, 'notification_id': notification_id,
+        }], now=now)
+
+    @staticmethod
+    def enqueue_many(cursor, messages, now=None):
+        """Queue several emails with one executemany INSERT
+
+        Args:
+            cursor: sqlite3 cursor or connection, or the SQLAlchemy session
+            messages (list): Dicts with to, subject and body, and optionally
+                sender and notification_id, as taken by enqueue
+            now (float, optional): Current epoch time
+        """
+        if not messages:
+            return
+        now = time.time() if now is None else now
+        statement = '''
+            INSERT INTO email_outbox
+                (recipient, domain, sender, subject, body, notification_id, status, run_after, created_at)
+            VALUES (:recipient, :domain, :sender, :subject, :body, :notification_id, :status, :now, :now)
+        '''
+        params = [{
+            'recipient': message['to'], 'domain': recipient_domain(message['to']),
+            'sender': message.get('sender'), 'subject': message['subject'], 'body': message['body'],
+            'notification_id': message.get('notification_id'), 'status': QUEUED, 'now': now,
+        } for message in messages]
+        if isinstance(cursor, (sqlite3.Connection, sqlite3.Cursor)):
+            cursor.executemany(statement, params)
+        else:
+            from sqlalchemy import text
+            cursor.execute(text(statement), params)
+
+    @staticmethod
+    def claim(conn, worker_id=None, batch_size=None, lease_seconds=None, now=None):
+        """Lease a batch of ready messages to a worker
+
+        Ready messages are queued ones whose run_after has passed and sending
+        ones whose lease has expired, oldest first.
+
+        Args:
+            conn: sqlite3 connection (committed on return)
+            worker_id (str, optional): Lease owner (defaults to host:pid)
+            batch_size (int, optional): Maximum messages to claim
+            lease_seconds (float, optional): How long the lease lasts
+            now (float, optional): Current epoch time
+
+        Returns:
+            list: Message dicts with id, recipient, domain, sender, subject,
+                body, notification_id and attempts (including this one)
+        """
+        config = get_config()
+        worker_id = worker_id or default_worker_id()
+        batch_size = batch_size or config.MAIL_OUTBOX_BATCH_SIZE
+        lease_seconds = config.MAIL_OUTBOX_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        now = time.time() if now is None else now
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('''
+                SELECT id, recipient, domain, sender, subject, body, notification_id, attempts + 1 FROM (
+                    SELECT *, run_after AS ready_at FROM email_outbox
+                    WHERE status = ? AND run_after <= ?
+                    UNION ALL
+                    SELECT *, locked_until AS ready_at FROM email_outbox
+                    WHERE status = ? AND locked_until <= ?
+                )
+                ORDER BY ready_at, id
+                LIMIT ?
+            ''', (QUEUED, now, SENDING, now, batch_size)).fetchall()
+
+            conn.executemany('''
+                UPDATE email_outbox
+                SET status = ?, attempts = ?, locked_by = ?, locked_until = ?
+                WHERE id = ?
+            ''', [(SENDING, row[-1], worker_id, now + lease_seconds, row[0]) for row in rows])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    @staticmethod
+    def run_batch(conn, pool, worker_id=None, batch_size=None, now=None):
+        """Claim one batch and deliver it, one connection per recipient domain
+
+        Args:
+            conn: sqlite3 connection
+            pool (MailerPool): Connections to send through
+            worker_id (str, optional): Lease owner (defaults to host:pid)
+            batch_size (int, optional): Maximum messages to claim
+            now (float, optional): Current epoch time
+
+        Returns:
+            dict: Counts of claimed, sent, retried, deferred and dead messages
+        """
+        now = time.time() if now is None else now
+        messages = EmailOutbox.claim(conn, worker_id=worker_id, batch_size=batch_size, now=now)
+        result = {'claimed': len(messages), 'sent': 0, 'retried': 0, 'deferred': 0, 'dead': 0}
+
+        by_domain = OrderedDict()
+        for message in messages:
+            by_domain.setdefault(message['domain'], []).append(message)
+
+        sent, retries, dead, deferred = [], [], [], []
+        max_attempts = get_config().MAIL_OUTBOX_MAX_ATTEMPTS
+        for domain, group in by_domain.items():
+            mailer = pool.get(domain)
+            for position, message in enumerate(group):
+                try:
+                    email = build_message(message['recipient'], message['subject'],
+                                          message['body'], message['sender'])
+                except Exception as e:
+                    # A malformed message (e.g. a newline in a header) can never be sent
+                    error = f'{type(e).__name__}: {e}'[:1000]
+                    logger.error(f"Email {message['id']} to {message['recipient']} is malformed: {error}")
+                    dead.append((message, error))
+                    continue
+
+                try:
+                    mailer.send(email)
+                except Exception as e:
+                    error = f'{type(e).__name__}: {e}'[:1000]
+                    logger.warning(f"Email {message['id']} to {message['recipient']} failed "
+                                   f"(attempt {message['attempts']}): {error}")
+                    if not isinstance(e, (smtplib.SMTPException, OSError)):
+                        # Unexpected error: the connection state is unknown, so start over on a new one
+                        mailer.close()
+                    if is_permanent_failure(e) or message['attempts'] >= max_attempts:
+                        dead.append((message, error))
+                    else:
+                        retries.append((message, error))
+                    if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                        # The server or connection is failing; try the rest of this domain later
+                        deferred.extend(group[position + 1:])
+                        break
+                else:
+                    sent.append(message)
+
+        EmailOutbox._settle(conn, sent, retries, dead, deferred, now)
+        result.update(sent=len(sent), retried=len(retries), deferred=len(deferred), dead=len(dead))
+        return result
+
+    @staticmethod
+    def _settle(conn, sent, retries, dead, deferred, now):
+        """Record a batch's outcomes and notification delivery statuses in one transaction"""
+        try:
+            conn.executemany('''
+                UPDATE email_outbox
+                SET status = ?, sent_at = ?, locked_by = NULL, locked_until = NULL, last_error = NULL
+                WHERE id = ?
+            ''', [(SENT, now, message['id']) for message in sent])
+            conn.executemany('''
+                UPDATE email_outbox
+                SET status = ?, run_after = ?, last_error = ?, locked_by = NULL, locked_until = NULL
+                WHERE id = ?
+            ''', [(QUEUED, now + outbox_backoff(message['attempts']), error, message['id'])
+                  for message, error in retries])
+            conn.executemany('''
+                UPDATE email_outbox
+                SET status = ?, last_error = ?, locked_by = NULL, locked_until = NULL
+                WHERE id = ?
+            ''', [(DEAD, error, message['id']) for message, error in dead])
+            # Deferred messages were never tried, so they get their attempt back
+            conn.executemany('''
+                UPDATE email_outbox
+                SET status = ?, attempts = attempts - 1, run_after = ?, locked_by = NULL, locked_until = NULL
+                WHERE id = ?
+            ''', [(QUEUED, now + outbox_backoff(1), message['id']) for message in deferred])
+
+            for status, settled in ((DeliveryStatus.DELIVERED, sent),
+                                    (DeliveryStatus.FAILED, [message for message, _ in dead])):
+                notification_ids = [m['notification_id'] for m in settled if m['notification_id']]
+                if notification_ids:
+                    # SQLAlchemy stores enum members by name
+                    conn.executemany(
+                        'UPDATE appointment_notifications SET delivery_status = ? WHERE id = ?',
+                        [(status.name, notification_id) for notification_id in notification_ids]
+                    )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    @staticmethod
+    def stats(conn, now=None):
+        """Report outbox depth and lag
+
+        Returns:
+            dict: Message counts by status, ready (sendable now), and
+                lag_seconds, the age of the oldest message waiting to send
+        """
+        now = time.time() if now is None else now
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status').fetchall())
+        ready, oldest = conn.execute('''
+            SELECT COUNT(*), MIN(created_at) FROM email_outbox
+            WHERE status = ? AND run_after <= ?
+        ''', (QUEUED, now)).fetchone()
+        return {
+            'queued': counts.get(QUEUED, 0),
+            'sending': counts.get(SENDING, 0),
+            'sent': counts.get(SENT, 0),
+            'dead': counts.get(DEAD, 0),
+            'ready': ready,
+            'lag_seconds': round(now - oldest, 3) if oldest is not None else 0.0,
+        }
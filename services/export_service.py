@@ -0,0 +1,176 @@
+"""
+Streaming export service for large tables
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Response
+from database import connection
+
+# Rows pulled from the cursor per fetchmany() call
+EXPORT_BATCH_SIZE = 1000
+
+# Target size of each chunk handed to the WSGI server
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+def _json_default(value):
+    """Serialize values sqlite3 may hand back that json cannot"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+class ExportService:
+    """Service for streaming query results as NDJSON or CSV in constant memory"""
+
+    @staticmethod
+    def iter_batches(conn, sql, params=(), batch_size=EXPORT_BATCH_SIZE):
+        """Run a query and yield its rows in fetchmany() batches
+
+        SQLite cursors step the statement lazily, so only one batch is held
+        in memory at a time regardless of the result size.
+
+        Args:
+            conn: sqlite3 connection to run the query on
+            sql (str): SELECT statement
+            params (sequence, optional): Query parameters
+            batch_size (int, optional): Rows per batch
+
+        Returns:
+            tuple: (column names, generator of row batches)
+        """
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        columns = [description[0] for description in cursor.description]
+
+        def batches():
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cursor.close()
+
+        return columns, batches()
+
+    @staticmethod
+    def encode_ndjson(columns, batches):
+        """Encode row batches as newline-delimited JSON, one string per batch"""
+        for rows in batches:
+            yield ''.join(
+                json.dumps(dict(zip(columns, row)), default=_json_default, separators=(',', ':')) + '\n'
+                for row in rows
+            )
+
+    @staticmethod
+    def encode_csv(columns, batches):
+        """Encode row batches as CSV with a header row, one string per batch"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue()
+
+        for rows in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+
+    @staticmethod
+    def gzip_chunks(chunks):
+        """Compress a stream of text chunks into gzip bytes on the fly"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+
+    @staticmethod
+    def coalesce_chunks(chunks, size=EXPORT_CHUNK_BYTES):
+        """Group small encoded chunks so each write to the socket is reasonably sized"""
+        pending = []
+        pending_size = 0
+        for chunk in chunks:
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= size:
+                yield ''.join(pending)
+                pending = []
+                pending_size = 0
+        if pending:
+            yield ''.join(pending)
+
+    @staticmethod
+    def stream(sql, params=(), export_format='ndjson', filename='export', compress=False,
+               database=None, batch_size=EXPORT_BATCH_SIZE):
+        """Build a streaming Flask response for a query
+
+        The query runs on a dedicated pooled connection that is held only
+        while the response body is being generated and is returned to the
+        pool when the client finishes or disconnects.
+
+        Args:
+            sql (str): SELECT statement to export
+            params (sequence, optional): Query parameters
+            export_format (str, optional): 'ndjson' or 'csv'
+            filename (str, optional): Download name without extension
+            compress (bool, optional): Gzip the body on the fly
+            database (str, optional): Database path (defaults to DATABASE_NAME)
+            batch_size (int, optional): Rows per fetchmany() call
+
+        Returns:
+            Response: Streaming response
+
+        Raises:
+            ValueError: If the export format is not supported
+        """
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {export_format}")
+
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        encoder = ExportService.encode_ndjson if export_format == 'ndjson' else ExportService.encode_csv
+
+        def generate():
+            with connection(database) as conn:
+                columns, batches = ExportService.iter_batches(conn, sql, params, batch_size)
+                chunks = ExportService.coalesce_chunks(encoder(columns, batches))
+                if compress:
+                    yield from ExportService.gzip_chunks(chunks)
+                else:
+                    for chunk in chunks:
+                        yield chunk.encode('utf-8')
+
+        headers = {
+            'Content-Disposition': f'attachment; filename="{filename}.{extension}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no',
+            'Vary': 'Accept-Encoding',
+        }
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+
+        return Response(generate(), mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+    @staticmethod
+    def wants_gzip(request):
+        """Check whether the client accepts a gzip-encoded body"""
+        if request.args.get('gzip', '').lower() in ('0', 'false', 'no'):
+            return False
+        return 'gzip' in request.headers.get('Accept-Encoding', '').lower()
@@ -0,0 +1,406 @@
+"""
+Offline batch re-scoring of referral events
+
+FraudDetector.check_referral scores an event once, when it is recorded,
+against the campaign's fraud_threshold at that moment. This job re-scores
+history: it loads referral_events into NumPy columns, computes trailing
+window velocity counts per IP, code and advocate for every event at once,
+applies the check_referral weights plus an advocate velocity signal, and
+compares each score with the campaign's current threshold. Results are
+upserted into fraud_scores (one row per event) and, optionally, codes with
+a flagged event are marked FLAGGED.
+
+A window count for an event is the number of events with the same key in
+[created_at - window, created_at], the event included. Keys are factorized
+to integers and combined with the timestamp into one sortable int64, so each
+window is a sort and two searchsorted calls.
+
+Usage:
+    python -m services.fraud_rescore_service
+    python -m services.fraud_rescore_service --since 2024-06-01 --flag-codes
+    python -m services.fraud_rescore_service --benchmark 1000000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from config.app_config import get_config
+from services.fraud_signal_service import ua_fingerprint
+
+# signal -> trailing window in seconds
+VELOCITY_WINDOWS = {'ip': 86400, 'code': 3600, 'advocate': 86400}
+
+# Limits and weights mirror FraudDetector.check_referral
+IP_DAILY_LIMIT, IP_WEIGHT = 3, 2
+CODE_HOURLY_LIMIT, CODE_WEIGHT = 5, 3
+SELF_REFERRAL_WEIGHT = 5
+ADVOCATE_WEIGHT = 2
+DEFAULT_FRAUD_THRESHOLD = 3
+
+FETCH_SIZE = 50000
+
+
+def factorize(values):
+    """Map values to dense integer keys in order of first appearance
+
+    Returns:
+        tuple: (int64 array of keys with -1 for None, list of distinct values)
+    """
+    seen = {}
+    keys = np.fromiter(
+        (-1 if value is None else seen.setdefault(value, len(seen)) for value in values),
+        dtype=np.int64, count=len(values)
+    )
+    return keys, list(seen)
+
+
+def _int_column(values):
+    """Integer column with -1 for NULL"""
+    column = np.array(values, dtype=np.float64)
+    return np.where(np.isnan(column), -1, column).astype(np.int64)
+
+
+def window_counts(keys, times, window):
+    """Count, for each event, events sharing its key in the trailing window
+
+    Args:
+        keys (ndarray): int64 keys, negative for events without a value
+        times (ndarray): int64 epoch seconds
+        window (int): Window length in seconds
+
+    Returns:
+        ndarray: int64 counts, 0 where the key is negative
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    times = np.asarray(times, dtype=np.int64)
+    counts = np.zeros(len(keys), dtype=np.int64)
+    valid = keys >= 0
+    if not valid.any():
+        return counts
+
+    offsets = times[valid] - times[valid].min()
+    # Spacing keys span + window apart keeps every window inside its own key
+    span = int(offsets.max()) + window + 1
+    composite = keys[valid] * span + offsets
+    # Searching with sorted needles walks the array once instead of at random
+    order = np.argsort(composite, kind='stable')
+    ordered = composite[order]
+    sorted_counts = (np.searchsorted(ordered, ordered, side='right')
+                     - np.searchsorted(ordered, ordered - window, side='left'))
+    valid_counts = np.empty(len(ordered), dtype=np.int64)
+    valid_counts[order] = sorted_counts
+    counts[valid] = valid_counts
+    return counts
+
+
+def load_event_columns(conn, since=None):
+    """Load referral events as columns
+
+    With ``since``, events from the preceding longest window are loaded too
+    so their velocity counts are complete; ``in_scope`` marks the events at
+    or after ``since``.
+
+    Returns:
+        dict: NumPy columns id, code_id, advocate_id, patient_id, ip_key,
+            ua_key, created_at, threshold and in_scope, plus the distinct
+            ips and user_agents the keys index
+    """
+    params = [DEFAULT_FRAUD_THRESHOLD]
+    where = ''
+    since_epoch = None
+    if since:
+        since_epoch = conn.execute("SELECT CAST(strftime('%s', ?) AS INTEGER)", (since,)).fetchone()[0]
+        if since_epoch is None:
+            raise ValueError(f'Invalid since date: {since}')
+        where = "WHERE e.created_at >= datetime(?, 'unixepoch')"
+        params.append(since_epoch - max(VELOCITY_WINDOWS.values()))
+
+    cursor = conn.execute(f'''
+        SELECT e.id, e.code_id, c.advocate_id, e.referred_patient_id, e.ip_addr, e.user_agent,
+               COALESCE(CAST(strftime('%s', e.created_at) AS INTEGER), 0),
+               COALESCE(camp.fraud_threshold, ?)
+        FROM referral_events e
+        LEFT JOIN referral_codes c ON c.id = e.code_id
+        LEFT JOIN referral_campaigns camp ON camp.id = c.campaign_id
+        {where}
+        ORDER BY e.id
+    ''', params)
+
+    raw = [[] for _ in range(8)]
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for column, values in zip(raw, zip(*rows)):
+            column.extend(values)
+
+    event_ids, code_ids, advocate_ids, patient_ids, ips, user_agents, created_at, thresholds = raw
+    ip_keys, distinct_ips = factorize(ips)
+    ua_keys, distinct_user_agents = factorize(user_agents)
+    created_at = np.array(created_at, dtype=np.int64)
+    return {
+        'id': np.array(event_ids, dtype=np.int64),
+        'code_id': _int_column(code_ids),
+        'advocate_id': _int_column(advocate_ids),
+        'patient_id': _int_column(patient_ids),
+        'ip_key': ip_keys,
+        'ua_key': ua_keys,
+        'created_at': created_at,
+        'threshold': np.array(thresholds, dtype=np.float64),
+        'in_scope': created_at >= since_epoch if since_epoch is not None else np.ones(len(created_at), dtype=bool),
+        'ips': distinct_ips,
+        'user_agents': distinct_user_agents,
+    }
+
+
+def score_events(columns, advocate_threshold=None):
+    """Compute velocity features and scores for loaded events
+
+    Returns:
+        dict: NumPy columns ip_count, code_count, advocate_count,
+            self_referral, score and flagged
+    """
+    if advocate_threshold is None:
+        advocate_threshold = get_config().FRAUD_ADVOCATE_DAILY_THRESHOLD
+    times = columns['created_at']
+
+    ip_count = window_counts(columns['ip_key'], times, VELOCITY_WINDOWS['ip'])
+    code_count = window_counts(columns['code_id'], times, VELOCITY_WINDOWS['code'])
+    advocate_count = window_counts(columns['advocate_id'], times, VELOCITY_WINDOWS['advocate'])
+    self_referral = (columns['advocate_id'] >= 0) & (columns['advocate_id'] == columns['patient_id'])
+
+    score = (IP_WEIGHT * (ip_count > IP_DAILY_LIMIT)
+             + CODE_WEIGHT * (code_count > CODE_HOURLY_LIMIT)
+             + ADVOCATE_WEIGHT * (advocate_count > advocate_threshold)
+             + SELF_REFERRAL_WEIGHT * self_referral)
+    return {
+        'ip_count': ip_count,
+        'code_count': code_count,
+        'advocate_count': advocate_count,
+        'self_referral': self_referral,
+        'score': score,
+        'flagged': score >= columns['threshold'],
+    }
+
+
+def _reasons(result, index, advocate_threshold):
+    reasons = []
+    if result['ip_count'][index] > IP_DAILY_LIMIT:
+        reasons.append(f"Multiple sign-ups ({result['ip_count'][index]}) from same IP")
+    if result['code_count'][index] > CODE_HOURLY_LIMIT:
+        reasons.append(f"Rapid-fire referrals ({result['code_count'][index]} in last hour)")
+    if result['advocate_count'][index] > advocate_threshold:
+        reasons.append(f"Advocate velocity ({result['advocate_count'][index]} in last day)")
+    if result['self_referral'][index]:
+        reasons.append("Advocate referring themselves")
+    return json.dumps(reasons)
+
+
+class FraudRescoreService:
+    """Service for re-scoring referral events in bulk"""
+
+    @staticmethod
+    def write_scores(conn, columns, result, advocate_threshold=None):
+        """Upsert a fraud_scores row for every in-scope event
+
+        Runs on the caller's transaction and does not commit.
+
+        Returns:
+            int: Number of rows written
+        """
+        if advocate_threshold is None:
+            advocate_threshold = get_config().FRAUD_ADVOCATE_DAILY_THRESHOLD
+        indexes = np.flatnonzero(columns['in_scope'])
+        fingerprints = [ua_fingerprint(user_agent) for user_agent in columns['user_agents']]
+
+        def nullable(value):
+            return None if value < 0 else value
+
+        def rows():
+            for i in indexes.tolist():
+                score = int(result['score'][i])
+                ip_key, ua_key = int(columns['ip_key'][i]), int(columns['ua_key'][i])
+                # user_id is the signing-up patient the IP and fingerprint
+                # belong to; the advocate is reachable through code_id
+                yield (
+                    int(columns['id'][i]),
+                    nullable(int(columns['code_id'][i])),
+                    nullable(int(columns['patient_id'][i])),
+                    columns['ips'][ip_key] if ip_key >= 0 else None,
+                    fingerprints[ua_key] if ua_key >= 0 else None,
+                    score,
+                    'high' if result['flagged'][i] else ('medium' if score else 'low'),
+                    _reasons(result, i, advocate_threshold) if score else None,
+                )
+
+        conn.executemany('''
+            INSERT INTO fraud_scores
+                (event_id, code_id, user_id, ip_address, device_fingerprint,
+                 fraud_score, risk_level, reasons)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (event_id) WHERE event_id IS NOT NULL DO UPDATE SET
+                code_id = excluded.code_id,
+                user_id = excluded.user_id,
+                ip_address = excluded.ip_address,
+                device_fingerprint = excluded.device_fingerprint,
+                fraud_score = excluded.fraud_score,
+                risk_level = excluded.risk_level,
+                reasons = excluded.reasons,
+                updated_at = CURRENT_TIMESTAMP
+        ''', rows())
+        return len(indexes)
+
+    @staticmethod
+    def flag_codes(conn, columns, result):
+        """Mark codes with a flagged in-scope event as FLAGGED
+
+        Runs on the caller's transaction and does not commit.
+
+        Returns:
+            int: Number of codes newly flagged
+        """
+        flagged = columns['in_scope'] & result['flagged'] & (columns['code_id'] >= 0)
+        code_ids = np.unique(columns['code_id'][flagged]).tolist()
+        before = conn.total_changes
+        conn.executemany('''
+            UPDATE referral_codes SET reward_status = 'FLAGGED'
+            WHERE id = ? AND reward_status IS NOT 'FLAGGED'
+        ''', [(code_id,) for code_id in code_ids])
+        return conn.total_changes - before
+
+    @staticmethod
+    def rescore(conn, since=None, flag_codes=False, advocate_threshold=None):
+        """Re-score referral events against current campaign thresholds
+
+        Runs on the caller's transaction and does not commit.
+
+        Args:
+            conn: sqlite3 connection
+            since (str, optional): Only write scores for events at or after this date
+            flag_codes (bool, optional): Also flag codes with a flagged event
+            advocate_threshold (int, optional): Advocate events per day before it scores
+
+        Returns:
+            dict: events, flagged_events, flagged_codes and per-stage seconds
+        """
+        timings = {}
+        started = time.perf_counter()
+        columns = load_event_columns(conn, since)
+        timings['load'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result = score_events(columns, advocate_threshold)
+        timings['score'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        written = FraudRescoreService.write_scores(conn, columns, result, advocate_threshold)
+        flagged_codes = FraudRescoreService.flag_codes(conn, columns, result) if flag_codes else 0
+        timings['write'] = time.perf_counter() - started
+
+        return {
+            'events': written,
+            'flagged_events': int((result['flagged'] & columns['in_scope']).sum()),
+            'flagged_codes': flagged_codes,
+            'seconds': {stage: round(seconds, 3) for stage, seconds in timings.items()},
+        }
+
+
+def generate_events(conn, events, seed=0, days=90):
+    """Fill a migrated database with a synthetic referral history
+
+    Roughly one code per 50 events, one IP per 20 events and a small pool
+    of user agents, spread over ``days`` days; a few percent of events are
+    self-referrals.
+    """
+    rng = np.random.default_rng(seed)
+    codes = max(1, events // 50)
+    campaigns = 10
+    end = int(time.time())
+
+    conn.executemany('''
+        INSERT INTO referral_campaigns
+            (id, name, start_date, end_date, advocate_role, reward_type, reward_value,
+             reward_trigger, fraud_threshold)
+        VALUES (?, ?, '2020-01-01', '2100-01-01', 'patient', 'CREDIT', 10, 'CONVERTED', ?)
+    ''', [(i, f'Campaign {i}', 3 + i % 3) for i in range(1, campaigns + 1)])
+    conn.executemany('''
+        INSERT INTO referral_codes (id, campaign_id, advocate_id, code, link_slug)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(i, 1 + i % campaigns, 1 + i // 2, f'CODE{i}', f'slug{i}') for i in range(1, codes + 1)])
+
+    code_ids = rng.integers(1, codes + 1, events)
+    patients = np.where(rng.random(events) < 0.02, 1 + code_ids // 2, rng.integers(100000, 10000000, events))
+    ips = rng.integers(0, max(1, events // 20), events)
+    agents = rng.integers(0, 50, events)
+    created = np.sort(rng.integers(end - days * 86400, end, events))
+    conn.executemany('''
+        INSERT INTO referral_events (code_id, referred_patient_id, status, ip_addr, user_agent, created_at)
+        VALUES (?, ?, 'SIGNED_UP', ?, ?, datetime(?, 'unixepoch'))
+    ''', ((int(code), int(patient), f'10.{ip >> 16 & 255}.{ip >> 8 & 255}.{ip & 255}',
+           f'Mozilla/5.0 Agent/{agent}', int(at))
+          for code, patient, ip, agent, at in zip(code_ids, patients, ips, agents, created)))
+
+
+def benchmark(events, seed=0):
+    """Time a full re-score of a generated dataset in a temporary database"""
+    import sqlite3
+    from migrations import run_migrations
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        run_migrations(conn)
+        started = time.perf_counter()
+        generate_events(conn, events, seed)
+        conn.commit()
+        generated = time.perf_counter() - started
+
+        summary = FraudRescoreService.rescore(conn, flag_codes=True)
+        conn.commit()
+        conn.close()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    summary['seconds']['generate'] = round(generated, 3)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-score referral events against current fraud thresholds')
+    parser.add_argument('--database', help='SQLite database path (defaults to DATABASE_NAME)')
+    parser.add_argument('--since', help='Only re-score events created on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--flag-codes', action='store_true', help='Flag codes that have a flagged event')
+    parser.add_argument('--benchmark', type=int, metavar='EVENTS',
+                        help='Re-score a generated dataset of this many events and report timings')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for --benchmark')
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.benchmark, args.seed), indent=2))
+        return 0
+
+    from database import connection
+
+    with connection(args.database) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            summary = FraudRescoreService.rescore(conn, since=args.since, flag_codes=args.flag_codes)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Sliding-window fraud signals for referral events
+
+FraudDetector.check_referral used to COUNT(*) referral_events by IP and by
+code over a time window for every event. FraudSignalEngine instead counts
+events into fixed-width time buckets per signal key:
+
+- ip: the client address, over a day in hourly buckets
+- code: the referral code, over an hour in 5 minute buckets
+- ua: a user-agent fingerprint (version numbers folded), over an hour
+- subnet: the client's /24 (IPv4) or /64 (IPv6), over a day
+
+fraud_signal_buckets (migration v012) is the copy shared by every worker
+process; record() upserts one row per signal on the caller's transaction.
+Each process keeps ring counters for the keys it has seen recently and
+re-reads a key's buckets once its copy is older than
+FRAUD_COUNTER_SYNC_SECONDS, so scoring a hot key is a few dictionary reads.
+Windows are approximate: a window covers its current, partly elapsed
+bucket plus the full buckets before it.
+
+Usage:
+    python -m services.fraud_signal_service --prune
+    python -m services.fraud_signal_service --rebuild
+"""
+
+import argparse
+import hashlib
+import ipaddress
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from config.app_config import get_config
+
+# signal -> (window seconds, bucket seconds)
+SIGNAL_WINDOWS = {
+    'ip': (86400, 3600),
+    'code': (3600, 300),
+    'ua': (3600, 300),
+    'subnet': (86400, 3600),
+}
+
+# One signal key's live buckets; a sync reads several keys as a UNION ALL
+BUCKETS_SQL = '''
+    SELECT signal, key, bucket, count FROM fraud_signal_buckets
+    WHERE signal = ? AND key = ? AND bucket >= ?
+'''
+
+_VERSION_NUMBERS = re.compile(r'\d+')
+
+
+def ua_fingerprint(user_agent):
+    """Hash a user agent with its version numbers folded, or None if empty"""
+    normalized = _VERSION_NUMBERS.sub('0', (user_agent or '').strip().lower())
+    if not normalized:
+        return None
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def subnet_of(ip_addr):
+    """Return the /24 (IPv4) or /64 (IPv6) network of an address, or None"""
+    try:
+        address = ipaddress.ip_address((ip_addr or '').strip())
+    except ValueError:
+        return None
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
+
+
+def signal_keys(code_id, ip_addr, user_agent):
+    """Map each signal to its key for an event, skipping missing values"""
+    keys = {
+        'ip': ip_addr or None,
+        'code': str(code_id) if code_id is not None else None,
+        'ua': ua_fingerprint(user_agent),
+        'subnet': subnet_of(ip_addr),
+    }
+    return {signal: key for signal, key in keys.items() if key is not None}
+
+
+class RingCounter:
+    """Per-key event counts over the last ``slots`` time buckets
+
+    Each key owns a ring of (bucket, count) slots indexed by bucket number
+    modulo the ring size; a slot holding an older bucket is reset on write
+    and ignored on read. The least recently loaded keys are evicted past
+    max_keys.
+    """
+
+    def __init__(self, window_seconds, bucket_seconds, max_keys=50000):
+        self.bucket_seconds = bucket_seconds
+        self.slots = max(1, int(window_seconds // bucket_seconds))
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # key -> [synced_at, buckets, counts]
+
+    def bucket(self, now):
+        """Bucket number containing an epoch time"""
+        return int(now // self.bucket_seconds)
+
+    def oldest_bucket(self, now):
+        """First bucket inside the window ending at now"""
+        return self.bucket(now) - self.slots + 1
+
+    def is_fresh(self, key, now, max_age):
+        entry = self._entries.get(key)
+        return entry is not None and now - entry[0] < max_age
+
+    def load(self, key, bucket_counts, now):
+        """Replace a key's ring with counts read from the shared table"""
+        buckets, counts = [None] * self.slots, [0] * self.slots
+        oldest = self.oldest_bucket(now)
+        for bucket, count in bucket_counts:
+            if bucket >= oldest:
+                slot = bucket % self.slots
+                buckets[slot], counts[slot] = bucket, count
+        self._entries[key] = [now, buckets, counts]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def add(self, key, now, amount=1):
+        """Count an event for a key that is already loaded"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        bucket = self.bucket(now)
+        slot = bucket % self.slots
+        if entry[1][slot] != bucket:
+            entry[1][slot], entry[2][slot] = bucket, 0
+        entry[2][slot] += amount
+
+    def count(self, key, now):
+        """Events for a key inside the window ending at now"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0
+        oldest = self.oldest_bucket(now)
+        return sum(count for bucket, count in zip(entry[1], entry[2])
+                   if bucket is not None and bucket >= oldest)
+
+
+class FraudSignalEngine:
+    """Per-process sliding-window counters backed by fraud_signal_buckets"""
+
+    def __init__(self, sync_seconds=None, max_keys=None):
+        config = get_config()
+        self.sync_seconds = config.FRAUD_COUNTER_SYNC_SECONDS if sync_seconds is None else sync_seconds
+        max_keys = max_keys or config.FRAUD_COUNTER_MAX_KEYS
+        self.counters = {
+            signal: RingCounter(window, bucket, max_keys)
+            for signal, (window, bucket) in SIGNAL_WINDOWS.items()
+        }
+        self._lock = threading.Lock()
+
+    def record(self, cursor, code_id, ip_addr, user_agent, now=None):
+        """Count a referral event against each of its signals
+
+        Runs on the caller's transaction. The local counters are not
+        touched; pass the return value to apply() once the transaction has
+        committed, so a rolled-back event is never counted in memory.
+
+        Args:
+            cursor: sqlite3 cursor or connection
+            code_id (int): referral_codes id
+            ip_addr (str): Client address
+            user_agent (str): Client User-Agent header
+            now (float, optional): Event epoch time
+
+        Returns:
+            tuple: (keys, now) for apply()
+        """
+        now = time.time() if now is None else now
+        keys = signal_keys(code_id, ip_addr, user_agent)
+        cursor.executemany('''
+            INSERT INTO fraud_signal_buckets (signal, key, bucket, count)
+            VALUES (?, ?, ?, 1)
+            ON CONFLICT (signal, key, bucket) DO UPDATE SET count = count + 1
+        ''', [(signal, key, self.counters[signal].bucket(now)) for signal, key in keys.items()])
+        return keys, now
+
+    def apply(self, recorded):
+        """Count a committed event in the local counters
+
+        Args:
+            recorded (tuple): Return value of record()
+        """
+        keys, now = recorded
+        with self._lock:
+            for signal, key in keys.items():
+                self.counters[signal].add(key, now)
+
+    def counts(self, conn, code_id, ip_addr, user_agent, now=None):
+        """Return the windowed event count of each signal for an event
+
+        Keys whose local copy is missing or older than sync_seconds are
+        re-read from fraud_signal_buckets in a single query.
+
+        Returns:
+            dict: signal -> count, for the signals the event has a key for
+        """
+        now = time.time() if now is None else now
+        keys = signal_keys(code_id, ip_addr, user_agent)
+
+        with self._lock:
+            stale = [(signal, key) for signal, key in keys.items()
+                     if not self.counters[signal].is_fresh(key, now, self.sync_seconds)]
+        if stale:
+            loaded = self._read_buckets(conn, stale, now)
+            with self._lock:
+                for signal, key in stale:
+                    self.counters[signal].load(key, loaded.get((signal, key), ()), now)
+
+        with self._lock:
+            return {signal: self.counters[signal].count(key, now) for signal, key in keys.items()}
+
+    def _read_buckets(self, conn, pairs, now):
+        params = []
+        for signal, key in pairs:
+            params.extend((signal, key, self.counters[signal].oldest_bucket(now)))
+
+        loaded = {}
+        sql = ' UNION ALL '.join([BUCKETS_SQL] * len(pairs))
+        for signal, key, bucket, count in conn.execute(sql, params).fetchall():
+            loaded.setdefault((signal, key), []).append((bucket, count))
+        return loaded
+
+    @staticmethod
+    def prune(conn, now=None):
+        """Delete buckets that have left every window
+
+        Runs on the caller's transaction and does not commit.
+
+        Returns:
+            int: Number of bucket rows deleted
+        """
+        now = time.time() if now is None else now
+        deleted = 0
+        for signal, (window, bucket_seconds) in SIGNAL_WINDOWS.items():
+            oldest = int(now // bucket_seconds) - int(window // bucket_seconds) + 1
+            cursor = conn.execute(
+                'DELETE FROM fraud_signal_buckets WHERE signal = ? AND bucket < ?', (signal, oldest)
+            )
+            deleted += cursor.rowcount
+        return deleted
+
+    @staticmethod
+    def rebuild(conn, now=None):
+        """Recompute the buckets of the current windows from referral_events
+
+        Runs on the caller's transaction and does not commit.
+
+        Returns:
+            int: Number of bucket rows written
+        """
+        now = time.time() if now is None else now
+        longest = max(window for window, _ in SIGNAL_WINDOWS.values())
+        since = datetime.fromtimestamp(now - longest, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+        buckets = Counter()
+        cursor = conn.execute('''
+            SELECT code_id, ip_addr, user_agent, strftime('%s', created_at)
+            FROM referral_events
+            WHERE created_at >= ?
+        ''', (since,))
+        for code_id, ip_addr, user_agent, created_at in cursor.fetchall():
+            created_at = float(created_at) if created_at is not None else now
+            for signal, key in signal_keys(code_id, ip_addr, user_agent).items():
+                buckets[(signal, key, int(created_at // SIGNAL_WINDOWS[signal][1]))] += 1
+
+        conn.execute('DELETE FROM fraud_signal_buckets')
+        conn.executemany('''
+            INSERT INTO fraud_signal_buckets (signal, key, bucket, count)
+            VALUES (?, ?, ?, ?)
+        ''', [(signal, key, bucket, count) for (signal, key, bucket), count in buckets.items()])
+        return len(buckets)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_fraud_engine():
+    """Return this process's FraudSignalEngine, creating it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = FraudSignalEngine()
+        return _engine
+
+
+def main(argv=None):
+    from database import connection
+
+    parser = argparse.ArgumentParser(description='Maintain the shared fraud signal buckets')
+    parser.add_argument('--database', help='SQLite database path (defaults to DATABASE_NAME)')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--prune', action='store_true', help='Delete buckets outside every window')
+    group.add_argument('--rebuild', action='store_true', help='Recompute current windows from referral_events')
+    args = parser.parse_args(argv)
+
+    with connection(args.database) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if args.prune:
+                rows = FraudSignalEngine.prune(conn)
+                message = f'Pruned {rows} expired fraud signal bucket(s)'
+            else:
+                rows = FraudSignalEngine.rebuild(conn)
+                message = f'Rebuilt {rows} fraud signal bucket(s)'
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(message)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
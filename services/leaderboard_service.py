@@ -0,0 +1,203 @@
+"""
+Rewards leaderboard backed by the precomputed user_points table
+
+user_points is maintained by triggers on user_rewards (see migration v008).
+Every query here is an index seek on (period, points, user_id): top-N and
+neighbors read only the rows they return, and a rank is a count over the
+index entries above the user rather than an aggregate of user_rewards.
+Ties on points are broken by user id so positions are stable.
+"""
+
+from datetime import datetime
+
+LEADERBOARD_PERIODS = ('all', 'week', 'month')
+
+TOP_SQL = '''
+    SELECT up.user_id, u.full_name, up.points, up.reward_count
+    FROM user_points up
+    JOIN users u ON u.id = up.user_id
+    WHERE up.period = ?
+    ORDER BY up.points DESC, up.user_id DESC
+    LIMIT ?
+'''
+POINTS_AHEAD_SQL = '''
+    SELECT COUNT(*) FROM user_points
+    WHERE period = ? AND points > ?
+'''
+NEIGHBORS_ABOVE_SQL = '''
+    SELECT up.user_id, u.full_name, up.points, up.reward_count
+    FROM user_points up
+    JOIN users u ON u.id = up.user_id
+    WHERE up.period = ? AND (up.points, up.user_id) > (?, ?)
+    ORDER BY up.points ASC, up.user_id ASC
+    LIMIT ?
+'''
+NEIGHBORS_BELOW_SQL = '''
+    SELECT up.user_id, u.full_name, up.points, up.reward_count
+    FROM user_points up
+    JOIN users u ON u.id = up.user_id
+    WHERE up.period = ? AND (up.points, up.user_id) <= (?, ?)
+    ORDER BY up.points DESC, up.user_id DESC
+    LIMIT ?
+'''
+
+
+def period_key(period='all', when=None):
+    """Return the user_points period key for a window containing ``when``
+
+    Args:
+        period (str): 'all', 'week' or 'month'
+        when (datetime, optional): Moment inside the window (defaults to now, UTC)
+
+    Raises:
+        ValueError: If the period is not supported
+    """
+    if period not in LEADERBOARD_PERIODS:
+        raise ValueError(f'period must be one of {", ".join(LEADERBOARD_PERIODS)}')
+    if period == 'all':
+        return 'all'
+    when = when or datetime.utcnow()  # earned_date defaults to UTC CURRENT_TIMESTAMP
+    if period == 'week':
+        return 'week:' + when.strftime('%Y-%W')
+    return 'month:' + when.strftime('%Y-%m')
+
+
+def _with_ranks(rows, first_position, first_rank):
+    """Attach competition ranks (ties share a rank) to consecutive rows"""
+    entries = []
+    previous_points = None
+    rank = first_rank
+    for offset, (user_id, full_name, points, reward_count) in enumerate(rows):
+        if previous_points is not None and points != previous_points:
+            rank = first_position + offset
+        previous_points = points
+        entries.append({
+            'user_id': user_id,
+            'full_name': full_name,
+            'points': points,
+            'reward_count': reward_count,
+            'rank': rank,
+        })
+    return entries
+
+
+class LeaderboardService:
+    """Service for reading ranks from user_points"""
+
+    @staticmethod
+    def top(conn, period='all', limit=20, when=None):
+        """Return the highest scoring users for a window
+
+        Args:
+            conn: sqlite3 connection
+            period (str, optional): 'all', 'week' or 'month'
+            limit (int, optional): Number of users to return
+            when (datetime, optional): Moment inside the window
+
+        Returns:
+            list: Dicts with user_id, full_name, points, reward_count and rank
+        """
+        cursor = conn.cursor()
+        cursor.execute(TOP_SQL, (period_key(period, when), limit))
+        return _with_ranks(cursor.fetchall(), 1, 1)
+
+    @staticmethod
+    def get_entry(conn, user_id, period='all', when=None):
+        """Return a user's points, reward count and rank for a window
+
+        Returns:
+            dict: Entry as returned by top(), or None if the user has no points
+        """
+        key = period_key(period, when)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT up.user_id, u.full_name, up.points, up.reward_count
+            FROM user_points up
+            JOIN users u ON u.id = up.user_id
+            WHERE up.period = ? AND up.user_id = ?
+        ''', (key, user_id))
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        cursor.execute(POINTS_AHEAD_SQL, (key, row[2]))
+        return _with_ranks([row], 1, cursor.fetchone()[0] + 1)[0]
+
+    @staticmethod
+    def rank_of(conn, user_id, period='all', when=None):
+        """Return a user's rank in a window, or None if they have no points"""
+        entry = LeaderboardService.get_entry(conn, user_id, period, when)
+        return entry['rank'] if entry else None
+
+    @staticmethod
+    def neighbors(conn, user_id, period='all', radius=2, when=None):
+        """Return the users ranked just above and below a user, and the user
+
+        Args:
+            conn: sqlite3 connection
+            user_id (int): User to center on
+            period (str, optional): 'all', 'week' or 'month'
+            radius (int, optional): Users to include on each side
+            when (datetime, optional): Moment inside the window
+
+        Returns:
+            list: Entries in rank order, empty if the user has no points
+        """
+        key = period_key(period, when)
+        cursor = conn.cursor()
+        cursor.execute('SELECT points FROM user_points WHERE period = ? AND user_id = ?', (key, user_id))
+        row = cursor.fetchone()
+        if not row:
+            return []
+        points = row[0]
+
+        cursor.execute(NEIGHBORS_ABOVE_SQL, (key, points, user_id, radius))
+        above = cursor.fetchall()[::-1]
+
+        cursor.execute(NEIGHBORS_BELOW_SQL, (key, points, user_id, radius + 1))
+        rows = above + cursor.fetchall()
+        if not rows:
+            return []
+
+        first_points, first_user = rows[0][2], rows[0][0]
+        cursor.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM user_points
+                 WHERE period = ? AND (points, user_id) > (?, ?)),
+                (SELECT COUNT(*) FROM user_points
+                 WHERE period = ? AND points > ?)
+        ''', (key, first_points, first_user, key, first_points))
+        ahead_position, ahead_points = cursor.fetchone()
+        return _with_ranks(rows, ahead_position + 1, ahead_points + 1)
+
+    @staticmethod
+    def rebuild(conn):
+        """Recompute user_points from earned user_rewards
+
+        Runs on the caller's transaction and does not commit.
+
+        Args:
+            conn: sqlite3 connection or cursor
+
+        Returns:
+            int: Number of user_points rows written
+        """
+        conn.execute('DELETE FROM user_points')
+        cursor = conn.execute('''
+            INSERT INTO user_points (period, user_id, points, reward_count)
+            SELECT period, user_id, SUM(points), COUNT(*)
+            FROM (
+                SELECT 'all' AS period, user_id, COALESCE(points_earned, 0) AS points
+                FROM user_rewards WHERE reward_status = 'earned' AND user_id IS NOT NULL
+                UNION ALL
+                SELECT 'week:' || strftime('%Y-%W', COALESCE(earned_date, CURRENT_TIMESTAMP)),
+                       user_id, COALESCE(points_earned, 0)
+                FROM user_rewards WHERE reward_status = 'earned' AND user_id IS NOT NULL
+                UNION ALL
+                SELECT 'month:' || strftime('%Y-%m', COALESCE(earned_date, CURRENT_TIMESTAMP)),
+                       user_id, COALESCE(points_earned, 0)
+                FROM user_rewards WHERE reward_status = 'earned' AND user_id IS NOT NULL
+            )
+            GROUP BY period, user_id
+        ''')
+        return cursor.rowcount
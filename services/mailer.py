@@ -0,0 +1,139 @@
+"""
+SMTP sending over a reused connection
+
+Opening an SMTP connection costs a TCP handshake, STARTTLS and AUTH, which
+is most of the time spent on a short message. SMTPMailer opens one
+connection under the MAIL_* settings and sends every message over it,
+reconnecting once if the server dropped an idle connection.
+
+Without MAIL_SERVER (development and tests) messages are logged instead of
+sent, as the notification placeholders always did.
+"""
+
+import logging
+import smtplib
+from email.message import EmailMessage
+
+from config.app_config import get_config
+
+logger = logging.getLogger(__name__)
+
+
+def build_message(to, subject, body, sender=None):
+    """Build a plain-text email
+
+    Args:
+        to (str): Recipient address
+        subject (str): Subject line
+        body (str): Plain-text body
+        sender (str, optional): From address, defaults to MAIL_DEFAULT_SENDER
+
+    Returns:
+        EmailMessage: The message
+    """
+    message = EmailMessage()
+    message['From'] = sender or get_config().MAIL_DEFAULT_SENDER or 'noreply@sapyyn.com'
+    message['To'] = to
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
+
+
+class SMTPMailer:
+    """Sends messages over one SMTP connection, opened on first use"""
+
+    def __init__(self, server=None, port=None, use_tls=None, username=None, password=None, timeout=None):
+        config = get_config()
+        self.server = server if server is not None else config.MAIL_SERVER
+        self.port = port if port is not None else config.MAIL_PORT
+        self.use_tls = use_tls if use_tls is not None else config.MAIL_USE_TLS
+        self.username = username if username is not None else config.MAIL_USERNAME
+        self.password = password if password is not None else config.MAIL_PASSWORD
+        self.timeout = timeout if timeout is not None else config.MAIL_TIMEOUT_SECONDS
+        self._connection = None
+        self.connections_opened = 0
+
+    @property
+    def enabled(self):
+        """Whether messages are sent, rather than logged"""
+        return bool(self.server)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                connection.starttls()
+            if self.username:
+                connection.login(self.username, self.password or '')
+        except Exception:
+            connection.close()
+            raise
+        self.connections_opened += 1
+        return connection
+
+    def close(self):
+        """Quit the connection if one is open"""
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.quit()
+            except smtplib.SMTPException:
+                connection.close()
+            except OSError:
+                pass
+
+    def send(self, message):
+        """Send one message
+
+        Args:
+            message (EmailMessage): Message with From and To set
+
+        Raises:
+            smtplib.SMTPException, OSError: If the message was not accepted
+        """
+        if not self.enabled:
+            logger.info(f"[EMAIL] To: {message['To']} Subject: {message['Subject']}")
+            return
+
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.send_message(message)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # Idle connections are dropped by the server; retry once on a new one
+                self.close()
+                if attempt:
+                    raise
+            except smtplib.SMTPRecipientsRefused:
+                # The connection is still good; only this message failed
+                raise
+            except (smtplib.SMTPException, OSError):
+                self.close()
+                raise
+
+    def send_many(self, messages):
+        """Send messages over the same connection, continuing past failures
+
+        Args:
+            messages (list): EmailMessage objects
+
+        Returns:
+            list: None for each sent message, or the error that stopped it
+        """
+        results = []
+        for message in messages:
+            try:
+                self.send(message)
+                results.append(None)
+            except (smtplib.SMTPException, OSError) as e:
+                logger.warning(f"Email to {message['To']} failed: {str(e)}")
+                results.append(e)
+        return results
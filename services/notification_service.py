@@ -2,8 +2,16 @@
 Notification service for appointment-related notifications
 """
 
-from datetime import datetime
-from models import db, Appointment, AppointmentNotification, NotificationType, DeliveryStatus, User
+import logging
+import time
+from datetime import datetime, timedelta
+from config.app_config import get_config
+from models import db, Appointment, AppointmentNotification, AppointmentStatus, NotificationType, DeliveryStatus, User
+from services.email_outbox import EmailOutbox
+from sqlalchemy import insert
+from sqlalchemy.orm import aliased
+
+logger = logging.getLogger(__name__)
 
 class NotificationService:
     """Service for appointment-related notifications"""
@@ -35,7 +43,7 @@ class NotificationService:
             notification_type=NotificationType.CONFIRMATION
         )
         
-        db.session.add_all([patient_notification, specialist_notification])
+        notifications = [patient_notification, specialist_notification]
         
         # If this appointment is linked to a referral, notify the referring doctor
         if appointment.referral_id:
@@ -46,12 +54,15 @@ class NotificationService:
                     user_id=referral.user_id,
                     notification_type=NotificationType.CONFIRMATION
                 )
-                db.session.add(referring_doctor_notification)
+                notifications.append(referring_doctor_notification)
         
-        db.session.commit()
+        db.session.add_all(notifications)
+        db.session.flush()
+        
+        # Queue emails on the same transaction; the email worker sends them after commit
+        NotificationService._send_confirmation_emails(appointment, notifications)
         
-        # Send emails (this would integrate with an email service)
-        NotificationService._send_confirmation_emails(appointment)
+        db.session.commit()
         
         return True
     
@@ -70,7 +81,7 @@ class NotificationService:
             return False
         
         # Only send reminders for scheduled appointments
-        if appointment.status != 'scheduled':
+        if appointment.status != AppointmentStatus.SCHEDULED:
             return False
         
         # Create notification for patient
@@ -81,13 +92,110 @@ class NotificationService:
         )
         
         db.session.add(patient_notification)
-        db.session.commit()
+        db.session.flush()
+        
+        # Queue the email on the same transaction; the email worker sends it after commit
+        NotificationService._send_reminder_email(appointment, [patient_notification])
         
-        # Send email reminder (this would integrate with an email service)
-        NotificationService._send_reminder_email(appointment)
+        db.session.commit()
         
         return True
     
+    @staticmethod
+    def dispatch_due_reminders(now=None, lead_hours=None, batch_size=None):
+        """Queue reminders for scheduled appointments starting within the lead time
+        
+        Appointments starting in the next REMINDER_LEAD_HOURS that have no
+        reminder notification yet are read in batches of REMINDER_BATCH_SIZE,
+        one indexed query per batch. Each batch's notification rows and their
+        emails in the outbox are inserted and committed together, so a run
+        that dies midway never reminds a patient twice. The email worker then
+        delivers them, retrying with backoff, and marks each row DELIVERED or
+        FAILED.
+        
+        Args:
+            now (datetime): Optional current UTC time
+            lead_hours (float): Optional override of REMINDER_LEAD_HOURS
+            batch_size (int): Optional override of REMINDER_BATCH_SIZE
+            
+        Returns:
+            dict: reminded, queued, failed (no email address) and batches
+                counts, elapsed_seconds, per_second, and max_lag_seconds /
+                mean_lag_seconds between when each reminder fell due and when
+                it was queued
+        """
+        config = get_config()
+        now = datetime.utcnow() if now is None else now
+        lead = timedelta(hours=config.REMINDER_LEAD_HOURS if lead_hours is None else lead_hours)
+        batch_size = batch_size or config.REMINDER_BATCH_SIZE
+        
+        patient = aliased(User)
+        specialist = aliased(User)
+        already_reminded = db.session.query(AppointmentNotification.id).filter(
+            AppointmentNotification.appointment_id == Appointment.id,
+            AppointmentNotification.notification_type == NotificationType.REMINDER
+        ).exists()
+        due_query = db.session.query(
+            Appointment.id, Appointment.patient_id, Appointment.start_time,
+            patient.email, specialist.full_name
+        ).join(
+            patient, patient.id == Appointment.patient_id
+        ).join(
+            specialist, specialist.id == Appointment.specialist_id
+        ).filter(
+            Appointment.status == AppointmentStatus.SCHEDULED,
+            Appointment.start_time > now,
+            Appointment.start_time <= now + lead,
+            ~already_reminded
+        ).order_by(Appointment.start_time, Appointment.id).limit(batch_size)
+        
+        metrics = {'reminded': 0, 'queued': 0, 'failed': 0, 'batches': 0}
+        lags = []
+        started = time.monotonic()
+        while True:
+            rows = due_query.all()
+            if not rows:
+                break
+            queued_at = now + timedelta(seconds=time.monotonic() - started)
+            
+            notification_ids = dict(db.session.execute(
+                insert(AppointmentNotification).returning(
+                    AppointmentNotification.appointment_id, AppointmentNotification.id
+                ),
+                [{
+                    'appointment_id': appointment_id,
+                    'user_id': patient_id,
+                    'notification_type': NotificationType.REMINDER,
+                    'sent_at': queued_at,
+                    'delivery_status': DeliveryStatus.SENT if email else DeliveryStatus.FAILED,
+                } for appointment_id, patient_id, _, email, _ in rows]
+            ).all())
+            emailed = [row for row in rows if row[3]]
+            messages = []
+            for appointment_id, _, start_time, email, specialist_name in emailed:
+                subject, body = NotificationService._reminder_text(specialist_name, start_time)
+                messages.append({'to': email, 'subject': subject, 'body': body,
+                                 'notification_id': notification_ids[appointment_id]})
+            EmailOutbox.enqueue_many(db.session, messages)
+            db.session.commit()
+            
+            lags.extend((queued_at - (start_time - lead)).total_seconds() for _, _, start_time, _, _ in rows)
+            metrics['batches'] += 1
+            metrics['reminded'] += len(rows)
+            metrics['queued'] += len(emailed)
+            metrics['failed'] += len(rows) - len(emailed)
+            if len(rows) < batch_size:
+                break
+        
+        elapsed = time.monotonic() - started
+        metrics['elapsed_seconds'] = round(elapsed, 3)
+        metrics['per_second'] = round(metrics['reminded'] / elapsed, 1) if elapsed > 0 else 0
+        metrics['max_lag_seconds'] = round(max(lags), 1) if lags else 0
+        metrics['mean_lag_seconds'] = round(sum(lags) / len(lags), 1) if lags else 0
+        if metrics['reminded']:
+            logger.info(f"Appointment reminders queued: {metrics}")
+        return metrics
+    
     @staticmethod
     def send_appointment_update(appointment_id, update_type):
         """Send appointment update notifications
@@ -116,7 +224,7 @@ class NotificationService:
             notification_type=NotificationType.UPDATE
         )
         
-        db.session.add_all([patient_notification, specialist_notification])
+        notifications = [patient_notification, specialist_notification]
         
         # If this appointment is linked to a referral, notify the referring doctor
         if appointment.referral_id:
@@ -127,12 +235,15 @@ class NotificationService:
                     user_id=referral.user_id,
                     notification_type=NotificationType.UPDATE
                 )
-                db.session.add(referring_doctor_notification)
+                notifications.append(referring_doctor_notification)
         
-        db.session.commit()
+        db.session.add_all(notifications)
+        db.session.flush()
         
-        # Send emails (this would integrate with an email service)
-        NotificationService._send_update_emails(appointment, update_type)
+        # Queue emails on the same transaction; the email worker sends them after commit
+        NotificationService._send_update_emails(appointment, notifications, update_type)
+        
+        db.session.commit()
         
         return True
     
@@ -164,7 +275,7 @@ class NotificationService:
             notification_type=NotificationType.CANCELLATION
         )
         
-        db.session.add_all([patient_notification, specialist_notification])
+        notifications = [patient_notification, specialist_notification]
         
         # If this appointment is linked to a referral, notify the referring doctor
         if appointment.referral_id:
@@ -175,143 +286,181 @@ class NotificationService:
                     user_id=referral.user_id,
                     notification_type=NotificationType.CANCELLATION
                 )
-                db.session.add(referring_doctor_notification)
+                notifications.append(referring_doctor_notification)
         
-        db.session.commit()
+        db.session.add_all(notifications)
+        db.session.flush()
         
-        # Send emails (this would integrate with an email service)
-        NotificationService._send_cancellation_emails(appointment, cancellation_reason)
+        # Queue emails on the same transaction; the email worker sends them after commit
+        NotificationService._send_cancellation_emails(appointment, notifications, cancellation_reason)
+        
+        db.session.commit()
         
         return True
     
     @staticmethod
-    def _send_confirmation_emails(appointment):
-        """Send confirmation emails for an appointment
+    def _queue_email(user, subject, body, notifications):
+        """Add an email to the outbox on the current session
         
         Args:
-            appointment (Appointment): The appointment
+            user (User): Recipient; users without an email address are skipped
+            subject (str): Subject line
+            body (str): Plain-text body
+            notifications (list): Notifications being created, so the one for
+                this user gets its delivery_status from the email
         """
-        # This is a placeholder for actual email sending logic
-        # In a real implementation, this would use an email service
+        if not user or not user.email:
+            return
+        notification_ids = {notification.user_id: notification.id for notification in notifications}
+        EmailOutbox.enqueue(db.session, user.email, subject, body,
+                            notification_id=notification_ids.get(user.id))
+    
+    @staticmethod
+    def _send_confirmation_emails(appointment, notifications):
+        """Queue confirmation emails for an appointment
         
+        Args:
+            appointment (Appointment): The appointment
+            notifications (list): The confirmation notifications being created
+        """
         # Get user information
         patient = User.query.get(appointment.patient_id)
         specialist = User.query.get(appointment.specialist_id)
-        
-        if patient and patient.email:
-            # Send patient confirmation email
-            print(f"[EMAIL] To: {patient.email}")
-            print(f"[EMAIL] Subject: Your appointment with {specialist.full_name} is confirmed")
-            print(f"[EMAIL] Body: Your appointment on {appointment.start_time.strftime('%Y-%m-%d at %H:%M')} has been confirmed.")
-        
-        if specialist and specialist.email:
-            # Send specialist confirmation email
-            print(f"[EMAIL] To: {specialist.email}")
-            print(f"[EMAIL] Subject: New appointment with {patient.full_name}")
-            print(f"[EMAIL] Body: You have a new appointment on {appointment.start_time.strftime('%Y-%m-%d at %H:%M')}.")
+        when = appointment.start_time.strftime('%Y-%m-%d at %H:%M')
+        
+        if patient and specialist:
+            NotificationService._queue_email(
+                patient,
+                f"Your appointment with {specialist.full_name} is confirmed",
+                f"Your appointment on {when} has been confirmed.",
+                notifications
+            )
+            NotificationService._queue_email(
+                specialist,
+                f"New appointment with {patient.full_name}",
+                f"You have a new appointment on {when}.",
+                notifications
+            )
         
         # If this appointment is linked to a referral, notify the referring doctor
         if appointment.referral_id:
             referral = appointment.referral
             if referral and referral.user_id:
-                referring_doctor = User.query.get(referral.user_id)
-                if referring_doctor and referring_doctor.email:
-                    print(f"[EMAIL] To: {referring_doctor.email}")
-                    print(f"[EMAIL] Subject: Referral appointment scheduled")
-                    print(f"[EMAIL] Body: An appointment has been scheduled for your referral {referral.referral_id}.")
+                NotificationService._queue_email(
+                    User.query.get(referral.user_id),
+                    "Referral appointment scheduled",
+                    f"An appointment has been scheduled for your referral {referral.referral_id}.",
+                    notifications
+                )
     
     @staticmethod
-    def _send_reminder_email(appointment):
-        """Send reminder email for an appointment
+    def _send_reminder_email(appointment, notifications):
+        """Queue the reminder email for an appointment
         
         Args:
             appointment (Appointment): The appointment
+            notifications (list): The reminder notifications being created
         """
-        # This is a placeholder for actual email sending logic
-        # In a real implementation, this would use an email service
-        
         # Get user information
         patient = User.query.get(appointment.patient_id)
         specialist = User.query.get(appointment.specialist_id)
         
-        if patient and patient.email:
-            # Send patient reminder email
-            print(f"[EMAIL] To: {patient.email}")
-            print(f"[EMAIL] Subject: Reminder: Your appointment with {specialist.full_name}")
-            print(f"[EMAIL] Body: This is a reminder for your appointment on {appointment.start_time.strftime('%Y-%m-%d at %H:%M')}.")
+        if patient and specialist:
+            subject, body = NotificationService._reminder_text(specialist.full_name, appointment.start_time)
+            NotificationService._queue_email(patient, subject, body, notifications)
+    
+    @staticmethod
+    def _reminder_text(specialist_name, start_time):
+        """Subject and body of a patient's reminder email
+        
+        Args:
+            specialist_name (str): Full name of the specialist
+            start_time (datetime): Appointment start
+            
+        Returns:
+            tuple: (subject, body)
+        """
+        return (
+            f"Reminder: Your appointment with {specialist_name}",
+            f"This is a reminder for your appointment on {start_time.strftime('%Y-%m-%d at %H:%M')}."
+        )
     
     @staticmethod
-    def _send_update_emails(appointment, update_type):
-        """Send update emails for an appointment
+    def _send_update_emails(appointment, notifications, update_type):
+        """Queue update emails for an appointment
         
         Args:
             appointment (Appointment): The appointment
+            notifications (list): The update notifications being created
             update_type (str): Type of update
         """
-        # This is a placeholder for actual email sending logic
-        # In a real implementation, this would use an email service
-        
         # Get user information
         patient = User.query.get(appointment.patient_id)
         specialist = User.query.get(appointment.specialist_id)
-        
-        if patient and patient.email:
-            # Send patient update email
-            print(f"[EMAIL] To: {patient.email}")
-            print(f"[EMAIL] Subject: Your appointment with {specialist.full_name} has been updated")
-            print(f"[EMAIL] Body: Your appointment on {appointment.start_time.strftime('%Y-%m-%d at %H:%M')} has been updated.")
-        
-        if specialist and specialist.email:
-            # Send specialist update email
-            print(f"[EMAIL] To: {specialist.email}")
-            print(f"[EMAIL] Subject: Updated appointment with {patient.full_name}")
-            print(f"[EMAIL] Body: The appointment on {appointment.start_time.strftime('%Y-%m-%d at %H:%M')} has been updated.")
+        when = appointment.start_time.strftime('%Y-%m-%d at %H:%M')
+        
+        if patient and specialist:
+            NotificationService._queue_email(
+                patient,
+                f"Your appointment with {specialist.full_name} has been updated",
+                f"Your appointment on {when} has been updated.",
+                notifications
+            )
+            NotificationService._queue_email(
+                specialist,
+                f"Updated appointment with {patient.full_name}",
+                f"The appointment on {when} has been updated.",
+                notifications
+            )
         
         # If this appointment is linked to a referral, notify the referring doctor
         if appointment.referral_id:
             referral = appointment.referral
             if referral and referral.user_id:
-                referring_doctor = User.query.get(referral.user_id)
-                if referring_doctor and referring_doctor.email:
-                    print(f"[EMAIL] To: {referring_doctor.email}")
-                    print(f"[EMAIL] Subject: Referral appointment updated")
-                    print(f"[EMAIL] Body: An appointment for your referral {referral.referral_id} has been updated.")
+                NotificationService._queue_email(
+                    User.query.get(referral.user_id),
+                    "Referral appointment updated",
+                    f"An appointment for your referral {referral.referral_id} has been updated.",
+                    notifications
+                )
     
     @staticmethod
-    def _send_cancellation_emails(appointment, cancellation_reason=None):
-        """Send cancellation emails for an appointment
+    def _send_cancellation_emails(appointment, notifications, cancellation_reason=None):
+        """Queue cancellation emails for an appointment
         
         Args:
             appointment (Appointment): The appointment
+            notifications (list): The cancellation notifications being created
             cancellation_reason (str): Optional reason for cancellation
         """
-        # This is a placeholder for actual email sending logic
-        # In a real implementation, this would use an email service
-        
         # Get user information
         patient = User.query.get(appointment.patient_id)
         specialist = User.query.get(appointment.specialist_id)
+        when = appointment.start_time.strftime('%Y-%m-%d at %H:%M')
         
         reason_text = f"Reason: {cancellation_reason}" if cancellation_reason else ""
         
-        if patient and patient.email:
-            # Send patient cancellation email
-            print(f"[EMAIL] To: {patient.email}")
-            print(f"[EMAIL] Subject: Your appointment with {specialist.full_name} has been cancelled")
-            print(f"[EMAIL] Body: Your appointment on {appointment.start_time.strftime('%Y-%m-%d at %H:%M')} has been cancelled. {reason_text}")
-        
-        if specialist and specialist.email:
-            # Send specialist cancellation email
-            print(f"[EMAIL] To: {specialist.email}")
-            print(f"[EMAIL] Subject: Cancelled appointment with {patient.full_name}")
-            print(f"[EMAIL] Body: The appointment on {appointment.start_time.strftime('%Y-%m-%d at %H:%M')} has been cancelled. {reason_text}")
+        if patient and specialist:
+            NotificationService._queue_email(
+                patient,
+                f"Your appointment with {specialist.full_name} has been cancelled",
+                f"Your appointment on {when} has been cancelled. {reason_text}",
+                notifications
+            )
+            NotificationService._queue_email(
+                specialist,
+                f"Cancelled appointment with {patient.full_name}",
+                f"The appointment on {when} has been cancelled. {reason_text}",
+                notifications
+            )
         
         # If this appointment is linked to a referral, notify the referring doctor
         if appointment.referral_id:
             referral = appointment.referral
             if referral and referral.user_id:
-                referring_doctor = User.query.get(referral.user_id)
-                if referring_doctor and referring_doctor.email:
-                    print(f"[EMAIL] To: {referring_doctor.email}")
-                    print(f"[EMAIL] Subject: Referral appointment cancelled")
-                    print(f"[EMAIL] Body: An appointment for your referral {referral.referral_id} has been cancelled. {reason_text}")
\ No newline at end of file
+                NotificationService._queue_email(
+                    User.query.get(referral.user_id),
+                    "Referral appointment cancelled",
+                    f"An appointment for your referral {referral.referral_id} has been cancelled. {reason_text}",
+                    notifications
+                )
@@ -0,0 +1,231 @@
+"""
+Promotion performance analytics from hourly rollups
+
+Promotion.impression_count and click_count are lifetime totals. Every
+impression and click is also counted into promotion_metrics_hourly, one row
+per (promotion, hour, slot location, viewer role), by the write-behind
+buffer in services/promotion_counters.py. The reports below read only those
+buckets, so a sponsor's daily report over a month reads at most
+24 * 31 rows per location and role.
+
+Windows are whole hours: start is rounded down and end up to an hour
+boundary, and end is exclusive. A date without a time as end includes that
+whole day. Counts for the last PROMOTION_COUNTER_FLUSH_SECONDS may not be
+flushed yet.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import func
+
+from models import db, Promotion, PromotionMetricsHourly
+
+GRANULARITIES = ('hour', 'day')
+BREAKDOWNS = ('location', 'role')
+METRICS = ('ctr', 'clicks', 'impressions')
+
+DEFAULT_WINDOW_DAYS = 7
+MAX_SERIES_POINTS = 24 * 92
+
+
+def click_through_rate(impressions, clicks):
+    """Clicks per impression, rounded to 4 places; 0 without impressions"""
+    return round(clicks / impressions, 4) if impressions else 0
+
+
+def _parse_time(value, is_end):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        parsed, date_only = datetime(value.year, value.month, value.day), True
+    else:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid date: {value!r}')
+        date_only = len(value.strip()) == 10
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed + timedelta(days=1) if is_end and date_only else parsed
+
+
+def _floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(value):
+    floored = _floor_hour(value)
+    return floored if floored == value else floored + timedelta(hours=1)
+
+
+class PromotionAnalyticsService:
+    """Service for promotion performance reports"""
+
+    @staticmethod
+    def window(start=None, end=None, now=None):
+        """Resolve a report window to whole UTC hours
+
+        Args:
+            start (str|date|datetime, optional): Window start; defaults to
+                DEFAULT_WINDOW_DAYS before end
+            end (str|date|datetime, optional): Window end (exclusive); a bare
+                date includes that day. Defaults to now
+
+        Returns:
+            tuple: (start, end) naive UTC datetimes on hour boundaries
+
+        Raises:
+            ValueError: If a date cannot be parsed or start is not before end
+        """
+        now = datetime.utcnow() if now is None else now
+        end = _ceil_hour(_parse_time(end, is_end=True) if end else now)
+        start = _floor_hour(_parse_time(start, is_end=False)) if start else end - timedelta(days=DEFAULT_WINDOW_DAYS)
+        if start >= end:
+            raise ValueError('start must be before end')
+        return start, end
+
+    @staticmethod
+    def _filtered(query, start, end, promotion_id=None, location=None, role=None):
+        metrics = PromotionMetricsHourly
+        query = query.filter(metrics.hour >= start, metrics.hour < end)
+        if promotion_id is not None:
+            query = query.filter(metrics.promotion_id == promotion_id)
+        if location is not None:
+            query = query.filter(metrics.location == getattr(location, 'value', location))
+        if role is not None:
+            query = query.filter(metrics.role == role)
+        return query
+
+    @staticmethod
+    def time_series(start, end, granularity='day', promotion_id=None, location=None, role=None):
+        """Impressions, clicks and CTR per hour or day, with empty periods as zeros
+
+        Args:
+            start (datetime): Window start, from window()
+            end (datetime): Window end (exclusive), from window()
+            granularity (str): 'hour' or 'day'
+            promotion_id (int, optional): Limit to one promotion
+            location (PromotionLocation|str, optional): Limit to one slot location
+            role (str, optional): Limit to one viewer role ('anonymous' for logged-out)
+
+        Returns:
+            list: Dicts with period (ISO string), impressions, clicks and ctr
+
+        Raises:
+            ValueError: If the granularity is unknown or the series too long
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f'granularity must be one of {", ".join(GRANULARITIES)}')
+        step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+        first = start if granularity == 'hour' else start.replace(hour=0)
+        if (end - first) / step > MAX_SERIES_POINTS:
+            raise ValueError(f'Window too long for {granularity}ly points (max {MAX_SERIES_POINTS})')
+
+        metrics = PromotionMetricsHourly
+        period = metrics.hour if granularity == 'hour' else func.date(metrics.hour)
+        rows = PromotionAnalyticsService._filtered(
+            db.session.query(period, func.sum(metrics.impressions), func.sum(metrics.clicks)),
+            start, end, promotion_id, location, role
+        ).group_by(period).all()
+
+        def label(value):
+            if isinstance(value, str):
+                # SQLite returns date() and DateTime values as text
+                value = datetime.fromisoformat(value)
+            return value.isoformat() if granularity == 'hour' else value.strftime('%Y-%m-%d')
+
+        totals = {label(value): (impressions or 0, clicks or 0) for value, impressions, clicks in rows}
+        series = []
+        current = first
+        while current < end:
+            key = label(current)
+            impressions, clicks = totals.get(key, (0, 0))
+            series.append({
+                'period': key,
+                'impressions': impressions,
+                'clicks': clicks,
+                'ctr': click_through_rate(impressions, clicks),
+            })
+            current += step
+        return series
+
+    @staticmethod
+    def breakdown(start, end, by='location', promotion_id=None):
+        """Impressions, clicks and CTR per slot location or viewer role
+
+        Args:
+            start (datetime): Window start, from window()
+            end (datetime): Window end (exclusive), from window()
+            by (str): 'location' or 'role'
+            promotion_id (int, optional): Limit to one promotion
+
+        Returns:
+            list: Dicts with the grouping key, impressions, clicks and ctr,
+                most impressions first
+
+        Raises:
+            ValueError: If by is unknown
+        """
+        if by not in BREAKDOWNS:
+            raise ValueError(f'by must be one of {", ".join(BREAKDOWNS)}')
+        metrics = PromotionMetricsHourly
+        column = getattr(metrics, by)
+        impressions = func.sum(metrics.impressions)
+        rows = PromotionAnalyticsService._filtered(
+            db.session.query(column, impressions, func.sum(metrics.clicks)),
+            start, end, promotion_id
+        ).group_by(column).order_by(impressions.desc(), column).all()
+        return [
+            {by: key, 'impressions': impressions, 'clicks': clicks,
+             'ctr': click_through_rate(impressions, clicks)}
+            for key, impressions, clicks in rows
+        ]
+
+    @staticmethod
+    def top_performers(start, end, metric='ctr', limit=10, min_impressions=100, location=None):
+        """Best promotions over a window
+
+        Args:
+            start (datetime): Window start, from window()
+            end (datetime): Window end (exclusive), from window()
+            metric (str): 'ctr', 'clicks' or 'impressions'
+            limit (int): Number of promotions to return
+            min_impressions (int): Ignore promotions shown fewer times than
+                this, so a single lucky click does not top the CTR list
+            location (PromotionLocation|str, optional): Limit to one slot location
+
+        Returns:
+            list: Dicts with promotion_id, title, impressions, clicks and ctr
+
+        Raises:
+            ValueError: If the metric is unknown or limit is not positive
+        """
+        if metric not in METRICS:
+            raise ValueError(f'metric must be one of {", ".join(METRICS)}')
+        if limit < 1:
+            raise ValueError('limit must be positive')
+
+        metrics = PromotionMetricsHourly
+        impressions = func.sum(metrics.impressions)
+        clicks = func.sum(metrics.clicks)
+        order = {
+            'ctr': 1.0 * clicks / func.nullif(impressions, 0),
+            'clicks': clicks,
+            'impressions': impressions,
+        }[metric]
+        rows = PromotionAnalyticsService._filtered(
+            db.session.query(metrics.promotion_id, impressions, clicks),
+            start, end, location=location
+        ).group_by(metrics.promotion_id).having(
+            impressions >= min_impressions
+        ).order_by(order.desc(), metrics.promotion_id).limit(limit).all()
+
+        titles = dict(db.session.query(Promotion.id, Promotion.title).filter(
+            Promotion.id.in_([row[0] for row in rows])
+        ).all()) if rows else {}
+        return [
+            {'promotion_id': promotion_id, 'title': titles.get(promotion_id),
+             'impressions': impressions, 'clicks': clicks,
+             'ctr': click_through_rate(impressions, clicks)}
+            for promotion_id, impressions, clicks in rows
+        ]
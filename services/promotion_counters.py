@@ -0,0 +1,363 @@
+"""
+Write-behind impression and click counters for promotions
+
+record_impression and record_click used to run an UPDATE and a commit on
+the request thread, so every page with a slot queued on the same hot
+promotion row. PromotionCounterBuffer adds events to per-promotion counts in
+memory instead; a background thread applies them every
+PROMOTION_COUNTER_FLUSH_SECONDS, or sooner once PROMOTION_COUNTER_FLUSH_EVENTS
+are pending, as one executemany UPDATE of the lifetime totals plus one
+executemany upsert into promotion_metrics_hourly. Events are counted per
+(promotion, hour, slot location, viewer role), which is the grain the
+analytics in services/promotion_analytics_service.py read.
+
+Crash safety: each event is also appended to this process's current spool
+segment in PROMOTION_COUNTER_SPOOL_DIR, which the process holds an flock on
+until the segment is applied. A flush also replays segments nobody holds a
+lock on (left by a process that died) from the file contents. The segment
+name is inserted into promotion_counter_segments in the same transaction as
+the counts, so a segment is applied once even if it is replayed after a
+crash between the commit and the file delete. Segment names are kept for
+SEGMENT_RETENTION_SECONDS.
+
+The buffer flushes on interpreter exit, so totals are exact after a clean
+shutdown. With an empty spool dir the counts live only in memory.
+"""
+
+import atexit
+import fcntl
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+from config.app_config import get_config
+from models import db, Promotion, PromotionCounterSegment, PromotionLocation, PromotionMetricsHourly
+
+logger = logging.getLogger('promotion_counters')
+
+SEGMENT_SUFFIX = '.spool'
+SEGMENT_RETENTION_SECONDS = 7 * 86400
+
+_EVENT_KINDS = {'i': 0, 'c': 1}  # spool line prefix -> index in [impressions, clicks]
+
+UNKNOWN_LOCATION = 'unknown'
+ANONYMOUS_ROLE = 'anonymous'
+
+
+def metrics_key(promotion_id, location=None, role=None, now=None):
+    """Return the (promotion_id, hour, location, role) a single event counts toward
+
+    hour is the number of whole hours since the epoch, UTC.
+    """
+    now = time.time() if now is None else now
+    if isinstance(location, PromotionLocation):
+        location = location.value
+    location = (location or UNKNOWN_LOCATION).replace(' ', '_')
+    role = (role or ANONYMOUS_ROLE).replace(' ', '_')
+    return int(promotion_id), int(now // 3600), location, role
+
+
+def hour_start(hour):
+    """Naive UTC datetime at the start of an epoch hour number"""
+    return datetime.fromtimestamp(hour * 3600, timezone.utc).replace(tzinfo=None)
+
+
+def read_segment(handle):
+    """Sum a spool segment's lines into {metrics_key: [impressions, clicks]}
+
+    A torn last line (the process died mid-write, maybe partway through an
+    id) has no newline and is skipped.
+    """
+    handle.seek(0)
+    counts = defaultdict(lambda: [0, 0])
+    for line in handle.read().split('\n')[:-1]:
+        fields = line.split(' ')
+        if len(fields) != 5 or fields[0] not in _EVENT_KINDS or not fields[1].isdigit() or not fields[2].isdigit():
+            continue
+        key = (int(fields[1]), int(fields[2]), fields[3], fields[4])
+        counts[key][_EVENT_KINDS[fields[0]]] += 1
+    return dict(counts)
+
+
+def lifetime_totals(counts):
+    """Collapse {metrics_key: [impressions, clicks]} to {promotion_id: [impressions, clicks]}"""
+    totals = defaultdict(lambda: [0, 0])
+    for (promotion_id, _, _, _), (impressions, clicks) in counts.items():
+        totals[promotion_id][0] += impressions
+        totals[promotion_id][1] += clicks
+    return dict(totals)
+
+
+def _insert_for(dialect_name):
+    """INSERT construct with on_conflict_do_update for the bound database"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+class PromotionCounterBuffer:
+    """Per-process write-behind buffer for promotion impressions and clicks"""
+
+    def __init__(self, spool_dir=None, flush_seconds=None, flush_events=None):
+        config = get_config()
+        self.spool_dir = config.PROMOTION_COUNTER_SPOOL_DIR if spool_dir is None else spool_dir
+        self.flush_seconds = config.PROMOTION_COUNTER_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.flush_events = flush_events or config.PROMOTION_COUNTER_FLUSH_EVENTS
+
+        self._lock = threading.Lock()        # guards the pending counts and segment
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._counts = defaultdict(lambda: [0, 0])
+        self._events = 0
+        self._segment = None  # (name, path, handle) of the segment being written
+        self._sequence = 0
+
+        self._app = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def _open_segment(self):
+        self._sequence += 1
+        name = f'{time.time_ns():020d}-{socket.gethostname()}-{os.getpid()}-{self._sequence}'
+        path = os.path.join(self.spool_dir, name + SEGMENT_SUFFIX)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        handle = open(path, 'a+')
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return name, path, handle
+
+    def record(self, promotion_id, impressions=0, clicks=0, location=None, role=None, now=None):
+        """Count impressions and clicks for a promotion
+
+        Args:
+            promotion_id (int): ID of the promotion
+            impressions (int): Impressions to add
+            clicks (int): Clicks to add
+            location (PromotionLocation|str, optional): Slot the promotion was shown in
+            role (str, optional): Viewer's role; None for logged-out visitors
+            now (float, optional): Event epoch time
+        """
+        key = metrics_key(promotion_id, location, role, now)
+        with self._lock:
+            if self.spool_dir:
+                if self._segment is None:
+                    self._segment = self._open_segment()
+                fields = ' '.join(str(field) for field in key)
+                self._segment[2].write(f'i {fields}\n' * impressions + f'c {fields}\n' * clicks)
+                self._segment[2].flush()
+            counts = self._counts[key]
+            counts[0] += impressions
+            counts[1] += clicks
+            self._events += impressions + clicks
+            full = self._events >= self.flush_events
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        """Return the unflushed counts as {promotion_id: (impressions, clicks)}"""
+        with self._lock:
+            return {promotion_id: tuple(counts) for promotion_id, counts in lifetime_totals(self._counts).items()}
+
+    def flush(self):
+        """Apply pending counts and any orphaned spool segments
+
+        Needs an application context.
+
+        Returns:
+            int: Number of segments (or in-memory batches) applied
+        """
+        with self._flush_lock:
+            with self._lock:
+                counts, segment = dict(self._counts), self._segment
+                self._counts = defaultdict(lambda: [0, 0])
+                self._events = 0
+                self._segment = None
+
+            applied = 0
+            if segment is not None:
+                name, path, handle = segment
+                applied += self._apply_segment(name, path, handle, counts)
+            elif counts:
+                try:
+                    self._apply(counts)
+                    applied += 1
+                except Exception as e:
+                    logger.error(f"Error flushing promotion counters: {str(e)}")
+                    self._restore(counts)
+
+            if self.spool_dir:
+                applied += self._recover()
+            return applied
+
+    def _restore(self, counts):
+        with self._lock:
+            for key, (impressions, clicks) in counts.items():
+                self._counts[key][0] += impressions
+                self._counts[key][1] += clicks
+                self._events += impressions + clicks
+
+    def _apply(self, counts, segment=None):
+        """Add counts to promotions and their hourly metrics in one transaction
+
+        Counts for promotions that have since been deleted are dropped.
+
+        Returns:
+            bool: False if the segment had already been applied
+        """
+        try:
+            if segment is not None:
+                try:
+                    db.session.add(PromotionCounterSegment(segment=segment))
+                    db.session.flush()
+                except IntegrityError:
+                    # Only the segment name is unique here: it was applied before a crash
+                    db.session.rollback()
+                    return False
+                retain_after = f'{time.time_ns() - SEGMENT_RETENTION_SECONDS * 10 ** 9:020d}'
+                PromotionCounterSegment.query.filter(
+                    PromotionCounterSegment.segment < retain_after
+                ).delete(synchronize_session=False)
+
+            promotion_ids = {key[0] for key in counts}
+            live_ids = {row[0] for row in db.session.query(Promotion.id).filter(Promotion.id.in_(promotion_ids))}
+            if live_ids != promotion_ids:
+                logger.warning(f"Dropping counts for deleted promotions {sorted(promotion_ids - live_ids)}")
+                counts = {key: value for key, value in counts.items() if key[0] in live_ids}
+
+            if counts:
+                promotions = Promotion.__table__
+                db.session.execute(
+                    promotions.update().where(promotions.c.id == bindparam('promotion_id')).values(
+                        impression_count=promotions.c.impression_count + bindparam('impressions'),
+                        click_count=promotions.c.click_count + bindparam('clicks'),
+                    ),
+                    [
+                        {'promotion_id': promotion_id, 'impressions': impressions, 'clicks': clicks}
+                        for promotion_id, (impressions, clicks) in sorted(lifetime_totals(counts).items())
+                    ]
+                )
+
+                metrics = PromotionMetricsHourly.__table__
+                upsert = _insert_for(db.session.get_bind().dialect.name)(metrics)
+                db.session.execute(
+                    upsert.on_conflict_do_update(
+                        index_elements=[metrics.c.promotion_id, metrics.c.hour, metrics.c.location, metrics.c.role],
+                        set_={
+                            'impressions': metrics.c.impressions + upsert.excluded.impressions,
+                            'clicks': metrics.c.clicks + upsert.excluded.clicks,
+                        }
+                    ),
+                    [
+                        {'promotion_id': promotion_id, 'hour': hour_start(hour), 'location': location,
+                         'role': role, 'impressions': impressions, 'clicks': clicks}
+                        for (promotion_id, hour, location, role), (impressions, clicks) in sorted(counts.items())
+                    ]
+                )
+            db.session.commit()
+            return True
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _apply_segment(self, name, path, handle, counts):
+        """Apply a locked segment, then delete it; on error leave it for recovery"""
+        try:
+            if counts:
+                self._apply(counts, segment=name)
+            os.remove(path)
+            return 1
+        except Exception as e:
+            logger.error(f"Error flushing promotion counter segment {name}: {str(e)}")
+            return 0
+        finally:
+            # Closing releases the lock, so a failed segment is replayed later
+            handle.close()
+
+    def _recover(self):
+        """Replay segments whose writer has exited"""
+        try:
+            names = sorted(os.listdir(self.spool_dir))
+        except FileNotFoundError:
+            return 0
+
+        applied = 0
+        for filename in names:
+            if not filename.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(self.spool_dir, filename)
+            try:
+                handle = open(path, 'r+')
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Still being written or flushed by its process
+                handle.close()
+                continue
+            if not os.path.exists(path):
+                # Applied and deleted by its owner while we waited on the lock
+                handle.close()
+                continue
+            applied += self._apply_segment(filename[:-len(SEGMENT_SUFFIX)], path, handle, read_segment(handle))
+        return applied
+
+    def _ensure_thread(self):
+        if self._thread is not None or not self.flush_seconds:
+            return
+        from flask import current_app, has_app_context
+        if not has_app_context():
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._app = current_app._get_current_object()
+            self._thread = threading.Thread(target=self._run, name='promotion-counters', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                with self._app.app_context():
+                    self.flush()
+                    db.session.remove()
+            except Exception as e:
+                logger.error(f"Error flushing promotion counters: {str(e)}")
+
+    def close(self):
+        """Stop the flush thread and apply everything still pending"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._app is not None:
+            with self._app.app_context():
+                self.flush()
+                db.session.remove()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_counter_buffer():
+    """Return this process's PromotionCounterBuffer, creating it on first use"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = PromotionCounterBuffer()
+            atexit.register(_buffer.close)
+        return _buffer
@@ -0,0 +1,244 @@
+"""
+In-process promotion selection index
+
+get_promotion_for_location used to run three or four ORM queries per slot
+render (eligible promotions, the user's preference row, role-specific ids,
+unrestricted ids) and rebuild the selection weights every time.
+PromotionIndex loads the promotions that are active now or later in two
+queries, groups them by location and precomputes an alias table (Vose's
+method) per (location, role), so choosing a promotion is two random draws.
+
+The index is rebuilt when:
+
+- PromotionService changes a promotion in this process (invalidate())
+- a loaded promotion ends or a scheduled one starts
+- it is older than PROMOTION_INDEX_REFRESH_SECONDS, which bounds how long
+  edits made by another worker, or the expiry cron job, take to show and
+  how far selection weights lag impression counts
+
+OptOutCache keeps the most recently used users' opt-out flags, each for
+PROMOTION_OPT_OUT_TTL_SECONDS; the preferences endpoint updates the
+current process's copy directly.
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from config.app_config import get_config
+from models import db, Promotion, PromotionRole, PromotionLocation, UserPromotionPreference
+
+
+def _as_location(location):
+    """Return the PromotionLocation for an enum, name or value, or None"""
+    if isinstance(location, PromotionLocation):
+        return location
+    try:
+        return PromotionLocation[location]
+    except KeyError:
+        pass
+    try:
+        return PromotionLocation(location)
+    except ValueError:
+        return None
+
+
+def selection_weights(impression_counts):
+    """Inverse impression-share weights, so newer promotions surface more often
+
+    Each weight is 1 minus the promotion's share of the group's impressions,
+    floored at 0.1.
+    """
+    total = sum(impression_counts) or len(impression_counts)
+    return [max(0.1, 1 - count / total) for count in impression_counts]
+
+
+class AliasTable:
+    """Weighted sampling in constant time (Vose's alias method)"""
+
+    def __init__(self, items, weights):
+        n = len(items)
+        total = float(sum(weights))
+        scaled = [weight * n / total for weight in weights]
+        self.items = list(items)
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less], self.alias[less] = scaled[less], more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Whatever is left over is 1 up to rounding error
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def pick(self, rng=random):
+        """Draw one item with probability proportional to its weight"""
+        u = rng.random() * len(self.items)
+        column = int(u)
+        return self.items[column] if u - column < self.prob[column] else self.items[self.alias[column]]
+
+
+class PromotionIndex:
+    """Per-process selection tables for active promotions"""
+
+    def __init__(self, refresh_seconds=None):
+        config = get_config()
+        self.refresh_seconds = config.PROMOTION_INDEX_REFRESH_SECONDS if refresh_seconds is None else refresh_seconds
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._by_location = None  # location -> [(id, impression_count, roles or None)]
+        self._tables = {}
+        self._built_at = None
+        self._valid_until = None
+
+    def invalidate(self):
+        """Drop the index so the next selection reloads it"""
+        with self._lock:
+            self._clear()
+
+    def _is_stale(self, now, clock):
+        return (self._by_location is None
+                or clock - self._built_at >= self.refresh_seconds
+                or (self._valid_until is not None and now >= self._valid_until))
+
+    def _rebuild(self, now, clock):
+        rows = db.session.query(
+            Promotion.id, Promotion.location, Promotion.start_date,
+            Promotion.end_date, Promotion.impression_count
+        ).filter(
+            Promotion.is_active == True,
+            Promotion.end_date >= now
+        ).all()
+
+        roles = {}
+        for promotion_id, role in db.session.query(
+            PromotionRole.promotion_id, PromotionRole.role
+        ).join(Promotion, Promotion.id == PromotionRole.promotion_id).filter(
+            Promotion.is_active == True,
+            Promotion.end_date >= now
+        ).all():
+            roles.setdefault(promotion_id, set()).add(role)
+
+        by_location, boundaries = {}, []
+        for promotion_id, location, start_date, end_date, impression_count in rows:
+            if start_date > now:
+                boundaries.append(start_date)
+                continue
+            # end_date is inclusive, so the promotion leaves just after it
+            boundaries.append(end_date)
+            by_location.setdefault(location, []).append(
+                (promotion_id, impression_count or 0, frozenset(roles.get(promotion_id, ())) or None)
+            )
+
+        self._by_location = by_location
+        self._tables = {}
+        self._built_at = clock
+        self._valid_until = min(boundaries) if boundaries else None
+
+    def _table(self, location, role):
+        key = (location, role)
+        if key not in self._tables:
+            # Anonymous visitors are not filtered by role
+            entries = [
+                entry for entry in self._by_location.get(location, ())
+                if role is None or entry[2] is None or role in entry[2]
+            ]
+            self._tables[key] = AliasTable(
+                [entry[0] for entry in entries],
+                selection_weights([entry[1] for entry in entries])
+            ) if entries else None
+        return self._tables[key]
+
+    def select(self, location, role=None, now=None, rng=random):
+        """Choose a promotion id for a slot
+
+        Args:
+            location (PromotionLocation|str): Slot location, as an enum, name or value
+            role (str, optional): Viewer's role; None for anonymous visitors
+            now (datetime, optional): Current UTC time
+            rng (random.Random, optional): Random source
+
+        Returns:
+            int: Selected promotion id, or None if no promotion is eligible
+        """
+        location = _as_location(location)
+        if location is None:
+            return None
+        now = datetime.utcnow() if now is None else now
+        clock = time.monotonic()
+
+        with self._lock:
+            if self._is_stale(now, clock):
+                self._rebuild(now, clock)
+            table = self._table(location, role)
+        return table.pick(rng) if table is not None else None
+
+
+class OptOutCache:
+    """Bounded LRU cache of users' promotion opt-out flags"""
+
+    def __init__(self, max_users=None, ttl_seconds=None):
+        config = get_config()
+        self.max_users = max_users or config.PROMOTION_OPT_OUT_CACHE_SIZE
+        self.ttl_seconds = config.PROMOTION_OPT_OUT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (loaded_at, opt_out)
+
+    def is_opted_out(self, user_id):
+        """Return whether a user has opted out of targeted promotions"""
+        clock = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and clock - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        opt_out = db.session.query(UserPromotionPreference.opt_out).filter_by(user_id=user_id).scalar()
+        self.remember(user_id, bool(opt_out))
+        return bool(opt_out)
+
+    def remember(self, user_id, opt_out):
+        """Store a user's opt-out flag, e.g. right after they change it"""
+        with self._lock:
+            self._entries[user_id] = (time.monotonic(), bool(opt_out))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_index = None
+_opt_outs = None
+_singleton_lock = threading.Lock()
+
+
+def get_promotion_index():
+    """Return this process's PromotionIndex, creating it on first use"""
+    global _index
+    with _singleton_lock:
+        if _index is None:
+            _index = PromotionIndex()
+        return _index
+
+
+def get_opt_out_cache():
+    """Return this process's OptOutCache, creating it on first use"""
+    global _opt_outs
+    with _singleton_lock:
+        if _opt_outs is None:
+            _opt_outs = OptOutCache()
+        return _opt_outs
@@ -3,9 +3,10 @@ Promotion service for managing promotional content
 """
 
 from datetime import datetime
-from models import db, Promotion, PromotionRole, UserPromotionPreference, User
+from models import db, Promotion, PromotionMetricsHourly, PromotionRole, User
+from services.promotion_index import get_promotion_index, get_opt_out_cache
+from services.promotion_counters import get_counter_buffer
 from sqlalchemy import func
-import random
 import logging
 
 class PromotionService:
@@ -42,6 +43,7 @@ class PromotionService:
                 db.session.add(promotion_role)
         
         db.session.commit()
+        get_promotion_index().invalidate()
         return promotion
     
     @staticmethod
@@ -89,6 +91,7 @@ class PromotionService:
         
         promotion.updated_at = datetime.utcnow()
         db.session.commit()
+        get_promotion_index().invalidate()
         return promotion
     
     @staticmethod
@@ -141,8 +144,10 @@ class PromotionService:
         if not promotion:
             return False
         
+        PromotionMetricsHourly.query.filter_by(promotion_id=promotion_id).delete(synchronize_session=False)
         db.session.delete(promotion)
         db.session.commit()
+        get_promotion_index().invalidate()
         return True
     
     @staticmethod
@@ -163,13 +168,15 @@ class PromotionService:
         promotion.is_active = is_active
         promotion.updated_at = datetime.utcnow()
         db.session.commit()
+        get_promotion_index().invalidate()
         return promotion
     
     @staticmethod
     def get_promotion_for_location(location, user=None):
         """Get an appropriate promotion for the given location and user
         
-        Uses weighted round-robin selection based on impression count
+        Uses weighted selection based on impression count, from the
+        in-process promotion index (see services/promotion_index.py)
         
         Args:
             location (PromotionLocation): Location to get promotion for
@@ -178,116 +185,75 @@ class PromotionService:
         Returns:
             Promotion: Selected promotion or None if none available
         """
-        now = datetime.utcnow()
-        
-        # Base query for active promotions at this location
-        query = Promotion.query.filter(
-            Promotion.location == location,
-            Promotion.is_active == True,
-            Promotion.start_date <= now,
-            Promotion.end_date >= now
-        )
-        
-        # Filter by user role if user is provided
+        role = None
         if user:
             # Check if user has opted out
-            user_prefs = UserPromotionPreference.query.filter_by(user_id=user.id).first()
-            if user_prefs and user_prefs.opt_out:
+            if get_opt_out_cache().is_opted_out(user.id):
                 # Return None or a house ad
                 return None
-            
-            # Get promotions that either have no role restrictions or match this user's role
-            role_specific_promo_ids = db.session.query(PromotionRole.promotion_id).filter_by(role=user.role).all()
-            role_specific_promo_ids = [r[0] for r in role_specific_promo_ids]
-            
-            # Get promotions with no role restrictions
-            no_role_promo_ids = db.session.query(Promotion.id).outerjoin(
-                PromotionRole, Promotion.id == PromotionRole.promotion_id
-            ).filter(PromotionRole.id == None).all()
-            no_role_promo_ids = [r[0] for r in no_role_promo_ids]
-            
-            # Combine both sets of IDs
-            allowed_promo_ids = role_specific_promo_ids + no_role_promo_ids
-            if allowed_promo_ids:
-                query = query.filter(Promotion.id.in_(allowed_promo_ids))
+            role = user.role
         
-        # Get all eligible promotions
-        promotions = query.all()
-        if not promotions:
+        promotion_id = get_promotion_index().select(location, role)
+        if promotion_id is None:
             return None
         
-        # Weighted selection based on inverse of impression count
-        # (fewer impressions = higher chance of selection)
-        total_impressions = sum(p.impression_count for p in promotions) or len(promotions)
-        weights = []
-        
-        for promo in promotions:
-            # Base weight is inverse of impression share
-            weight = 1 - (promo.impression_count / total_impressions) if total_impressions > 0 else 1
-            # Ensure minimum weight
-            weight = max(0.1, weight)
-            weights.append(weight)
+        promotion = db.session.get(Promotion, promotion_id)
+        if promotion is None:
+            # Deleted by another process since the index was built
+            get_promotion_index().invalidate()
+        return promotion
+    
+    @staticmethod
+    def set_opt_out(user_id, opt_out):
+        """Record a user's promotion opt-out in this process's cache
         
-        # Normalize weights
-        total_weight = sum(weights)
-        if total_weight > 0:
-            weights = [w / total_weight for w in weights]
-        else:
-            weights = [1 / len(promotions)] * len(promotions)
+        Call after committing the user's UserPromotionPreference.
         
-        # Select promotion based on weights
-        selected_promotion = random.choices(promotions, weights=weights, k=1)[0]
-        return selected_promotion
+        Args:
+            user_id (int): ID of the user
+            opt_out (bool): Whether the user opted out of targeted promotions
+        """
+        get_opt_out_cache().remember(user_id, opt_out)
     
     @staticmethod
-    def record_impression(promotion_id):
-        """Increment impression count for a promotion
-        Uses an isolated transaction to avoid any connection to PHI
+    def record_impression(promotion_id, location=None, role=None):
+        """Count an impression for a promotion
+        Buffered in memory and applied in batches by a background thread,
+        away from the request's session and any connection to PHI
         
         Args:
             promotion_id (int): ID of the promotion
+            location (PromotionLocation, optional): Slot the promotion was shown in
+            role (str, optional): Viewer's role; None for logged-out visitors
             
         Returns:
-            bool: True if successful, False if promotion not found
+            bool: True if the impression was recorded
         """
         try:
-            # Use atomic update to avoid race conditions
-            result = db.session.query(Promotion).filter(
-                Promotion.id == promotion_id
-            ).update(
-                {Promotion.impression_count: Promotion.impression_count + 1},
-                synchronize_session=False
-            )
-            db.session.commit()
-            return result > 0
+            get_counter_buffer().record(promotion_id, impressions=1, location=location, role=role)
+            return True
         except Exception as e:
-            db.session.rollback()
             logging.error(f"Error recording impression: {str(e)}")
             return False
     
     @staticmethod
-    def record_click(promotion_id):
-        """Increment click count for a promotion
-        Uses an isolated transaction to avoid any connection to PHI
+    def record_click(promotion_id, location=None, role=None):
+        """Count a click for a promotion
+        Buffered in memory and applied in batches by a background thread,
+        away from the request's session and any connection to PHI
         
         Args:
             promotion_id (int): ID of the promotion
+            location (PromotionLocation, optional): Slot the promotion was shown in
+            role (str, optional): Viewer's role; None for logged-out visitors
             
         Returns:
-            bool: True if successful, False if promotion not found
+            bool: True if the click was recorded
         """
         try:
-            # Use atomic update to avoid race conditions
-            result = db.session.query(Promotion).filter(
-                Promotion.id == promotion_id
-            ).update(
-                {Promotion.click_count: Promotion.click_count + 1},
-                synchronize_session=False
-            )
-            db.session.commit()
-            return result > 0
+            get_counter_buffer().record(promotion_id, clicks=1, location=location, role=role)
+            return True
         except Exception as e:
-            db.session.rollback()
             logging.error(f"Error recording click: {str(e)}")
             return False
     
@@ -303,9 +269,10 @@ class PromotionService:
             Promotion.is_active == True,
             Promotion.end_date < now
         ).update(
-            {Promotion.is_active: False},
+            {Promotion.is_active: False, Promotion.updated_at: now},
             synchronize_session=False
         )
         
         db.session.commit()
+        get_promotion_index().invalidate()
         return result
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+Referring doctor conversion statistics
+
+referring_doctors keeps integer counters per doctor (see migration v006);
+conversion rate and average case value are derived from them on read, so
+they never drift no matter how many outcomes have been recorded.
+
+Usage:
+    python -m services.referring_doctor_service --rebuild
+"""
+
+import argparse
+import sys
+from datetime import datetime
+
+# case_conversions stages that count as an outcome for the referring doctor
+OUTCOME_STAGES = ('case_accepted', 'case_rejected')
+
+# Expression indexed by idx_referring_doctors_conversion; keep them identical
+CONVERSION_RATE_SQL = 'CAST(accepted_count AS REAL) / NULLIF(referral_count, 0)'
+
+TOP_DOCTORS_SQL = f'''
+    SELECT name, referral_count, accepted_count, case_value_sum_cents,
+           case_value_count, last_referral_date
+    FROM referring_doctors
+    ORDER BY {CONVERSION_RATE_SQL} DESC, referral_count DESC
+    LIMIT ?
+'''
+
+
+def normalize_name(name):
+    """Return the lookup key for a referring doctor name"""
+    return name.strip().lower()
+
+
+def to_cents(value):
+    """Convert a case value to integer cents"""
+    return int(round(float(value) * 100))
+
+
+class ReferringDoctorService:
+    """Service for maintaining and ranking referring doctor statistics"""
+
+    @staticmethod
+    def record_outcome(cursor, referral_id, case_accepted):
+        """Count an accepted or rejected case against its referring doctor
+
+        Accepted cases count the referral's actual value, falling back to its
+        estimate, exactly as rebuild does, so call this after the referral
+        row has been updated. Runs on the caller's transaction.
+
+        Args:
+            cursor: sqlite3 cursor
+            referral_id (str): Public referral id of the case
+            case_accepted (bool): Whether the case was accepted
+
+        Returns:
+            bool: False if the referral has no referring doctor
+        """
+        cursor.execute('''
+            SELECT referring_doctor, COALESCE(actual_value, estimated_value)
+            FROM referrals WHERE referral_id = ?
+        ''', (referral_id,))
+        result = cursor.fetchone()
+        if not result or not result[0] or not result[0].strip():
+            return False
+
+        name, case_value = result[0].strip(), result[1]
+        counted_value = case_accepted and case_value is not None
+        now = datetime.now()
+
+        cursor.execute('''
+            INSERT INTO referring_doctors
+                (name, name_key, referral_count, accepted_count,
+                 case_value_sum_cents, case_value_count, last_referral_date, updated_at)
+            VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+            ON CONFLICT (name_key) DO UPDATE SET
+                referral_count = referral_count + 1,
+                accepted_count = accepted_count + excluded.accepted_count,
+                case_value_sum_cents = case_value_sum_cents + excluded.case_value_sum_cents,
+                case_value_count = case_value_count + excluded.case_value_count,
+                last_referral_date = excluded.last_referral_date,
+                updated_at = excluded.updated_at
+        ''', (name, normalize_name(name), 1 if case_accepted else 0,
+              to_cents(case_value) if counted_value else 0, 1 if counted_value else 0, now, now))
+        return True
+
+    @staticmethod
+    def top_doctors(conn, limit=10):
+        """Return the referring doctors with the highest conversion rate
+
+        Args:
+            conn: sqlite3 connection
+            limit (int, optional): Number of doctors to return
+
+        Returns:
+            list: Dicts with name, referral_count, accepted_count,
+                conversion_rate (percent), avg_case_value and last_referral_date
+        """
+        cursor = conn.cursor()
+        cursor.execute(TOP_DOCTORS_SQL, (limit,))
+
+        doctors = []
+        for name, total, accepted, value_cents, value_count, last_referral_date in cursor.fetchall():
+            doctors.append({
+                'name': name,
+                'referral_count': total,
+                'accepted_count': accepted,
+                'conversion_rate': round(100.0 * accepted / total, 2) if total else 0.0,
+                'avg_case_value': round(value_cents / value_count / 100, 2) if value_count else 0.0,
+                'last_referral_date': last_referral_date
+            })
+        return doctors
+
+    @staticmethod
+    def rebuild(conn):
+        """Recompute every doctor's counters from case_conversions in one pass
+
+        Doctors that appear in case history but have no row yet are created,
+        and doctors with no outcomes are reset to zero with no last referral
+        date. Case values are taken from the referral's actual value, falling
+        back to its estimate, as record_outcome does. Runs on the caller's
+        transaction and does not commit.
+
+        Args:
+            conn: sqlite3 connection or cursor
+
+        Returns:
+            int: Number of doctors with at least one outcome
+        """
+        conn.execute('''
+            UPDATE referring_doctors
+            SET referral_count = 0, accepted_count = 0,
+                case_value_sum_cents = 0, case_value_count = 0, last_referral_date = NULL
+        ''')
+
+        placeholders = ', '.join('?' for _ in OUTCOME_STAGES)
+        cursor = conn.execute(f'''
+            INSERT INTO referring_doctors
+                (name, name_key, referral_count, accepted_count,
+                 case_value_sum_cents, case_value_count, last_referral_date, updated_at)
+            SELECT MIN(trim(r.referring_doctor)),
+                   lower(trim(r.referring_doctor)),
+                   COUNT(*),
+                   SUM(cc.stage = 'case_accepted'),
+                   COALESCE(SUM(CASE WHEN cc.stage = 'case_accepted'
+                                     THEN CAST(round(COALESCE(r.actual_value, r.estimated_value) * 100) AS INTEGER)
+                                END), 0),
+                   COUNT(CASE WHEN cc.stage = 'case_accepted'
+                              THEN COALESCE(r.actual_value, r.estimated_value) END),
+                   MAX(cc.stage_date),
+                   CURRENT_TIMESTAMP
+            FROM case_conversions cc
+            JOIN referrals r ON r.referral_id = cc.referral_id
+            WHERE cc.stage IN ({placeholders})
+              AND trim(COALESCE(r.referring_doctor, '')) != ''
+            GROUP BY lower(trim(r.referring_doctor))
+            ON CONFLICT (name_key) DO UPDATE SET
+                referral_count = excluded.referral_count,
+                accepted_count = excluded.accepted_count,
+                case_value_sum_cents = excluded.case_value_sum_cents,
+                case_value_count = excluded.case_value_count,
+                last_referral_date = excluded.last_referral_date,
+                updated_at = excluded.updated_at
+        ''', OUTCOME_STAGES)
+        return cursor.rowcount
+
+
+def main(argv=None):
+    from database import connection
+
+    parser = argparse.ArgumentParser(description='Rebuild referring doctor statistics from case history')
+    parser.add_argument('--database', help='SQLite database path (defaults to DATABASE_NAME)')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute counters from case_conversions')
+    args = parser.parse_args(argv)
+
+    if not args.rebuild:
+        parser.error('--rebuild is required')
+
+    with connection(args.database) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            doctors = ReferringDoctorService.rebuild(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f'Rebuilt statistics for {doctors} referring doctor(s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
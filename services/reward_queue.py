@@ -0,0 +1,239 @@
+"""
+Durable SQLite-backed queue for reward issuance
+
+Request handlers call RewardQueue.enqueue on their own transaction, so a
+conversion and its reward job commit together and the HTTP response never
+waits on reward issuance. The worker (cron_jobs/reward_worker.py) claims
+ready jobs in batches under a lease, runs them, and either completes them or
+reschedules them with exponential backoff until they are marked dead.
+
+A job whose worker dies mid-run is reclaimed once its lease expires. The
+handler must therefore be idempotent per event_id; rewards.event_id is
+unique (migration v018) and the issuers insert with ON CONFLICT DO NOTHING,
+so a second run of an event issues nothing.
+"""
+
+import logging
+import os
+import socket
+import time
+
+from config.app_config import get_config
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+DEAD = 'dead'
+
+# Ready jobs: queued ones that are due and running ones whose lease expired
+CLAIM_SQL = '''
+    SELECT id, event_id, attempts + 1 FROM (
+        SELECT id, event_id, attempts, run_after FROM reward_jobs
+        WHERE status = ? AND run_after <= ?
+        UNION ALL
+        SELECT id, event_id, attempts, locked_until FROM reward_jobs
+        WHERE status = ? AND locked_until <= ?
+    )
+    ORDER BY run_after
+    LIMIT ?
+'''
+
+
+def default_worker_id():
+    """Identify this worker process in locked_by"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def backoff_delay(attempts, base=None, maximum=None):
+    """Seconds to wait before retry number ``attempts`` (1-based), doubling each time"""
+    config = get_config()
+    base = config.REWARD_QUEUE_BACKOFF_SECONDS if base is None else base
+    maximum = config.REWARD_QUEUE_MAX_BACKOFF_SECONDS if maximum is None else maximum
+    return min(base * (2 ** max(attempts - 1, 0)), maximum)
+
+
+class RewardQueue:
+    """Service for enqueuing, claiming and settling reward jobs"""
+
+    @staticmethod
+    def enqueue(cursor, event_id, now=None):
+        """Queue reward issuance for a converted referral event
+
+        Runs on the caller's transaction. Enqueuing an event that already
+        has a job is a no-op.
+
+        Args:
+            cursor: sqlite3 cursor or connection
+            event_id (int): referral_events id
+            now (float, optional): Current epoch time
+
+        Returns:
+            bool: True if a new job was created
+        """
+        now = time.time() if now is None else now
+        result = cursor.execute('''
+            INSERT INTO reward_jobs (event_id, status, run_after, created_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (event_id) DO NOTHING
+        ''', (event_id, QUEUED, now, now))
+        return result.rowcount == 1
+
+    @staticmethod
+    def claim(conn, worker_id=None, batch_size=None, lease_seconds=None, now=None):
+        """Lease a batch of ready jobs to a worker
+
+        Ready jobs are queued jobs whose run_after has passed and running
+        jobs whose lease has expired. The select and the lease update run
+        in one IMMEDIATE transaction so two workers never claim the same job.
+
+        Args:
+            conn: sqlite3 connection (committed on return)
+            worker_id (str, optional): Lease owner (defaults to host:pid)
+            batch_size (int, optional): Maximum jobs to claim
+            lease_seconds (float, optional): How long the lease lasts
+            now (float, optional): Current epoch time
+
+        Returns:
+            list: (job_id, event_id, attempts) tuples, attempts including this one
+        """
+        config = get_config()
+        worker_id = worker_id or default_worker_id()
+        batch_size = batch_size or config.REWARD_QUEUE_BATCH_SIZE
+        lease_seconds = config.REWARD_QUEUE_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        now = time.time() if now is None else now
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            jobs = conn.execute(CLAIM_SQL, (QUEUED, now, RUNNING, now, batch_size)).fetchall()
+
+            conn.executemany('''
+                UPDATE reward_jobs
+                SET status = ?, attempts = ?, locked_by = ?, locked_until = ?
+                WHERE id = ?
+            ''', [(RUNNING, attempts, worker_id, now + lease_seconds, job_id)
+                  for job_id, _, attempts in jobs])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return jobs
+
+    @staticmethod
+    def complete(conn, job_id, reward_id=None, now=None):
+        """Mark a job done and record the reward it produced"""
+        conn.execute('''
+            UPDATE reward_jobs
+            SET status = ?, reward_id = ?, completed_at = ?,
+                locked_by = NULL, locked_until = NULL, last_error = NULL
+            WHERE id = ?
+        ''', (DONE, reward_id, time.time() if now is None else now, job_id))
+        conn.commit()
+
+    @staticmethod
+    def complete_many(conn, results, now=None):
+        """Mark several jobs done in one transaction
+
+        Args:
+            conn: sqlite3 connection
+            results (list): (job_id, reward_id) tuples
+        """
+        now = time.time() if now is None else now
+        conn.executemany('''
+            UPDATE reward_jobs
+            SET status = ?, reward_id = ?, completed_at = ?,
+                locked_by = NULL, locked_until = NULL, last_error = NULL
+            WHERE id = ?
+        ''', [(DONE, reward_id, now, job_id) for job_id, reward_id in results])
+        conn.commit()
+
+    @staticmethod
+    def fail(conn, job_id, attempts, error, max_attempts=None, now=None):
+        """Reschedule a failed job with backoff, or mark it dead
+
+        Returns:
+            str: The job's new status ('queued' or 'dead')
+        """
+        max_attempts = max_attempts or get_config().REWARD_QUEUE_MAX_ATTEMPTS
+        now = time.time() if now is None else now
+        status = DEAD if attempts >= max_attempts else QUEUED
+
+        conn.execute('''
+            UPDATE reward_jobs
+            SET status = ?, run_after = ?, last_error = ?,
+                locked_by = NULL, locked_until = NULL
+            WHERE id = ?
+        ''', (status, now + backoff_delay(attempts), str(error)[:1000], job_id))
+        conn.commit()
+        return status
+
+    @staticmethod
+    def run_batch(conn, handler, worker_id=None, batch_size=None, now=None, batch_handler=None):
+        """Claim one batch and run ``handler(event_id)`` for each job
+
+        The handler returns the issued reward id (or None when the event is
+        not eligible); an exception schedules a retry.
+
+        If ``batch_handler(event_ids)`` is given it is tried first for the
+        whole batch and must return an event_id -> reward id dict. When it
+        raises, the batch falls back to ``handler`` one job at a time so a
+        single bad event only delays itself.
+
+        Returns:
+            dict: Counts of claimed, done, retried and dead jobs
+        """
+        jobs = RewardQueue.claim(conn, worker_id=worker_id, batch_size=batch_size, now=now)
+        result = {'claimed': len(jobs), 'done': 0, 'retried': 0, 'dead': 0}
+
+        if batch_handler is not None and jobs:
+            try:
+                reward_ids = batch_handler([event_id for _, event_id, _ in jobs])
+            except Exception as e:
+                logger.warning(f'Reward batch of {len(jobs)} failed, retrying jobs one at a time: {e}')
+            else:
+                RewardQueue.complete_many(conn, [(job_id, reward_ids.get(event_id)) for job_id, event_id, _ in jobs])
+                result['done'] = len(jobs)
+                return result
+
+        for job_id, event_id, attempts in jobs:
+            try:
+                reward_id = handler(event_id)
+            except Exception as e:
+                logger.warning(f'Reward job {job_id} for event {event_id} failed (attempt {attempts}): {e}')
+                status = RewardQueue.fail(conn, job_id, attempts, e)
+                result['dead' if status == DEAD else 'retried'] += 1
+                continue
+            RewardQueue.complete(conn, job_id, reward_id)
+            result['done'] += 1
+
+        return result
+
+    @staticmethod
+    def stats(conn, now=None):
+        """Report queue depth and lag
+
+        Returns:
+            dict: Job counts by status, ready (runnable now), and lag_seconds,
+                the age of the oldest job still waiting to run
+        """
+        now = time.time() if now is None else now
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM reward_jobs GROUP BY status').fetchall())
+        ready, oldest = conn.execute('''
+            SELECT COUNT(*), MIN(created_at) FROM reward_jobs
+            WHERE status = ? AND run_after <= ?
+        ''', (QUEUED, now)).fetchone()
+        waiting_since = conn.execute(
+            'SELECT MIN(created_at) FROM reward_jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+        ).fetchone()[0]
+
+        return {
+            'queued': counts.get(QUEUED, 0),
+            'running': counts.get(RUNNING, 0),
+            'done': counts.get(DONE, 0),
+            'dead': counts.get(DEAD, 0),
+            'depth': counts.get(QUEUED, 0) + counts.get(RUNNING, 0),
+            'ready': ready,
+            'lag_seconds': round(now - oldest, 3) if oldest is not None else 0.0,
+            'oldest_pending_seconds': round(now - waiting_since, 3) if waiting_since is not None else 0.0,
+        }
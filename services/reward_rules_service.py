@@ -0,0 +1,77 @@
+"""
+Cached reward trigger rules
+
+check_reward_triggers used to join every active reward program with its
+triggers on each call. RewardRuleCache loads that join once and groups it
+by trigger type; later lookups cost one primary-key read of the
+'reward_rules' generation, which migration v011 bumps on any write to
+reward_programs, reward_triggers or reward_tiers. A stale generation
+reloads the rules, so edits made by another worker process (or by a
+script) are picked up on the next lookup.
+"""
+
+import threading
+
+GENERATION_KEY = 'reward_rules'
+GENERATION_SQL = 'SELECT generation FROM cache_generations WHERE name = ?'
+
+
+class RewardRuleCache:
+    """Per-process cache of active reward triggers keyed by trigger type"""
+
+    _lock = threading.Lock()
+    _rules = None
+    _generation = None
+
+    @staticmethod
+    def _current_generation(conn):
+        row = conn.execute(GENERATION_SQL, (GENERATION_KEY,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _load(conn):
+        cursor = conn.execute('''
+            SELECT rt.trigger_type, rt.id, rt.program_id, rt.trigger_condition,
+                   rt.trigger_value, rt.points_awarded, rt.tier_advancement
+            FROM reward_triggers rt
+            JOIN reward_programs rp ON rp.id = rt.program_id
+            WHERE rp.status = 'active' AND rt.is_active = TRUE
+            ORDER BY rt.id
+        ''')
+        rules = {}
+        for trigger_type, trigger_id, program_id, condition, value, points, tier_advancement in cursor.fetchall():
+            rules.setdefault(trigger_type, []).append({
+                'trigger_id': trigger_id,
+                'program_id': program_id,
+                'trigger_condition': condition,
+                'trigger_value': value,
+                'points_awarded': points,
+                'tier_advancement': bool(tier_advancement),
+            })
+        return {trigger_type: tuple(items) for trigger_type, items in rules.items()}
+
+    @classmethod
+    def rules_for(cls, conn, trigger_type):
+        """Return the active rules for a trigger type
+
+        Args:
+            conn: sqlite3 connection
+            trigger_type (str): reward_triggers.trigger_type, e.g. 'referral_completed'
+
+        Returns:
+            tuple: Rule dicts with trigger_id, program_id, trigger_condition,
+                trigger_value, points_awarded and tier_advancement
+        """
+        generation = cls._current_generation(conn)
+        with cls._lock:
+            if cls._rules is None or generation is None or generation != cls._generation:
+                cls._rules = cls._load(conn)
+                cls._generation = generation
+            return cls._rules.get(trigger_type, ())
+
+    @classmethod
+    def invalidate(cls):
+        """Drop this process's cached rules"""
+        with cls._lock:
+            cls._rules = None
+            cls._generation = None
@@ -0,0 +1,340 @@
+"""
+Background job scheduler
+
+Periodic maintenance (promotion expiry, counter recovery, bucket pruning)
+used to run from cron scripts that imported the whole app module, with
+Stripe, qrcode and the rate limiter, to run a single UPDATE. JobScheduler
+runs registered jobs from a minimal Flask app (create_job_app) that only
+binds the database, either on a thread inside each gunicorn worker
+(SCHEDULER_ENABLED) or from cron_jobs/scheduler.py.
+
+Each job has a row in scheduler_jobs (migration v014). A worker runs a due
+job only after leasing that row in one UPDATE, so however many workers
+poll, each run happens once; a lease left by a dead worker expires after
+the job's lease_seconds. Every run is recorded in scheduler_runs.
+
+Jobs are registered with @scheduled_job and called with a pooled sqlite3
+connection inside the job app's context, so they can also use the ORM
+session. They import what they need when they run and return a
+JSON-serializable summary for the run history.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from config.app_config import get_config
+from services.reward_queue import default_worker_id
+
+logger = logging.getLogger(__name__)
+
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class ScheduledJob:
+    """A named function run every interval_seconds"""
+
+    def __init__(self, name, func, interval_seconds, lease_seconds=None, description=None):
+        self.name = name
+        self.func = func
+        self.interval_seconds = interval_seconds
+        self.lease_seconds = lease_seconds or get_config().SCHEDULER_LEASE_SECONDS
+        self.description = description or (func.__doc__ or '').strip().split('\n')[0]
+
+    def __repr__(self):
+        return f'<ScheduledJob {self.name} every {self.interval_seconds}s>'
+
+
+JOBS = {}
+
+
+def scheduled_job(name, interval_seconds, lease_seconds=None):
+    """Register a function as a scheduled job
+
+    Args:
+        name (str): Unique job name, the key in scheduler_jobs
+        interval_seconds (float): Seconds between the starts of two runs
+        lease_seconds (float, optional): How long a run may take before
+            another worker may assume it died (defaults to SCHEDULER_LEASE_SECONDS)
+    """
+    def register(func):
+        if name in JOBS:
+            raise ValueError(f'Duplicate scheduled job: {name}')
+        JOBS[name] = ScheduledJob(name, func, interval_seconds, lease_seconds)
+        return func
+    return register
+
+
+def create_job_app(config=None):
+    """Build the minimal Flask app that scheduled jobs run in
+
+    Binds the pooled sqlite3 connections and the SQLAlchemy session to the
+    configured database and nothing else. The URI uses the absolute path of
+    DATABASE_NAME: Flask-SQLAlchemy would resolve a relative sqlite path
+    under instance/, a different file from the one the pool opens.
+    """
+    from flask import Flask
+
+    import database
+    from models import db
+
+    config = config or get_config()
+    app = Flask('sapyyn_jobs')
+    app.config['DATABASE_NAME'] = config.DATABASE_NAME
+    if config.DATABASE_NAME == ':memory:':
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.abspath(config.DATABASE_NAME)}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    database.init_app(app)
+    return app
+
+
+class JobScheduler:
+    """Runs due jobs under per-job leases and records their history"""
+
+    def __init__(self, jobs=None, worker_id=None, database=None, app=None, poll_seconds=None):
+        config = get_config()
+        self.jobs = dict(JOBS if jobs is None else jobs)
+        self.worker_id = worker_id or default_worker_id()
+        self.database = database
+        self.poll_seconds = config.SCHEDULER_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.retry_seconds = config.SCHEDULER_RETRY_SECONDS
+        self._app = app
+        self._synced = False
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def app(self):
+        if self._app is None:
+            self._app = create_job_app()
+        return self._app
+
+    def sync(self, conn, now=None):
+        """Create scheduler_jobs rows for new jobs and update intervals; new jobs are due now"""
+        now = time.time() if now is None else now
+        conn.executemany('''
+            INSERT INTO scheduler_jobs (name, interval_seconds, next_run_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET interval_seconds = excluded.interval_seconds
+        ''', [(job.name, job.interval_seconds, now) for job in self.jobs.values()])
+        conn.commit()
+        self._synced = True
+
+    def claim(self, conn, job, now=None, force=False):
+        """Lease a job if it is due and no live lease is held
+
+        Args:
+            conn: sqlite3 connection (committed on return)
+            job (ScheduledJob): Job to lease
+            now (float, optional): Current epoch time
+            force (bool): Claim even if the job is not due yet
+
+        Returns:
+            int: scheduler_runs id of the started run, or None if not claimed
+        """
+        now = time.time() if now is None else now
+        cursor = conn.execute('''
+            UPDATE scheduler_jobs
+            SET locked_by = ?, locked_until = ?, last_started_at = ?
+            WHERE name = ?
+              AND (? OR next_run_at <= ?)
+              AND (locked_until IS NULL OR locked_until < ?)
+        ''', (self.worker_id, now + job.lease_seconds, now, job.name, bool(force), now, now))
+        if cursor.rowcount != 1:
+            conn.commit()
+            return None
+        run_id = conn.execute('''
+            INSERT INTO scheduler_runs (job_name, worker_id, status, started_at)
+            VALUES (?, ?, ?, ?)
+        ''', (job.name, self.worker_id, RUNNING, now)).lastrowid
+        conn.commit()
+        return run_id
+
+    def finish(self, conn, job, run_id, status, result=None, error=None, started_at=None, now=None):
+        """Release a job's lease, schedule its next run and record the outcome"""
+        now = time.time() if now is None else now
+        started_at = now if started_at is None else started_at
+        if status == SUCCEEDED:
+            next_run_at = max(started_at + job.interval_seconds, now)
+        else:
+            next_run_at = now + min(self.retry_seconds, job.interval_seconds)
+        conn.execute('''
+            UPDATE scheduler_jobs
+            SET locked_by = NULL, locked_until = NULL, next_run_at = ?,
+                last_finished_at = ?, last_status = ?
+            WHERE name = ? AND locked_by = ?
+        ''', (next_run_at, now, status, job.name, self.worker_id))
+        conn.execute('''
+            UPDATE scheduler_runs SET status = ?, finished_at = ?, result = ?, error = ?
+            WHERE id = ?
+        ''', (status, now, json.dumps(result) if result is not None else None, error, run_id))
+        conn.commit()
+
+    def run_job(self, conn, job, now=None, force=False):
+        """Claim and run one job
+
+        now fixes both the start and finish time, for tests; by default they
+        are read when the job is claimed and when it finishes.
+
+        Returns:
+            dict: name, run_id, status and result or error; None if the job
+                was not due or is leased by another worker
+        """
+        started_at = time.time() if now is None else now
+        run_id = self.claim(conn, job, started_at, force=force)
+        if run_id is None:
+            return None
+
+        try:
+            with self.app.app_context():
+                result = job.func(conn)
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.exception(f"Scheduled job {job.name} failed")
+            self.finish(conn, job, run_id, FAILED, error=f'{type(e).__name__}: {e}',
+                        started_at=started_at, now=now)
+            return {'name': job.name, 'run_id': run_id, 'status': FAILED, 'error': str(e)}
+
+        self.finish(conn, job, run_id, SUCCEEDED, result=result, started_at=started_at, now=now)
+        return {'name': job.name, 'run_id': run_id, 'status': SUCCEEDED, 'result': result}
+
+    def run_pending(self, conn=None, now=None):
+        """Run every due job this worker can lease
+
+        Returns:
+            list: Outcomes of the jobs that ran, as returned by run_job
+        """
+        if conn is None:
+            from database import connection
+            with connection(self.database) as conn:
+                return self.run_pending(conn, now)
+
+        if not self._synced:
+            self.sync(conn, now)
+        polled_at = time.time() if now is None else now
+        due = {row[0] for row in conn.execute('''
+            SELECT name FROM scheduler_jobs
+            WHERE next_run_at <= ? AND (locked_until IS NULL OR locked_until < ?)
+        ''', (polled_at, polled_at)).fetchall()}
+        conn.commit()
+
+        outcomes = []
+        for name in sorted(due):
+            job = self.jobs.get(name)
+            if job is not None:
+                # Without a fixed now (tests), each job is leased and finished at the current time
+                outcome = self.run_job(conn, job, now)
+                if outcome is not None:
+                    outcomes.append(outcome)
+        return outcomes
+
+    def start(self):
+        """Poll for due jobs on a daemon thread until stop()"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run_forever, name='job-scheduler', daemon=True)
+        self._thread.start()
+
+    def run_forever(self):
+        """Poll for due jobs on the calling thread until stop()"""
+        while not self._stop.is_set():
+            try:
+                for outcome in self.run_pending():
+                    logger.info(f"Scheduled job finished: {outcome}")
+            except Exception as e:
+                logger.error(f"Scheduler poll failed: {str(e)}")
+            self._stop.wait(self.poll_seconds)
+
+    def stop(self):
+        """Stop polling once the running job, if any, finishes"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    @staticmethod
+    def history(conn, job_name=None, limit=50):
+        """Return the most recent runs, newest first
+
+        Returns:
+            list: Dicts with id, job_name, worker_id, status, started_at,
+                finished_at, result and error
+        """
+        query = '''
+            SELECT id, job_name, worker_id, status, started_at, finished_at, result, error
+            FROM scheduler_runs
+        '''
+        params = []
+        if job_name is not None:
+            query += ' WHERE job_name = ?'
+            params.append(job_name)
+        query += ' ORDER BY started_at DESC, id DESC LIMIT ?'
+        params.append(limit)
+        columns = ('id', 'job_name', 'worker_id', 'status', 'started_at', 'finished_at', 'result', 'error')
+        runs = []
+        for row in conn.execute(query, params).fetchall():
+            run = dict(zip(columns, row))
+            run['result'] = json.loads(run['result']) if run['result'] else None
+            runs.append(run)
+        return runs
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler():
+    """Start this process's scheduler thread once, if SCHEDULER_ENABLED"""
+    global _scheduler
+    if not get_config().SCHEDULER_ENABLED:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+            _scheduler.start()
+        return _scheduler
+
+
+# Jobs
+
+@scheduled_job('expire_promotions', interval_seconds=3600)
+def expire_promotions(conn):
+    """Deactivate promotions past their end date"""
+    from services.promotion_service import PromotionService
+    return {'expired': PromotionService.expire_outdated_promotions()}
+
+
+@scheduled_job('recover_promotion_counters', interval_seconds=300)
+def recover_promotion_counters(conn):
+    """Apply promotion counter spool segments left by exited workers"""
+    from services.promotion_counters import get_counter_buffer
+    return {'segments': get_counter_buffer().flush()}
+
+
+@scheduled_job('send_appointment_reminders', interval_seconds=300)
+def send_appointment_reminders(conn):
+    """Queue reminder emails for appointments starting within REMINDER_LEAD_HOURS"""
+    from services.notification_service import NotificationService
+    return NotificationService.dispatch_due_reminders()
+
+
+@scheduled_job('prune_fraud_signal_buckets', interval_seconds=3600)
+def prune_fraud_signal_buckets(conn):
+    """Delete fraud signal buckets outside every window"""
+    from services.fraud_signal_service import FraudSignalEngine
+    return {'pruned': FraudSignalEngine.prune(conn)}
+
+
+@scheduled_job('prune_scheduler_history', interval_seconds=86400)
+def prune_scheduler_history(conn):
+    """Delete scheduler runs older than SCHEDULER_HISTORY_DAYS"""
+    cutoff = time.time() - get_config().SCHEDULER_HISTORY_DAYS * 86400
+    cursor = conn.execute('DELETE FROM scheduler_runs WHERE started_at < ?', (cutoff,))
+    return {'pruned': cursor.rowcount}
@@ -0,0 +1,127 @@
+"""
+Interval arithmetic for appointment slots
+
+A specialist's free time is their availability windows minus their booked
+appointments. Both are lists of (start, end) datetime intervals, so free
+slots come from merging each list and subtracting one from the other in a
+single sweep, O((windows + bookings) log) for the sort plus one slot per
+result, instead of testing every candidate slot against every appointment.
+
+Slots sit on a grid of step anchored at the start of each merged window, so
+with a 30-minute duration and step a 09:00-12:00 window offers 09:00,
+09:30, ... whatever is booked in between. Buffers pad each booking on both
+sides so that a new appointment cannot start the minute another ends.
+find_conflicts runs the same kind of sweep to check a batch of new bookings
+against each other and against existing ones.
+"""
+
+from datetime import timedelta
+
+
+def merge_intervals(intervals):
+    """Sort intervals and merge the ones that overlap or touch
+
+    Args:
+        intervals (iterable): (start, end) pairs; empty intervals are dropped
+
+    Returns:
+        list: Disjoint (start, end) tuples in order
+    """
+    merged = []
+    for start, end in sorted(interval for interval in intervals if interval[0] < interval[1]):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _grid_slots(anchor, gap_start, gap_end, duration, step, not_before):
+    """Slots of duration on the step grid from anchor that fit in [gap_start, gap_end)"""
+    if not_before is not None and not_before > gap_start:
+        gap_start = not_before
+    # Round gap_start up to the next grid point
+    start = anchor - ((anchor - gap_start) // step) * step
+    slots = []
+    while start + duration <= gap_end:
+        slots.append((start, start + duration))
+        start += step
+    return slots
+
+
+def free_slots(windows, booked, duration, buffer=timedelta(0), step=None, not_before=None, limit=None):
+    """Bookable slots in windows that do not overlap booked intervals
+
+    Args:
+        windows (iterable): Availability (start, end) intervals, in any order
+        booked (iterable): Booked (start, end) intervals, in any order
+        duration (timedelta): Length of each slot
+        buffer (timedelta): Free time required before and after each booking
+        step (timedelta, optional): Distance between slot starts; defaults to duration
+        not_before (datetime, optional): Drop slots starting earlier than this
+        limit (int, optional): Stop after this many slots
+
+    Returns:
+        list: (start, end) tuples in order
+
+    Raises:
+        ValueError: If duration or step is not positive or buffer is negative
+    """
+    step = duration if step is None else step
+    if duration <= timedelta(0) or step <= timedelta(0):
+        raise ValueError("Slot duration and step must be positive")
+    if buffer < timedelta(0):
+        raise ValueError("Buffer cannot be negative")
+
+    busy = merge_intervals((start - buffer, end + buffer) for start, end in booked)
+    slots = []
+    i = 0
+    for window_start, window_end in merge_intervals(windows):
+        # Bookings that ended before this window cannot affect it or later ones
+        while i < len(busy) and busy[i][1] <= window_start:
+            i += 1
+        cursor = window_start
+        j = i
+        while j < len(busy) and busy[j][0] < window_end:
+            if busy[j][0] > cursor:
+                slots.extend(_grid_slots(window_start, cursor, busy[j][0], duration, step, not_before))
+            cursor = max(cursor, busy[j][1])
+            if busy[j][1] >= window_end:
+                break
+            j += 1
+        if cursor < window_end:
+            slots.extend(_grid_slots(window_start, cursor, window_end, duration, step, not_before))
+        if limit is not None and len(slots) >= limit:
+            return slots[:limit]
+    return slots
+
+
+def find_conflicts(requested, booked):
+    """Requested intervals that overlap a booked interval or each other
+
+    Args:
+        requested (list): (start, end) pairs to check, in any order
+        booked (iterable): Existing (start, end) intervals, in any order
+
+    Returns:
+        list: (index, other) pairs in index order, where index is a position
+            in requested and other is the position of the requested interval
+            it overlaps, or None for a booked one
+    """
+    busy = merge_intervals(booked)
+    conflicts = {}
+    latest = None  # index of the requested interval ending last so far
+    b = 0
+    for index in sorted(range(len(requested)), key=lambda i: requested[i]):
+        start, end = requested[index]
+        if latest is not None and start < requested[latest][1]:
+            conflicts.setdefault(index, latest)
+            conflicts.setdefault(latest, index)
+        if latest is None or end > requested[latest][1]:
+            latest = index
+        while b < len(busy) and busy[b][1] <= start:
+            b += 1
+        if b < len(busy) and busy[b][0] < end:
+            conflicts[index] = None
+    return sorted(conflicts.items())
@@ -0,0 +1,92 @@
+"""
+Team productivity counters keyed by (user_id, date)
+"""
+
+from datetime import date, datetime
+
+# Case statuses that count as handling a referral
+PROCESSED_STATUSES = ('consultation_scheduled', 'case_accepted', 'case_rejected')
+
+_UPSERT_SQL = '''
+    INSERT INTO team_metrics
+        (user_id, date, referrals_processed, consultations_completed, cases_accepted)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, date) DO UPDATE SET
+        referrals_processed = referrals_processed + excluded.referrals_processed,
+        consultations_completed = consultations_completed + excluded.consultations_completed,
+        cases_accepted = cases_accepted + excluded.cases_accepted
+'''
+
+
+def status_increments(status):
+    """Return the (processed, consultations, accepted) deltas for a case status"""
+    return (
+        1 if status in PROCESSED_STATUSES else 0,
+        1 if status == 'consultation_scheduled' else 0,
+        1 if status == 'case_accepted' else 0,
+    )
+
+
+def _day(value):
+    """Normalize a date, datetime or ISO string to the stored YYYY-MM-DD form"""
+    if value is None:
+        return datetime.now().date().isoformat()
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)[:10]
+
+
+class TeamMetricsService:
+    """Service for recording case status changes in team_metrics"""
+
+    @staticmethod
+    def record_status(cursor, user_id, status, day=None):
+        """Count one case status change for a user in a single statement
+
+        Runs on the caller's transaction.
+
+        Args:
+            cursor: sqlite3 cursor
+            user_id (int): Team member who made the change
+            status (str): New case status
+            day (date, optional): Day to count it on (defaults to today)
+        """
+        cursor.execute(_UPSERT_SQL, (user_id, _day(day), *status_increments(status)))
+
+    @staticmethod
+    def record_events(conn, events):
+        """Apply a batch of case status changes in one transaction
+
+        Events for the same user and day are summed first, so each
+        team_metrics row is written once however many events it receives.
+
+        Args:
+            conn: sqlite3 connection
+            events (iterable): (user_id, status, day) tuples; day may be a
+                date, datetime, ISO string or None for today
+
+        Returns:
+            int: Number of team_metrics rows written
+
+        Raises:
+            ValueError: If an event has no user_id or status
+        """
+        totals = {}
+        for user_id, status, day in events:
+            if not user_id or not status:
+                raise ValueError('Each event needs a user_id and a status')
+            counters = totals.setdefault((user_id, _day(day)), [0, 0, 0])
+            for index, delta in enumerate(status_increments(status)):
+                counters[index] += delta
+
+        params = [key + tuple(counters) for key, counters in sorted(totals.items())]
+
+        try:
+            conn.executemany(_UPSERT_SQL, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(params)
@@ -0,0 +1,210 @@
+"""
+Per-user summary counters backing the dashboard and /api/stats
+
+The counters live in user_stats and user_stat_counts and are kept current
+by triggers on referrals and documents (see migration v004), so readers
+here never aggregate over a user's full history.
+
+Usage:
+    python -m services.user_stats_service --rebuild            # all users
+    python -m services.user_stats_service --rebuild --user 42  # one user
+    python -m services.user_stats_service --check              # report drift
+"""
+
+import argparse
+import sys
+
+REFERRAL_STATUS = 'referral_status'
+DOCUMENT_TYPE = 'document_type'
+# find_drift reports the user_stats totals under this kind, keyed by column
+TOTAL = 'total'
+
+STATS_TOTALS_SQL = '''
+    SELECT referral_total, document_total, last_activity_at
+    FROM user_stats
+    WHERE user_id = ?
+'''
+STAT_COUNTS_SQL = '''
+    SELECT kind, key, count
+    FROM user_stat_counts
+    WHERE user_id = ? AND count > 0
+'''
+
+
+class UserStatsService:
+    """Service for reading and repairing materialized per-user counters"""
+
+    @staticmethod
+    def get_stats(conn, user_id):
+        """Read a user's counters
+
+        Args:
+            conn: sqlite3 connection
+            user_id (int): User to read
+
+        Returns:
+            dict: referral_total, document_total, last_activity_at,
+                status_counts and document_counts
+        """
+        cursor = conn.cursor()
+        cursor.execute(STATS_TOTALS_SQL, (user_id,))
+        row = cursor.fetchone() or (0, 0, None)
+
+        stats = {
+            'referral_total': row[0],
+            'document_total': row[1],
+            'last_activity_at': row[2],
+            'status_counts': {},
+            'document_counts': {},
+        }
+
+        cursor.execute(STAT_COUNTS_SQL, (user_id,))
+        for kind, key, count in cursor.fetchall():
+            if kind == REFERRAL_STATUS:
+                stats['status_counts'][key] = count
+            elif kind == DOCUMENT_TYPE:
+                stats['document_counts'][key] = count
+
+        return stats
+
+    @staticmethod
+    def rebuild(conn, user_id=None):
+        """Recompute counters from the source tables
+
+        Runs on the caller's transaction and does not commit.
+
+        Args:
+            conn: sqlite3 connection or cursor
+            user_id (int, optional): Only rebuild this user (defaults to all)
+
+        Returns:
+            int: Number of user_stats rows written
+        """
+        if user_id is None:
+            where, params = '', ()
+            conn.execute('DELETE FROM user_stat_counts')
+            conn.execute('DELETE FROM user_stats')
+        else:
+            where, params = 'AND user_id = ?', (user_id,)
+            conn.execute('DELETE FROM user_stat_counts WHERE user_id = ?', params)
+            conn.execute('DELETE FROM user_stats WHERE user_id = ?', params)
+
+        conn.execute(f'''
+            INSERT INTO user_stat_counts (user_id, kind, key, count)
+            SELECT user_id, '{REFERRAL_STATUS}', COALESCE(status, ''), COUNT(*)
+            FROM referrals
+            WHERE user_id IS NOT NULL {where}
+            GROUP BY user_id, COALESCE(status, '')
+        ''', params)
+        conn.execute(f'''
+            INSERT INTO user_stat_counts (user_id, kind, key, count)
+            SELECT user_id, '{DOCUMENT_TYPE}', COALESCE(file_type, ''), COUNT(*)
+            FROM documents
+            WHERE user_id IS NOT NULL {where}
+            GROUP BY user_id, COALESCE(file_type, '')
+        ''', params)
+
+        # Totals and last activity come from the referral and document
+        # histories together; a user with neither gets no row.
+        cursor = conn.execute(f'''
+            INSERT INTO user_stats (user_id, referral_total, document_total, last_activity_at)
+            SELECT user_id, SUM(is_referral), SUM(1 - is_referral), MAX(activity_at)
+            FROM (
+                SELECT user_id, 1 AS is_referral, created_at AS activity_at
+                FROM referrals WHERE user_id IS NOT NULL {where}
+                UNION ALL
+                SELECT user_id, 0, upload_date
+                FROM documents WHERE user_id IS NOT NULL {where}
+            )
+            GROUP BY user_id
+        ''', params + params)
+        return cursor.rowcount
+
+    @staticmethod
+    def find_drift(conn):
+        """List users whose stored counters disagree with the source tables
+
+        Covers the user_stat_counts breakdowns and the user_stats totals.
+        last_activity_at is not compared: the triggers stamp it with the
+        write time, which the source rows do not record.
+
+        Returns:
+            list: (user_id, kind, key, stored, actual) tuples
+        """
+        cursor = conn.execute(f'''
+            WITH actual AS (
+                SELECT user_id, '{REFERRAL_STATUS}' AS kind, COALESCE(status, '') AS key, COUNT(*) AS count
+                FROM referrals WHERE user_id IS NOT NULL
+                GROUP BY user_id, COALESCE(status, '')
+                UNION ALL
+                SELECT user_id, '{DOCUMENT_TYPE}', COALESCE(file_type, ''), COUNT(*)
+                FROM documents WHERE user_id IS NOT NULL
+                GROUP BY user_id, COALESCE(file_type, '')
+                UNION ALL
+                SELECT user_id, '{TOTAL}', 'referral_total', COUNT(*)
+                FROM referrals WHERE user_id IS NOT NULL
+                GROUP BY user_id
+                UNION ALL
+                SELECT user_id, '{TOTAL}', 'document_total', COUNT(*)
+                FROM documents WHERE user_id IS NOT NULL
+                GROUP BY user_id
+            ),
+            stored AS (
+                SELECT user_id, kind, key, count FROM user_stat_counts WHERE count != 0
+                UNION ALL
+                SELECT user_id, '{TOTAL}', 'referral_total', referral_total
+                FROM user_stats WHERE referral_total != 0
+                UNION ALL
+                SELECT user_id, '{TOTAL}', 'document_total', document_total
+                FROM user_stats WHERE document_total != 0
+            )
+            SELECT a.user_id, a.kind, a.key, COALESCE(s.count, 0), a.count
+            FROM actual a
+            LEFT JOIN stored s ON s.user_id = a.user_id AND s.kind = a.kind AND s.key = a.key
+            WHERE COALESCE(s.count, 0) != a.count
+            UNION ALL
+            SELECT s.user_id, s.kind, s.key, s.count, 0
+            FROM stored s
+            LEFT JOIN actual a ON a.user_id = s.user_id AND a.kind = s.kind AND a.key = s.key
+            WHERE a.user_id IS NULL
+            ORDER BY 1, 2, 3
+        ''')
+        return cursor.fetchall()
+
+
+def main(argv=None):
+    from database import connection
+
+    parser = argparse.ArgumentParser(description='Check or rebuild the per-user summary counters')
+    parser.add_argument('--database', help='SQLite database path (defaults to DATABASE_NAME)')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute counters from the source tables')
+    parser.add_argument('--check', action='store_true', help='Report counters that have drifted')
+    parser.add_argument('--user', type=int, help='Limit --rebuild to a single user id')
+    args = parser.parse_args(argv)
+
+    if not (args.rebuild or args.check):
+        parser.error('one of --rebuild or --check is required')
+
+    with connection(args.database) as conn:
+        if args.check:
+            drift = UserStatsService.find_drift(conn)
+            for user_id, kind, key, stored, actual in drift:
+                print(f'user {user_id} {kind}={key!r}: stored {stored}, actual {actual}')
+            print(f'{len(drift)} drifted counter(s)')
+            if drift and not args.rebuild:
+                return 1
+
+        if args.rebuild:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = UserStatsService.rebuild(conn, user_id=args.user)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print(f'Rebuilt counters for {rows} user(s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
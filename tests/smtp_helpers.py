@@ -0,0 +1,62 @@
+"""Local SMTP server helpers shared by the email delivery tests"""
+
+import os
+import socket
+import sys
+from email import message_from_bytes
+from aiosmtpd.controller import Controller
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.email_outbox import MailerPool
+from services.mailer import SMTPMailer
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RecordingHandler:
+    """aiosmtpd handler that refuses bounce@ permanently and busy@ temporarily"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('bounce@'):
+            return '550 No such user'
+        if address.startswith('busy@'):
+            return '451 Mailbox busy, try again later'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(message_from_bytes(envelope.content))
+        return '250 OK'
+
+
+class SMTPTestMixin:
+    """Starts a local aiosmtpd server and a pool of mailers pointed at it"""
+
+    def serve_smtp(self):
+        self.handler = RecordingHandler()
+        self.smtp = Controller(self.handler, hostname='127.0.0.1', port=free_port())
+        self.smtp.start()
+
+    def start_smtp(self):
+        self.serve_smtp()
+        self.mailers = []
+        self.pool = MailerPool(size=4, factory=self.mailer_factory(self.smtp.port))
+
+    def mailer_factory(self, port):
+        def factory():
+            mailer = SMTPMailer(server='127.0.0.1', port=port, use_tls=False, username='')
+            self.mailers.append(mailer)
+            return mailer
+        return factory
+
+    def stop_smtp(self):
+        self.pool.close()
+        self.smtp.stop()
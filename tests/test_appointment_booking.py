@@ -0,0 +1,118 @@
+import unittest
+import os
+import sys
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import event
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import db, Appointment, User
+from services.appointment_service import AppointmentService
+from services.slot_engine import find_conflicts
+
+START = datetime(2030, 6, 3, 9)
+
+
+def booking(offset_minutes, length_minutes=30, specialist_id=2, **extra):
+    start = START + timedelta(minutes=offset_minutes)
+    data = {
+        'patient_id': 1, 'specialist_id': specialist_id, 'title': 'Consult', 'created_by': 1,
+        'start_time': start, 'end_time': start + timedelta(minutes=length_minutes),
+    }
+    data.update(extra)
+    return data
+
+
+class FindConflictsTestCase(unittest.TestCase):
+    """Test cases for overlap detection between new and existing bookings"""
+
+    def test_batch_and_existing_overlaps(self):
+        """Test that clashes within the batch and with bookings are both found"""
+        at = lambda hour, minute=0: START.replace(hour=hour, minute=minute)
+        requested = [(at(11), at(12)), (at(9), at(10)), (at(11, 30), at(11, 45)), (at(10), at(10, 30))]
+        booked = [(at(10, 15), at(10, 45))]
+        self.assertEqual(find_conflicts(requested, booked), [(0, 2), (2, 0), (3, None)])
+        self.assertEqual(find_conflicts(requested[1:2], booked), [])
+
+
+class BulkAppointmentTestCase(unittest.TestCase):
+    """Test cases for creating appointments in bulk"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        for username, role in [('patient', 'patient'), ('endo', 'specialist'), ('ortho', 'specialist')]:
+            db.session.add(User(username=username, email=f'{username}@example.com',
+                                password_hash='x', full_name=username.title(), role=role))
+        db.session.commit()
+        AppointmentService.create_appointment(booking(0))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def count_queries(self, func, *args):
+        statements = []
+        listener = lambda *params: statements.append(params[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            result = func(*args)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return result, [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+
+    def test_creates_a_week_in_one_transaction(self):
+        """Test that a batch for two specialists is validated with a fixed number of queries"""
+        batch = [booking(day * 1440 + 60 * hour, specialist_id=2 + hour % 2)
+                 for day in range(5) for hour in range(1, 7)]
+        appointments, selects = self.count_queries(AppointmentService.create_appointments, batch)
+        self.assertEqual(len(appointments), 30)
+        self.assertTrue(all(appointment.id for appointment in appointments))
+        # users, then one range query per specialist
+        self.assertEqual(len(selects), 3)
+        self.assertEqual(Appointment.query.count(), 31)
+
+    def test_conflict_with_existing_booking_creates_nothing(self):
+        """Test that one clash rejects the whole batch"""
+        with self.assertRaisesRegex(ValueError, 'index 1: time conflicts with an existing appointment'):
+            AppointmentService.create_appointments([booking(60), booking(15), booking(120)])
+        self.assertEqual(Appointment.query.count(), 1)
+
+    def test_conflict_within_batch(self):
+        """Test that overlapping appointments in the batch are rejected, other specialists are not"""
+        with self.assertRaisesRegex(ValueError, 'index 0: time conflicts with appointment at index 2'):
+            AppointmentService.create_appointments([booking(60), booking(15, specialist_id=3), booking(75)])
+        created = AppointmentService.create_appointments([booking(60), booking(15, specialist_id=3)])
+        self.assertEqual(len(created), 2)
+
+    def test_validation_names_the_item(self):
+        """Test that missing users, referrals and bad times are reported by index"""
+        cases = [
+            (booking(60, patient_id=99), 'index 0: Patient with ID 99 not found'),
+            (booking(60, specialist_id=1), 'index 0: Specialist with ID 1 not found'),
+            (booking(60, referral_id=5), 'index 0: Referral with ID 5 not found'),
+            (booking(60, length_minutes=5), 'index 0: Appointment must be at least 15 minutes long'),
+        ]
+        for data, message in cases:
+            with self.subTest(message=message):
+                with self.assertRaisesRegex(ValueError, message):
+                    AppointmentService.create_appointments([data])
+        self.assertEqual(AppointmentService.create_appointments([]), [])
+
+    def test_single_create_still_checks_conflicts(self):
+        """Test that create_appointment shares the validation and conflict check"""
+        with self.assertRaisesRegex(ValueError, 'conflicts'):
+            AppointmentService.create_appointment(booking(10))
+        with self.assertRaisesRegex(ValueError, 'Creator with ID 42 not found'):
+            AppointmentService.create_appointment(booking(60, created_by=42))
+
+
+if __name__ == '__main__':
+    unittest.main()
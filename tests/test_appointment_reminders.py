@@ -0,0 +1,118 @@
+import unittest
+import os
+import sys
+import socket
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import (
+    db, Appointment, AppointmentNotification, AppointmentStatus, DeliveryStatus, NotificationType, User
+)
+from services.email_outbox import EmailOutbox, MailerPool
+from services.mailer import SMTPMailer, build_message
+from services.notification_service import NotificationService
+from smtp_helpers import SMTPTestMixin
+
+NOW = datetime(2030, 6, 3, 7)
+
+
+class AppointmentReminderTestCase(SMTPTestMixin, unittest.TestCase):
+    """Test cases for the batched appointment reminder pipeline"""
+
+    def setUp(self):
+        # A file database, so the email worker's connection sees the queued reminders
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.path}'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.serve_smtp()
+        self.mailer = SMTPMailer(server='127.0.0.1', port=self.smtp.port, use_tls=False, username='')
+        self.pool = MailerPool(factory=lambda: self.mailer)
+
+        for username, role in [('ann', 'patient'), ('bounce', 'patient'), ('dr', 'specialist')]:
+            db.session.add(User(username=username, email=f'{username}@example.com',
+                                password_hash='x', full_name=username.title(), role=role))
+        db.session.flush()
+        # (patient, hours from now, status)
+        for patient_id, hours, status in [
+            (1, 2, AppointmentStatus.SCHEDULED),
+            (2, 5, AppointmentStatus.SCHEDULED),
+            (1, 23, AppointmentStatus.SCHEDULED),
+            (1, 30, AppointmentStatus.SCHEDULED),  # not due yet
+            (1, -1, AppointmentStatus.SCHEDULED),  # already started
+            (1, 3, AppointmentStatus.CANCELED),
+            (1, 4, AppointmentStatus.SCHEDULED),   # already reminded
+        ]:
+            start = NOW + timedelta(hours=hours)
+            db.session.add(Appointment(patient_id=patient_id, specialist_id=3, title='Consult', created_by=3,
+                                       start_time=start, end_time=start + timedelta(minutes=30), status=status))
+        db.session.add(AppointmentNotification(appointment_id=7, user_id=1,
+                                               notification_type=NotificationType.REMINDER))
+        db.session.commit()
+
+    def tearDown(self):
+        self.mailer.close()
+        self.smtp.stop()
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        os.remove(self.path)
+
+    def deliver(self):
+        with sqlite3.connect(self.path) as conn:
+            return EmailOutbox.run_batch(conn, self.pool, worker_id='test')
+
+    def reminder_statuses(self):
+        return dict(db.session.query(
+            AppointmentNotification.appointment_id, AppointmentNotification.delivery_status
+        ).filter(AppointmentNotification.notification_type == NotificationType.REMINDER).all())
+
+    def test_dispatches_due_reminders_once(self):
+        """Test that due appointments are queued in batches and delivered by the outbox worker"""
+        metrics = NotificationService.dispatch_due_reminders(now=NOW, lead_hours=24, batch_size=2)
+        self.assertEqual((metrics['reminded'], metrics['queued'], metrics['failed'], metrics['batches']),
+                         (3, 3, 0, 2))
+        # The 23-hours-out appointment fell due one hour ago
+        self.assertAlmostEqual(metrics['max_lag_seconds'], 22 * 3600, delta=60)
+        self.assertEqual(self.handler.messages, [])
+
+        result = self.deliver()
+        self.assertEqual((result['sent'], result['dead']), (2, 1))
+        self.assertEqual(self.mailer.connections_opened, 1)
+        self.assertEqual([message['To'] for message in self.handler.messages],
+                         ['ann@example.com', 'ann@example.com'])
+        self.assertEqual(self.handler.messages[0]['Subject'], 'Reminder: Your appointment with Dr')
+        db.session.expire_all()
+        self.assertEqual(self.reminder_statuses(), {
+            1: DeliveryStatus.DELIVERED, 2: DeliveryStatus.FAILED, 3: DeliveryStatus.DELIVERED, 7: DeliveryStatus.SENT,
+        })
+
+        metrics = NotificationService.dispatch_due_reminders(now=NOW, lead_hours=24)
+        self.assertEqual((metrics['reminded'], metrics['batches']), (0, 0))
+        self.assertEqual(self.deliver()['claimed'], 0)
+
+    def test_mailer_reconnects_after_the_server_drops_it(self):
+        """Test that a dropped idle connection is replaced transparently"""
+        self.mailer.send(build_message('ann@example.com', 'One', 'Body'))
+        self.mailer._connection.sock.shutdown(socket.SHUT_RDWR)
+        self.mailer.send(build_message('ann@example.com', 'Two', 'Body'))
+        self.assertEqual(len(self.handler.messages), 2)
+        self.assertEqual(self.mailer.connections_opened, 2)
+
+    def test_single_reminder_for_scheduled_appointment(self):
+        """Test that send_appointment_reminder accepts scheduled appointments"""
+        self.assertTrue(NotificationService.send_appointment_reminder(1))
+        self.assertFalse(NotificationService.send_appointment_reminder(6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import os
+import sys
+import sqlite3
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from services.conversion_rollup_service import ConversionRollupService
+
+# The per-request query the rollups replace
+FUNNEL_SCAN = '''
+    SELECT COALESCE(case_status, 'pending'), COUNT(*),
+           AVG(COALESCE(estimated_value, 0)), AVG(COALESCE(actual_value, 0))
+    FROM referrals
+    WHERE created_at >= date('now', ?)
+    GROUP BY COALESCE(case_status, 'pending')
+'''
+
+
+class ConversionRollupTestCase(unittest.TestCase):
+    """Test cases for the daily conversion funnel rollups"""
+
+    def setUp(self):
+        """Create a migrated database with referrals spread over a year"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+        self.conn.executemany(
+            '''INSERT INTO referrals (user_id, referral_id, patient_name, estimated_value, created_at)
+               VALUES (?, ?, ?, ?, datetime('now', ?))''',
+            [(1, f'R{i}', 'Patient', 100 * (i % 4) or None, f'-{i * 3} days') for i in range(120)]
+        )
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def scan(self, days):
+        rows = self.conn.execute(FUNNEL_SCAN, (f'-{days} days',)).fetchall()
+        return {
+            status: {'count': count, 'avg_estimated_value': round(estimated, 2),
+                     'avg_actual_value': round(actual, 2)}
+            for status, count, estimated, actual in rows
+        }
+
+    def update_status(self, referral_id, status, actual_value=None):
+        self.conn.execute(
+            'UPDATE referrals SET case_status = ?, actual_value = ? WHERE referral_id = ?',
+            (status, actual_value, referral_id)
+        )
+
+    def test_rollups_match_full_scan(self):
+        """Test that every window agrees with aggregating referrals directly"""
+        self.update_status('R1', 'case_accepted', 2500)
+        self.update_status('R2', 'case_rejected')
+        self.update_status('R40', 'case_accepted', 900)
+        self.update_status('R1', 'treatment_completed', 3000)
+        self.conn.execute("DELETE FROM referrals WHERE referral_id = 'R5'")
+
+        for days in (7, 30, 90, 365):
+            with self.subTest(days=days):
+                self.assertEqual(ConversionRollupService.get_funnel(self.conn, days), self.scan(days))
+
+    def test_status_change_moves_bucket(self):
+        """Test that a case status update moves the referral between statuses"""
+        before = ConversionRollupService.get_funnel(self.conn, 7)
+        self.update_status('R0', 'case_accepted', 1200)
+        after = ConversionRollupService.get_funnel(self.conn, 7)
+
+        self.assertEqual(after['pending']['count'], before['pending']['count'] - 1)
+        self.assertEqual(after['case_accepted'], {
+            'count': 1, 'avg_estimated_value': 0.0, 'avg_actual_value': 1200.0
+        })
+
+    def test_rebuild_matches_incremental(self):
+        """Test that a rebuild reproduces the trigger-maintained buckets"""
+        self.update_status('R3', 'consultation_scheduled')
+        incremental = self.conn.execute(
+            'SELECT * FROM conversion_daily_rollups WHERE referral_count > 0 ORDER BY 1, 2').fetchall()
+
+        ConversionRollupService.rebuild(self.conn)
+        rebuilt = self.conn.execute('SELECT * FROM conversion_daily_rollups ORDER BY 1, 2').fetchall()
+        self.assertEqual(incremental, rebuilt)
+
+    def test_unsupported_window(self):
+        """Test that only the dashboard windows are accepted"""
+        with self.assertRaises(ValueError):
+            ConversionRollupService.get_funnel(self.conn, 14)
+
+
+if __name__ == '__main__':
+    unittest.main()
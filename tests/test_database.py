@@ -0,0 +1,111 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from flask import Flask
+
+# Add parent directory to path to import database
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+from database import ConnectionPool, get_db, close_db, connection
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    """Test cases for the pooled SQLite connection layer"""
+
+    def setUp(self):
+        """Create a throwaway database file and a Flask app using it"""
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = Flask(__name__)
+        self.app.config['DATABASE_NAME'] = self.db_path
+        database.init_app(self.app)
+
+    def tearDown(self):
+        """Close pooled connections and remove the database file"""
+        close_db()
+        pool = database._pools.pop(self.db_path, None)
+        if pool is not None:
+            pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_pragmas_applied(self):
+        """Test that new connections are configured for WAL and NORMAL sync"""
+        pool = ConnectionPool(self.db_path, max_size=1)
+        conn = pool.acquire()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertGreater(conn.execute('PRAGMA busy_timeout').fetchone()[0], 0)
+        pool.release(conn)
+        pool.close_all()
+
+    def test_connection_reused_within_request(self):
+        """Test that get_db returns the same connection for a whole request"""
+        with self.app.app_context():
+            first = get_db()
+            second = get_db()
+            self.assertIs(first, second)
+        pool = database.get_pool(self.db_path)
+        self.assertEqual(pool.idle, 1)
+
+    def test_teardown_rolls_back_uncommitted_work(self):
+        """Test that connections are returned to the pool without open transactions"""
+        with self.app.app_context():
+            conn = get_db()
+            conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+            conn.commit()
+            conn.execute('INSERT INTO items DEFAULT VALUES')
+
+        with self.app.app_context():
+            conn = get_db()
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM items').fetchone()[0], 0)
+
+    def test_pool_is_bounded(self):
+        """Test that the pool never opens more than max_size connections"""
+        pool = ConnectionPool(self.db_path, max_size=2, timeout=0.05)
+        first = pool.acquire()
+        second = pool.acquire()
+        with self.assertRaises(Exception):
+            pool.acquire()
+        pool.release(first)
+        self.assertIs(pool.acquire(), first)
+        pool.release(first)
+        pool.release(second)
+        self.assertEqual(pool.size, 2)
+        pool.close_all()
+
+    def test_concurrent_requests(self):
+        """Test that concurrent threads each get their own pooled connection"""
+        with connection(self.db_path) as conn:
+            conn.execute('CREATE TABLE hits (thread TEXT)')
+            conn.commit()
+
+        errors = []
+
+        def worker(name):
+            try:
+                with self.app.app_context():
+                    for _ in range(20):
+                        conn = get_db()
+                        conn.execute('INSERT INTO hits (thread) VALUES (?)', (name,))
+                        conn.commit()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(str(i),)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        with connection(self.db_path) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM hits').fetchone()[0], 160)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import unittest
+import os
+import sys
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from models import db, Appointment, AppointmentNotification, DeliveryStatus, User
+from services.email_outbox import DEAD, QUEUED, SENT, EmailOutbox, MailerPool, recipient_domain
+from services.notification_service import NotificationService
+from smtp_helpers import SMTPTestMixin, free_port
+
+NOW = 1_700_000_000.0
+
+
+class EmailOutboxTestCase(SMTPTestMixin, unittest.TestCase):
+    """Test cases for queueing and delivering email through the outbox"""
+
+    def setUp(self):
+        """Create a migrated database and a local SMTP server"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+        self.start_smtp()
+
+    def tearDown(self):
+        """Stop the SMTP server and close the test database"""
+        self.stop_smtp()
+        self.conn.close()
+
+    def enqueue(self, *recipients, now=NOW):
+        for recipient in recipients:
+            EmailOutbox.enqueue(self.conn, recipient, f'Hello {recipient}', 'Body', now=now)
+        self.conn.commit()
+
+    def statuses(self):
+        return dict(self.conn.execute('SELECT recipient, status FROM email_outbox').fetchall())
+
+    def test_enqueue_waits_for_the_callers_commit(self):
+        """Test that a rolled-back transaction leaves nothing to send"""
+        EmailOutbox.enqueue(self.conn, 'Ann@Example.COM', 'Hi', 'Body', now=NOW)
+        self.conn.rollback()
+        self.assertEqual(EmailOutbox.stats(self.conn, now=NOW)['queued'], 0)
+
+        self.enqueue('Ann@Example.COM')
+        self.assertEqual(self.conn.execute('SELECT domain FROM email_outbox').fetchone()[0], 'example.com')
+        self.assertEqual(recipient_domain('x@Mail.Example.org '), 'mail.example.org')
+
+    def test_batch_is_sent_with_one_connection_per_domain(self):
+        """Test that messages are grouped by domain over persistent connections"""
+        self.enqueue('a@one.test', 'b@two.test', 'c@one.test', 'd@two.test', 'e@one.test')
+        result = EmailOutbox.run_batch(self.conn, self.pool, worker_id='w', now=NOW + 1)
+
+        self.assertEqual((result['claimed'], result['sent']), (5, 5))
+        self.assertEqual([message['To'] for message in self.handler.messages],
+                         ['a@one.test', 'c@one.test', 'e@one.test', 'b@two.test', 'd@two.test'])
+        self.assertEqual([mailer.connections_opened for mailer in self.mailers], [1, 1])
+        self.assertEqual(set(self.statuses().values()), {SENT})
+
+        # The next batch reuses the open connections
+        self.enqueue('f@one.test', now=NOW + 2)
+        EmailOutbox.run_batch(self.conn, self.pool, worker_id='w', now=NOW + 3)
+        self.assertEqual([mailer.connections_opened for mailer in self.mailers], [1, 1])
+
+    def test_permanent_refusal_is_dead_and_temporary_retries(self):
+        """Test that 5xx refusals are not retried and 4xx refusals back off"""
+        self.enqueue('bounce@one.test', 'busy@one.test', 'ok@one.test')
+        result = EmailOutbox.run_batch(self.conn, self.pool, worker_id='w', now=NOW + 1)
+
+        self.assertEqual((result['sent'], result['retried'], result['dead']), (1, 1, 1))
+        self.assertEqual(self.statuses(), {'bounce@one.test': DEAD, 'busy@one.test': QUEUED, 'ok@one.test': SENT})
+        run_after, attempts, error = self.conn.execute(
+            "SELECT run_after, attempts, last_error FROM email_outbox WHERE recipient = 'busy@one.test'"
+        ).fetchone()
+        self.assertGreater(run_after, NOW + 1)
+        self.assertEqual(attempts, 1)
+        self.assertIn('451', error)
+
+        # Not ready until the backoff passes
+        self.assertEqual(EmailOutbox.run_batch(self.conn, self.pool, now=NOW + 2)['claimed'], 0)
+        self.assertEqual(EmailOutbox.run_batch(self.conn, self.pool, now=run_after)['retried'], 1)
+
+    def test_malformed_message_does_not_abort_the_batch(self):
+        """Test that a message that cannot be built is dead and the rest are sent"""
+        EmailOutbox.enqueue(self.conn, 'evil@one.test', 'Hi\nBcc: x@two.test', 'Body', now=NOW)
+        self.enqueue('ok@one.test')
+        result = EmailOutbox.run_batch(self.conn, self.pool, worker_id='w', now=NOW + 1)
+
+        self.assertEqual((result['sent'], result['dead']), (1, 1))
+        self.assertEqual(self.statuses(), {'evil@one.test': DEAD, 'ok@one.test': SENT})
+        self.assertEqual([message['To'] for message in self.handler.messages], ['ok@one.test'])
+
+    def test_unreachable_server_defers_rest_of_domain(self):
+        """Test that a connection failure spends one attempt and puts the group back"""
+        self.enqueue('a@down.test', 'b@down.test', 'c@down.test')
+        pool = MailerPool(size=1, factory=self.mailer_factory(free_port()))
+        result = EmailOutbox.run_batch(self.conn, pool, worker_id='w', now=NOW + 1)
+        pool.close()
+
+        self.assertEqual((result['retried'], result['deferred']), (1, 2))
+        attempts = dict(self.conn.execute('SELECT recipient, attempts FROM email_outbox').fetchall())
+        self.assertEqual(attempts, {'a@down.test': 1, 'b@down.test': 0, 'c@down.test': 0})
+        self.assertEqual(set(self.statuses().values()), {QUEUED})
+
+    def test_expired_lease_is_redelivered(self):
+        """Test that messages held by a dead worker are claimed again"""
+        self.enqueue('a@one.test')
+        self.assertEqual(len(EmailOutbox.claim(self.conn, 'dead', lease_seconds=60, now=NOW + 1)), 1)
+        self.assertEqual(EmailOutbox.run_batch(self.conn, self.pool, now=NOW + 30)['claimed'], 0)
+
+        result = EmailOutbox.run_batch(self.conn, self.pool, now=NOW + 61)
+        self.assertEqual(result['sent'], 1)
+        self.assertEqual(EmailOutbox.stats(self.conn, now=NOW + 61)['sent'], 1)
+
+    def test_pool_evicts_least_recently_used(self):
+        """Test that the pool closes the oldest connection beyond its size"""
+        pool = MailerPool(size=2, factory=self.mailer_factory(self.smtp.port))
+        first = pool.get('one.test')
+        pool.get('two.test')
+        pool.get('one.test')
+        pool.get('three.test')
+        self.assertIs(pool.get('one.test'), first)
+        self.assertEqual(len(self.mailers), 3)
+        pool.get('two.test')  # evicted by three.test, so it reconnects
+        self.assertEqual(len(self.mailers), 4)
+        pool.close()
+
+
+class NotificationOutboxTestCase(SMTPTestMixin, unittest.TestCase):
+    """Test cases for appointment notifications sent through the outbox"""
+
+    def setUp(self):
+        """Create an ORM database in a file the worker connection can share"""
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.path}'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.start_smtp()
+
+        for username, role in [('ann', 'patient'), ('bounce', 'specialist')]:
+            db.session.add(User(username=username, email=f'{username}@example.com',
+                                password_hash='x', full_name=username.title(), role=role))
+        start = datetime(2030, 6, 3, 9)
+        db.session.add(Appointment(patient_id=1, specialist_id=2, title='Consult', created_by=2,
+                                   start_time=start, end_time=start + timedelta(minutes=30)))
+        db.session.commit()
+
+    def tearDown(self):
+        self.stop_smtp()
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        os.remove(self.path)
+
+    def test_confirmation_is_queued_and_settles_delivery_status(self):
+        """Test that the request only queues mail and the worker updates DeliveryStatus"""
+        self.assertTrue(NotificationService.send_appointment_confirmation(1))
+        self.assertEqual(self.handler.messages, [])
+
+        with sqlite3.connect(self.path) as conn:
+            result = EmailOutbox.run_batch(conn, self.pool, worker_id='w')
+        self.assertEqual((result['sent'], result['dead']), (1, 1))
+        self.assertEqual([message['To'] for message in self.handler.messages], ['ann@example.com'])
+
+        db.session.expire_all()
+        statuses = dict(db.session.query(AppointmentNotification.user_id,
+                                         AppointmentNotification.delivery_status).all())
+        self.assertEqual(statuses, {1: DeliveryStatus.DELIVERED, 2: DeliveryStatus.FAILED})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import sqlite3
+import tempfile
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+from services.export_service import ExportService
+
+
+class ExportServiceTestCase(unittest.TestCase):
+    """Test cases for the streaming export service"""
+
+    ROWS = 2500
+
+    def setUp(self):
+        """Create a database with enough rows to span several batches"""
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, note TEXT)')
+        conn.executemany(
+            'INSERT INTO items (name, note) VALUES (?, ?)',
+            [(f'item {i}', 'has, a comma' if i % 7 == 0 else None) for i in range(self.ROWS)]
+        )
+        conn.commit()
+        conn.close()
+
+        self.app = Flask(__name__)
+        self.app.config['DATABASE_NAME'] = self.db_path
+        database.init_app(self.app)
+
+    def tearDown(self):
+        """Close pooled connections and remove the database file"""
+        pool = database._pools.pop(self.db_path, None)
+        if pool is not None:
+            pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def export(self, **kwargs):
+        with self.app.test_request_context():
+            response = ExportService.stream('SELECT * FROM items ORDER BY id', database=self.db_path,
+                                            batch_size=100, **kwargs)
+            return response, b''.join(response.response)
+
+    def test_batches_are_bounded(self):
+        """Test that rows are fetched in batches no larger than batch_size"""
+        conn = sqlite3.connect(self.db_path)
+        columns, batches = ExportService.iter_batches(conn, 'SELECT * FROM items', batch_size=300)
+        sizes = [len(rows) for rows in batches]
+        conn.close()
+
+        self.assertEqual(columns, ['id', 'name', 'note'])
+        self.assertEqual(sum(sizes), self.ROWS)
+        self.assertLessEqual(max(sizes), 300)
+
+    def test_ndjson_export(self):
+        """Test that NDJSON export yields one JSON object per row"""
+        response, body = self.export(export_format='ndjson', filename='items')
+        lines = body.decode().splitlines()
+
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertIn('items.ndjson', response.headers['Content-Disposition'])
+        self.assertEqual(len(lines), self.ROWS)
+        self.assertEqual(json.loads(lines[0]), {'id': 1, 'name': 'item 0', 'note': 'has, a comma'})
+
+    def test_csv_export(self):
+        """Test that CSV export has a header and quotes embedded commas"""
+        response, body = self.export(export_format='csv')
+        rows = list(csv.reader(io.StringIO(body.decode())))
+
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(rows[0], ['id', 'name', 'note'])
+        self.assertEqual(len(rows), self.ROWS + 1)
+        self.assertEqual(rows[1], ['1', 'item 0', 'has, a comma'])
+
+    def test_gzip_export(self):
+        """Test that compressed exports decompress to the plain body"""
+        _, plain = self.export(export_format='ndjson')
+        response, compressed = self.export(export_format='ndjson', compress=True)
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertLess(len(compressed), len(plain))
+        self.assertEqual(gzip.decompress(compressed), plain)
+
+    def test_connection_returned_after_stream(self):
+        """Test that the export connection goes back to the pool once the body is consumed"""
+        self.export(export_format='csv')
+        pool = database.get_pool(self.db_path)
+        self.assertEqual(pool.idle, pool.size)
+
+    def test_unknown_format(self):
+        """Test that unsupported formats are rejected"""
+        with self.assertRaises(ValueError):
+            self.export(export_format='xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
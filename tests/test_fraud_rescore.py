@@ -0,0 +1,119 @@
+import unittest
+import json
+import os
+import sys
+import sqlite3
+
+import numpy as np
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from services.fraud_rescore_service import FraudRescoreService, generate_events, window_counts
+
+T0 = 1_700_000_000
+
+
+class WindowCountsTestCase(unittest.TestCase):
+    """Test cases for the vectorized trailing-window counts"""
+
+    def test_matches_brute_force(self):
+        """Test window counts against a direct count per event"""
+        rng = np.random.default_rng(7)
+        keys = rng.integers(-1, 6, 500)
+        times = rng.integers(T0, T0 + 20000, 500)
+
+        expected = [0 if key < 0 else int(((keys == key) & (times <= t) & (times >= t - 3600)).sum())
+                    for key, t in zip(keys, times)]
+        self.assertEqual(window_counts(keys, times, 3600).tolist(), expected)
+
+    def test_no_keys(self):
+        """Test that events without a key count zero"""
+        self.assertEqual(window_counts([-1, -1], [T0, T0], 60).tolist(), [0, 0])
+
+
+class FraudRescoreTestCase(unittest.TestCase):
+    """Test cases for re-scoring referral history"""
+
+    def setUp(self):
+        """Create a migrated database with a burst from one IP and one quiet code"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+        self.conn.execute('''
+            INSERT INTO referral_campaigns
+                (id, name, start_date, end_date, advocate_role, reward_type, reward_value,
+                 reward_trigger, fraud_threshold)
+            VALUES (1, 'Spring', '2024-01-01', '2030-01-01', 'patient', 'CREDIT', 10, 'CONVERTED', 5)
+        ''')
+        self.conn.executemany('''
+            INSERT INTO referral_codes (id, campaign_id, advocate_id, code, link_slug)
+            VALUES (?, 1, ?, ?, ?)
+        ''', [(1, 100, 'A', 'a'), (2, 200, 'B', 'b')])
+
+        # Code 1: six sign-ups from one IP within ten minutes; code 2: one self-referral a week later
+        events = [(1, 1000 + i, '203.0.113.7', T0 + i * 100) for i in range(6)]
+        events.append((2, 200, '198.51.100.1', T0 + 7 * 86400))
+        self.conn.executemany('''
+            INSERT INTO referral_events (code_id, referred_patient_id, ip_addr, user_agent, created_at)
+            VALUES (?, ?, ?, 'Mozilla/5.0', datetime(?, 'unixepoch'))
+        ''', events)
+        self.conn.commit()
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def scores(self):
+        return {event_id: (score, risk) for event_id, score, risk in self.conn.execute(
+            'SELECT event_id, fraud_score, risk_level FROM fraud_scores ORDER BY event_id')}
+
+    def test_rescore_writes_one_row_per_event(self):
+        """Test scores against the campaign threshold, and that reruns upsert"""
+        summary = FraudRescoreService.rescore(self.conn, advocate_threshold=20)
+        self.assertEqual((summary['events'], summary['flagged_events'], summary['flagged_codes']), (7, 2, 0))
+
+        scores = self.scores()
+        self.assertEqual(scores[3], (0, 'low'))
+        self.assertEqual(scores[4], (2, 'medium'))
+        self.assertEqual(scores[6], (5, 'high'))
+        self.assertEqual(scores[7], (5, 'high'))
+        self.assertEqual(json.loads(self.conn.execute(
+            'SELECT reasons FROM fraud_scores WHERE event_id = 7').fetchone()[0]), ['Advocate referring themselves'])
+
+        FraudRescoreService.rescore(self.conn, advocate_threshold=20)
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM fraud_scores').fetchone()[0], 7)
+        self.assertEqual(self.conn.execute(
+            'SELECT code_id, user_id, ip_address FROM fraud_scores WHERE event_id = 1').fetchone(),
+            (1, 1000, '203.0.113.7'))
+
+    def test_tightened_threshold_flags_codes_retroactively(self):
+        """Test that lowering fraud_threshold flags codes with past events"""
+        self.conn.execute('UPDATE referral_campaigns SET fraud_threshold = 2')
+        summary = FraudRescoreService.rescore(self.conn, flag_codes=True, advocate_threshold=20)
+
+        self.assertEqual((summary['flagged_events'], summary['flagged_codes']), (4, 2))
+        self.assertEqual(self.scores()[4], (2, 'high'))
+        self.assertEqual({row[0] for row in self.conn.execute(
+            "SELECT id FROM referral_codes WHERE reward_status = 'FLAGGED'")}, {1, 2})
+
+    def test_since_keeps_earlier_events_as_context(self):
+        """Test that --since scores only newer events but counts older ones in windows"""
+        since = self.conn.execute("SELECT datetime(?, 'unixepoch')", (T0 + 450,)).fetchone()[0]
+        summary = FraudRescoreService.rescore(self.conn, since=since, advocate_threshold=20)
+
+        self.assertEqual(summary['events'], 2)
+        self.assertEqual(self.scores(), {6: (5, 'high'), 7: (5, 'high')})
+
+    def test_generated_dataset(self):
+        """Test that the benchmark generator produces scoreable history"""
+        conn = sqlite3.connect(':memory:')
+        run_migrations(conn)
+        generate_events(conn, 2000, seed=1)
+        summary = FraudRescoreService.rescore(conn)
+        self.assertEqual(summary['events'], 2000)
+        self.assertGreater(summary['flagged_events'], 0)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
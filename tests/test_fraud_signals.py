@@ -0,0 +1,184 @@
+import unittest
+import os
+import sys
+import sqlite3
+import tempfile
+from unittest import mock
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+from migrations import run_migrations
+from referral_management import FraudDetector
+from services.fraud_signal_service import (
+    FraudSignalEngine, RingCounter, signal_keys, subnet_of, ua_fingerprint
+)
+
+CHROME = 'Mozilla/5.0 (Windows NT 10.0) Chrome/120.0.6099.71 Safari/537.36'
+
+
+class RingCounterTestCase(unittest.TestCase):
+    """Test cases for the bucketed ring counter"""
+
+    def test_counts_slide_with_the_window(self):
+        """Test that buckets leave the count once they fall out of the window"""
+        counter = RingCounter(window_seconds=3600, bucket_seconds=300)
+        counter.load('k', [], now=0)
+        for minute in range(0, 60, 10):
+            counter.add('k', minute * 60)
+        self.assertEqual(counter.count('k', 59 * 60), 6)
+
+        # Twelve buckets per hour: at 65 minutes the 0-5 minute bucket is gone
+        self.assertEqual(counter.count('k', 65 * 60), 5)
+        counter.add('k', 65 * 60)
+        self.assertEqual(counter.count('k', 65 * 60), 6)
+        self.assertEqual(counter.count('k', 3 * 3600), 0)
+
+    def test_least_recently_loaded_keys_are_evicted(self):
+        """Test that the counter holds at most max_keys keys"""
+        counter = RingCounter(3600, 300, max_keys=2)
+        for key in ('a', 'b', 'c'):
+            counter.load(key, [(0, 1)], now=0)
+        self.assertFalse(counter.is_fresh('a', 1, 60))
+        self.assertTrue(counter.is_fresh('c', 1, 60))
+
+
+class FraudSignalEngineTestCase(unittest.TestCase):
+    """Test cases for the shared sliding-window fraud counters"""
+
+    NOW = 1_700_000_000.0
+
+    def setUp(self):
+        """Create a migrated database"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def test_signal_keys(self):
+        """Test key extraction for each signal"""
+        self.assertEqual(subnet_of('203.0.113.77'), '203.0.113.0/24')
+        self.assertEqual(subnet_of('2001:db8::1'), '2001:db8::/64')
+        self.assertIsNone(subnet_of('not an ip'))
+        self.assertEqual(ua_fingerprint(CHROME), ua_fingerprint(CHROME.replace('120.0', '121.1')))
+        self.assertIsNone(ua_fingerprint(''))
+        self.assertEqual(sorted(signal_keys(4, None, '')), ['code'])
+
+    def test_workers_share_counts_through_the_table(self):
+        """Test that one worker sees another's events once its copy is stale"""
+        worker_a, worker_b = FraudSignalEngine(sync_seconds=5), FraudSignalEngine(sync_seconds=5)
+        for offset in range(3):
+            worker_a.record(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW + offset)
+        self.conn.commit()
+
+        counts = worker_b.counts(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW + 3)
+        self.assertEqual(counts, {'ip': 3, 'code': 3, 'ua': 3, 'subnet': 3})
+
+        # A neighbour on the same /24 and another worker's event
+        worker_a.record(self.conn, 2, '203.0.113.8', CHROME, now=self.NOW + 4)
+        self.conn.commit()
+        self.assertEqual(worker_b.counts(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW + 4)['subnet'], 3)
+        self.assertEqual(worker_b.counts(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW + 9)['subnet'], 4)
+
+    def test_fresh_keys_are_scored_from_memory(self):
+        """Test that repeat lookups within the sync interval skip the database"""
+        engine = FraudSignalEngine(sync_seconds=60)
+        engine.counts(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW)
+        with mock.patch.object(engine, '_read_buckets') as read:
+            for offset in range(1, 6):
+                engine.apply(engine.record(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW + offset))
+                counts = engine.counts(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW + offset)
+            read.assert_not_called()
+        self.assertEqual(counts['code'], 5)
+
+    def test_rolled_back_events_are_not_counted(self):
+        """Test that an event reaches the local counters only once it is applied"""
+        engine = FraudSignalEngine(sync_seconds=60)
+        engine.counts(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW)
+        engine.record(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW + 1)
+        self.conn.rollback()
+
+        counts = engine.counts(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW + 1)
+        self.assertEqual(counts['code'], 0)
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM fraud_signal_buckets').fetchone()[0], 0)
+
+    def test_prune_and_rebuild(self):
+        """Test that expired buckets are dropped and windows rebuilt from events"""
+        engine = FraudSignalEngine()
+        engine.record(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW - 2 * 86400)
+        engine.record(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW)
+        self.assertEqual(FraudSignalEngine.prune(self.conn, now=self.NOW), 4)
+
+        self.conn.executemany('''
+            INSERT INTO referral_events (code_id, ip_addr, user_agent, created_at)
+            VALUES (?, ?, ?, datetime(?, 'unixepoch'))
+        ''', [(1, '203.0.113.7', CHROME, self.NOW - 60), (1, '198.51.100.1', CHROME, self.NOW - 120),
+              (1, '203.0.113.7', CHROME, self.NOW - 3 * 86400)])
+        FraudSignalEngine.rebuild(self.conn, now=self.NOW)
+        counts = FraudSignalEngine(sync_seconds=0).counts(self.conn, 1, '203.0.113.7', CHROME, now=self.NOW)
+        self.assertEqual(counts, {'ip': 1, 'code': 2, 'ua': 2, 'subnet': 1})
+
+
+class FraudDetectorTestCase(unittest.TestCase):
+    """Test cases for scoring referral events from the fraud counters"""
+
+    def setUp(self):
+        """Create a migrated database with one campaign and code"""
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.db_path)
+        run_migrations(conn)
+        conn.execute('''
+            INSERT INTO referral_campaigns
+                (id, name, start_date, end_date, advocate_role, reward_type, reward_value,
+                 reward_trigger, fraud_threshold)
+            VALUES (1, 'Spring', '2024-01-01', '2030-01-01', 'patient', 'CREDIT', 10, 'CONVERTED', 3)
+        ''')
+        conn.execute("INSERT INTO referral_codes (id, campaign_id, advocate_id, code, link_slug) VALUES (1, 1, 100, 'A', 'a')")
+        conn.commit()
+        conn.close()
+
+        self.app = Flask(__name__)
+        self.app.config['DATABASE_NAME'] = self.db_path
+        database.init_app(self.app)
+
+    def tearDown(self):
+        """Close pooled connections and remove the database file"""
+        pool = database._pools.pop(self.db_path, None)
+        if pool is not None:
+            pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_velocity_and_self_referral_flag_the_code(self):
+        """Test that IP velocity and self-referral scores reach the campaign threshold"""
+        with self.app.app_context():
+            engine = FraudSignalEngine()
+            detector = FraudDetector(engine)
+            conn = database.get_db()
+
+            recorded = engine.record(conn, 1, '203.0.113.7', CHROME)
+            conn.commit()
+            engine.apply(recorded)
+            result = detector.check_referral(1, 200, '203.0.113.7', CHROME)
+            self.assertEqual((result['score'], result['flagged']), (0, False))
+
+            recorded = [engine.record(conn, 1, '203.0.113.7', CHROME) for _ in range(3)]
+            conn.commit()
+            for event in recorded:
+                engine.apply(event)
+            result = detector.check_referral(1, 200, '203.0.113.7', CHROME)
+            self.assertEqual((result['score'], result['flagged']), (2, False))
+
+            result = detector.check_referral(1, 100, '203.0.113.7', CHROME)
+            self.assertEqual((result['score'], result['flagged']), (7, True))
+            self.assertEqual(conn.execute('SELECT reward_status FROM referral_codes WHERE id = 1').fetchone()[0],
+                             'FLAGGED')
+
+
+if __name__ == '__main__':
+    unittest.main()
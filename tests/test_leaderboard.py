@@ -0,0 +1,108 @@
+import unittest
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from services.leaderboard_service import LeaderboardService, period_key
+
+
+class LeaderboardTestCase(unittest.TestCase):
+    """Test cases for the precomputed rewards leaderboard"""
+
+    def setUp(self):
+        """Create a migrated database with six users"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+        self.conn.executemany(
+            'INSERT INTO users (id, username, email, password_hash, full_name) VALUES (?, ?, ?, ?, ?)',
+            [(i, f'user{i}', f'user{i}@example.com', 'x', f'User {i}') for i in range(1, 7)]
+        )
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def earn(self, user_id, points, earned_date='2024-03-06 10:00:00', status='earned'):
+        cursor = self.conn.execute(
+            'INSERT INTO user_rewards (user_id, points_earned, reward_status, earned_date) VALUES (?, ?, ?, ?)',
+            (user_id, points, status, earned_date)
+        )
+        return cursor.lastrowid
+
+    def ranking(self, period='all', when=None):
+        return [(entry['user_id'], entry['points'], entry['rank'])
+                for entry in LeaderboardService.top(self.conn, period, when=when)]
+
+    def test_top_and_rank_with_ties(self):
+        """Test that tied users share a competition rank"""
+        self.earn(1, 50)
+        self.earn(2, 30)
+        self.earn(2, 20)
+        self.earn(3, 40)
+        self.earn(4, 10, status='pending')
+
+        self.assertEqual(self.ranking(), [(2, 50, 1), (1, 50, 1), (3, 40, 3)])
+        self.assertEqual(LeaderboardService.rank_of(self.conn, 3), 3)
+        self.assertEqual(LeaderboardService.get_entry(self.conn, 2)['reward_count'], 2)
+        self.assertIsNone(LeaderboardService.rank_of(self.conn, 4))
+
+    def test_revoke_and_earn_updates_points(self):
+        """Test that status changes and deletes move points in and out"""
+        reward_id = self.earn(1, 50)
+        self.earn(2, 30)
+        self.conn.execute("UPDATE user_rewards SET reward_status = 'revoked' WHERE id = ?", (reward_id,))
+        self.assertEqual(self.ranking(), [(2, 30, 1)])
+
+        self.conn.execute("UPDATE user_rewards SET reward_status = 'earned' WHERE id = ?", (reward_id,))
+        self.conn.execute("UPDATE user_rewards SET points_earned = 70 WHERE id = ?", (reward_id,))
+        self.assertEqual(self.ranking(), [(1, 70, 1), (2, 30, 2)])
+
+        self.conn.execute('DELETE FROM user_rewards WHERE user_id = 2')
+        self.assertEqual(self.ranking(), [(1, 70, 1)])
+
+    def test_weekly_and_monthly_windows(self):
+        """Test that rewards count only in the week and month they were earned"""
+        self.earn(1, 10, '2024-03-04 09:00:00')  # Monday of ISO week 10
+        self.earn(2, 20, '2024-03-03 09:00:00')  # Sunday, previous %W week
+        self.earn(3, 30, '2024-02-28 09:00:00')
+
+        when = datetime(2024, 3, 6)
+        self.assertEqual(period_key('week', when), 'week:2024-10')
+        self.assertEqual(self.ranking('week', when), [(1, 10, 1)])
+        self.assertEqual(self.ranking('month', when), [(2, 20, 1), (1, 10, 2)])
+        self.assertEqual(self.ranking('all'), [(3, 30, 1), (2, 20, 2), (1, 10, 3)])
+
+    def test_neighbors(self):
+        """Test that neighbors are the adjacent users in rank order, ties by user id descending"""
+        for user_id, points in ((1, 60), (2, 50), (3, 40), (4, 40), (5, 20), (6, 10)):
+            self.earn(user_id, points)
+
+        around = LeaderboardService.neighbors(self.conn, 4, radius=2)
+        self.assertEqual([(e['user_id'], e['rank']) for e in around], [(1, 1), (2, 2), (4, 3), (3, 3), (5, 5)])
+
+        top = LeaderboardService.neighbors(self.conn, 1, radius=1)
+        self.assertEqual([e['user_id'] for e in top], [1, 2])
+        self.assertEqual(LeaderboardService.neighbors(self.conn, 99), [])
+
+    def test_rebuild_matches_triggers(self):
+        """Test that a rebuild reproduces the trigger-maintained totals"""
+        for user_id, points, day in ((1, 5, '2024-01-02'), (2, 7, '2024-02-10'), (1, 3, '2024-02-11')):
+            self.earn(user_id, points, day)
+        query = 'SELECT * FROM user_points ORDER BY period, user_id'
+        incremental = self.conn.execute(query).fetchall()
+
+        LeaderboardService.rebuild(self.conn)
+        self.assertEqual(self.conn.execute(query).fetchall(), incremental)
+
+    def test_unknown_period(self):
+        """Test that unsupported windows are rejected"""
+        with self.assertRaises(ValueError):
+            period_key('year')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import os
+import sys
+import sqlite3
+
+# Add parent directory to path to import migrations
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import (
+    current_version, is_up_to_date, latest_version, load_migrations,
+    pending_migrations, run_migrations
+)
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """Test cases for the versioned schema migration runner"""
+
+    def setUp(self):
+        """Use a fresh in-memory database for every test"""
+        self.conn = sqlite3.connect(':memory:')
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def table_names(self):
+        rows = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return {row[0] for row in rows}
+
+    def test_versions_are_sequential(self):
+        """Test that migration versions start at 1 with no gaps"""
+        versions = [module.VERSION for module in load_migrations()]
+        self.assertEqual(versions, list(range(1, len(versions) + 1)))
+
+    def test_fresh_database_is_fully_migrated(self):
+        """Test that a new database is brought to the latest version"""
+        applied = run_migrations(self.conn)
+
+        self.assertEqual(applied, list(range(1, latest_version() + 1)))
+        self.assertEqual(current_version(self.conn), latest_version())
+        self.assertTrue(is_up_to_date(self.conn))
+        self.assertEqual(pending_migrations(self.conn), [])
+        for table in ('users', 'referrals', 'user_feedback', 'fraud_scores',
+                      'referral_events', 'schema_migrations'):
+            self.assertIn(table, self.table_names())
+
+        recorded = self.conn.execute('SELECT COUNT(*) FROM schema_migrations').fetchone()[0]
+        self.assertEqual(recorded, latest_version())
+
+    def test_rerun_is_a_noop(self):
+        """Test that running migrations twice applies nothing the second time"""
+        run_migrations(self.conn)
+        self.assertEqual(run_migrations(self.conn), [])
+
+        plans = self.conn.execute('SELECT COUNT(*) FROM subscription_plans').fetchone()[0]
+        self.assertEqual(plans, 3)
+
+    def test_target_version(self):
+        """Test that migrations stop at the requested target version"""
+        run_migrations(self.conn, target=1)
+        self.assertEqual(current_version(self.conn), 1)
+        self.assertNotIn('referral_events', self.table_names())
+
+    def test_duplicate_doctors_are_merged(self):
+        """Test that v006 keeps contact details from rows it folds together"""
+        run_migrations(self.conn, target=5)
+        self.conn.executemany('INSERT INTO referring_doctors (name, email, phone) VALUES (?, ?, ?)', [
+            ('Dr. Adams', None, '555-0100'), (' dr. adams', 'adams@example.com', '555-0199'),
+        ])
+        self.conn.commit()
+
+        run_migrations(self.conn, target=6)
+        rows = self.conn.execute('SELECT id, name, email, phone FROM referring_doctors').fetchall()
+        self.assertEqual(rows, [(1, 'Dr. Adams', 'adams@example.com', '555-0100')])
+
+    def test_duplicate_rewards_are_dropped(self):
+        """Test that v018 keeps the earliest reward of each event and enforces one per event"""
+        run_migrations(self.conn, target=17)
+        self.conn.executemany('''
+            INSERT INTO rewards (advocate_id, campaign_id, event_id, reward_type, amount)
+            VALUES (1, 1, ?, 'CREDIT', 10)
+        ''', [(5,), (5,), (6,)])
+        self.conn.commit()
+
+        run_migrations(self.conn, target=18)
+        rows = self.conn.execute('SELECT id, event_id FROM rewards ORDER BY id').fetchall()
+        self.assertEqual(rows, [(1, 5), (3, 6)])
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("INSERT INTO rewards (advocate_id, campaign_id, event_id, reward_type, amount) "
+                              "VALUES (1, 1, 6, 'CREDIT', 10)")
+
+    def test_upgrades_legacy_database(self):
+        """Test that a database created before the runner existed is upgraded in place"""
+        self.conn.execute('''
+            CREATE TABLE referrals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                referral_id TEXT UNIQUE NOT NULL,
+                patient_name TEXT NOT NULL,
+                referring_doctor TEXT,
+                target_doctor TEXT,
+                status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.conn.commit()
+
+        run_migrations(self.conn)
+
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(referrals)')}
+        self.assertIn('case_status', columns)
+        self.assertIn('dentist_id', columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import os
+import sys
+import sqlite3
+
+# Add parent directory to path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from utils.pagination import (
+    InvalidCursor, decode_cursor, encode_cursor, keyset_condition, keyset_order_by,
+    parse_fields, parse_limit, parse_order, MAX_PAGE_SIZE
+)
+
+
+class PaginationTestCase(unittest.TestCase):
+    """Test cases for keyset pagination helpers"""
+
+    def test_cursor_round_trip(self):
+        """Test that a cursor decodes to the position it was built from"""
+        token = encode_cursor('created_at', 'desc', '2024-01-01 10:00:00', 42)
+        self.assertEqual(decode_cursor(token, 'created_at', 'desc'), ('2024-01-01 10:00:00', 42))
+
+    def test_cursor_rejects_other_sort(self):
+        """Test that a cursor cannot be replayed against a different ordering"""
+        token = encode_cursor('created_at', 'desc', '2024-01-01', 1)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(token, 'status', 'desc')
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(token, 'created_at', 'asc')
+
+    def test_cursor_rejects_garbage(self):
+        """Test that malformed cursors raise InvalidCursor"""
+        for token in ('not-a-cursor', '', 'e30'):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(token, 'created_at', 'desc')
+
+    def test_parse_arguments(self):
+        """Test limit, order and fields parsing"""
+        self.assertEqual(parse_limit(None), 50)
+        self.assertEqual(parse_limit('0'), 1)
+        self.assertEqual(parse_limit('100000'), MAX_PAGE_SIZE)
+        with self.assertRaises(ValueError):
+            parse_limit('ten')
+
+        self.assertEqual(parse_order('ASC'), 'asc')
+        with self.assertRaises(ValueError):
+            parse_order('sideways; DROP TABLE referrals')
+
+        self.assertIsNone(parse_fields('', {'id'}))
+        self.assertEqual(parse_fields('id, status,id', {'id', 'status'}), ['id', 'status'])
+        with self.assertRaises(ValueError):
+            parse_fields('id,password_hash', {'id'})
+
+    def test_keyset_walk_visits_every_row_once(self):
+        """Test that following cursors pages through ties without gaps or repeats"""
+        conn = sqlite3.connect(':memory:')
+        run_migrations(conn)
+        # Several rows share a created_at so the id tie-breaker matters
+        conn.executemany(
+            'INSERT INTO referrals (user_id, referral_id, patient_name, created_at) VALUES (?, ?, ?, ?)',
+            [(1, f'R{i:04d}', f'Patient {i}', f'2024-01-{(i % 5) + 1:02d}') for i in range(53)]
+        )
+
+        seen = []
+        after = None
+        while True:
+            sql = 'SELECT id, created_at FROM referrals r WHERE r.user_id = ?'
+            params = [1]
+            if after is not None:
+                sql += ' AND ' + keyset_condition('r.created_at', 'r.id', 'desc')
+                params.extend(after)
+            sql += ' ' + keyset_order_by('r.created_at', 'r.id', 'desc') + ' LIMIT 10'
+            rows = conn.execute(sql, params).fetchall()
+            if not rows:
+                break
+            seen.extend(row[0] for row in rows)
+            token = encode_cursor('created_at', 'desc', rows[-1][1], rows[-1][0])
+            after = decode_cursor(token, 'created_at', 'desc')
+
+        expected = [row[0] for row in conn.execute(
+            'SELECT id FROM referrals ORDER BY created_at DESC, id DESC')]
+        self.assertEqual(seen, expected)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
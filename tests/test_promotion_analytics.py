@@ -0,0 +1,124 @@
+import unittest
+import os
+import sys
+from datetime import datetime, timedelta
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import db, Promotion, PromotionLocation, PromotionMetricsHourly
+from services.promotion_analytics_service import PromotionAnalyticsService
+
+
+class PromotionAnalyticsTestCase(unittest.TestCase):
+    """Test cases for reports over hourly promotion metrics"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        start = datetime(2024, 6, 1)
+        for title in ('Implants', 'Imaging', 'Webinar'):
+            db.session.add(Promotion(
+                title=title, image_url='/static/images/promo.jpg', target_url='https://example.com',
+                location=PromotionLocation.DASHBOARD_TOP, start_date=start, end_date=start + timedelta(days=30)
+            ))
+
+        # (promotion, hour, location, role, impressions, clicks)
+        for promotion_id, hour, location, role, impressions, clicks in [
+            (1, datetime(2024, 6, 1, 9), 'dashboard_top', 'dentist', 100, 5),
+            (1, datetime(2024, 6, 1, 9), 'dashboard_top', 'anonymous', 50, 0),
+            (1, datetime(2024, 6, 1, 14), 'profile_page', 'dentist', 50, 5),
+            (1, datetime(2024, 6, 3, 8), 'dashboard_top', 'patient', 100, 2),
+            (2, datetime(2024, 6, 1, 9), 'dashboard_top', 'dentist', 200, 20),
+            (3, datetime(2024, 6, 2, 12), 'dashboard_top', 'dentist', 10, 5),
+            (3, datetime(2024, 5, 20, 12), 'dashboard_top', 'dentist', 1000, 500),
+        ]:
+            db.session.add(PromotionMetricsHourly(
+                promotion_id=promotion_id, hour=hour, location=location, role=role,
+                impressions=impressions, clicks=clicks
+            ))
+        db.session.commit()
+        self.start, self.end = PromotionAnalyticsService.window('2024-06-01', '2024-06-03')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_window_rounds_to_whole_hours(self):
+        """Test that bare end dates include the day and times round outward"""
+        self.assertEqual((self.start, self.end), (datetime(2024, 6, 1), datetime(2024, 6, 4)))
+        self.assertEqual(
+            PromotionAnalyticsService.window('2024-06-01T09:15:00', '2024-06-01T10:05:00'),
+            (datetime(2024, 6, 1, 9), datetime(2024, 6, 1, 11))
+        )
+        self.assertEqual(
+            PromotionAnalyticsService.window(now=datetime(2024, 6, 8, 0, 30)),
+            (datetime(2024, 6, 1, 1), datetime(2024, 6, 8, 1))
+        )
+        with self.assertRaises(ValueError):
+            PromotionAnalyticsService.window('2024-06-03', '2024-06-01')
+        with self.assertRaises(ValueError):
+            PromotionAnalyticsService.window('June 1st')
+
+    def test_daily_series_fills_empty_days(self):
+        """Test that each day in the window appears, with CTR per day"""
+        series = PromotionAnalyticsService.time_series(self.start, self.end, 'day', promotion_id=1)
+        self.assertEqual(series, [
+            {'period': '2024-06-01', 'impressions': 200, 'clicks': 10, 'ctr': 0.05},
+            {'period': '2024-06-02', 'impressions': 0, 'clicks': 0, 'ctr': 0},
+            {'period': '2024-06-03', 'impressions': 100, 'clicks': 2, 'ctr': 0.02},
+        ])
+
+    def test_hourly_series_with_filters(self):
+        """Test hourly points filtered by location and role"""
+        start, end = PromotionAnalyticsService.window('2024-06-01T08:00', '2024-06-01T10:00')
+        series = PromotionAnalyticsService.time_series(
+            start, end, 'hour', location=PromotionLocation.DASHBOARD_TOP, role='dentist'
+        )
+        self.assertEqual([(point['period'], point['impressions'], point['clicks']) for point in series], [
+            ('2024-06-01T08:00:00', 0, 0),
+            ('2024-06-01T09:00:00', 300, 25),
+        ])
+
+        with self.assertRaises(ValueError):
+            PromotionAnalyticsService.time_series(start, end, 'week')
+        with self.assertRaises(ValueError):
+            PromotionAnalyticsService.time_series(datetime(2020, 1, 1), end, 'hour')
+
+    def test_breakdowns(self):
+        """Test per-location and per-role totals over the window"""
+        self.assertEqual(PromotionAnalyticsService.breakdown(self.start, self.end, 'location'), [
+            {'location': 'dashboard_top', 'impressions': 460, 'clicks': 32, 'ctr': 0.0696},
+            {'location': 'profile_page', 'impressions': 50, 'clicks': 5, 'ctr': 0.1},
+        ])
+        self.assertEqual(
+            [row['role'] for row in PromotionAnalyticsService.breakdown(self.start, self.end, 'role', promotion_id=1)],
+            ['dentist', 'patient', 'anonymous']
+        )
+        with self.assertRaises(ValueError):
+            PromotionAnalyticsService.breakdown(self.start, self.end, 'browser')
+
+    def test_top_performers(self):
+        """Test ranking by CTR with a minimum impression count, and by clicks"""
+        top = PromotionAnalyticsService.top_performers(self.start, self.end, 'ctr', min_impressions=100)
+        self.assertEqual([(row['title'], row['ctr']) for row in top], [('Imaging', 0.1), ('Implants', 0.04)])
+
+        # Without the floor, ten impressions and five clicks win
+        top = PromotionAnalyticsService.top_performers(self.start, self.end, 'ctr', limit=1, min_impressions=0)
+        self.assertEqual(top[0]['title'], 'Webinar')
+
+        top = PromotionAnalyticsService.top_performers(self.start, self.end, 'clicks', min_impressions=0)
+        self.assertEqual([row['clicks'] for row in top], [20, 12, 5])
+
+        with self.assertRaises(ValueError):
+            PromotionAnalyticsService.top_performers(self.start, self.end, 'revenue')
+
+
+if __name__ == '__main__':
+    unittest.main()
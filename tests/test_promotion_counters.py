@@ -0,0 +1,193 @@
+import unittest
+import io
+import os
+import sys
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import db, Promotion, PromotionCounterSegment, PromotionLocation, PromotionMetricsHourly
+from services.promotion_counters import PromotionCounterBuffer, metrics_key, read_segment
+
+
+class PromotionCounterBufferTestCase(unittest.TestCase):
+    """Test cases for write-behind promotion counters"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool_dir = os.path.join(self.tmpdir, 'spool')
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.tmpdir, 'test.db')
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        now = datetime.utcnow()
+        for title in ('First', 'Second'):
+            db.session.add(Promotion(
+                title=title, image_url='/static/images/promo.jpg', target_url='https://example.com',
+                location=PromotionLocation.DASHBOARD_TOP, start_date=now, end_date=now + timedelta(days=1),
+                impression_count=0, click_count=0
+            ))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.context.pop()
+        shutil.rmtree(self.tmpdir)
+
+    def totals(self):
+        db.session.expire_all()
+        return {p.id: (p.impression_count, p.click_count) for p in Promotion.query.all()}
+
+    def spool_files(self):
+        return sorted(os.listdir(self.spool_dir)) if os.path.isdir(self.spool_dir) else []
+
+    def test_flush_applies_buffered_counts(self):
+        """Test that counts stay in memory until a flush applies them together"""
+        buffer = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        for _ in range(3):
+            buffer.record(1, impressions=1)
+        buffer.record(2, impressions=1)
+        buffer.record(1, clicks=1)
+
+        self.assertEqual(buffer.pending(), {1: (3, 1), 2: (1, 0)})
+        self.assertEqual(self.totals(), {1: (0, 0), 2: (0, 0)})
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.totals(), {1: (3, 1), 2: (1, 0)})
+        self.assertEqual(buffer.pending(), {})
+        self.assertEqual(self.spool_files(), [])
+        self.assertEqual(PromotionCounterSegment.query.count(), 1)
+
+    def test_flush_rolls_counts_up_by_hour_location_and_role(self):
+        """Test that events land in the hourly bucket of their slot and viewer"""
+        buffer = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        ten = datetime(2024, 6, 1, 10, 30).replace(tzinfo=timezone.utc).timestamp()
+        buffer.record(1, impressions=1, location=PromotionLocation.DASHBOARD_TOP, role='dentist', now=ten)
+        buffer.record(1, impressions=1, clicks=1, location=PromotionLocation.DASHBOARD_TOP, role='dentist', now=ten + 60)
+        buffer.record(1, impressions=1, location='dashboard_top', now=ten + 3600)
+        buffer.flush()
+        buffer.record(1, impressions=1, location=PromotionLocation.DASHBOARD_TOP, role='dentist', now=ten + 120)
+        buffer.flush()
+
+        rows = db.session.query(
+            PromotionMetricsHourly.hour, PromotionMetricsHourly.location, PromotionMetricsHourly.role,
+            PromotionMetricsHourly.impressions, PromotionMetricsHourly.clicks
+        ).order_by(PromotionMetricsHourly.hour).all()
+        self.assertEqual(rows, [
+            (datetime(2024, 6, 1, 10), 'dashboard_top', 'dentist', 3, 1),
+            (datetime(2024, 6, 1, 11), 'dashboard_top', 'anonymous', 1, 0),
+        ])
+        self.assertEqual(self.totals()[1], (4, 1))
+
+    def test_memory_only_buffer(self):
+        """Test that an empty spool dir keeps counts in memory only"""
+        buffer = PromotionCounterBuffer(spool_dir='', flush_seconds=0)
+        buffer.record(2, impressions=2, clicks=1)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.totals()[2], (2, 1))
+        self.assertEqual(PromotionCounterSegment.query.count(), 0)
+
+    def test_segments_of_exited_processes_are_replayed(self):
+        """Test that a dead writer's spool segment is applied by the next flush"""
+        crashed = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        crashed.record(1, impressions=1)
+        crashed.record(1, impressions=1, clicks=1)
+        # The process dies: its lock goes away, its memory with it
+        crashed._segment[2].close()
+
+        survivor = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        survivor.record(2, impressions=1)
+        self.assertEqual(survivor.flush(), 2)
+        self.assertEqual(self.totals(), {1: (2, 1), 2: (1, 0)})
+        self.assertEqual(self.spool_files(), [])
+
+    def test_live_segments_are_left_alone(self):
+        """Test that a flush does not replay a segment another writer holds"""
+        writer = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        writer.record(1, impressions=1)
+
+        other = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        self.assertEqual(other.flush(), 0)
+        self.assertEqual(self.totals()[1], (0, 0))
+
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(self.totals()[1], (1, 0))
+
+    def test_applied_segment_is_not_counted_twice(self):
+        """Test that a segment replayed after its commit is only deleted"""
+        crashed = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        crashed.record(1, impressions=1)
+        name = crashed._segment[0]
+        crashed._apply({metrics_key(1): [1, 0]}, segment=name)
+        # Died between the commit and deleting the file
+        crashed._segment[2].close()
+
+        self.assertEqual(PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0).flush(), 1)
+        self.assertEqual(self.totals()[1], (1, 0))
+        self.assertEqual(self.spool_files(), [])
+
+    def test_counts_for_deleted_promotions_are_dropped(self):
+        """Test that an event for a missing promotion does not sink the rest of the batch"""
+        buffer = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        buffer.record(1, impressions=5)
+        buffer.record(999, impressions=1)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.totals()[1], (5, 0))
+        self.assertEqual({row.promotion_id for row in PromotionMetricsHourly.query.all()}, {1})
+
+    def test_failed_segment_is_kept_for_retry(self):
+        """Test that errors other than a replayed segment leave the spool file in place"""
+        buffer = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0)
+        buffer.record(1, impressions=2)
+        PromotionMetricsHourly.__table__.drop(db.engine)
+
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(len(self.spool_files()), 1)
+        self.assertEqual(PromotionCounterSegment.query.count(), 0)
+
+        PromotionMetricsHourly.__table__.create(db.engine)
+        self.assertEqual(PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=0).flush(), 1)
+        self.assertEqual(self.totals()[1], (2, 0))
+
+    def test_torn_last_line_is_skipped(self):
+        """Test that a partially written event is ignored on replay"""
+        spool = 'i 1 10 dashboard_top dentist\ni 1 10 dashboard_top dentist\nc 2 11 profile_page anonymous\ni 1 10 dash'
+        self.assertEqual(read_segment(io.StringIO(spool)), {
+            (1, 10, 'dashboard_top', 'dentist'): [2, 0],
+            (2, 11, 'profile_page', 'anonymous'): [0, 1],
+        })
+
+    def test_event_threshold_wakes_the_flush_thread(self):
+        """Test that reaching flush_events flushes without waiting for the timer"""
+        buffer = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=60, flush_events=3)
+        self.addCleanup(buffer.close)
+        for _ in range(3):
+            buffer.record(1, impressions=1)
+
+        deadline = time.time() + 5
+        while self.totals()[1] != (3, 0) and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.totals()[1], (3, 0))
+
+    def test_close_flushes_exact_totals(self):
+        """Test that shutting down applies every recorded event"""
+        buffer = PromotionCounterBuffer(spool_dir=self.spool_dir, flush_seconds=60, flush_events=1000)
+        for i in range(250):
+            buffer.record(1 + i % 2, impressions=1, clicks=i % 5 == 0)
+        buffer.close()
+        self.assertEqual(self.totals(), {1: (125, 25), 2: (125, 25)})
+        self.assertEqual(self.spool_files(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
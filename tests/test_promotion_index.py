@@ -0,0 +1,169 @@
+import unittest
+import os
+import sys
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest import mock
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import db, PromotionLocation, User, UserPromotionPreference
+from services import promotion_index
+from services.promotion_index import AliasTable, OptOutCache, PromotionIndex, selection_weights
+from services.promotion_service import PromotionService
+
+
+class AliasTableTestCase(unittest.TestCase):
+    """Test cases for alias-method sampling"""
+
+    def test_draws_follow_the_weights(self):
+        """Test that each item is drawn in proportion to its weight"""
+        table = AliasTable(['a', 'b', 'c'], [1, 2, 7])
+        rng = random.Random(7)
+        draws = Counter(table.pick(rng) for _ in range(50000))
+        self.assertAlmostEqual(draws['a'] / 50000, 0.1, delta=0.01)
+        self.assertAlmostEqual(draws['b'] / 50000, 0.2, delta=0.01)
+        self.assertAlmostEqual(draws['c'] / 50000, 0.7, delta=0.01)
+
+    def test_single_item(self):
+        """Test that a one-item table always returns it"""
+        table = AliasTable([42], [0.3])
+        self.assertEqual({table.pick() for _ in range(20)}, {42})
+
+    def test_weights_match_inverse_impression_share(self):
+        """Test the floor and the no-impression case of the weights"""
+        self.assertEqual(selection_weights([0, 0]), [1, 1])
+        self.assertEqual(selection_weights([90, 10]), [0.1, 0.9])
+        self.assertEqual(selection_weights([100, 0])[0], 0.1)
+
+
+class PromotionIndexTestCase(unittest.TestCase):
+    """Test cases for promotion selection through the index"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.now = datetime.utcnow()
+        self.index = PromotionIndex(refresh_seconds=3600)
+        self.opt_outs = OptOutCache(max_users=2, ttl_seconds=3600)
+        patches = [
+            mock.patch.object(promotion_index, '_index', self.index),
+            mock.patch.object(promotion_index, '_opt_outs', self.opt_outs),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def add_promotion(self, title, location=PromotionLocation.DASHBOARD_TOP, roles=(), starts=-1, ends=1):
+        return PromotionService.create_promotion({
+            'title': title,
+            'image_url': '/static/images/promo.jpg',
+            'target_url': 'https://example.com',
+            'location': location,
+            'start_date': self.now + timedelta(days=starts),
+            'end_date': self.now + timedelta(days=ends),
+            'allowed_roles': list(roles),
+        })
+
+    def add_user(self, username, role):
+        user = User(username=username, email=f'{username}@example.com', password_hash='x',
+                    full_name=username, role=role)
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def selected_titles(self, location, user=None, draws=200):
+        return {
+            promotion.title
+            for promotion in (PromotionService.get_promotion_for_location(location, user) for _ in range(draws))
+            if promotion is not None
+        }
+
+    def test_role_restricted_promotions(self):
+        """Test that users see unrestricted promotions and those for their role"""
+        self.add_promotion('Everyone')
+        self.add_promotion('Dentists', roles=['dentist'])
+        self.add_promotion('Sidebar', location=PromotionLocation.DASHBOARD_SIDEBAR)
+        dentist = self.add_user('dentist', 'dentist')
+        patient = self.add_user('patient', 'patient')
+
+        self.assertEqual(self.selected_titles('DASHBOARD_TOP', dentist), {'Everyone', 'Dentists'})
+        self.assertEqual(self.selected_titles('DASHBOARD_TOP', patient), {'Everyone'})
+        self.assertEqual(self.selected_titles(PromotionLocation.DASHBOARD_SIDEBAR, patient), {'Sidebar'})
+        self.assertEqual(self.selected_titles('nowhere', patient), set())
+
+    def test_only_promotions_running_now(self):
+        """Test that scheduled and ended promotions are not selected"""
+        self.add_promotion('Running', ends=3)
+        self.add_promotion('Scheduled', starts=1, ends=2)
+        self.add_promotion('Ended', starts=-2, ends=-1)
+        self.assertEqual(self.selected_titles('dashboard_top'), {'Running'})
+
+        # A scheduled promotion joins once its start date passes
+        later = self.now + timedelta(days=1, hours=1)
+        selected = {self.index.select('DASHBOARD_TOP', now=later) for _ in range(200)}
+        self.assertEqual(len(selected), 2)
+
+    def test_admin_edits_refresh_the_index(self):
+        """Test that promotion changes show on the next selection"""
+        first = self.add_promotion('First')
+        self.assertEqual(self.selected_titles('DASHBOARD_TOP'), {'First'})
+
+        second = self.add_promotion('Second')
+        self.assertEqual(self.selected_titles('DASHBOARD_TOP'), {'First', 'Second'})
+
+        PromotionService.toggle_promotion_status(first.id, False)
+        self.assertEqual(self.selected_titles('DASHBOARD_TOP'), {'Second'})
+
+        PromotionService.update_promotion(second.id, {'location': PromotionLocation.PROFILE_PAGE})
+        self.assertEqual(self.selected_titles('DASHBOARD_TOP'), set())
+        self.assertEqual(self.selected_titles('PROFILE_PAGE'), {'Second'})
+
+        PromotionService.delete_promotion(second.id)
+        self.assertIsNone(PromotionService.get_promotion_for_location('PROFILE_PAGE'))
+
+    def test_warm_index_skips_selection_queries(self):
+        """Test that a warm index leaves only the primary-key read of the pick"""
+        self.add_promotion('First')
+        self.add_promotion('Second', roles=['dentist'])
+        dentist = self.add_user('dentist', 'dentist')
+        PromotionService.get_promotion_for_location('DASHBOARD_TOP', dentist)
+        db.session.expunge_all()
+
+        with mock.patch.object(db.session, 'query', wraps=db.session.query) as query:
+            PromotionService.get_promotion_for_location('DASHBOARD_TOP', dentist)
+        query.assert_not_called()
+
+    def test_opted_out_users_see_nothing(self):
+        """Test that opt-outs are read once and updated by set_opt_out"""
+        self.add_promotion('Everyone')
+        user = self.add_user('patient', 'patient')
+        db.session.add(UserPromotionPreference(user_id=user.id, opt_out=True))
+        db.session.commit()
+
+        self.assertIsNone(PromotionService.get_promotion_for_location('DASHBOARD_TOP', user))
+
+        PromotionService.set_opt_out(user.id, False)
+        self.assertEqual(self.selected_titles('DASHBOARD_TOP', user), {'Everyone'})
+
+    def test_opt_out_cache_is_bounded(self):
+        """Test that the least recently used users are evicted"""
+        for user_id in (1, 2, 3):
+            self.opt_outs.remember(user_id, False)
+        self.assertEqual(list(self.opt_outs._entries), [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import os
+import re
+import sys
+import sqlite3
+
+# Add parent directory to path to import migrations
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from queries import (
+    DASHBOARD_DOCUMENTS_SQL, DASHBOARD_REFERRALS_SQL, MESSAGES_ALL_SQL, MESSAGES_RECEIVED_SQL,
+    MESSAGES_SENT_SQL, PROVIDER_CODE_SQL, REFERRAL_LIST_PATIENT_FILTER,
+    REFERRAL_LIST_PROVIDER_FILTER, REFERRAL_SORT_COLUMNS, REFERRALS_PAGE_SPECIALIST_SQL,
+    referral_list_query, referrals_page_query
+)
+from referral_management import (
+    CODE_FRAUD_THRESHOLD_SQL, LATEST_SIGNUP_SQL, REWARD_EVENTS_SQL, REWARDED_EVENTS_SQL
+)
+from services.campaign_tier_service import CAMPAIGN_TIERS_SQL
+from services.conversion_rollup_service import FUNNEL_SQL
+from services.fraud_signal_service import BUCKETS_SQL
+from services.leaderboard_service import (
+    NEIGHBORS_ABOVE_SQL, NEIGHBORS_BELOW_SQL, POINTS_AHEAD_SQL, TOP_SQL
+)
+from services.referring_doctor_service import TOP_DOCTORS_SQL
+from services.reward_queue import CLAIM_SQL
+from services.reward_rules_service import GENERATION_SQL
+from services.user_stats_service import STAT_COUNTS_SQL, STATS_TOTALS_SQL
+from utils.pagination import keyset_condition
+
+# A plan step that reads a whole table, e.g. "SCAN r" or "SCAN TABLE
+# referrals AS r" on older SQLite versions, or walks a whole index, e.g.
+# "SCAN r USING INDEX idx_referrals_created_at".
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?( USING (COVERING )?INDEX \w+)?$')
+INDEX_WALK = re.compile(r' USING (COVERING )?INDEX ')
+
+LIST_COLUMNS = 'r.id, r.created_at, p.full_name as patient_name_user, d.full_name as dentist_name_user'
+CREATED_AT = REFERRAL_SORT_COLUMNS['created_at']
+AFTER_CURSOR = keyset_condition(CREATED_AT, 'r.id', 'desc')
+
+
+def in_list(sql, count):
+    """Fill an IN ({placeholders}) query for a batch of count ids"""
+    return sql.format(placeholders=', '.join('?' for _ in range(count)))
+
+
+# The statements the hot handlers execute, imported from the modules that run them
+HOT_QUERIES = {
+    'dashboard_referrals': DASHBOARD_REFERRALS_SQL,
+    'user_stats_totals': STATS_TOTALS_SQL,
+    'user_stats_counts': STAT_COUNTS_SQL,
+    'conversion_funnel': FUNNEL_SQL,
+    'top_referring_doctors': TOP_DOCTORS_SQL,
+    'dashboard_recent_documents': DASHBOARD_DOCUMENTS_SQL,
+    'referrals_list_admin_first_page': referral_list_query(LIST_COLUMNS, CREATED_AT, 'desc'),
+    'referrals_list_admin': referral_list_query(LIST_COLUMNS, CREATED_AT, 'desc', [AFTER_CURSOR]),
+    'referrals_list_provider': referral_list_query(
+        LIST_COLUMNS, CREATED_AT, 'desc', [REFERRAL_LIST_PROVIDER_FILTER, AFTER_CURSOR]
+    ),
+    'referrals_list_patient': referral_list_query(
+        LIST_COLUMNS, CREATED_AT, 'desc', [REFERRAL_LIST_PATIENT_FILTER, AFTER_CURSOR]
+    ),
+    'referrals_page_specialist': referrals_page_query(REFERRALS_PAGE_SPECIALIST_SQL, CREATED_AT, 'desc'),
+    'messages_sent': MESSAGES_SENT_SQL,
+    'messages_received': MESSAGES_RECEIVED_SQL,
+    'messages_all': MESSAGES_ALL_SQL,
+    'rewards_leaderboard': TOP_SQL,
+    'rewards_user_rank': POINTS_AHEAD_SQL,
+    'rewards_neighbors_above': NEIGHBORS_ABOVE_SQL,
+    'rewards_neighbors_below': NEIGHBORS_BELOW_SQL,
+    'fraud_signal_buckets': ' UNION ALL '.join([BUCKETS_SQL] * 2),
+    'fraud_code_threshold': CODE_FRAUD_THRESHOLD_SQL,
+    'webhook_latest_signup': LATEST_SIGNUP_SQL,
+    'reward_batch_events': in_list(REWARD_EVENTS_SQL, 3),
+    'reward_batch_issued': in_list(REWARDED_EVENTS_SQL, 3),
+    'campaign_reward_tiers': in_list(CAMPAIGN_TIERS_SQL, 2),
+    'reward_rules_generation': GENERATION_SQL,
+    'reward_jobs_claim': CLAIM_SQL,
+    'provider_code_lookup': PROVIDER_CODE_SQL,
+}
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """Guard the hot queries against falling back to full table scans"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Build the fully migrated schema once"""
+        cls.conn = sqlite3.connect(':memory:')
+        run_migrations(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Close the schema database"""
+        cls.conn.close()
+
+    def explain(self, sql):
+        params = [1] * sql.count('?')
+        return [row[3] for row in self.conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+    def full_scans(self, sql, plan):
+        """Plan steps that read a whole table or index
+
+        Walking an index in order is allowed when it supplies the ORDER BY
+        of a LIMIT query, since the walk stops after LIMIT rows.
+        """
+        ordered_walk = 'LIMIT' in sql and 'USE TEMP B-TREE FOR ORDER BY' not in plan
+        return [step for step in plan
+                if FULL_SCAN.match(step) and not (ordered_walk and INDEX_WALK.search(step))]
+
+    def test_full_scan_detection(self):
+        """Test that table scans and unbounded index walks are both reported"""
+        self.assertEqual(self.full_scans('SELECT * FROM users', ['SCAN users']), ['SCAN users'])
+        walk = ['SCAN referring_doctors USING INDEX idx_referring_doctors_conversion']
+        self.assertEqual(self.full_scans('SELECT * FROM referring_doctors ORDER BY x', walk), walk)
+        self.assertEqual(self.full_scans('SELECT * FROM referring_doctors ORDER BY x LIMIT ?', walk), [])
+        self.assertEqual(self.full_scans('SELECT id FROM users', ['SCAN users USING COVERING INDEX idx']),
+                         ['SCAN users USING COVERING INDEX idx'])
+
+    def test_hot_queries_use_indexes(self):
+        """Test that no hot query plan contains a full table or index scan"""
+        for name, sql in HOT_QUERIES.items():
+            with self.subTest(query=name):
+                plan = self.explain(sql)
+                self.assertEqual(self.full_scans(sql, plan), [], f'{name} plan: {plan}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import os
+import sys
+import sqlite3
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from services.referring_doctor_service import ReferringDoctorService
+
+
+class ReferringDoctorStatsTestCase(unittest.TestCase):
+    """Test cases for referring doctor running sums"""
+
+    def setUp(self):
+        """Create a migrated database with referrals from three doctors"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+        doctors = ['Dr. Adams', ' dr. adams ', 'Dr. Baker', 'Dr. Chen']
+        self.conn.executemany(
+            'INSERT INTO referrals (user_id, referral_id, patient_name, referring_doctor) VALUES (?, ?, ?, ?)',
+            [(1, f'R{i}', 'Patient', doctors[i % len(doctors)]) for i in range(40)]
+        )
+        self.cursor = self.conn.cursor()
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def outcome(self, referral_id, accepted, value=None):
+        stage = 'case_accepted' if accepted else 'case_rejected'
+        self.cursor.execute('UPDATE referrals SET actual_value = ? WHERE referral_id = ?', (value, referral_id))
+        self.cursor.execute('INSERT INTO case_conversions (referral_id, stage) VALUES (?, ?)', (referral_id, stage))
+        ReferringDoctorService.record_outcome(self.cursor, referral_id, accepted)
+
+    def doctors_by_name(self):
+        return {doctor['name']: doctor for doctor in ReferringDoctorService.top_doctors(self.conn, limit=100)}
+
+    def test_rates_are_exact_after_many_outcomes(self):
+        """Test that rates derived from integer sums do not drift"""
+        # 0, 4, 8, ... are Dr. Adams; accept one in three over 10 outcomes
+        for n, i in enumerate(range(0, 40, 4)):
+            self.outcome(f'R{i}', n % 3 == 0, 33.33)
+
+        adams = self.doctors_by_name()['Dr. Adams']
+        self.assertEqual(adams['referral_count'], 10)
+        self.assertEqual(adams['accepted_count'], 4)
+        self.assertEqual(adams['conversion_rate'], 40.0)
+        self.assertEqual(adams['avg_case_value'], 33.33)
+
+    def test_names_share_a_key(self):
+        """Test that spacing and case variants count against one doctor"""
+        self.outcome('R0', True, 100)
+        self.outcome('R1', False)
+
+        doctors = self.doctors_by_name()
+        self.assertEqual(list(doctors), ['Dr. Adams'])
+        self.assertEqual(doctors['Dr. Adams']['referral_count'], 2)
+
+    def test_ranking_orders_by_conversion_rate(self):
+        """Test that top doctors are ordered by rate, then volume"""
+        self.outcome('R2', True)
+        self.outcome('R6', True)
+        self.outcome('R3', True)
+        self.outcome('R0', True)
+        self.outcome('R4', False)
+
+        names = [doctor['name'] for doctor in ReferringDoctorService.top_doctors(self.conn)]
+        self.assertEqual(names, ['Dr. Baker', 'Dr. Chen', 'Dr. Adams'])
+
+    def test_rebuild_matches_incremental(self):
+        """Test that the backfill reproduces the running sums"""
+        for i in range(12):
+            self.outcome(f'R{i}', i % 2 == 0, 150.5 if i % 4 == 0 else None)
+        before = self.doctors_by_name()
+
+        self.conn.execute('UPDATE referring_doctors SET referral_count = 0, accepted_count = 7')
+        self.assertEqual(ReferringDoctorService.rebuild(self.conn), 3)
+
+        after = self.doctors_by_name()
+        for name in before:
+            before[name].pop('last_referral_date')
+            after[name].pop('last_referral_date')
+        self.assertEqual(after, before)
+
+    def test_estimated_value_counts_when_no_actual_value(self):
+        """Test that both paths fall back to the referral's estimate"""
+        self.cursor.execute("UPDATE referrals SET estimated_value = 80 WHERE referral_id = 'R0'")
+        self.outcome('R0', True)
+        self.assertEqual(self.doctors_by_name()['Dr. Adams']['avg_case_value'], 80.0)
+
+        ReferringDoctorService.rebuild(self.conn)
+        self.assertEqual(self.doctors_by_name()['Dr. Adams']['avg_case_value'], 80.0)
+
+    def test_rebuild_resets_doctors_without_outcomes(self):
+        """Test that a doctor whose outcomes are gone is zeroed, date included"""
+        self.outcome('R2', True, 10)
+        self.conn.execute('DELETE FROM case_conversions')
+        ReferringDoctorService.rebuild(self.conn)
+
+        baker = self.doctors_by_name()['Dr. Baker']
+        self.assertEqual((baker['referral_count'], baker['last_referral_date']), (0, None))
+
+    def test_referral_without_doctor_is_ignored(self):
+        """Test that outcomes without a referring doctor are skipped"""
+        self.conn.execute("INSERT INTO referrals (user_id, referral_id, patient_name) VALUES (1, 'X', 'P')")
+        self.assertFalse(ReferringDoctorService.record_outcome(self.cursor, 'X', True))
+        self.assertEqual(ReferringDoctorService.top_doctors(self.conn), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
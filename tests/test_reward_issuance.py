@@ -0,0 +1,186 @@
+import unittest
+import os
+import sys
+import sqlite3
+import tempfile
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+from migrations import run_migrations
+from referral_management import RewardEngine, ManualSwagIssuer, StripeGiftCardIssuer
+from services.campaign_tier_service import CampaignTierService, DEFAULT_REWARD_TIERS, normalize_tiers
+
+
+class RewardIssuanceTestCase(unittest.TestCase):
+    """Test cases for batched reward issuance"""
+
+    def setUp(self):
+        """Create a migrated database with converted events for two campaigns"""
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.db_path)
+        run_migrations(conn)
+        conn.executemany('''
+            INSERT INTO referral_campaigns
+                (id, name, start_date, end_date, advocate_role, reward_type, reward_value, reward_trigger)
+            VALUES (?, ?, '2024-01-01', '2030-01-01', 'patient', ?, ?, 'CONVERTED')
+        ''', [(1, 'Gift cards', 'GIFT_CARD', 10), (2, 'Swag', 'SWAG', 5)])
+        conn.executemany('''
+            INSERT INTO referral_codes (id, campaign_id, advocate_id, code, link_slug)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(1, 1, 100, 'A', 'a'), (2, 1, 200, 'B', 'b'), (3, 2, 100, 'C', 'c')])
+        CampaignTierService.set_tiers(conn, 1, DEFAULT_REWARD_TIERS)
+
+        # Advocate 100 converted 6 times in campaign 1 (the 5th and 6th reach the 20% tier),
+        # advocate 200 once
+        events = [(1, 'CONVERTED')] * 6 + [(2, 'CONVERTED'), (2, 'SIGNED_UP'), (3, 'CONVERTED')]
+        conn.executemany('INSERT INTO referral_events (code_id, status) VALUES (?, ?)', events)
+        conn.commit()
+        conn.close()
+
+        self.app = Flask(__name__)
+        self.app.config['DATABASE_NAME'] = self.db_path
+        database.init_app(self.app)
+
+    def tearDown(self):
+        """Close pooled connections and remove the database file"""
+        pool = database._pools.pop(self.db_path, None)
+        if pool is not None:
+            pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def rewards(self):
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('''
+            SELECT event_id, id, advocate_id, reward_type, amount, status, fulfilled_at IS NOT NULL
+            FROM rewards ORDER BY event_id
+        ''').fetchall()
+        conn.close()
+        return {row[0]: row[1:] for row in rows}
+
+    def test_process_rewards_issues_one_reward_per_converted_event(self):
+        """Test that a batch issues every eligible event with tiered amounts"""
+        with self.app.app_context():
+            reward_ids = RewardEngine().process_rewards(list(range(1, 10)) + [1, 999])
+
+        rewards = self.rewards()
+        self.assertEqual(sorted(reward_ids), [1, 2, 3, 4, 5, 6, 7, 9])
+        self.assertEqual(sorted(rewards), [1, 2, 3, 4, 5, 6, 7, 9])
+        self.assertEqual({event_id: rewards[event_id][0] for event_id in reward_ids}, reward_ids)
+
+        self.assertEqual(rewards[1][1:], (100, 'GIFT_CARD', 10, 'ISSUED', 1))
+        self.assertEqual(rewards[5][1:], (100, 'GIFT_CARD', 12, 'ISSUED', 1))
+        self.assertEqual(rewards[7][1:], (200, 'GIFT_CARD', 10, 'ISSUED', 1))
+        self.assertEqual(rewards[9][1:], (100, 'SWAG', 5, 'PENDING', 0))
+
+    def test_process_rewards_is_idempotent(self):
+        """Test that already rewarded events are skipped on a rerun"""
+        with self.app.app_context():
+            engine = RewardEngine()
+            first = engine.process_reward(7)
+            self.assertIsNotNone(first)
+            self.assertIsNone(engine.process_reward(7))
+            self.assertEqual(sorted(engine.process_rewards([7, 9])), [9])
+
+        self.assertEqual(sorted(self.rewards()), [7, 9])
+
+    def test_reclaimed_event_is_not_issued_twice(self):
+        """Test that a second issue of an event, past the already-rewarded check, is a no-op"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT INTO users (id, username, email, password_hash, full_name)
+            VALUES (100, 'ada', 'ada@example.com', 'x', 'Ada')
+        ''')
+        conn.commit()
+
+        with self.app.app_context():
+            first = StripeGiftCardIssuer().issue_rewards([(100, 10, 1, 1), (100, 10, 1, 2)])
+            second = StripeGiftCardIssuer().issue_rewards([(100, 10, 1, 2), (100, 10, 1, 3)])
+
+        self.assertEqual(sorted(first), [1, 2])
+        self.assertEqual(sorted(second), [3])
+        self.assertEqual(sorted(self.rewards()), [1, 2, 3])
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM email_outbox').fetchone()[0], 3)
+        conn.close()
+
+    def test_converted_count_follows_event_status(self):
+        """Test that the triggers keep referral_codes.converted_count exact"""
+        conn = sqlite3.connect(self.db_path)
+        counts = lambda: dict(conn.execute('SELECT id, converted_count FROM referral_codes').fetchall())
+        self.assertEqual(counts(), {1: 6, 2: 1, 3: 1})
+
+        conn.execute("UPDATE referral_events SET status = 'CONVERTED' WHERE id = 8")
+        conn.execute("UPDATE referral_events SET code_id = 2 WHERE id = 1")
+        conn.execute("DELETE FROM referral_events WHERE id = 9")
+        self.assertEqual(counts(), {1: 5, 2: 3, 3: 0})
+
+        conn.execute('UPDATE referral_codes SET converted_count = 0')
+        CampaignTierService.rebuild_counts(conn)
+        self.assertEqual(counts(), {1: 5, 2: 3, 3: 0})
+        conn.close()
+
+    def test_tier_is_fixed_at_conversion_time(self):
+        """Test that later conversions do not lift an earlier event's tier"""
+        conn = sqlite3.connect(self.db_path)
+        ordinals = lambda: dict(conn.execute(
+            'SELECT id, conversion_ordinal FROM referral_events WHERE code_id = 2'
+        ).fetchall())
+        self.assertEqual(ordinals(), {7: 1, 8: None})
+
+        # Eight more conversions commit before the worker gets to event 8
+        conn.execute("UPDATE referral_events SET status = 'CONVERTED' WHERE id = 8")
+        conn.executemany('INSERT INTO referral_events (code_id, status) VALUES (?, ?)', [(2, 'CONVERTED')] * 8)
+        conn.commit()
+        self.assertEqual(ordinals()[8], 2)
+
+        with self.app.app_context():
+            RewardEngine().process_rewards([8, 12, 17])
+        rewards = self.rewards()
+        self.assertEqual((rewards[8][3], rewards[12][3], rewards[17][3]), (10, 12, 15))
+
+        conn.execute("UPDATE referral_events SET status = 'SIGNED_UP' WHERE id = 8")
+        self.assertIsNone(ordinals()[8])
+        conn.close()
+
+    def test_campaign_tiers_are_configurable(self):
+        """Test that rewards use the campaign's own tier table"""
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(CampaignTierService.get_tiers(conn, [1, 2, 3]),
+                         {1: [(5, 1.2), (10, 1.5)], 2: [], 3: []})
+        CampaignTierService.set_tiers(conn, 1, [{'min_conversions': 1, 'multiplier': 2},
+                                                {'min_conversions': 6, 'multiplier': 3}])
+        conn.commit()
+        conn.close()
+
+        with self.app.app_context():
+            RewardEngine().process_rewards([1, 6, 7])
+
+        rewards = self.rewards()
+        self.assertEqual(rewards[1][3], 20)
+        self.assertEqual(rewards[6][3], 30)
+        self.assertEqual(rewards[7][3], 20)
+
+    def test_normalize_tiers_rejects_bad_input(self):
+        """Test tier validation"""
+        self.assertEqual(normalize_tiers([(10, '1.5'), {'min_conversions': '5', 'multiplier': 1.2}]),
+                         [(5, 1.2), (10, 1.5)])
+        for tiers in ([(0, 2)], [(5, 0)], [(5, 2), (5, 3)], [{'multiplier': 2}]):
+            with self.subTest(tiers=tiers):
+                with self.assertRaises(ValueError):
+                    normalize_tiers(tiers)
+
+    def test_failed_batch_rolls_back(self):
+        """Test that an error mid-batch leaves no partial rewards behind"""
+        with self.app.app_context():
+            with self.assertRaises(sqlite3.IntegrityError):
+                ManualSwagIssuer().issue_rewards([(100, 5, 2, 9), (None, 5, 2, 9)])
+
+        self.assertEqual(self.rewards(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
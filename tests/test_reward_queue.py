@@ -0,0 +1,131 @@
+import unittest
+import os
+import sys
+import sqlite3
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from services.reward_queue import RewardQueue, backoff_delay
+
+
+class RewardQueueTestCase(unittest.TestCase):
+    """Test cases for the durable reward job queue"""
+
+    NOW = 1_700_000_000.0
+
+    def setUp(self):
+        """Create a migrated database with ten queued events"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+        for event_id in range(1, 11):
+            RewardQueue.enqueue(self.conn, event_id, now=self.NOW + event_id)
+        self.conn.commit()
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def statuses(self):
+        return dict(self.conn.execute('SELECT event_id, status FROM reward_jobs').fetchall())
+
+    def test_enqueue_is_idempotent_per_event(self):
+        """Test that an event is only queued once"""
+        self.assertFalse(RewardQueue.enqueue(self.conn, 3, now=self.NOW))
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM reward_jobs').fetchone()[0], 10)
+
+    def test_claim_in_batches_without_overlap(self):
+        """Test that concurrent claims lease disjoint batches in FIFO order"""
+        first = RewardQueue.claim(self.conn, 'a', batch_size=4, lease_seconds=60, now=self.NOW + 20)
+        second = RewardQueue.claim(self.conn, 'b', batch_size=4, lease_seconds=60, now=self.NOW + 20)
+
+        self.assertEqual([event_id for _, event_id, _ in first], [1, 2, 3, 4])
+        self.assertEqual([event_id for _, event_id, _ in second], [5, 6, 7, 8])
+        self.assertEqual({attempts for _, _, attempts in first + second}, {1})
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test that jobs held by a dead worker are picked up after the lease"""
+        RewardQueue.claim(self.conn, 'a', batch_size=10, lease_seconds=60, now=self.NOW + 20)
+        self.assertEqual(RewardQueue.claim(self.conn, 'b', now=self.NOW + 30), [])
+
+        reclaimed = RewardQueue.claim(self.conn, 'b', batch_size=10, now=self.NOW + 100)
+        self.assertEqual(len(reclaimed), 10)
+        self.assertEqual({attempts for _, _, attempts in reclaimed}, {2})
+
+    def test_run_batch_retries_with_backoff_then_dies(self):
+        """Test that failures back off exponentially and stop at max attempts"""
+        calls = []
+
+        def handler(event_id):
+            calls.append(event_id)
+            if event_id == 2:
+                raise RuntimeError('issuer unavailable')
+            return event_id * 100
+
+        now = self.NOW + 20
+        result = RewardQueue.run_batch(self.conn, handler, batch_size=10, now=now)
+        self.assertEqual(result, {'claimed': 10, 'done': 9, 'retried': 1, 'dead': 0})
+        self.assertEqual(self.conn.execute(
+            'SELECT reward_id FROM reward_jobs WHERE event_id = 5').fetchone()[0], 500)
+
+        # Not runnable again until the backoff has elapsed
+        run_after, error = self.conn.execute(
+            'SELECT run_after, last_error FROM reward_jobs WHERE event_id = 2').fetchone()
+        self.assertGreaterEqual(run_after, backoff_delay(1))
+        self.assertIn('issuer unavailable', error)
+        self.assertEqual(RewardQueue.claim(self.conn, batch_size=10, now=now + 1), [])
+
+        # Keep failing until the job is dead
+        for _ in range(20):
+            now = self.conn.execute('SELECT run_after FROM reward_jobs WHERE event_id = 2').fetchone()[0]
+            RewardQueue.run_batch(self.conn, handler, batch_size=10, now=now)
+            if self.statuses()[2] == 'dead':
+                break
+        self.assertEqual(self.statuses()[2], 'dead')
+        self.assertEqual(calls.count(5), 1)
+
+    def test_run_batch_with_batch_handler_falls_back_per_job(self):
+        """Test that a failed batch is retried one job at a time"""
+        batches = []
+
+        def batch_handler(event_ids):
+            batches.append(event_ids)
+            if 2 in event_ids:
+                raise RuntimeError('bad event in batch')
+            return {event_id: event_id * 100 for event_id in event_ids}
+
+        def handler(event_id):
+            if event_id == 2:
+                raise RuntimeError('bad event')
+            return event_id * 100
+
+        result = RewardQueue.run_batch(self.conn, handler, batch_size=10, now=self.NOW + 20,
+                                       batch_handler=batch_handler)
+        self.assertEqual(result, {'claimed': 10, 'done': 9, 'retried': 1, 'dead': 0})
+
+        self.conn.execute("UPDATE reward_jobs SET status = 'queued', run_after = 0 WHERE event_id IN (3, 4)")
+        self.conn.commit()
+        result = RewardQueue.run_batch(self.conn, handler, batch_size=2, now=self.NOW + 20,
+                                       batch_handler=batch_handler)
+        self.assertEqual(result, {'claimed': 2, 'done': 2, 'retried': 0, 'dead': 0})
+        self.assertEqual(batches[-1], [3, 4])
+        self.assertEqual(self.conn.execute(
+            'SELECT status, reward_id FROM reward_jobs WHERE event_id = 4').fetchone(), ('done', 400))
+
+    def test_backoff_doubles_and_caps(self):
+        """Test the retry delay schedule"""
+        self.assertEqual([backoff_delay(n, base=10, maximum=60) for n in (1, 2, 3, 4, 5)],
+                         [10, 20, 40, 60, 60])
+
+    def test_stats_report_depth_and_lag(self):
+        """Test that stats expose queue depth and the age of the oldest ready job"""
+        RewardQueue.claim(self.conn, 'a', batch_size=3, lease_seconds=60, now=self.NOW + 20)
+        stats = RewardQueue.stats(self.conn, now=self.NOW + 50)
+
+        self.assertEqual((stats['queued'], stats['running'], stats['depth'], stats['ready']), (7, 3, 10, 7))
+        self.assertEqual(stats['lag_seconds'], 46.0)
+        self.assertEqual(stats['oldest_pending_seconds'], 49.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import os
+import sys
+import sqlite3
+from unittest import mock
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from services.reward_rules_service import RewardRuleCache
+
+
+class RewardRuleCacheTestCase(unittest.TestCase):
+    """Test cases for the reward trigger rules cache"""
+
+    def setUp(self):
+        """Create a migrated database with one active and one paused program"""
+        RewardRuleCache.invalidate()
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+        self.conn.executemany('INSERT INTO reward_programs (id, name, status) VALUES (?, ?, ?)',
+                              [(1, 'Active', 'active'), (2, 'Paused', 'paused')])
+        self.conn.executemany('''
+            INSERT INTO reward_triggers (program_id, trigger_type, trigger_value, points_awarded, is_active)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(1, 'referral_completed', 'completed', 10, True),
+              (1, 'referral_completed', 'bonus', 5, True),
+              (1, 'first_referral', 'first_time', 50, True),
+              (1, 'referral_completed', 'retired', 99, False),
+              (2, 'referral_completed', 'completed', 7, True)])
+        self.conn.commit()
+
+    def tearDown(self):
+        """Close the test database and drop cached rules"""
+        self.conn.close()
+        RewardRuleCache.invalidate()
+
+    def points(self, trigger_type='referral_completed'):
+        return [rule['points_awarded'] for rule in RewardRuleCache.rules_for(self.conn, trigger_type)]
+
+    def test_rules_are_grouped_by_trigger_type(self):
+        """Test that only active triggers of active programs are returned"""
+        self.assertEqual(self.points(), [10, 5])
+        self.assertEqual(self.points('first_referral'), [50])
+        self.assertEqual(self.points('unknown'), [])
+        self.assertEqual(RewardRuleCache.rules_for(self.conn, 'first_referral')[0]['program_id'], 1)
+
+    def test_rules_are_loaded_once_per_generation(self):
+        """Test that repeated lookups don't re-read the rules"""
+        with mock.patch.object(RewardRuleCache, '_load', wraps=RewardRuleCache._load) as load:
+            for _ in range(5):
+                self.points()
+            self.assertEqual(load.call_count, 1)
+
+    def test_edits_invalidate_the_cache(self):
+        """Test that program, trigger and tier writes are seen on the next lookup"""
+        self.assertEqual(self.points(), [10, 5])
+
+        # Another process pausing the program is picked up through the generation
+        self.conn.execute("UPDATE reward_programs SET status = 'paused' WHERE id = 1")
+        self.conn.commit()
+        self.assertEqual(self.points(), [])
+
+        self.conn.execute("UPDATE reward_programs SET status = 'active' WHERE id = 2")
+        self.conn.commit()
+        self.assertEqual(self.points(), [7])
+
+        generation = RewardRuleCache._current_generation(self.conn)
+        self.conn.execute("INSERT INTO reward_tiers (program_id, tier_name, tier_level) VALUES (2, 'Gold', 1)")
+        self.assertEqual(RewardRuleCache._current_generation(self.conn), generation + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
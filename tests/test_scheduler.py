@@ -0,0 +1,188 @@
+import unittest
+import os
+import sys
+import sqlite3
+import shutil
+import subprocess
+import tempfile
+import time
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+from config.app_config import get_config
+from migrations import run_migrations
+from models import db
+from services.scheduler import (
+    JOBS, FAILED, RUNNING, SUCCEEDED, JobScheduler, ScheduledJob, create_job_app
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class JobSchedulerTestCase(unittest.TestCase):
+    """Test cases for leased background jobs and their run history"""
+
+    NOW = 1_700_000_000.0
+
+    def setUp(self):
+        """Create a migrated database and two jobs"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+        self.calls = []
+        self.jobs = {
+            'tick': ScheduledJob('tick', self.tick, interval_seconds=60, lease_seconds=30),
+            'broken': ScheduledJob('broken', self.broken, interval_seconds=3600, lease_seconds=30),
+        }
+        self.app = Flask(__name__)
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def tick(self, conn):
+        self.calls.append('tick')
+        return {'ticks': len(self.calls)}
+
+    def broken(self, conn):
+        raise RuntimeError('boom')
+
+    def scheduler(self, worker_id):
+        scheduler = JobScheduler(jobs=self.jobs, worker_id=worker_id, app=self.app)
+        scheduler.retry_seconds = 120
+        return scheduler
+
+    def job_state(self, name):
+        return self.conn.execute('''
+            SELECT next_run_at, locked_by, last_status FROM scheduler_jobs WHERE name = ?
+        ''', (name,)).fetchone()
+
+    def test_new_jobs_run_then_wait_for_their_interval(self):
+        """Test that a job runs when registered and again one interval later"""
+        scheduler = self.scheduler('a')
+        outcomes = scheduler.run_pending(self.conn, now=self.NOW)
+        self.assertEqual({outcome['name']: outcome['status'] for outcome in outcomes},
+                         {'tick': SUCCEEDED, 'broken': FAILED})
+        self.assertEqual(self.job_state('tick'), (self.NOW + 60, None, SUCCEEDED))
+
+        self.assertEqual(scheduler.run_pending(self.conn, now=self.NOW + 30), [])
+        self.assertEqual([o['name'] for o in scheduler.run_pending(self.conn, now=self.NOW + 60)], ['tick'])
+        self.assertEqual(self.calls, ['tick', 'tick'])
+
+    def test_failed_jobs_retry_sooner(self):
+        """Test that a failure is recorded and retried after retry_seconds"""
+        scheduler = self.scheduler('a')
+        scheduler.run_pending(self.conn, now=self.NOW)
+        self.assertEqual(self.job_state('broken'), (self.NOW + 120, None, FAILED))
+
+        run = JobScheduler.history(self.conn, 'broken')[0]
+        self.assertEqual((run['status'], run['error']), (FAILED, 'RuntimeError: boom'))
+
+    def test_runs_record_their_own_start_and_finish(self):
+        """Test that without a fixed now each job is timed and leased when it runs"""
+        self.jobs['slow'] = ScheduledJob('slow', lambda conn: time.sleep(0.05), interval_seconds=60)
+        self.scheduler('a').run_pending(self.conn)
+
+        runs = {run['job_name']: run for run in JobScheduler.history(self.conn)}
+        self.assertGreaterEqual(runs['slow']['finished_at'] - runs['slow']['started_at'], 0.05)
+        # tick is claimed after slow finished, not at poll time
+        self.assertGreaterEqual(runs['tick']['started_at'], runs['slow']['finished_at'])
+
+    def test_one_worker_runs_each_job(self):
+        """Test that a leased job is skipped by other workers until the lease expires"""
+        first, second = self.scheduler('a'), self.scheduler('b')
+        first.sync(self.conn, now=self.NOW)
+        run_id = first.claim(self.conn, self.jobs['tick'], now=self.NOW)
+        self.assertIsNotNone(run_id)
+
+        self.assertIsNone(second.run_job(self.conn, self.jobs['tick'], now=self.NOW + 10))
+        self.assertIsNone(second.run_job(self.conn, self.jobs['tick'], now=self.NOW + 10, force=True))
+
+        # Worker a died mid-run: after its lease b takes over, and a's late
+        # finish does not clobber b's lease
+        outcome = second.run_job(self.conn, self.jobs['tick'], now=self.NOW + 31)
+        self.assertEqual(outcome['status'], SUCCEEDED)
+        self.assertEqual(self.calls, ['tick'])
+
+        history = JobScheduler.history(self.conn, 'tick')
+        self.assertEqual([(run['worker_id'], run['status']) for run in history], [('b', SUCCEEDED), ('a', RUNNING)])
+        self.assertEqual(history[0]['result'], {'ticks': 1})
+
+    def test_forced_run_ignores_schedule(self):
+        """Test that --run style forcing starts a job that is not due"""
+        scheduler = self.scheduler('a')
+        scheduler.run_pending(self.conn, now=self.NOW)
+        outcome = scheduler.run_job(self.conn, self.jobs['tick'], now=self.NOW + 1, force=True)
+        self.assertEqual(outcome['status'], SUCCEEDED)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_history_is_pruned(self):
+        """Test the built-in job that deletes old runs"""
+        scheduler = self.scheduler('a')
+        scheduler.run_pending(self.conn, now=self.NOW)
+        JOBS['prune_scheduler_history'].func(self.conn)
+        self.assertEqual(JobScheduler.history(self.conn), [])
+
+    def test_registered_jobs(self):
+        """Test that the maintenance jobs are registered"""
+        self.assertTrue({'expire_promotions', 'recover_promotion_counters', 'send_appointment_reminders',
+                         'prune_fraud_signal_buckets', 'prune_scheduler_history'} <= set(JOBS))
+
+    def test_cron_entry_point_does_not_load_the_web_app(self):
+        """Test that the scheduler CLI imports without the app module"""
+        result = subprocess.run(
+            [sys.executable, '-c', 'import sys, cron_jobs.scheduler; print("app" in sys.modules)'],
+            cwd=ROOT, capture_output=True, text=True, timeout=60
+        )
+        self.assertEqual(result.stdout.strip(), 'False', result.stderr)
+
+
+class JobAppTestCase(unittest.TestCase):
+    """Test cases for the app that scheduled jobs run in"""
+
+    def setUp(self):
+        """Create a migrated database file, named relative to the working directory"""
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        conn = sqlite3.connect('jobs.db')
+        run_migrations(conn)
+        conn.execute('''
+            INSERT INTO promotions (user_id, title, start_date, end_date, is_active)
+            VALUES (1, 'Old', '2020-01-01', '2020-02-01', 1)
+        ''')
+        conn.commit()
+        conn.close()
+
+        class JobConfig(get_config()):
+            DATABASE_NAME = 'jobs.db'
+        self.app = create_job_app(JobConfig)
+
+    def tearDown(self):
+        """Dispose of both connection layers and remove the working directory"""
+        with self.app.app_context():
+            db.engine.dispose()
+        pool = database._pools.pop('jobs.db', None)
+        if pool is not None:
+            pool.close_all()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def test_orm_and_pooled_connections_share_the_database(self):
+        """Test that an ORM job runs against the same file as the pooled connections"""
+        scheduler = JobScheduler(jobs={'expire_promotions': JOBS['expire_promotions']},
+                                 worker_id='a', database='jobs.db', app=self.app)
+        outcomes = scheduler.run_pending()
+        self.assertEqual([(o['status'], o.get('result')) for o in outcomes], [(SUCCEEDED, {'expired': 1})])
+
+        conn = sqlite3.connect('jobs.db')
+        try:
+            self.assertEqual(conn.execute('SELECT is_active FROM promotions').fetchone()[0], 0)
+        finally:
+            conn.close()
+        self.assertFalse(os.path.exists('instance'))
+
+
+if __name__ == '__main__':
+    unittest.main()
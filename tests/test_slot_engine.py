@@ -0,0 +1,161 @@
+import unittest
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+from flask import Flask
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import db, Appointment, AppointmentStatus, Availability, User
+from services.appointment_service import AppointmentService
+from services.availability_service import AvailabilityService
+from services.slot_engine import free_slots, merge_intervals
+
+DAY = date(2030, 6, 3)  # a Monday
+
+
+def at(hour, minute=0, day=DAY):
+    return datetime.combine(day, time(hour, minute))
+
+
+def minutes(value):
+    return timedelta(minutes=value)
+
+
+class SlotEngineTestCase(unittest.TestCase):
+    """Test cases for subtracting bookings from availability windows"""
+
+    def test_merge_intervals(self):
+        """Test that overlapping and touching intervals merge and empty ones drop"""
+        self.assertEqual(
+            merge_intervals([(at(11), at(12)), (at(9), at(10)), (at(10), at(10, 30)), (at(13), at(13))]),
+            [(at(9), at(10, 30)), (at(11), at(12))]
+        )
+
+    def test_slots_stay_on_the_window_grid(self):
+        """Test that a booking removes only the slots it overlaps"""
+        slots = free_slots([(at(9), at(11))], [(at(9, 40), at(10, 10))], minutes(30))
+        self.assertEqual(slots, [(at(9), at(9, 30)), (at(10, 30), at(11))])
+
+    def test_variable_duration_step_and_buffer(self):
+        """Test longer slots on a finer grid with padding around bookings"""
+        slots = free_slots(
+            [(at(9), at(12))], [(at(10), at(10, 30))], minutes(45),
+            buffer=minutes(15), step=minutes(15)
+        )
+        self.assertEqual([start for start, _ in slots], [at(9), at(10, 45), at(11), at(11, 15)])
+
+    def test_overlapping_windows_and_bookings(self):
+        """Test merged windows, a booking spanning two windows and not_before"""
+        windows = [(at(13), at(15)), (at(9), at(11)), (at(10), at(12))]
+        booked = [(at(11, 30), at(13, 30)), (at(9), at(9, 30))]
+        slots = free_slots(windows, booked, minutes(30), not_before=at(9, 50))
+        self.assertEqual([start for start, _ in slots], [at(10), at(10, 30), at(11), at(13, 30), at(14), at(14, 30)])
+
+    def test_limit(self):
+        """Test that only the earliest slots are returned when limited"""
+        slots = free_slots([(at(13), at(17)), (at(9), at(12))], [], minutes(60), limit=2)
+        self.assertEqual(slots, [(at(9), at(10)), (at(10), at(11))])
+
+    def test_invalid_settings(self):
+        """Test that durations must be positive and buffers not negative"""
+        with self.assertRaises(ValueError):
+            free_slots([], [], minutes(0))
+        with self.assertRaises(ValueError):
+            free_slots([], [], minutes(30), buffer=minutes(-5))
+
+
+class AvailableSlotsTestCase(unittest.TestCase):
+    """Test cases for slot queries over specialists and dates"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        for username, role, specialization in [
+            ('patient', 'patient', None),
+            ('endo', 'specialist', 'endodontics'),
+            ('ortho', 'specialist', 'orthodontics'),
+            ('endo2', 'specialist', 'endodontics'),
+        ]:
+            db.session.add(User(username=username, email=f'{username}@example.com', password_hash='x',
+                                full_name=username.title(), role=role, specialization=specialization))
+        db.session.flush()
+        # endo: Mondays 9-12 and one extra Tuesday afternoon; ortho: Mondays 9-10;
+        # endo2: Tuesdays 8-9
+        db.session.add_all([
+            Availability(specialist_id=2, day_of_week=0, start_time=time(9), end_time=time(12)),
+            Availability(specialist_id=2, is_recurring=False, specific_date=DAY + timedelta(days=1),
+                         start_time=time(14), end_time=time(15)),
+            Availability(specialist_id=2, is_recurring=False, specific_date=DAY + timedelta(days=30),
+                         start_time=time(14), end_time=time(15)),
+            Availability(specialist_id=3, day_of_week=0, start_time=time(9), end_time=time(10)),
+            Availability(specialist_id=4, day_of_week=1, start_time=time(8), end_time=time(9)),
+        ])
+        for specialist_id, start, end, status in [
+            (2, at(9, 30), at(10, 30), AppointmentStatus.SCHEDULED),
+            (2, at(11), at(11, 30), AppointmentStatus.CANCELED),
+            (3, at(9), at(9, 30), AppointmentStatus.SCHEDULED),
+        ]:
+            db.session.add(Appointment(patient_id=1, specialist_id=specialist_id, title='Consult',
+                                       start_time=start, end_time=end, status=status, created_by=1))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_single_day(self):
+        """Test that scheduled appointments block slots and canceled ones do not"""
+        slots = AppointmentService.get_available_slots(2, DAY)
+        self.assertEqual([start for start, _ in slots], [at(9), at(10, 30), at(11), at(11, 30)])
+        self.assertEqual(AppointmentService.get_available_slots(2, DAY + timedelta(days=2)), [])
+
+    def test_buffer_and_duration(self):
+        """Test hour-long slots with buffers around the 09:30-10:30 booking"""
+        slots = AppointmentService.get_available_slots(2, DAY, duration_minutes=60, buffer_minutes=15)
+        self.assertEqual(slots, [(at(11), at(12))])
+        slots = AppointmentService.get_available_slots(2, DAY, duration_minutes=60, buffer_minutes=45)
+        self.assertEqual(slots, [])
+
+    def test_range_across_specialists(self):
+        """Test one call covering two specialists over a week"""
+        slots = AppointmentService.find_available_slots([2, 3, 99], DAY, DAY + timedelta(days=7))
+        self.assertEqual(set(slots), {2, 3, 99})
+        self.assertEqual(slots[99], [])
+        self.assertEqual([start for start, _ in slots[3]], [at(9, 30), at(9, 0, DAY + timedelta(days=7)),
+                                                             at(9, 30, DAY + timedelta(days=7))])
+        tuesday = DAY + timedelta(days=1)
+        self.assertIn((at(14, 0, tuesday), at(14, 30, tuesday)), slots[2])
+        self.assertEqual(len(slots[2]), 4 + 2 + 6)
+
+    def test_search_ranks_specialists_by_first_free_slot(self):
+        """Test the earliest slots per endodontist, soonest first"""
+        results = AvailabilityService.search_available_specialists(
+            DAY, DAY + timedelta(days=6), specialty='endodontics', duration_minutes=60,
+            slots_per_specialist=2, not_before=at(10)
+        )
+        tuesday = DAY + timedelta(days=1)
+        self.assertEqual([(r['full_name'], r['first_available']) for r in results],
+                         [('Endo', at(11)), ('Endo2', at(8, 0, tuesday))])
+        self.assertEqual(results[0]['slots'], [(at(11), at(12)), (at(14, 0, tuesday), at(15, 0, tuesday))])
+
+        results = AvailabilityService.search_available_specialists(DAY, specialty='orthodontics', not_before=at(8))
+        self.assertEqual([r['slots'] for r in results], [[(at(9, 30), at(10))]])
+        self.assertEqual(AvailabilityService.search_available_specialists(DAY, not_before=at(12)), [])
+
+    def test_invalid_range(self):
+        """Test that reversed and overlong ranges are rejected"""
+        with self.assertRaises(ValueError):
+            AppointmentService.find_available_slots([2], DAY, DAY - timedelta(days=1))
+        with self.assertRaises(ValueError):
+            AppointmentService.find_available_slots([2], DAY, DAY + timedelta(days=365))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import os
+import sys
+import sqlite3
+from datetime import date
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from services.team_metrics_service import TeamMetricsService
+
+
+class TeamMetricsTestCase(unittest.TestCase):
+    """Test cases for the team_metrics upsert path"""
+
+    def setUp(self):
+        """Create a fully migrated in-memory database"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def rows(self):
+        return self.conn.execute('''
+            SELECT user_id, date, referrals_processed, consultations_completed, cases_accepted
+            FROM team_metrics ORDER BY user_id, date
+        ''').fetchall()
+
+    def test_record_status_upserts_one_row(self):
+        """Test that repeated changes on a day increment a single row"""
+        cursor = self.conn.cursor()
+        day = date(2024, 3, 1)
+        for status in ('consultation_scheduled', 'case_accepted', 'case_rejected', 'treatment_started'):
+            TeamMetricsService.record_status(cursor, 7, status, day)
+
+        self.assertEqual(self.rows(), [(7, '2024-03-01', 3, 1, 1)])
+
+    def test_record_events_batches_by_user_and_day(self):
+        """Test that a batch is folded per (user, day) and added to existing rows"""
+        TeamMetricsService.record_status(self.conn.cursor(), 1, 'case_accepted', '2024-03-01')
+        written = TeamMetricsService.record_events(self.conn, [
+            (1, 'case_accepted', '2024-03-01T09:15:00'),
+            (1, 'consultation_scheduled', date(2024, 3, 1)),
+            (1, 'case_rejected', '2024-03-02'),
+            (2, 'case_accepted', '2024-03-01'),
+        ])
+
+        self.assertEqual(written, 3)
+        self.assertEqual(self.rows(), [
+            (1, '2024-03-01', 3, 1, 2),
+            (1, '2024-03-02', 1, 0, 0),
+            (2, '2024-03-01', 1, 0, 1),
+        ])
+
+    def test_invalid_batch_writes_nothing(self):
+        """Test that a batch with a bad event is rejected as a whole"""
+        with self.assertRaises(ValueError):
+            TeamMetricsService.record_events(self.conn, [(1, 'case_accepted', None), (None, 'case_accepted', None)])
+        self.assertEqual(self.rows(), [])
+
+    def test_duplicate_days_rejected(self):
+        """Test that the schema enforces one row per user and day"""
+        self.conn.execute("INSERT INTO team_metrics (user_id, date) VALUES (1, '2024-01-01')")
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("INSERT INTO team_metrics (user_id, date) VALUES (1, '2024-01-01')")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import os
+import sys
+import sqlite3
+
+# Add parent directory to path to import services
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import run_migrations
+from services.user_stats_service import TOTAL, UserStatsService
+
+
+class UserStatsTestCase(unittest.TestCase):
+    """Test cases for the materialized per-user counters"""
+
+    def setUp(self):
+        """Create a fully migrated in-memory database"""
+        self.conn = sqlite3.connect(':memory:')
+        run_migrations(self.conn)
+
+    def tearDown(self):
+        """Close the test database"""
+        self.conn.close()
+
+    def add_referral(self, user_id, referral_id, status='pending'):
+        self.conn.execute(
+            'INSERT INTO referrals (user_id, referral_id, patient_name, status) VALUES (?, ?, ?, ?)',
+            (user_id, referral_id, 'Patient', status)
+        )
+
+    def add_document(self, user_id, file_type):
+        self.conn.execute(
+            'INSERT INTO documents (user_id, file_type, file_name, file_path) VALUES (?, ?, ?, ?)',
+            (user_id, file_type, 'scan.pdf', '/tmp/scan.pdf')
+        )
+
+    def test_inserts_update_counters(self):
+        """Test that referral and document inserts are counted per user"""
+        self.add_referral(1, 'R1')
+        self.add_referral(1, 'R2', 'approved')
+        self.add_referral(2, 'R3')
+        self.add_document(1, 'xray')
+        self.add_document(1, 'xray')
+
+        stats = UserStatsService.get_stats(self.conn, 1)
+        self.assertEqual(stats['referral_total'], 2)
+        self.assertEqual(stats['document_total'], 2)
+        self.assertEqual(stats['status_counts'], {'pending': 1, 'approved': 1})
+        self.assertEqual(stats['document_counts'], {'xray': 2})
+        self.assertIsNotNone(stats['last_activity_at'])
+        self.assertEqual(UserStatsService.get_stats(self.conn, 2)['status_counts'], {'pending': 1})
+
+    def test_status_change_and_delete(self):
+        """Test that updates move counts between statuses and deletes remove them"""
+        self.add_referral(1, 'R1')
+        self.add_referral(1, 'R2')
+        self.conn.execute("UPDATE referrals SET status = 'completed' WHERE referral_id = 'R1'")
+        self.conn.execute("UPDATE referrals SET notes = 'unrelated' WHERE referral_id = 'R2'")
+        self.conn.execute("DELETE FROM referrals WHERE referral_id = 'R2'")
+
+        stats = UserStatsService.get_stats(self.conn, 1)
+        self.assertEqual(stats['referral_total'], 1)
+        self.assertEqual(stats['status_counts'], {'completed': 1})
+
+    def test_reassigned_referral_moves_between_users(self):
+        """Test that changing a referral's owner adjusts both users"""
+        self.add_referral(1, 'R1')
+        self.conn.execute("UPDATE referrals SET user_id = 2 WHERE referral_id = 'R1'")
+
+        self.assertEqual(UserStatsService.get_stats(self.conn, 1)['referral_total'], 0)
+        self.assertEqual(UserStatsService.get_stats(self.conn, 2)['status_counts'], {'pending': 1})
+
+    def test_rolled_back_write_leaves_counters_untouched(self):
+        """Test that counters share the transaction of the write that changed them"""
+        self.add_referral(1, 'R1')
+        self.conn.commit()
+        self.add_referral(1, 'R2')
+        self.conn.rollback()
+
+        self.assertEqual(UserStatsService.get_stats(self.conn, 1)['referral_total'], 1)
+
+    def test_rebuild_repairs_drift(self):
+        """Test that rebuild recomputes counters from the source tables"""
+        self.add_referral(1, 'R1')
+        self.add_document(1, 'xray')
+        self.conn.execute('UPDATE user_stat_counts SET count = 99')
+        self.conn.execute('UPDATE user_stats SET referral_total = 99')
+        self.assertEqual(len(UserStatsService.find_drift(self.conn)), 3)
+
+        UserStatsService.rebuild(self.conn, user_id=1)
+
+        self.assertEqual(UserStatsService.find_drift(self.conn), [])
+        stats = UserStatsService.get_stats(self.conn, 1)
+        self.assertEqual((stats['referral_total'], stats['document_total']), (1, 1))
+
+    def test_check_reports_drifted_totals(self):
+        """Test that find_drift compares the user_stats totals too"""
+        self.add_referral(1, 'R1')
+        self.add_document(1, 'xray')
+        self.conn.execute('UPDATE user_stats SET document_total = 0')
+
+        self.assertEqual(UserStatsService.find_drift(self.conn), [(1, TOTAL, 'document_total', 0, 1)])
+
+    def test_unknown_user_has_empty_stats(self):
+        """Test that a user without history reads as zeros"""
+        stats = UserStatsService.get_stats(self.conn, 404)
+        self.assertEqual(stats['referral_total'], 0)
+        self.assertEqual(stats['status_counts'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
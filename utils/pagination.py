@@ -0,0 +1,104 @@
+"""
+Keyset (cursor) pagination helpers
+
+Pages are ordered by a whitelisted sort expression with the row id as a
+tie-breaker, and each page continues strictly after the last row of the
+previous one. Unlike OFFSET, fetching page N does not read the N-1 pages
+before it, so deep pages cost the same as the first.
+"""
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor is malformed or does not match the query"""
+
+
+def encode_cursor(sort, order, value, row_id):
+    """Encode the position after a row as an opaque URL-safe token"""
+    payload = json.dumps({'s': sort, 'o': order, 'v': value, 'id': row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, sort, order):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+        token (str): Cursor from a previous response
+        sort (str): Sort key of the current request
+        order (str): 'asc' or 'desc' for the current request
+
+    Returns:
+        tuple: (sort value, row id) of the last row already returned
+
+    Raises:
+        InvalidCursor: If the token is malformed or was issued for another sort
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        value, row_id = payload['v'], int(payload['id'])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+    if payload.get('s') != sort or payload.get('o') != order:
+        raise InvalidCursor('Cursor does not match the requested sort order')
+    return value, row_id
+
+
+def parse_limit(raw, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Parse a page size request argument, clamped to 1..maximum"""
+    if raw in (None, ''):
+        return default
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    return max(1, min(limit, maximum))
+
+
+def parse_order(raw, default='desc'):
+    """Normalize a sort direction request argument"""
+    order = (raw or default).lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'")
+    return order
+
+
+def parse_fields(raw, allowed):
+    """
+    Parse a comma separated fields= projection against a whitelist.
+
+    Returns:
+        list: Requested field names in request order, or None for all fields
+
+    Raises:
+        ValueError: If an unknown field is requested
+    """
+    if not raw:
+        return None
+    fields = []
+    for name in raw.split(','):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in allowed:
+            raise ValueError(f'Unknown field: {name}')
+        fields.append(name)
+    return fields or None
+
+
+def keyset_condition(sort_expr, id_expr, order):
+    """SQL predicate selecting rows after a cursor position (two parameters)"""
+    operator = '<' if order == 'desc' else '>'
+    return f'({sort_expr}, {id_expr}) {operator} (?, ?)'
+
+
+def keyset_order_by(sort_expr, id_expr, order):
+    """SQL ORDER BY clause matching keyset_condition"""
+    direction = order.upper()
+    return f'ORDER BY {sort_expr} {direction}, {id_expr} {direction}'